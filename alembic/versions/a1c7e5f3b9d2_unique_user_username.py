@@ -0,0 +1,28 @@
+"""unique user username
+
+Revision ID: a1c7e5f3b9d2
+Revises: f5a8c2d4e6b1
+Create Date: 2026-10-19 18:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'a1c7e5f3b9d2'
+down_revision: Union[str, Sequence[str], None] = 'f5a8c2d4e6b1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index('ix_user_username', ['username'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_username')
@@ -0,0 +1,34 @@
+"""add alert and sensordata indexes
+
+Revision ID: c4e1a9d27f10
+Revises: b902bf103253
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e1a9d27f10'
+down_revision: Union[str, Sequence[str], None] = 'b902bf103253'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('alert', schema=None) as batch_op:
+        batch_op.create_index('ix_alert_sensor_ack_timestamp', ['sensor_id', 'acknowledged', 'timestamp'], unique=False)
+
+    with op.batch_alter_table('sensordata', schema=None) as batch_op:
+        batch_op.create_index('ix_sensordata_sensor_timestamp', ['sensor_id', 'timestamp'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('sensordata', schema=None) as batch_op:
+        batch_op.drop_index('ix_sensordata_sensor_timestamp')
+
+    with op.batch_alter_table('alert', schema=None) as batch_op:
+        batch_op.drop_index('ix_alert_sensor_ack_timestamp')
@@ -0,0 +1,39 @@
+"""add alert episode fields
+
+Revision ID: d7b3f2e8a915
+Revises: c4e1a9d27f10
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7b3f2e8a915'
+down_revision: Union[str, Sequence[str], None] = 'c4e1a9d27f10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('alert', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('last_seen', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('peak_value', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('occurrences', sa.Integer(), server_default=sa.text('1'), nullable=False))
+        batch_op.add_column(sa.Column('closed_at', sa.DateTime(), nullable=True))
+
+    # Las alertas anteriores son episodios de una sola evaluación ya cerrados
+    op.execute("UPDATE alert SET last_seen = timestamp, closed_at = timestamp")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('alert', schema=None) as batch_op:
+        batch_op.drop_column('closed_at')
+        batch_op.drop_column('occurrences')
+        batch_op.drop_column('peak_value')
+        batch_op.drop_column('last_seen')
@@ -0,0 +1,48 @@
+"""add alert archive
+
+Revision ID: e3f9a61c5b07
+Revises: d7b3f2e8a915
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+import sqlmodel
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'e3f9a61c5b07'
+down_revision: Union[str, Sequence[str], None] = 'd7b3f2e8a915'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'alertarchive',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('sensor_id', sa.Integer(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=False),
+        sa.Column('type', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('message', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('acknowledged', sa.Boolean(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('last_seen', sa.DateTime(), nullable=True),
+        sa.Column('peak_value', sa.Float(), nullable=True),
+        sa.Column('occurrences', sa.Integer(), nullable=False),
+        sa.Column('closed_at', sa.DateTime(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    with op.batch_alter_table('alertarchive', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_alertarchive_sensor_id'), ['sensor_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('alertarchive', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_alertarchive_sensor_id'))
+    op.drop_table('alertarchive')
@@ -0,0 +1,35 @@
+"""unique sensordata sensor timestamp
+
+Revision ID: f5a8c2d4e6b1
+Revises: e3f9a61c5b07
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'f5a8c2d4e6b1'
+down_revision: Union[str, Sequence[str], None] = 'e3f9a61c5b07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Registros duplicados por guardados concurrentes: se conserva el más reciente
+    op.execute(
+        "DELETE FROM sensordata WHERE id NOT IN ("
+        "SELECT MAX(id) FROM sensordata GROUP BY sensor_id, timestamp)"
+    )
+    with op.batch_alter_table('sensordata', schema=None) as batch_op:
+        batch_op.drop_index('ix_sensordata_sensor_timestamp')
+        batch_op.create_index('ix_sensordata_sensor_timestamp', ['sensor_id', 'timestamp'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('sensordata', schema=None) as batch_op:
+        batch_op.drop_index('ix_sensordata_sensor_timestamp')
+        batch_op.create_index('ix_sensordata_sensor_timestamp', ['sensor_id', 'timestamp'], unique=False)
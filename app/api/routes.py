@@ -1,13 +1,23 @@
+import asyncio
+import os
+import secrets
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
-from fastapi import APIRouter, HTTPException, Query
-from pydantic import BaseModel
+from fastapi import APIRouter, Header, HTTPException, Query
+from pydantic import BaseModel, Field
 from sqlmodel import Session, select
 from starlette.requests import Request
-from starlette.responses import JSONResponse  # ← AÑADIR ESTO
+from starlette.responses import JSONResponse, PlainTextResponse, Response  # ← AÑADIR ESTO
 
-from app.models import Parcel, Sensor, SensorData
+from app.models import Parcel, Sensor
+from app.services.alert_queries import acknowledge_alerts
+from app.services.cold_archive import cold_archive
+from app.services.data_aggregator import data_aggregator
+from app.services.health import health_monitor
+from app.services.maiota_client import MAIOTA_TYPE_MAP
+from app.services.metrics import CONTENT_TYPE, REGISTRY
+from app.services.profiler import ProfilerBusy, profiler
 from app.utils import engine
 
 router = APIRouter() 
@@ -32,6 +42,13 @@ class ParcelCreate(BaseModel):
     area: float
     owner_id: int
 
+class AlertBulkAcknowledge(BaseModel):
+    sensor_ids: Optional[List[int]] = None
+    parcel_id: Optional[int] = None
+    type: Optional[str] = None
+    start: Optional[datetime] = Field(None, alias="from")
+    end: Optional[datetime] = Field(None, alias="to")
+
 @router.get("/parcels")
 def get_parcels(request: Request):
     """List all registered parcels."""
@@ -99,22 +116,37 @@ def create_sensor(request: Request, sensor: SensorCreate):
 
 @router.post("/sensors/{sensor_id}/data")
 def receive_sensor_data(request: Request, sensor_id: int, data: SensorDataInput):
-    """Submit a new data reading for a sensor."""
+    """Submit a new data reading for a sensor.
+
+    The reading is upserted into the aggregated row of its interval and
+    `data_id` is that row's id. The interval comes from its own timestamp
+    (timezone-aware values are converted to server local time, naive ones are
+    taken as local time) or from the arrival time if omitted; late readings are
+    merged into the already saved interval within the aggregator's allowed
+    lateness.
+    """
     with Session(engine) as session:
         sensor = session.get(Sensor, sensor_id)
         if not sensor:
             return JSONResponse(status_code=404, content={"detail": "Sensor no encontrado"})
-        
-        new_data = SensorData(
-            sensor_id=sensor_id,
-            timestamp=data.timestamp or datetime.utcnow(),
-            value=data.value,
-            raw=str(data.value),
+        sensor_type = MAIOTA_TYPE_MAP.get(sensor.type, sensor.type)
+
+    # El agregador trabaja en hora local sin zona: sin timestamp, la hora de llegada
+    timestamp = data.timestamp or datetime.now()
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+    reading = {sensor_type: data.value, "source": "api", "timestamp": timestamp}
+    if data.unit:
+        reading["unit"] = data.unit
+
+    # Sólo el registro de este sensor e intervalo: los buffers de la ingesta no se tocan
+    status, data_id = data_aggregator.save_reading(sensor_id, sensor_type, reading)
+    if status == "dropped":
+        return JSONResponse(
+            status_code=422,
+            content={"detail": "Lectura fuera del retraso permitido por el agregador"},
         )
-        session.add(new_data)
-        session.commit()
-        session.refresh(new_data)
-        return JSONResponse(content={"status": "success", "data_id": new_data.id})
+    return JSONResponse(content={"status": "success", "data_id": data_id, "aggregation": status})
 
 @router.get("/sensors/{sensor_id}/data")
 def get_sensor_history(
@@ -124,19 +156,19 @@ def get_sensor_history(
     end: Optional[datetime] = Query(None, alias="to"),
     limit: int = 100,
 ):
-    """Get historical data for a specific sensor."""
+    """Get historical data for a specific sensor.
+
+    Ranges older than the hot database are read from the cold archive;
+    archived points have no id or raw payload.
+    """
     with Session(engine) as session:
-        query = select(SensorData).where(SensorData.sensor_id == sensor_id)
-        if start:
-            query = query.where(SensorData.timestamp >= start)
-        if end:
-            query = query.where(SensorData.timestamp <= end)
-        query = query.order_by(SensorData.timestamp.desc()).limit(limit)
-        results = session.exec(query).all()
+        results = cold_archive.read_history(
+            session, sensor_id, start=start, end=end, limit=limit, newest_first=True
+        )
         
         data = [
             {
-                "id": r.id, "sensor_id": r.sensor_id,
+                "id": r.id, "sensor_id": sensor_id,
                 "timestamp": r.timestamp.isoformat(),
                 "value": r.value, "raw": r.raw
             } for r in results
@@ -156,3 +188,72 @@ def acknowledge_alert(request: Request, alert_id: int):
         session.add(alert)
         session.commit()
         return JSONResponse(content={"status": "success", "message": "Alerta confirmada"})
+
+@router.post("/alerts/acknowledge")
+def acknowledge_alerts_bulk(request: Request, filters: AlertBulkAcknowledge):
+    """Acknowledge all pending alerts matching the filters in a single update.
+
+    Filters: sensor_ids, parcel_id, type (HIGH/LOW) and a from/to time range.
+    Without filters every pending alert is acknowledged.
+    """
+    with Session(engine) as session:
+        sensor_ids = filters.sensor_ids
+        if filters.parcel_id is not None:
+            parcel_sensors = session.exec(
+                select(Sensor.id).where(Sensor.parcel_id == filters.parcel_id)
+            ).all()
+            if sensor_ids is not None:
+                requested = set(sensor_ids)
+                parcel_sensors = [sid for sid in parcel_sensors if sid in requested]
+            sensor_ids = parcel_sensors
+
+        count = acknowledge_alerts(
+            session, sensor_ids,
+            alert_type=filters.type, start=filters.start, end=filters.end,
+        )
+        session.commit()
+        return JSONResponse(content={"status": "success", "acknowledged": count})
+
+@router.get("/health")
+def get_health():
+    """Liveness: always 200 while the process answers, with the state of every check.
+
+    "status" is "degraded" when any check fails (broker, aggregator, ingest lag or DB).
+    """
+    return JSONResponse(content=health_monitor.report())
+
+@router.get("/ready")
+def get_ready():
+    """Readiness: 200 if broker, aggregator, ingest lag and DB are healthy, 503 otherwise."""
+    report = health_monitor.report()
+    return JSONResponse(content=report, status_code=200 if report["ready"] else 503)
+
+@router.get("/metrics")
+def get_metrics():
+    """Prometheus metrics of this process (ingest, aggregator, alerts, DB and dashboard)."""
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
+@router.get("/debug/profile")
+async def get_profile(
+    seconds: float = Query(10, gt=0, le=120),
+    x_profiler_token: Optional[str] = Header(None),
+):
+    """Sample every thread of this process for N seconds and return collapsed stacks.
+
+    Admin only: requires the X-Profiler-Token header to match AGRORETO_PROFILER_TOKEN.
+    Without that variable the endpoint does not exist. Sampling runs in a worker
+    thread, so the event loop keeps serving requests meanwhile.
+    """
+    token = os.environ.get("AGRORETO_PROFILER_TOKEN")
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_profiler_token or not secrets.compare_digest(x_profiler_token, token):
+        raise HTTPException(status_code=403, detail="Invalid profiler token")
+    try:
+        collapsed = await asyncio.to_thread(profiler.profile, seconds)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(
+        collapsed,
+        headers={"Content-Disposition": f'attachment; filename="profile-{os.getpid()}.collapsed"'},
+    )
@@ -1,59 +1,41 @@
 # app/app.py
+# Primero: el cronómetro de arranque mide el resto de importaciones
+from app.startup_timing import startup_timer
+
+import asyncio
+import contextlib
 import logging
-import time
+import os
 
 import reflex as rx
-from sqlmodel import Session, select
+from sqlmodel import Session
 
 from app.api.routes import router as api_router
-from app.models import Sensor
-from app.pages.admin_users import AdminUserState, admin_users_page
-from app.pages.alerts import alerts_page
-from app.pages.dashboard import dashboard
-from app.pages.index import index
-from app.pages.info import info
-from app.pages.login_form import login_form
-from app.pages.parcel_detail import parcel_detail_page
-from app.pages.parcels import parcels_page
-from app.pages.register_form import register_form
-from app.pages.sensor_detail import sensor_detail_page
-# Importar MQTT y modelos
-from app.services.maiota_client import maiota_client
-from app.services.data_aggregator import data_aggregator
+from app.logging_config import configure_logging
+# Importar servicio de ingesta MQTT
+from app.services.async_ingest import async_ingest_service
+from app.services.ingest import ingest_service
+from app.services.query_tracking import QueryTrackingASGIMiddleware, QueryTrackingMiddleware
+from app.states.admin_user_state import AdminUserState
 from app.states.alert_state import AlertState
 from app.states.auth_state import AuthState
 from app.states.dashboard_state import DashboardState
 from app.states.parcel_state import ParcelState
 from app.states.sensor_history_state import SensorHistoryState
 from app.states.sensor_state import SensorState
-from app.utils import engine
+from app.utils import init_database
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
+startup_timer.mark("imports")
 
 
 def save_sensor_reading_direct(sensor_id: int, sensor_type: str, data: dict):
     """
     Añade una lectura de sensor al agregador para calcular medias cada 5 minutos.
     No guarda directamente en la base de datos, acumula en memoria.
-    
-    Args:
-        sensor_id: ID del sensor en la base de datos
-        sensor_type: Tipo de dato (temperatura, humedad_ambiente, etc.)
-        data: Diccionario con los datos del sensor recibidos por MQTT
+    Se mantiene por compatibilidad; delega en ingest_service.save_reading().
     """
-    try:
-        # En lugar de guardar directamente, añadir al buffer del agregador
-        data_aggregator.add_reading(sensor_id, sensor_type, data)
-        
-        # Log reducido para no saturar
-        logger.debug(f"📥 Lectura añadida al buffer: Sensor {sensor_id} ({sensor_type})")
-            
-    except Exception as e:
-        logger.exception(f"❌ Error añadiendo lectura al agregador: {e}")
+    ingest_service.save_reading(sensor_id, sensor_type, data)
 
 
 def check_thresholds_direct(session: Session, sensor_id: int, sensor_type: str, value: float):
@@ -68,120 +50,66 @@ def check_thresholds_direct(session: Session, sensor_id: int, sensor_type: str,
 def load_existing_sensors():
     """
     Carga todos los sensores activos de la BD y los registra en el cliente MQTT.
-    Agrupa sensores por topic MQTT para optimizar las suscripciones.
-    Cada topic puede tener múltiples sensores que reciben los mismos datos.
+    Se mantiene por compatibilidad; delega en ingest_service.load_sensors(),
+    que sólo registra los sensores de la partición de este proceso.
     """
-    try:
-        with Session(engine) as session:
-            active_sensors = session.exec(
-                select(Sensor).where(Sensor.active.is_(True))
-            ).all()
-            
-            # Agrupar sensores por topic
-            sensors_by_topic = {}
-            for sensor in active_sensors:
-                topic = sensor.mqtt_topic
-                if topic not in sensors_by_topic:
-                    sensors_by_topic[topic] = []
-                sensors_by_topic[topic].append({
-                    'id': sensor.id,
-                    'code': sensor.id_code,
-                    'type': sensor.type,
-                })
-            
-            # Mapeo de tipos
-            type_map = {
-                "temperature": "temperatura",
-                "humidity_ambient": "humedad_ambiente",
-                "humidity_soil": "humedad_suelo",
-                "luminosity": "iluminacion",
-                "co2": "co2",
-                "cov": "cov",
-                "nox": "nox"
-            }
-            
-            # Registrar un callback POR TOPIC que guarda en TODOS los sensores
-            for topic, sensors_list in sensors_by_topic.items():
-                
-                def make_callback_for_topic(topic_sensors):
-                    """
-                    Crea una función callback para un topic MQTT específico.
-                    El callback procesa datos para todos los sensores asociados al topic.
-                    
-                    Args:
-                        topic_sensors: Lista de sensores que comparten el mismo topic MQTT
-                    
-                    Returns:
-                        Función callback que procesa mensajes MQTT
-                    """
-                    def on_data(data: dict):
-                        """
-                        Callback ejecutado cuando llegan datos MQTT del topic.
-                        Distribuye los datos a todos los sensores del topic.
-                        
-                        Args:
-                            data: Diccionario con los datos parseados del mensaje MQTT
-                        """
-                        for sensor_info in topic_sensors:
-                            s_id = sensor_info['id']
-                            s_type = sensor_info['type']
-                            s_code = sensor_info['code']
-                            
-                            # Mapear tipo de BD a tipo MAIoTA
-                            maiota_type = type_map.get(s_type, s_type)
-                            
-                            try:
-                                save_sensor_reading_direct(s_id, maiota_type, data)
-                            except Exception as e:
-                                logger.exception(f"❌ Error procesando {s_code}: {e}")
-                    
-                    return on_data
-                
-                # Registrar el callback para este topic
-                # Usar el primer sensor como referencia
-                first_sensor = sensors_list[0]
-                maiota_client.add_sensor(
-                    sensor_id=first_sensor['id'],
-                    sensor_code=f"Topic_{topic[:20]}",
-                    sensor_type=type_map.get(first_sensor['type'], 'temperatura'),
-                    topic=topic,
-                    callback=make_callback_for_topic(sensors_list)
-                )
-                
-                logger.info(f"✅ Topic {topic} con {len(sensors_list)} sensores registrados")
-            
-            total_sensors = sum(len(sensors) for sensors in sensors_by_topic.values())
-            logger.info(f"✅ Total: {total_sensors} sensores en {len(sensors_by_topic)} topics")
-    
-    except Exception as e:
-        logger.exception(f"❌ Error cargando sensores existentes: {e}")
+    ingest_service.load_sensors()
+
 
+# Las páginas se importan al renderizarlas: los módulos de componentes sólo
+# se cargan al compilar el frontend, no en cada import del backend.
 
 #definir registro
 def register_page() -> rx.Component:
     """Renderiza la página de registro de nuevos usuarios"""
+    from app.pages.register_form import register_form
     return register_form()
 
 def login_page() -> rx.Component:
     """Renderiza la página de inicio de sesión"""
+    from app.pages.login_form import login_form
     return login_form()
 
 def info_page() -> rx.components:
     """Renderiza la página de información sobre el sistema"""
+    from app.pages.info import info
     return info()
 
 def dashboard_page() -> rx.Component:
     """Renderiza el dashboard principal con estadísticas y gráficos"""
+    from app.pages.dashboard import dashboard
     return dashboard()
 
 def index_page() -> rx.Component:
     """Renderiza la página de inicio/landing page"""
+    from app.pages.index import index
     return index()
 
 def admin_page() -> rx.Component:
     """Renderiza la página de administración de usuarios (solo admin)"""
+    from app.pages.admin_users import admin_users_page
     return admin_users_page()
 
+def parcels_page() -> rx.Component:
+    """Renderiza el listado de parcelas"""
+    from app.pages.parcels import parcels_page as render_parcels
+    return render_parcels()
+
+def parcel_detail_page() -> rx.Component:
+    """Renderiza el detalle de una parcela con sus sensores"""
+    from app.pages.parcel_detail import parcel_detail_page as render_parcel_detail
+    return render_parcel_detail()
+
+def sensor_detail_page() -> rx.Component:
+    """Renderiza el análisis histórico de un sensor"""
+    from app.pages.sensor_detail import sensor_detail_page as render_sensor_detail
+    return render_sensor_detail()
+
+def alerts_page() -> rx.Component:
+    """Renderiza la gestión de alertas"""
+    from app.pages.alerts import alerts_page as render_alerts
+    return render_alerts()
+
 def api_routes(api_app):
     """Registra las rutas de la API REST"""
     from fastapi import FastAPI
@@ -189,31 +117,52 @@ def api_routes(api_app):
     # Crear app FastAPI temporal
     fastapi_app = FastAPI()
     fastapi_app.include_router(api_router)
+    # Consultas SQL por ruta (número, tiempo y presupuesto)
+    fastapi_app.add_middleware(QueryTrackingASGIMiddleware)
     
     # Montar en Starlette
     api_app.mount("/api", fastapi_app)
     return api_app
 
-# ==================== INICIALIZACIÓN MQTT ====================
-logger.info("🚀 Iniciando aplicación Agrotech...")
-logger.info("🔌 Conectando al cliente MQTT MAIoTA...")
-
-# Iniciar cliente MQTT
-maiota_client.start()
-
-# Iniciar agregador de datos
-logger.info("📊 Iniciando agregador de datos (media cada 5 minutos)...")
-data_aggregator.start()
-
-# Esperar conexión
-time.sleep(2)
-
-# Cargar sensores existentes
-logger.info("📡 Cargando sensores existentes...")
-load_existing_sensors()
-
-logger.info("✅ Sistema de monitoreo MAIoTA iniciado")
-# =============================================================
+@contextlib.asynccontextmanager
+async def embedded_ingest():
+    """
+    Tarea de ciclo de vida del backend: arranca la ingesta MQTT embebida al
+    iniciar el servidor y la detiene (guardando lo pendiente) al apagarlo.
+    Importar este módulo no tiene efectos secundarios: compilar, recargar o
+    exportar la app no configura el logging, no conecta al broker ni toca la BD.
+    
+    Con AGRORETO_INGEST_MODE=external la ingesta corre aparte
+    (python -m app.ingest) y el proceso web sólo sirve páginas y API.
+    Con AGRORETO_INGEST_MODE=asyncio la ingesta corre como tareas del mismo
+    event loop que el servidor, sin threads MQTT ni de agregación.
+    """
+    # El logging raíz lo configura el servidor al arrancar, no quien importa el módulo
+    configure_logging()
+    startup_timer.mark("server_start")
+    
+    # Esquema y datos iniciales: una vez por proceso, no en cada navegación
+    await asyncio.to_thread(init_database)
+    startup_timer.mark("db_init")
+    
+    mode = os.environ.get("AGRORETO_INGEST_MODE", "embedded")
+    if mode == "external":
+        logger.info("📡 Ingesta MQTT externa: no se inicia en el proceso web")
+    elif mode == "asyncio":
+        await async_ingest_service.start()
+        startup_timer.mark("ingest_start")
+    else:
+        await asyncio.to_thread(ingest_service.start)
+        startup_timer.mark("ingest_start")
+    
+    startup_timer.write_report("web")
+    try:
+        yield
+    finally:
+        if ingest_service.running:
+            await asyncio.to_thread(ingest_service.stop)
+        if async_ingest_service.running:
+            await async_ingest_service.stop()
 
 
 app = rx.App(
@@ -230,11 +179,14 @@ app = rx.App(
     
 )
 
+app.register_lifespan_task(embedded_ingest)
+# Consultas SQL por evento de Reflex (número, tiempo y presupuesto)
+app.add_middleware(QueryTrackingMiddleware())
+
 app.add_page(
     login_page,
     route="/login",
     title="Login - Agrotech",
-    on_load=AuthState.ensure_db_seeded,
 )
 
 app.add_page(
@@ -255,7 +207,6 @@ app.add_page(
     register_page,
     route="/register",
     title="Register - Agrotech",
-    on_load=AuthState.ensure_db_seeded,
 )
 
 app.add_page(
@@ -264,7 +215,6 @@ app.add_page(
     title="Dashboard - Agrotech",
     on_load=[
         AuthState.check_authentication,
-        AuthState.ensure_db_seeded,
         DashboardState.load_dashboard_stats,
         DashboardState.start_polling,
     ],
@@ -274,7 +224,6 @@ app.add_page(
     route="/parcels",
     title="Parcels - Agrotech",
     on_load=[AuthState.check_authentication,
-             AuthState.ensure_db_seeded,
                ParcelState.load_parcels],
 )
 app.add_page(
@@ -282,7 +231,6 @@ app.add_page(
     route="/parcels/[id]",
     title="Parcel Detail - Agrotech",
         on_load=[AuthState.check_authentication,
-                         AuthState.ensure_db_seeded,
                              SensorState.load_sensors,
                              ParcelState.load_assigned_techs],
 )
@@ -291,7 +239,6 @@ app.add_page(
     route="/sensors/[id]",
     title="Sensor Analysis - Agrotech",
     on_load=[AuthState.check_authentication,
-             AuthState.ensure_db_seeded, 
              SensorHistoryState.load_history],
 )
 app.add_page(
@@ -299,7 +246,6 @@ app.add_page(
     route="/alerts",
     title="Alerts - Agrotech",
     on_load=[AuthState.check_authentication,
-             AuthState.ensure_db_seeded, 
              AlertState.load_alerts],
 )
 
@@ -308,6 +254,7 @@ app.add_page(
     route="/admin/users",
     title="Admin - Gestión de Usuarios",
     on_load=[AuthState.check_authentication,
-             AuthState.ensure_db_seeded, 
              AdminUserState.load_users],
 )
+
+startup_timer.mark("app_setup")
@@ -0,0 +1,121 @@
+"""
+Punto de entrada de la ingesta MQTT, independiente de la app web.
+
+Ejecuta sólo el cliente MQTT, el agregador de datos y la verificación de
+umbrales, sin importar Reflex ni las páginas (los modelos son SQLModel puro). Usar junto con
+AGRORETO_INGEST_MODE=external en los procesos web.
+
+Uso:
+    python -m app.ingest                   # un worker con todos los sensores
+    python -m app.ingest --partitions 4    # 4 procesos worker en esta máquina
+    python -m app.ingest --partition 1/4   # sólo la partición 1 de 4 (otro nodo)
+    python -m app.ingest --retention-once  # una pasada de retención y salir
+    python -m app.ingest --asyncio         # MQTT, parseo y agregación en un event loop
+"""
+# Primero: el cronómetro de arranque mide el resto de importaciones
+from app.startup_timing import startup_timer
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+
+from app.logging_config import configure_logging
+from app.services.async_ingest import AsyncIngestService
+from app.services.ingest import IngestService, run_partitioned_workers
+from app.services.metrics import start_http_server_from_env
+from app.services.partitioning import SensorPartition
+from app.services.profiler import profiler
+from app.services.retention import retention_job
+from app.utils import init_database
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """Parsea los argumentos de línea de comandos"""
+    parser = argparse.ArgumentParser(
+        prog="python -m app.ingest",
+        description="Servicio de ingesta MQTT MAIoTA (cliente, agregador y alertas)",
+    )
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        "--partitions",
+        type=int,
+        default=1,
+        help="Número de procesos worker a lanzar en esta máquina (por defecto 1)",
+    )
+    group.add_argument(
+        "--partition",
+        default=None,
+        help="Ejecutar sólo una partición con formato indice/total (ej. 0/4)",
+    )
+    parser.add_argument(
+        "--retention-once",
+        action="store_true",
+        help="Ejecutar una pasada de retención/compactación de datos y salir",
+    )
+    parser.add_argument(
+        "--asyncio",
+        action="store_true",
+        help="Ingesta asyncio: cliente MQTT, parseo, agregador y alertas en un único event loop",
+    )
+    parser.add_argument(
+        "--log-level",
+        default=None,
+        help="Nivel de logging (por defecto AGRORETO_LOG_LEVEL o INFO)",
+    )
+    args = parser.parse_args(argv)
+    if args.partitions < 1:
+        parser.error("--partitions debe ser un entero mayor o igual que 1")
+    return args
+
+
+def _report_startup():
+    """Registra el tiempo de arranque del worker de ingesta"""
+    startup_timer.mark("ingest_start")
+    startup_timer.write_report("ingest")
+
+
+def main(argv=None) -> int:
+    """Arranca la ingesta según los argumentos y bloquea hasta SIGINT/SIGTERM"""
+    startup_timer.mark("imports")
+    args = parse_args(argv)
+    configure_logging(level=args.log_level)
+
+    try:
+        if args.partition:
+            partition = SensorPartition.parse(args.partition)
+        else:
+            partition = SensorPartition.from_env()
+    except ValueError as e:
+        logging.getLogger(__name__).error(f"❌ {e}")
+        return 2
+
+    # Esquema y datos iniciales una sola vez, antes de lanzar los workers
+    init_database()
+    startup_timer.mark("db_init")
+
+    if args.retention_once:
+        report = retention_job.run()
+        print(json.dumps(report.to_dict(), indent=2))
+        return 0
+
+    if args.partitions > 1 and args.asyncio:
+        run_partitioned_workers(args.partitions, asyncio_mode=True)
+    elif args.partitions > 1:
+        run_partitioned_workers(args.partitions)
+    elif args.asyncio:
+        start_http_server_from_env()
+        profiler.install_signal_handler()
+        service = AsyncIngestService.from_env(partition=partition)
+        asyncio.run(service.run_forever(on_started=_report_startup))
+    else:
+        start_http_server_from_env()
+        profiler.install_signal_handler()
+        service = IngestService(partition=partition)
+        service.run_forever(on_started=_report_startup)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""
+Configuración de logging de los procesos (web, ingesta y simulador).
+
+- Formato de texto o JSON por línea (AGRORETO_LOG_FORMAT=text|json).
+- Handler con cola no bloqueante (AGRORETO_LOG_QUEUE=1): el thread que
+  registra sólo encola; un thread aparte formatea y escribe. Con la cola
+  llena los mensajes se descartan y se cuentan en lugar de bloquear.
+- RateLimitedLogger para los caminos calientes: como mucho un mensaje por
+  clave e intervalo, indicando cuántos se han suprimido.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional, Tuple
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+PROCESS_TEXT_FORMAT = '%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s'
+
+# Atributos estándar de LogRecord: el resto son campos estructurados (extra=...)
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por mensaje, con los campos de extra= como claves propias"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "process": record.processName,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que nunca bloquea: con la cola llena descarta y cuenta"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Sólo se resuelve el mensaje (el formato final lo hace el listener)
+        # para que la cola no arrastre argumentos ni tracebacks vivos
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RateLimitedLogger:
+    """
+    Logger para caminos calientes: emite como mucho un mensaje por clave e
+    intervalo y, en el siguiente, indica cuántos se suprimieron entretanto.
+    El formato es perezoso (estilo %): si el nivel está desactivado o el
+    mensaje se suprime no se formatea nada.
+    """
+
+    def __init__(self, logger: logging.Logger, interval: Optional[float] = None,
+                 max_keys: int = 1000, clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            logger: Logger de destino
+            interval: Segundos mínimos entre mensajes de una misma clave
+                (por defecto AGRORETO_LOG_RATE_LIMIT_SECONDS o 10)
+            max_keys: Claves recordadas como máximo (se olvidan todas al superarlo)
+            clock: Reloj monotónico (inyectable en tests)
+        """
+        self.logger = logger
+        self.interval = interval if interval is not None else float(
+            os.environ.get("AGRORETO_LOG_RATE_LIMIT_SECONDS", 10)
+        )
+        self.max_keys = max_keys
+        self.clock = clock
+        # clave -> (instante del último mensaje emitido, mensajes suprimidos desde entonces)
+        self._state: Dict[object, Tuple[float, int]] = {}
+        self._lock = threading.Lock()
+
+    def log(self, level: int, key, msg: str, *args, **kwargs) -> bool:
+        """
+        Registra el mensaje si su clave no ha emitido otro en el intervalo.
+
+        Args:
+            level: Nivel de logging
+            key: Clave de agrupación (p. ej. el tipo de error o el topic)
+            msg: Mensaje con formato %
+            *args: Argumentos del mensaje
+            **kwargs: exc_info, extra, etc. (como en logging)
+
+        Returns:
+            True si se ha emitido, False si se ha suprimido
+        """
+        if not self.logger.isEnabledFor(level):
+            return False
+        now = self.clock()
+        with self._lock:
+            last, suppressed = self._state.get(key, (None, 0))
+            if last is not None and now - last < self.interval:
+                self._state[key] = (last, suppressed + 1)
+                return False
+            if len(self._state) >= self.max_keys and key not in self._state:
+                self._state.clear()
+            self._state[key] = (now, 0)
+        if suppressed:
+            msg = f"{msg} (+%d similares suprimidos en {self.interval:g}s)"
+            args = args + (suppressed,)
+        self.logger.log(level, msg, *args, **kwargs)
+        return True
+
+    def warning(self, key, msg: str, *args, **kwargs) -> bool:
+        return self.log(logging.WARNING, key, msg, *args, **kwargs)
+
+    def error(self, key, msg: str, *args, **kwargs) -> bool:
+        return self.log(logging.ERROR, key, msg, *args, **kwargs)
+
+    def exception(self, key, msg: str, *args, **kwargs) -> bool:
+        kwargs.setdefault("exc_info", True)
+        return self.log(logging.ERROR, key, msg, *args, **kwargs)
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+# Handlers creados aquí (los únicos que se cierran al reconfigurar)
+_installed: list = []
+
+
+def configure_logging(level: Optional[str] = None, fmt: Optional[str] = None,
+                      use_queue: Optional[bool] = None, process_name: bool = False,
+                      force: bool = False) -> bool:
+    """
+    Configura el logging raíz del proceso. Como logging.basicConfig, no hace
+    nada si el logger raíz ya tiene handlers (salvo con force).
+
+    Args:
+        level: Nivel (por defecto AGRORETO_LOG_LEVEL o INFO)
+        fmt: "text" o "json" (por defecto AGRORETO_LOG_FORMAT o text)
+        use_queue: Escribir desde un thread aparte mediante una cola no bloqueante
+            (por defecto AGRORETO_LOG_QUEUE)
+        process_name: Incluir el nombre del proceso en el formato de texto (workers)
+        force: Sustituir los handlers existentes
+
+    Returns:
+        True si se ha configurado, False si ya había handlers
+    """
+    global _listener, _installed
+    root = logging.getLogger()
+    if root.handlers and not force:
+        return False
+    level = (level or os.environ.get("AGRORETO_LOG_LEVEL", "INFO")).upper()
+    fmt = (fmt or os.environ.get("AGRORETO_LOG_FORMAT", "text")).lower()
+    if use_queue is None:
+        use_queue = os.environ.get("AGRORETO_LOG_QUEUE", "").lower() in ("1", "true", "yes")
+
+    stream_handler = logging.StreamHandler()
+    if fmt == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(PROCESS_TEXT_FORMAT if process_name else TEXT_FORMAT))
+
+    stop_listener()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        if handler in _installed:
+            handler.close()
+    _installed = [stream_handler]
+    if use_queue:
+        log_queue = queue.Queue(maxsize=int(os.environ.get("AGRORETO_LOG_QUEUE_SIZE", 10000)))
+        queue_handler = NonBlockingQueueHandler(log_queue)
+        _installed.append(queue_handler)
+        root.addHandler(queue_handler)
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+    else:
+        root.addHandler(stream_handler)
+    root.setLevel(level)
+    return True
+
+
+def stop_listener():
+    """Vacía la cola de logging y detiene su thread (se llama también al salir)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_listener)
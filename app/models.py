@@ -1,12 +1,15 @@
 # app/models.py
 from datetime import datetime
 
-import reflex as rx
 import sqlmodel
+from sqlalchemy import Index
 from sqlmodel import Field, SQLModel
 
 
 class User(SQLModel, table=True):
+    # Login por nombre; único: dos registros simultáneos no crean el mismo usuario
+    __table_args__ = (Index("ix_user_username", "username", unique=True),)
+
     id: int | None = Field(default=None, primary_key=True)
     username: str
     password_hash: str
@@ -43,6 +46,10 @@ class ParcelTechnician(SQLModel, table=True):
     user_id: int = Field(foreign_key="user.id")
 
 class SensorData(SQLModel, table=True):
+    # Última lectura por sensor e históricos por rango de fechas; único: un
+    # registro por sensor e intervalo (el agregador guarda con ON CONFLICT)
+    __table_args__ = (Index("ix_sensordata_sensor_timestamp", "sensor_id", "timestamp", unique=True),)
+
     id: int | None = Field(default=None, primary_key=True)
     sensor_id: int = Field(foreign_key="sensor.id")
     timestamp: datetime = Field(default_factory=datetime.now)
@@ -50,10 +57,34 @@ class SensorData(SQLModel, table=True):
     raw: str  # Aquí guardaremos el JSON completo del MAIoTA
 
 class Alert(SQLModel, table=True):
+    # Listados de alertas por sensor, estado y fecha (paginados)
+    __table_args__ = (Index("ix_alert_sensor_ack_timestamp", "sensor_id", "acknowledged", "timestamp"),)
+
     id: int | None = Field(default=None, primary_key=True)
     sensor_id: int = Field(foreign_key="sensor.id")
     timestamp: datetime = Field(default_factory=datetime.now)
-    type: str  # low, high, offline, etc.
+    type: str  # HIGH, LOW, RATE, ANOMALY, OFFLINE
     message: str
     acknowledged: bool = False
     created_at: datetime = Field(default_factory=datetime.now)
+    # Episodio: una alerta por periodo fuera de rango, actualizada mientras dura
+    last_seen: datetime | None = None
+    peak_value: float | None = None
+    occurrences: int = 1
+    closed_at: datetime | None = None
+
+
+class AlertArchive(SQLModel, table=True):
+    """Alertas confirmadas y cerradas que la retención saca de la tabla alert"""
+    id: int | None = Field(default=None, primary_key=True)  # Mismo ID que tenía en alert
+    sensor_id: int = Field(index=True)
+    timestamp: datetime
+    type: str
+    message: str
+    acknowledged: bool = True
+    created_at: datetime
+    last_seen: datetime | None = None
+    peak_value: float | None = None
+    occurrences: int = 1
+    closed_at: datetime | None = None
+    archived_at: datetime = Field(default_factory=datetime.now)
@@ -1,112 +1,10 @@
-from datetime import datetime
-
 import reflex as rx
-from sqlmodel import select
 
 from app.components.styles import M3Styles
-from app.models import User
+from app.states.admin_user_state import AdminUserState
 from app.states.auth_state import AuthState
 
 
-class AdminUserState(rx.State):
-    """State para gestionar usuarios"""
-    pending_users: list[dict] = []
-    all_users: list[dict] = []
-    selected_tab: str = "pending"
-    
-    @rx.event(background=True)
-    async def load_users(self):
-        """Cargar usuarios pendientes y aprobados"""
-        async with self:
-            with rx.session() as session:
-                # Usuarios pendientes de aprobación
-                pending = session.exec(
-                    select(User).where(User.role == "registered")
-                ).all()
-                
-                # Todos los usuarios aprobados
-                approved = session.exec(
-                    select(User).where(User.role != "registered")
-                ).all()
-                
-                self.pending_users = [
-                    {
-                        "id": u.id,
-                        "username": u.username,
-                        "created_at": u.created_at.strftime("%d/%m/%Y %H:%M") if u.created_at else "",
-                    }
-                    for u in pending
-                ]
-                
-                self.all_users = [
-                    {
-                        "id": u.id,
-                        "username": u.username,
-                        "role": u.role,
-                        "created_at": u.created_at.strftime("%d/%m/%Y %H:%M") if u.created_at else "",
-                    }
-                    for u in approved
-                ]
-    
-    @rx.event(background=True)
-    async def approve_user(self, user_id: int):
-        """Aprobar usuario (cambiar rol a technician)"""
-        async with self:
-            with rx.session() as session:
-                user = session.exec(
-                    select(User).where(User.id == user_id)
-                ).first()
-                
-                if user:
-                    user.role = "technician"
-                    session.add(user)
-                    session.commit()
-        
-        yield AdminUserState.load_users
-    
-    @rx.event(background=True)
-    async def reject_user(self, user_id: int):
-        """Rechazar y eliminar usuario pendiente"""
-        async with self:
-            with rx.session() as session:
-                user = session.exec(
-                    select(User).where(User.id == user_id)
-                ).first()
-                
-                if user:
-                    session.delete(user)
-                    session.commit()
-        
-        yield AdminUserState.load_users
-    
-    @rx.event(background=True)
-    async def delete_user(self, user_id: int):
-        """Eliminar usuario aprobado"""
-        async with self:
-            # ✅ Obtener el estado de AuthState correctamente
-            auth_state = await self.get_state(AuthState)
-            current_user_id = auth_state.user_id
-            
-            with rx.session() as session:
-                user = session.exec(
-                    select(User).where(User.id == user_id)
-                ).first()
-                
-                if user:
-                    # ✅ Evitar que el admin se elimine a sí mismo
-                    if user.id == current_user_id:
-                        return
-                    
-                    # ✅ No permitir eliminar usuarios con rol "farmer" (admin)
-                    if user.role == "farmer":
-                        return
-                    
-                    session.delete(user)
-                    session.commit()
-        
-        yield AdminUserState.load_users
-
-
 def pending_users_table() -> rx.Component:
     """Tabla de usuarios pendientes de aprobación"""
     return rx.cond(
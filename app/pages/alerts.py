@@ -10,9 +10,12 @@ def alert_row(alert: dict) -> rx.Component:
     return rx.el.div(
         rx.el.div(
             rx.el.div(
-                rx.cond(
-                    alert["type"] == "HIGH",
-                    rx.icon("trending-up", class_name="w-5 h-5 text-red-500"),
+                rx.match(
+                    alert["type"],
+                    ("HIGH", rx.icon("trending-up", class_name="w-5 h-5 text-red-500")),
+                    ("OFFLINE", rx.icon("wifi-off", class_name="w-5 h-5 text-slate-500")),
+                    ("RATE", rx.icon("activity", class_name="w-5 h-5 text-orange-500")),
+                    ("ANOMALY", rx.icon("zap", class_name="w-5 h-5 text-purple-500")),
                     rx.icon("trending-down", class_name="w-5 h-5 text-amber-500"),
                 ),
                 class_name="p-3 bg-slate-50 rounded-full mr-4",
@@ -30,6 +33,17 @@ def alert_row(alert: dict) -> rx.Component:
                     class_name="flex items-center mb-1",
                 ),
                 rx.el.p(alert["message"], class_name="text-sm text-slate-600"),
+                rx.cond(
+                    alert["occurrences"].to(int) > 1,
+                    rx.el.p(
+                        rx.cond(alert["ongoing"], "Activa", "Resuelta"),
+                        " · ",
+                        alert["occurrences"].to_string(),
+                        " intervalos · última vez ",
+                        alert["last_seen"],
+                        class_name="text-xs text-slate-400 mt-1",
+                    ),
+                ),
             ),
             class_name="flex items-center flex-1",
         ),
@@ -55,6 +69,28 @@ def alert_row(alert: dict) -> rx.Component:
     )
 
 
+def pagination_controls() -> rx.Component:
+    """Controles de paginación del listado de alertas"""
+    return rx.el.div(
+        rx.el.button(
+            rx.icon("chevron-left", class_name="w-4 h-4"),
+            "Anterior",
+            on_click=AlertState.prev_page,
+            disabled=AlertState.page == 0,
+            class_name="flex items-center gap-1 text-sm text-slate-600 px-3 py-1.5 rounded-lg hover:bg-slate-100 disabled:opacity-40",
+        ),
+        rx.el.span(AlertState.page_label, class_name="text-xs text-slate-500"),
+        rx.el.button(
+            "Siguiente",
+            rx.icon("chevron-right", class_name="w-4 h-4"),
+            on_click=AlertState.next_page,
+            disabled=AlertState.page + 1 >= AlertState.total_pages,
+            class_name="flex items-center gap-1 text-sm text-slate-600 px-3 py-1.5 rounded-lg hover:bg-slate-100 disabled:opacity-40",
+        ),
+        class_name="flex items-center justify-between mt-6",
+    )
+
+
 def alerts_page() -> rx.Component:
     return rx.el.div(
         navbar(),
@@ -88,6 +124,9 @@ def alerts_page() -> rx.Component:
                             rx.el.option("Todos los Tipos", value="all"),
                             rx.el.option("Valor Alto", value="HIGH"),
                             rx.el.option("Valor Bajo", value="LOW"),
+                            rx.el.option("Cambio Brusco", value="RATE"),
+                            rx.el.option("Anomalía", value="ANOMALY"),
+                            rx.el.option("Sin Datos", value="OFFLINE"),
                             on_change=AlertState.set_filter_type,
                             class_name="bg-white border border-slate-200 text-slate-700 text-sm rounded-lg focus:ring-blue-500 focus:border-blue-500 block p-2.5",
                         ),
@@ -111,8 +150,11 @@ def alerts_page() -> rx.Component:
                     rx.cond(
                         AlertState.alerts.length() > 0,
                         rx.el.div(
-                            rx.foreach(AlertState.alerts, alert_row),
-                            class_name="flex flex-col gap-4",
+                            rx.el.div(
+                                rx.foreach(AlertState.alerts, alert_row),
+                                class_name="flex flex-col gap-4",
+                            ),
+                            pagination_controls(),
                         ),
                         rx.el.div(
                             rx.icon(
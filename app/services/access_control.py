@@ -0,0 +1,143 @@
+# app/services/access_control.py
+import logging
+import threading
+import time
+from typing import Dict, FrozenSet, NamedTuple, Optional, Tuple
+
+from sqlalchemy import event, or_
+from sqlalchemy.orm import Session as OrmSession
+from sqlmodel import Session, select
+
+from app.models import Parcel, ParcelTechnician, Sensor
+from app.utils import engine
+
+logger = logging.getLogger(__name__)
+
+
+class AccessScope(NamedTuple):
+    """Parcelas y sensores que un usuario puede ver"""
+    parcel_ids: FrozenSet[int]
+    sensor_ids: FrozenSet[int]
+
+
+EMPTY_SCOPE = AccessScope(frozenset(), frozenset())
+
+
+class AccessResolver:
+    """
+    Resuelve las parcelas y sensores accesibles para un usuario:
+    los agricultores (farmer) ven todo; los técnicos, sus parcelas propias
+    más las asignadas en ParcelTechnician.
+
+    El resultado se obtiene con una sola consulta y se cachea por usuario.
+    La caché se invalida al confirmar cambios en Parcel, Sensor o
+    ParcelTechnician desde este proceso, y caduca tras ttl_seconds para
+    recoger cambios hechos desde otros procesos.
+    """
+
+    def __init__(self, ttl_seconds: float = 60.0):
+        """
+        Inicializa el resolvedor de accesos.
+
+        Args:
+            ttl_seconds: Tiempo máximo en segundos que se reutiliza un resultado cacheado
+        """
+        self.ttl_seconds = ttl_seconds
+        self._cache: Dict[Tuple[int, str], Tuple[float, int, AccessScope]] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _query_scope(self, session: Session, user_id: int, user_role: Optional[str]) -> AccessScope:
+        """Obtiene parcelas y sensores accesibles en una única consulta (LEFT JOIN)"""
+        query = select(Parcel.id, Sensor.id).outerjoin(Sensor, Sensor.parcel_id == Parcel.id)
+
+        if user_role != "farmer":
+            assigned_subq = select(ParcelTechnician.parcel_id).where(
+                ParcelTechnician.user_id == user_id
+            )
+            query = query.where(or_(Parcel.owner_id == user_id, Parcel.id.in_(assigned_subq)))
+
+        parcel_ids = set()
+        sensor_ids = set()
+        for parcel_id, sensor_id in session.exec(query).all():
+            parcel_ids.add(parcel_id)
+            if sensor_id is not None:
+                sensor_ids.add(sensor_id)
+        return AccessScope(frozenset(parcel_ids), frozenset(sensor_ids))
+
+    def resolve(self, user_id: Optional[int], user_role: Optional[str],
+                session: Optional[Session] = None) -> AccessScope:
+        """
+        Devuelve las parcelas y sensores accesibles para el usuario.
+
+        Args:
+            user_id: ID del usuario (None = sin sesión, sin acceso)
+            user_role: Rol del usuario (farmer, technician, registered)
+            session: Sesión de BD a reutilizar (por defecto se abre una)
+
+        Returns:
+            AccessScope con los IDs de parcelas y sensores accesibles
+        """
+        if not user_id:
+            return EMPTY_SCOPE
+
+        key = (user_id, user_role or "")
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+            generation = self._generation
+        if cached and cached[1] == generation and now - cached[0] < self.ttl_seconds:
+            return cached[2]
+
+        if session is None:
+            with Session(engine) as own_session:
+                scope = self._query_scope(own_session, user_id, user_role)
+        else:
+            scope = self._query_scope(session, user_id, user_role)
+
+        with self._lock:
+            # Si hubo una invalidación durante la consulta, no cachear un resultado viejo
+            if generation == self._generation:
+                self._cache[key] = (now, generation, scope)
+        return scope
+
+    def invalidate(self, user_id: Optional[int] = None):
+        """
+        Invalida la caché de un usuario o, sin argumentos, la de todos.
+
+        Args:
+            user_id: ID del usuario a invalidar (None = todos)
+        """
+        with self._lock:
+            if user_id is None:
+                self._generation += 1
+                self._cache.clear()
+            else:
+                for key in [key for key in self._cache if key[0] == user_id]:
+                    del self._cache[key]
+
+
+# Instancia global del resolvedor de accesos
+access_resolver = AccessResolver()
+
+_ACCESS_MODELS = (Parcel, Sensor, ParcelTechnician)
+
+
+@event.listens_for(OrmSession, "after_flush")
+def _mark_access_changes(session, flush_context):
+    """Marca la sesión si el flush tocó parcelas, sensores o asignaciones de técnicos"""
+    changed = list(session.new) + list(session.dirty) + list(session.deleted)
+    if any(isinstance(obj, _ACCESS_MODELS) for obj in changed):
+        session.info["access_changed"] = True
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _invalidate_on_commit(session):
+    """Invalida la caché de accesos tras confirmar cambios relevantes"""
+    if session.info.pop("access_changed", False):
+        access_resolver.invalidate()
+
+
+@event.listens_for(OrmSession, "after_rollback")
+def _discard_on_rollback(session):
+    session.info.pop("access_changed", None)
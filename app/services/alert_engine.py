@@ -0,0 +1,331 @@
+# app/services/alert_engine.py
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import event
+from sqlmodel import Session, select
+
+from app.models import Alert, Sensor
+from app.services.alert_rules import RuleEpisode, worst
+from app.services.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+ALERTS_CREATED = Counter("agroreto_alerts_created_total", "Alertas creadas por tipo", ["type"])
+
+THRESHOLD_ALERT_TYPES = ("HIGH", "LOW")
+
+
+@dataclass
+class _SensorAlertState:
+    """Estado en memoria de las alertas de umbral de un sensor"""
+    open_alert_id: Optional[int] = None
+    open_type: Optional[str] = None
+    # Debounce: evaluaciones consecutivas fuera de rango (apertura) o recuperadas (cierre)
+    pending_type: Optional[str] = None
+    pending_count: int = 0
+    clear_count: int = 0
+
+
+class AlertEngine:
+    """
+    Motor de alertas de umbral por episodios.
+
+    Mientras un sensor sigue fuera de rango no se crean alertas nuevas: se
+    actualiza el episodio abierto (last_seen, peak_value, occurrences). El
+    episodio se cierra (closed_at) cuando el valor vuelve dentro del rango con
+    un margen de histéresis durante clear_after evaluaciones consecutivas.
+    Para abrirlo hacen falta raise_after evaluaciones consecutivas fuera de rango.
+    """
+
+    def __init__(self, raise_after: int = 1, clear_after: int = 2, hysteresis: float = 0.05):
+        """
+        Inicializa el motor de alertas.
+
+        Args:
+            raise_after: Evaluaciones consecutivas fuera de rango para abrir un episodio
+            clear_after: Evaluaciones consecutivas recuperadas para cerrar el episodio
+            hysteresis: Margen para considerar recuperado el valor, como fracción
+                del rango (threshold_high - threshold_low)
+        """
+        if raise_after < 1 or clear_after < 1:
+            raise ValueError("raise_after y clear_after deben ser >= 1")
+        if hysteresis < 0:
+            raise ValueError("La histéresis no puede ser negativa")
+        self.raise_after = raise_after
+        self.clear_after = clear_after
+        self.hysteresis = hysteresis
+        self._states: Dict[int, _SensorAlertState] = {}
+        # (sensor_id, tipo) -> ID de la alerta abierta de cada regla
+        self._rule_alerts: Dict[Tuple[int, str], int] = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "AlertEngine":
+        """
+        Crea el motor con la configuración de las variables de entorno
+        AGRORETO_ALERT_RAISE_AFTER, AGRORETO_ALERT_CLEAR_AFTER y AGRORETO_ALERT_HYSTERESIS.
+        """
+        return cls(
+            raise_after=int(os.environ.get("AGRORETO_ALERT_RAISE_AFTER", 1)),
+            clear_after=int(os.environ.get("AGRORETO_ALERT_CLEAR_AFTER", 2)),
+            hysteresis=float(os.environ.get("AGRORETO_ALERT_HYSTERESIS", 0.05)),
+        )
+
+    def _load_state(self, session: Session, sensor_id: int) -> _SensorAlertState:
+        """Recupera de la BD el episodio abierto del sensor (p. ej. tras un reinicio)"""
+        state = _SensorAlertState()
+        open_alert = session.exec(
+            select(Alert)
+            .where(
+                Alert.sensor_id == sensor_id,
+                Alert.closed_at.is_(None),
+                Alert.type.in_(THRESHOLD_ALERT_TYPES),
+            )
+            .order_by(Alert.timestamp.desc())
+            .limit(1)
+        ).first()
+        if open_alert:
+            state.open_alert_id = open_alert.id
+            state.open_type = open_alert.type
+        return state
+
+    def _open_alert(self, session: Session, sensor_id: int, state: _SensorAlertState) -> Optional[Alert]:
+        """Devuelve la alerta del episodio abierto si sigue existiendo y abierta en la BD"""
+        if state.open_alert_id is None:
+            return None
+        alert = session.get(Alert, state.open_alert_id)
+        if alert is None or alert.sensor_id != sensor_id or alert.closed_at is not None:
+            # Borrada, cerrada desde fuera o perdida en un rollback
+            state.open_alert_id = None
+            state.open_type = None
+            return None
+        return alert
+
+    @staticmethod
+    def _breach(sensor: Sensor, value: float) -> Optional[str]:
+        if value < sensor.threshold_low:
+            return "LOW"
+        if value > sensor.threshold_high:
+            return "HIGH"
+        return None
+
+    def _recovered(self, sensor: Sensor, alert_type: str, value: float) -> bool:
+        """Indica si el valor ha vuelto al rango con el margen de histéresis"""
+        band = self.hysteresis * max(sensor.threshold_high - sensor.threshold_low, 0.0)
+        if alert_type == "HIGH":
+            return value <= sensor.threshold_high - band
+        return value >= sensor.threshold_low + band
+
+    @staticmethod
+    def _message(sensor: Sensor, sensor_type: str, alert_type: str, value: float) -> str:
+        if alert_type == "LOW":
+            return (
+                f"⚠️ {sensor.id_code}: {sensor_type} bajo el mínimo. "
+                f"Media: {value:.2f} {sensor.unit} (límite: {sensor.threshold_low})"
+            )
+        return (
+            f"⚠️ {sensor.id_code}: {sensor_type} sobre el máximo. "
+            f"Media: {value:.2f} {sensor.unit} (límite: {sensor.threshold_high})"
+        )
+
+    def _close(self, alert: Alert, state: _SensorAlertState, now: datetime, session: Session):
+        alert.closed_at = now
+        session.add(alert)
+        state.open_alert_id = None
+        state.open_type = None
+        state.clear_count = 0
+        logger.info(f"✅ Alerta {alert.type} cerrada (sensor {alert.sensor_id}, {alert.occurrences} evaluaciones)")
+
+    def evaluate(self, session: Session, sensor: Sensor, sensor_type: str, value: float,
+                 now: Optional[datetime] = None) -> Optional[Alert]:
+        """
+        Evalúa un valor contra los umbrales del sensor y actualiza su episodio.
+        Los cambios se añaden a la sesión; el commit corresponde al llamador.
+
+        Args:
+            session: Sesión de BD
+            sensor: Sensor evaluado
+            sensor_type: Tipo de dato (temperatura, humedad_ambiente, etc.)
+            value: Valor a evaluar (normalmente la media del intervalo)
+            now: Momento de la evaluación (por defecto ahora)
+
+        Returns:
+            La alerta creada si se abre un episodio nuevo, None en otro caso
+        """
+        now = now or datetime.now()
+        with self.lock:
+            state = self._states.get(sensor.id)
+            if state is None:
+                state = self._states[sensor.id] = self._load_state(session, sensor.id)
+
+            breach = self._breach(sensor, value)
+            alert = self._open_alert(session, sensor.id, state)
+
+            if alert is not None:
+                if breach == alert.type:
+                    # Mismo episodio: actualizar en lugar de duplicar
+                    alert.last_seen = now
+                    alert.occurrences = (alert.occurrences or 1) + 1
+                    if alert.peak_value is None:
+                        alert.peak_value = value
+                    elif breach == "HIGH":
+                        alert.peak_value = max(alert.peak_value, value)
+                    else:
+                        alert.peak_value = min(alert.peak_value, value)
+                    session.add(alert)
+                    state.clear_count = 0
+                    return None
+
+                if breach is None:
+                    if self._recovered(sensor, alert.type, value):
+                        state.clear_count += 1
+                        if state.clear_count >= self.clear_after:
+                            self._close(alert, state, now, session)
+                    else:
+                        # Dentro del margen de histéresis: el episodio sigue abierto
+                        state.clear_count = 0
+                    return None
+
+                # Salto directo de HIGH a LOW (o viceversa): cerrar y abrir otro
+                self._close(alert, state, now, session)
+
+            if breach is None:
+                state.pending_type = None
+                state.pending_count = 0
+                return None
+
+            if breach == state.pending_type:
+                state.pending_count += 1
+            else:
+                state.pending_type = breach
+                state.pending_count = 1
+            if state.pending_count < self.raise_after:
+                return None
+
+            message = self._message(sensor, sensor_type, breach, value)
+            new_alert = Alert(
+                sensor_id=sensor.id,
+                timestamp=now,
+                type=breach,
+                message=message,
+                acknowledged=False,
+                last_seen=now,
+                peak_value=value,
+                occurrences=1,
+            )
+            session.add(new_alert)
+            session.flush()
+            state.open_alert_id = new_alert.id
+            state.open_type = breach
+            state.pending_type = None
+            state.pending_count = 0
+            state.clear_count = 0
+            logger.warning(f"🚨 ALERTA: {message}")
+            return new_alert
+
+    def _open_rule_alert(self, session: Session, sensor_id: int, alert_type: str) -> Optional[Alert]:
+        """Alerta abierta de una regla para el sensor (cacheada por ID)"""
+        alert_id = self._rule_alerts.get((sensor_id, alert_type))
+        if alert_id is not None:
+            alert = session.get(Alert, alert_id)
+            if alert is not None and alert.sensor_id == sensor_id and alert.closed_at is None:
+                return alert
+        alert = session.exec(
+            select(Alert)
+            .where(
+                Alert.sensor_id == sensor_id,
+                Alert.type == alert_type,
+                Alert.closed_at.is_(None),
+            )
+            .order_by(Alert.timestamp.desc())
+            .limit(1)
+        ).first()
+        if alert is None:
+            self._rule_alerts.pop((sensor_id, alert_type), None)
+        else:
+            self._rule_alerts[(sensor_id, alert_type)] = alert.id
+        return alert
+
+    def apply_rule_episodes(self, session: Session, episodes: Iterable[RuleEpisode]) -> int:
+        """
+        Persiste los episodios de las reglas de flujo (RATE, ANOMALY, OFFLINE y,
+        en el camino rápido, HIGH/LOW) con una alerta por episodio. peak_value
+        guarda la métrica de la regla (valor, velocidad, |z|, minutos sin datos).
+        Los cambios se añaden a la sesión; el commit corresponde al llamador.
+
+        Args:
+            session: Sesión de BD
+            episodes: Episodios devueltos por RuleEngine.drain()
+
+        Returns:
+            Número de alertas nuevas creadas
+        """
+        created = 0
+        with self.lock:
+            for episode in episodes:
+                key = (episode.sensor_id, episode.alert_type)
+                alert = self._open_rule_alert(session, *key)
+
+                if episode.occurrences:
+                    if alert is None:
+                        sensor = session.get(Sensor, episode.sensor_id)
+                        if sensor is None:
+                            continue
+                        alert = Alert(
+                            sensor_id=episode.sensor_id,
+                            timestamp=episode.first_seen,
+                            type=episode.alert_type,
+                            message=f"⚠️ {sensor.id_code}: {episode.message}",
+                            acknowledged=False,
+                            last_seen=episode.last_seen,
+                            peak_value=episode.peak,
+                            occurrences=episode.occurrences,
+                        )
+                        session.add(alert)
+                        session.flush()
+                        self._rule_alerts[key] = alert.id
+                        created += 1
+                        logger.warning(f"🚨 ALERTA {episode.alert_type}: {alert.message}")
+                    else:
+                        alert.last_seen = max(alert.last_seen or episode.last_seen, episode.last_seen)
+                        alert.peak_value = (
+                            episode.peak if alert.peak_value is None
+                            else worst(episode.alert_type, alert.peak_value, episode.peak)
+                        )
+                        alert.occurrences = (alert.occurrences or 1) + episode.occurrences
+                        session.add(alert)
+
+                if episode.closed_at is not None and alert is not None:
+                    alert.closed_at = episode.closed_at
+                    session.add(alert)
+                    self._rule_alerts.pop(key, None)
+                    logger.info(f"✅ Alerta {episode.alert_type} cerrada (sensor {episode.sensor_id})")
+        return created
+
+    def reset(self, sensor_id: Optional[int] = None):
+        """
+        Olvida el estado en memoria de un sensor (o de todos); se recarga de la BD
+        en la siguiente evaluación.
+
+        Args:
+            sensor_id: ID del sensor (None = todos)
+        """
+        with self.lock:
+            if sensor_id is None:
+                self._states.clear()
+                self._rule_alerts.clear()
+            else:
+                self._states.pop(sensor_id, None)
+                for key in [key for key in self._rule_alerts if key[0] == sensor_id]:
+                    del self._rule_alerts[key]
+
+
+@event.listens_for(Alert, "after_insert")
+def _count_alert(mapper, connection, alert: Alert):
+    """Cuenta todas las alertas insertadas, las cree quien las cree"""
+    ALERTS_CREATED.labels(alert.type).inc()
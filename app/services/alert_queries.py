@@ -0,0 +1,149 @@
+# app/services/alert_queries.py
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import update
+from sqlmodel import Session, desc, func, select
+
+from app.models import Alert, Sensor, SensorData
+
+
+def _alert_filters(sensor_ids: Iterable[int], acknowledged: Optional[bool] = None,
+                   alert_type: Optional[str] = None) -> list:
+    """Condiciones WHERE comunes a listados y recuentos de alertas"""
+    conditions = [Alert.sensor_id.in_(list(sensor_ids))]
+    if acknowledged is not None:
+        conditions.append(Alert.acknowledged == acknowledged)
+    if alert_type and alert_type != "all":
+        conditions.append(Alert.type == alert_type)
+    return conditions
+
+
+def count_alerts(session: Session, sensor_ids: Iterable[int],
+                 acknowledged: Optional[bool] = None,
+                 alert_type: Optional[str] = None) -> int:
+    """
+    Cuenta las alertas de los sensores indicados.
+
+    Args:
+        session: Sesión de BD
+        sensor_ids: IDs de los sensores accesibles
+        acknowledged: Filtrar por estado de confirmación (None = todas)
+        alert_type: Filtrar por tipo de alerta (None o "all" = todos)
+    """
+    sensor_ids = list(sensor_ids)
+    if not sensor_ids:
+        return 0
+    return session.exec(
+        select(func.count(Alert.id)).where(*_alert_filters(sensor_ids, acknowledged, alert_type))
+    ).one()
+
+
+def list_alerts(session: Session, sensor_ids: Iterable[int],
+                acknowledged: Optional[bool] = None,
+                alert_type: Optional[str] = None,
+                limit: int = 50, offset: int = 0) -> List[Tuple[Alert, str, str]]:
+    """
+    Lista alertas junto con el código y tipo de su sensor en una sola consulta
+    (JOIN), ordenadas de más reciente a más antigua y paginadas.
+
+    Args:
+        session: Sesión de BD
+        sensor_ids: IDs de los sensores accesibles
+        acknowledged: Filtrar por estado de confirmación (None = todas)
+        alert_type: Filtrar por tipo de alerta (None o "all" = todos)
+        limit: Número máximo de alertas a devolver
+        offset: Número de alertas a saltar (paginación)
+
+    Returns:
+        Lista de tuplas (alerta, código del sensor, tipo del sensor)
+    """
+    sensor_ids = list(sensor_ids)
+    if not sensor_ids:
+        return []
+    query = (
+        select(Alert, Sensor.id_code, Sensor.type)
+        .join(Sensor, Sensor.id == Alert.sensor_id)
+        .where(*_alert_filters(sensor_ids, acknowledged, alert_type))
+        .order_by(desc(Alert.timestamp), desc(Alert.id))
+        .offset(offset)
+        .limit(limit)
+    )
+    return list(session.exec(query).all())
+
+
+def acknowledge_alerts(session: Session, sensor_ids: Optional[Iterable[int]] = None,
+                       alert_type: Optional[str] = None,
+                       start: Optional[datetime] = None,
+                       end: Optional[datetime] = None) -> int:
+    """
+    Confirma en bloque las alertas pendientes que cumplen los filtros con un
+    único UPDATE, sin cargar las alertas en memoria. No hace commit.
+
+    Args:
+        session: Sesión de BD
+        sensor_ids: IDs de los sensores (None = todos los sensores)
+        alert_type: Filtrar por tipo de alerta (None o "all" = todos)
+        start: Confirmar sólo alertas con timestamp >= start
+        end: Confirmar sólo alertas con timestamp <= end
+
+    Returns:
+        Número de alertas confirmadas
+    """
+    conditions = [Alert.acknowledged == False]
+    if sensor_ids is not None:
+        sensor_ids = list(sensor_ids)
+        if not sensor_ids:
+            return 0
+        conditions.append(Alert.sensor_id.in_(sensor_ids))
+    if alert_type and alert_type != "all":
+        conditions.append(Alert.type == alert_type)
+    if start:
+        conditions.append(Alert.timestamp >= start)
+    if end:
+        conditions.append(Alert.timestamp <= end)
+
+    result = session.execute(
+        update(Alert)
+        .where(*conditions)
+        .values(acknowledged=True)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def latest_readings(session: Session, sensor_ids: Iterable[int]) -> dict:
+    """
+    Obtiene la última lectura de cada sensor en una sola consulta.
+
+    Args:
+        session: Sesión de BD
+        sensor_ids: IDs de los sensores
+
+    Returns:
+        Diccionario sensor_id -> SensorData más reciente
+    """
+    sensor_ids = list(sensor_ids)
+    if not sensor_ids:
+        return {}
+    latest = (
+        select(SensorData.sensor_id, func.max(SensorData.timestamp).label("latest"))
+        .where(SensorData.sensor_id.in_(sensor_ids))
+        .group_by(SensorData.sensor_id)
+        .subquery()
+    )
+    rows = session.exec(
+        select(SensorData).join(
+            latest,
+            (SensorData.sensor_id == latest.c.sensor_id)
+            & (SensorData.timestamp == latest.c.latest),
+        )
+    ).all()
+    # Con timestamps repetidos nos quedamos con la fila de mayor ID
+    readings: dict = {}
+    for reading in rows:
+        current = readings.get(reading.sensor_id)
+        if current is None or reading.id > current.id:
+            readings[reading.sensor_id] = reading
+    return readings
+
@@ -0,0 +1,594 @@
+# app/services/alert_rules.py
+import logging
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass, replace
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Límites de velocidad de cambio por tipo de dato (unidades por minuto)
+DEFAULT_RATE_LIMITS = {
+    "temperatura": 2.0,
+    "humedad_ambiente": 10.0,
+    "humedad_suelo": 5.0,
+}
+
+
+class RuleResult(NamedTuple):
+    """Resultado de evaluar una regla con una lectura"""
+    breached: bool
+    metric: float
+    message: str
+
+
+class AlertRule:
+    """
+    Regla de alerta evaluada de forma incremental con cada lectura.
+    Cada regla guarda un estado de tamaño constante por sensor y tipo de dato.
+    """
+    alert_type = ""
+    # Lecturas normales consecutivas para cerrar el episodio (None = las del motor)
+    clear_after: Optional[int] = None
+
+    def new_state(self):
+        """Crea el estado inicial de la regla para un sensor"""
+        return None
+
+    def evaluate(self, state, sensor_id: int, sensor_type: str, value: float,
+                 at: datetime) -> Optional[RuleResult]:
+        """
+        Evalúa una lectura y actualiza el estado.
+
+        Returns:
+            RuleResult, o None si la regla no puede decidir (calentando, tipo no soportado)
+        """
+        raise NotImplementedError
+
+
+class _RateState:
+    __slots__ = ("ref_time", "ref_value")
+
+    def __init__(self):
+        self.ref_time: Optional[datetime] = None
+        self.ref_value = 0.0
+
+
+class RateOfChangeRule(AlertRule):
+    """
+    Alerta si el valor cambia más rápido que el límite del tipo de dato.
+    La velocidad se mide contra una lectura de referencia de al menos
+    min_span_seconds de antigüedad, para no amplificar el ruido entre
+    lecturas consecutivas (cada 5 s).
+    """
+    alert_type = "RATE"
+
+    def __init__(self, limits: Optional[Dict[str, float]] = None, min_span_seconds: float = 60.0):
+        self.limits = dict(DEFAULT_RATE_LIMITS if limits is None else limits)
+        self.min_span_seconds = min_span_seconds
+
+    def new_state(self) -> _RateState:
+        return _RateState()
+
+    def evaluate(self, state: _RateState, sensor_id: int, sensor_type: str, value: float,
+                 at: datetime) -> Optional[RuleResult]:
+        limit = self.limits.get(sensor_type)
+        if limit is None:
+            return None
+        if state.ref_time is None or at < state.ref_time:
+            # Primera lectura o lectura desordenada: sólo referencia
+            if state.ref_time is None:
+                state.ref_time, state.ref_value = at, value
+            return None
+
+        span = (at - state.ref_time).total_seconds()
+        if span <= 0 or span < self.min_span_seconds:
+            return None
+
+        rate = (value - state.ref_value) / (span / 60)
+        state.ref_time, state.ref_value = at, value
+        return RuleResult(
+            breached=abs(rate) > limit,
+            metric=abs(rate),
+            message=f"{sensor_type} cambia {rate:+.2f}/min (límite: {limit}/min)",
+        )
+
+
+class _ZScoreState:
+    __slots__ = ("count", "mean", "variance")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.variance = 0.0
+
+
+class ZScoreRule(AlertRule):
+    """
+    Detecta anomalías con un z-score sobre media y varianza móviles
+    exponenciales (EWMA): O(1) en memoria y en tiempo por lectura.
+    """
+    alert_type = "ANOMALY"
+
+    def __init__(self, threshold: float = 4.0, alpha: float = 0.02, warmup: int = 30):
+        """
+        Args:
+            threshold: |z| a partir del cual la lectura es anómala
+            alpha: Peso de cada lectura nueva en la media móvil (~2/alpha lecturas de memoria)
+            warmup: Lecturas necesarias antes de empezar a evaluar
+        """
+        self.threshold = threshold
+        self.alpha = alpha
+        self.warmup = warmup
+
+    def new_state(self) -> _ZScoreState:
+        return _ZScoreState()
+
+    def evaluate(self, state: _ZScoreState, sensor_id: int, sensor_type: str, value: float,
+                 at: datetime) -> Optional[RuleResult]:
+        result = None
+        if state.count >= self.warmup:
+            std = math.sqrt(state.variance)
+            z = (value - state.mean) / std if std > 1e-9 else 0.0
+            result = RuleResult(
+                breached=abs(z) > self.threshold,
+                metric=abs(z),
+                message=f"{sensor_type} anómalo: {value:.2f} (z={z:+.1f}, media {state.mean:.2f})",
+            )
+
+        # Actualizar estadísticas (en el calentamiento, media acumulada exacta)
+        state.count += 1
+        alpha = max(self.alpha, 1.0 / state.count)
+        diff = value - state.mean
+        state.mean += alpha * diff
+        state.variance = (1 - alpha) * (state.variance + alpha * diff * diff)
+        return result
+
+
+class SensorThresholds(NamedTuple):
+    low: float
+    high: float
+    unit: str
+
+
+class ThresholdCache:
+    """
+    Umbrales de los sensores en memoria, para evaluar lecturas sin consultar
+    la BD. Se reemplaza entero en cada recarga de sensores.
+    """
+
+    def __init__(self):
+        self._thresholds: Dict[int, SensorThresholds] = {}
+
+    def update(self, thresholds: Dict[int, SensorThresholds]):
+        """Reemplaza los umbrales cacheados (asignación atómica)"""
+        self._thresholds = dict(thresholds)
+
+    def get(self, sensor_id: int) -> Optional[SensorThresholds]:
+        return self._thresholds.get(sensor_id)
+
+    def __contains__(self, sensor_id: int) -> bool:
+        return sensor_id in self._thresholds
+
+    def __len__(self) -> int:
+        return len(self._thresholds)
+
+
+class _ThresholdState:
+    __slots__ = ("breaches",)
+
+    def __init__(self):
+        self.breaches = 0
+
+
+class ThresholdRule(AlertRule):
+    """
+    Umbral HIGH o LOW evaluado con cada lectura cruda (camino rápido), con
+    los umbrales cacheados. Abre el episodio tras raise_after lecturas
+    consecutivas fuera de rango y lo cierra cuando el valor vuelve al rango
+    con el margen de histéresis.
+    """
+
+    def __init__(self, alert_type: str, thresholds: ThresholdCache, raise_after: int = 1,
+                 clear_after: int = 2, hysteresis: float = 0.05):
+        """
+        Args:
+            alert_type: "HIGH" o "LOW"
+            thresholds: Caché de umbrales compartida
+            raise_after: Lecturas consecutivas fuera de rango para abrir un episodio
+            clear_after: Lecturas recuperadas consecutivas para cerrarlo
+            hysteresis: Margen de recuperación como fracción del rango entre umbrales
+        """
+        if alert_type not in ("HIGH", "LOW"):
+            raise ValueError(f"Tipo de umbral no válido: {alert_type}")
+        self.alert_type = alert_type
+        self.thresholds = thresholds
+        self.raise_after = raise_after
+        self.clear_after = clear_after
+        self.hysteresis = hysteresis
+
+    def new_state(self) -> _ThresholdState:
+        return _ThresholdState()
+
+    def evaluate(self, state: _ThresholdState, sensor_id: int, sensor_type: str, value: float,
+                 at: datetime) -> Optional[RuleResult]:
+        limits = self.thresholds.get(sensor_id)
+        if limits is None:
+            return None
+
+        band = self.hysteresis * max(limits.high - limits.low, 0.0)
+        if self.alert_type == "HIGH":
+            breached = value > limits.high
+            recovered = value <= limits.high - band
+            message = f"{sensor_type} sobre el máximo. Valor: {value:.2f} {limits.unit} (límite: {limits.high})"
+        else:
+            breached = value < limits.low
+            recovered = value >= limits.low + band
+            message = f"{sensor_type} bajo el mínimo. Valor: {value:.2f} {limits.unit} (límite: {limits.low})"
+
+        if breached:
+            state.breaches += 1
+            if state.breaches < self.raise_after:
+                return None
+            return RuleResult(True, value, message)
+
+        state.breaches = 0
+        if recovered:
+            return RuleResult(False, value, "")
+        # Dentro del margen de histéresis: sin decisión, el episodio sigue abierto
+        return None
+
+
+def worst(alert_type: str, current: float, new: float) -> float:
+    """Valor pico de un episodio: el mínimo para LOW, el máximo para el resto"""
+    return min(current, new) if alert_type == "LOW" else max(current, new)
+
+
+class StaleSensorWheel:
+    """
+    Detección de sensores sin datos con una rueda de temporizadores (hashed
+    timing wheel): cada lectura reprograma el plazo del sensor y advance()
+    sólo recorre las ranuras vencidas, sin consultar la BD ni recorrer todos
+    los sensores.
+    """
+
+    def __init__(self, timeout_seconds: float, tick_seconds: float = 10.0, slots: int = 64):
+        """
+        Args:
+            timeout_seconds: Segundos sin datos para considerar el sensor sin conexión
+            tick_seconds: Resolución de la rueda en segundos
+            slots: Número de ranuras de la rueda
+        """
+        self.timeout_seconds = timeout_seconds
+        self.tick_seconds = tick_seconds
+        self._slots: List[Set[int]] = [set() for _ in range(slots)]
+        self._deadline_tick: Dict[int, int] = {}
+        self._last_seen: Dict[int, float] = {}
+        self._current_tick: Optional[int] = None
+        self.stale: Set[int] = set()
+
+    def _tick_of(self, moment: float) -> int:
+        return math.ceil(moment / self.tick_seconds)
+
+    def _schedule(self, sensor_id: int, deadline: float):
+        tick = self._tick_of(deadline)
+        if self._deadline_tick.get(sensor_id) != tick:
+            self._deadline_tick[sensor_id] = tick
+            self._slots[tick % len(self._slots)].add(sensor_id)
+
+    def touch(self, sensor_id: int, at: float) -> bool:
+        """
+        Registra datos de un sensor y reprograma su plazo.
+
+        Returns:
+            True si el sensor estaba marcado sin conexión (se ha recuperado)
+        """
+        if at < self._last_seen.get(sensor_id, float("-inf")):
+            return False
+        self._last_seen[sensor_id] = at
+        self._schedule(sensor_id, at + self.timeout_seconds)
+        if sensor_id in self.stale:
+            self.stale.discard(sensor_id)
+            return True
+        return False
+
+    def watch(self, sensor_id: int, at: float):
+        """Empieza a vigilar un sensor que todavía no ha enviado datos"""
+        if sensor_id not in self._last_seen:
+            self.touch(sensor_id, at)
+
+    def forget(self, sensor_id: int):
+        """Deja de vigilar un sensor (baja o cambio de partición)"""
+        self._last_seen.pop(sensor_id, None)
+        self._deadline_tick.pop(sensor_id, None)
+        self.stale.discard(sensor_id)
+
+    def advance(self, now: float) -> List[Tuple[int, float]]:
+        """
+        Avanza la rueda hasta now y devuelve los sensores vencidos.
+        Un sensor vencido se reprograma otro timeout, de modo que sigue
+        apareciendo periódicamente mientras no envíe datos.
+
+        Returns:
+            Lista de (sensor_id, segundos sin datos)
+        """
+        target = math.floor(now / self.tick_seconds)
+        if self._current_tick is None:
+            self._current_tick = target - len(self._slots)
+        first = max(self._current_tick + 1, target - len(self._slots) + 1)
+        self._current_tick = target
+
+        expired = []
+        for tick in range(first, target + 1):
+            slot = self._slots[tick % len(self._slots)]
+            for sensor_id in list(slot):
+                deadline = self._deadline_tick.get(sensor_id)
+                if deadline is None or deadline % len(self._slots) != tick % len(self._slots):
+                    # Entrada obsoleta: el sensor se reprogramó en otra ranura
+                    slot.discard(sensor_id)
+                elif deadline <= target:
+                    slot.discard(sensor_id)
+                    del self._deadline_tick[sensor_id]
+                    self.stale.add(sensor_id)
+                    expired.append((sensor_id, now - self._last_seen[sensor_id]))
+                    self._schedule(sensor_id, now + self.timeout_seconds)
+        return expired
+
+
+@dataclass
+class RuleEpisode:
+    """
+    Episodio de alerta de una regla, acumulado en memoria hasta persistirlo.
+    occurrences cuenta las evaluaciones fuera de rango desde la última persistencia.
+    """
+    sensor_id: int
+    alert_type: str
+    message: str
+    first_seen: datetime
+    last_seen: datetime
+    peak: float
+    occurrences: int = 0
+    closed_at: Optional[datetime] = None
+    clear_count: int = 0
+
+
+class RuleEngine:
+    """
+    Motor de reglas de alerta sobre el flujo de lecturas (tasa de cambio,
+    anomalías por z-score y sensores sin datos). Todo el estado está en
+    memoria y es O(1) por sensor y regla; los episodios resultantes se
+    recogen con drain() para persistirlos fuera del camino de ingesta.
+    """
+    OFFLINE = "OFFLINE"
+
+    def __init__(self, rules: Optional[Iterable[AlertRule]] = None,
+                 stale_after_minutes: float = 10.0, clear_after: int = 3,
+                 thresholds: Optional[ThresholdCache] = None):
+        """
+        Args:
+            rules: Reglas por lectura (por defecto tasa de cambio y z-score)
+            stale_after_minutes: Minutos sin datos para alertar (0 = desactivado)
+            clear_after: Lecturas normales consecutivas para cerrar un episodio
+            thresholds: Caché de umbrales usada por las ThresholdRule (camino rápido)
+        """
+        self.rules = list(rules) if rules is not None else [RateOfChangeRule(), ZScoreRule()]
+        self.clear_after = clear_after
+        self.thresholds = thresholds or ThresholdCache()
+        # Se llama (fuera del lock) cuando un episodio se abre o se cierra
+        self.on_change: Optional[Callable[[], None]] = None
+        self.stale = StaleSensorWheel(stale_after_minutes * 60) if stale_after_minutes > 0 else None
+        self._rule_states: Dict[Tuple[int, str, str], object] = {}
+        self._episodes: Dict[Tuple[int, str], RuleEpisode] = {}
+        # Episodios pendientes de persistir (por identidad: un cierre y una
+        # reapertura del mismo sensor entre dos drain() son dos episodios)
+        self._changed: Dict[int, RuleEpisode] = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "RuleEngine":
+        """
+        Crea el motor con AGRORETO_ALERT_STALE_MINUTES y AGRORETO_ALERT_ZSCORE.
+        Con AGRORETO_ALERT_FAST_PATH=1 añade los umbrales HIGH/LOW sobre lecturas
+        crudas, con la histéresis y el debounce de AGRORETO_ALERT_*.
+        """
+        thresholds = ThresholdCache()
+        rules: List[AlertRule] = [
+            RateOfChangeRule(),
+            ZScoreRule(threshold=float(os.environ.get("AGRORETO_ALERT_ZSCORE", 4.0))),
+        ]
+        if os.environ.get("AGRORETO_ALERT_FAST_PATH", "0").lower() in ("1", "true", "yes"):
+            settings = dict(
+                raise_after=int(os.environ.get("AGRORETO_ALERT_RAISE_AFTER", 1)),
+                clear_after=int(os.environ.get("AGRORETO_ALERT_CLEAR_AFTER", 2)),
+                hysteresis=float(os.environ.get("AGRORETO_ALERT_HYSTERESIS", 0.05)),
+            )
+            rules += [
+                ThresholdRule("HIGH", thresholds, **settings),
+                ThresholdRule("LOW", thresholds, **settings),
+            ]
+        return cls(
+            rules=rules,
+            stale_after_minutes=float(os.environ.get("AGRORETO_ALERT_STALE_MINUTES", 10)),
+            thresholds=thresholds,
+        )
+
+    @property
+    def fast_path(self) -> bool:
+        """Indica si los umbrales se evalúan con cada lectura (ThresholdRule)"""
+        return any(isinstance(rule, ThresholdRule) for rule in self.rules)
+
+    def covers_thresholds(self, sensor_id: int) -> bool:
+        """Indica si los umbrales del sensor ya se evalúan en el camino rápido"""
+        return self.fast_path and sensor_id in self.thresholds
+
+    def _record(self, sensor_id: int, alert_type: str, result: RuleResult, at: datetime,
+                clear_after: Optional[int] = None) -> bool:
+        """
+        Actualiza el episodio en memoria de (sensor, tipo) con un resultado. Con el lock tomado.
+
+        Returns:
+            True si el episodio se ha abierto o cerrado
+        """
+        key = (sensor_id, alert_type)
+        episode = self._episodes.get(key)
+
+        if result.breached:
+            opened = episode is None
+            if opened:
+                episode = self._episodes[key] = RuleEpisode(
+                    sensor_id=sensor_id, alert_type=alert_type, message=result.message,
+                    first_seen=at, last_seen=at, peak=result.metric,
+                )
+            episode.occurrences += 1
+            episode.last_seen = max(episode.last_seen, at)
+            episode.peak = worst(alert_type, episode.peak, result.metric)
+            episode.clear_count = 0
+            self._changed[id(episode)] = episode
+            return opened
+        elif episode is not None:
+            episode.clear_count += 1
+            if episode.clear_count >= (clear_after or self.clear_after):
+                episode.closed_at = at
+                del self._episodes[key]
+                self._changed[id(episode)] = episode
+                return True
+        return False
+
+    def _notify(self):
+        if self.on_change is not None:
+            try:
+                self.on_change()
+            except Exception as e:
+                logger.exception(f"❌ Error notificando cambios de alertas: {e}")
+
+    def on_reading(self, sensor_id: int, sensor_type: str, value: float,
+                   at: datetime, received: Optional[float] = None):
+        """
+        Evalúa todas las reglas con una lectura.
+
+        Args:
+            sensor_id: ID del sensor
+            sensor_type: Tipo de dato
+            value: Valor de la lectura
+            at: Tiempo de evento de la lectura
+            received: Instante de llegada en segundos desde la época (por defecto ahora)
+        """
+        changed = False
+        with self.lock:
+            for rule in self.rules:
+                state_key = (sensor_id, sensor_type, rule.alert_type)
+                state = self._rule_states.get(state_key)
+                if state is None:
+                    state = self._rule_states[state_key] = rule.new_state()
+                result = rule.evaluate(state, sensor_id, sensor_type, value, at)
+                if result is not None:
+                    changed |= self._record(sensor_id, rule.alert_type, result, at, rule.clear_after)
+            changed |= self._touch(sensor_id, at, received)
+        if changed:
+            self._notify()
+
+    def _touch(self, sensor_id: int, at: datetime, received: Optional[float] = None) -> bool:
+        if self.stale is None:
+            return False
+        received = time.time() if received is None else received
+        if self.stale.touch(sensor_id, received):
+            logger.info(f"📶 Sensor {sensor_id} vuelve a enviar datos")
+            return self._record(sensor_id, self.OFFLINE, RuleResult(False, 0.0, ""), at, clear_after=1)
+        return False
+
+    def touch(self, sensor_id: int, at: Optional[datetime] = None, received: Optional[float] = None):
+        """Registra actividad de un sensor sin evaluar reglas (p. ej. lecturas tardías)"""
+        with self.lock:
+            changed = self._touch(sensor_id, at or datetime.now(), received)
+        if changed:
+            self._notify()
+
+    def watch(self, sensor_ids: Iterable[int], now: Optional[float] = None):
+        """Vigila sensores aún sin datos para detectar los que nunca llegan a enviar"""
+        if self.stale is None:
+            return
+        now = time.time() if now is None else now
+        with self.lock:
+            for sensor_id in sensor_ids:
+                self.stale.watch(sensor_id, now)
+
+    def forget(self, sensor_ids: Iterable[int]):
+        """Deja de vigilar sensores dados de baja o que ya no son de esta partición"""
+        if self.stale is None:
+            return
+        with self.lock:
+            for sensor_id in sensor_ids:
+                self.stale.forget(sensor_id)
+
+    def tick(self, now: Optional[float] = None) -> int:
+        """
+        Avanza la rueda de sensores sin datos y abre/actualiza sus episodios OFFLINE.
+
+        Returns:
+            Número de sensores vencidos en este avance
+        """
+        if self.stale is None:
+            return 0
+        now = time.time() if now is None else now
+        at = datetime.fromtimestamp(now)
+        changed = False
+        with self.lock:
+            expired = self.stale.advance(now)
+            for sensor_id, silent_seconds in expired:
+                minutes = silent_seconds / 60
+                changed |= self._record(
+                    sensor_id, self.OFFLINE,
+                    RuleResult(True, minutes, f"sin datos desde hace {minutes:.0f} min"),
+                    at,
+                )
+        if expired:
+            logger.warning(f"📴 {len(expired)} sensor(es) sin datos")
+        if changed:
+            self._notify()
+        return len(expired)
+
+    def drain(self) -> List[RuleEpisode]:
+        """
+        Devuelve los episodios que han cambiado desde la última llamada
+        (copias) y reinicia sus contadores de evaluaciones.
+        """
+        with self.lock:
+            changed = [replace(episode) for episode in self._changed.values()]
+            for episode in self._changed.values():
+                episode.occurrences = 0
+            self._changed = {}
+        return changed
+
+    def requeue(self, episodes: Iterable[RuleEpisode]):
+        """
+        Devuelve a pendientes los episodios de un drain() que no se han podido
+        persistir. Si el episodio sigue en memoria (mismo sensor, tipo e inicio)
+        se le suman de nuevo las evaluaciones; si no, se reencola la copia
+        (p. ej. un cierre), así no se pierde ninguna apertura ni ningún cierre.
+        Los reencolados van por delante de los cambios posteriores al drain():
+        un cierre pendiente se aplica antes que la nueva apertura del mismo
+        sensor y tipo, que si no se fusionaría con la alerta aún abierta.
+
+        Args:
+            episodes: Episodios devueltos por drain()
+        """
+        with self.lock:
+            pending = {
+                (episode.sensor_id, episode.alert_type, episode.first_seen): episode
+                for episode in list(self._episodes.values()) + list(self._changed.values())
+            }
+            requeued: Dict[int, RuleEpisode] = {}
+            for episode in episodes:
+                current = pending.get((episode.sensor_id, episode.alert_type, episode.first_seen))
+                if current is None:
+                    requeued[id(episode)] = episode
+                    continue
+                current.occurrences += episode.occurrences
+                current.peak = worst(episode.alert_type, current.peak, episode.peak)
+                requeued[id(current)] = current
+            for key, episode in self._changed.items():
+                requeued.setdefault(key, episode)
+            self._changed = requeued
@@ -0,0 +1,97 @@
+# app/services/alert_writer.py
+import logging
+import threading
+
+from sqlmodel import Session
+
+from app.services.alert_engine import AlertEngine
+from app.services.alert_rules import RuleEngine
+from app.utils import engine
+
+logger = logging.getLogger(__name__)
+
+
+class AlertWriter:
+    """
+    Persiste en segundo plano los episodios del motor de reglas.
+
+    El motor de reglas avisa con notify() cuando un episodio se abre o se
+    cierra y el writer lo guarda en su propio thread, así el thread MQTT que
+    evalúa las lecturas nunca hace I/O de BD. Las actualizaciones de episodios
+    ya abiertos (last_seen, occurrences) se agrupan cada flush_seconds.
+    """
+
+    def __init__(self, rule_engine: RuleEngine, alert_engine: AlertEngine, flush_seconds: float = 30.0):
+        """
+        Inicializa el writer de alertas.
+
+        Args:
+            rule_engine: Motor de reglas del que se recogen los episodios
+            alert_engine: Motor de alertas que los persiste con deduplicación
+            flush_seconds: Cada cuántos segundos se guardan las actualizaciones pendientes
+        """
+        self.rule_engine = rule_engine
+        self.alert_engine = alert_engine
+        self.flush_seconds = flush_seconds
+        self.running = False
+        self.thread = None
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        # Un único escritor a la vez: evita crear dos alertas para el mismo episodio
+        self._flush_lock = threading.Lock()
+
+    def notify(self):
+        """Despierta al writer para guardar los episodios pendientes (no bloquea)"""
+        self._wake.set()
+
+    def flush(self) -> int:
+        """
+        Guarda ahora los episodios pendientes del motor de reglas. Si falla la
+        escritura se devuelven al motor para reintentarlos en el siguiente flush.
+
+        Returns:
+            Número de episodios procesados
+        """
+        with self._flush_lock:
+            episodes = self.rule_engine.drain()
+            if not episodes:
+                return 0
+            try:
+                with Session(engine) as session:
+                    self.alert_engine.apply_rule_episodes(session, episodes)
+                    session.commit()
+            except Exception as e:
+                # drain() ya ha vaciado los pendientes: sin reencolar se perderían
+                # aperturas (sin aviso) y cierres (alerta abierta para siempre)
+                self.rule_engine.requeue(episodes)
+                logger.exception(f"❌ Error guardando alertas ({len(episodes)} episodios reencolados): {e}")
+                return 0
+            return len(episodes)
+
+    def _writer_loop(self):
+        while not self._stop_event.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+    def start(self):
+        """Inicia el thread de escritura de alertas"""
+        if self.running:
+            return
+        self.running = True
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._writer_loop, daemon=True, name="AlertWriter-Thread")
+        self.thread.start()
+        logger.info("✅ Writer de alertas iniciado en background")
+
+    def stop(self):
+        """Detiene el thread y guarda los episodios pendientes"""
+        if not self.running:
+            return
+        self.running = False
+        self._stop_event.set()
+        self._wake.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+        self.flush()
@@ -0,0 +1,349 @@
+# app/services/async_ingest.py
+import asyncio
+import logging
+import os
+import signal
+import threading
+import time
+from datetime import datetime
+from typing import Callable, List, Optional
+
+import paho.mqtt.client as mqtt
+
+from app.logging_config import RateLimitedLogger
+from app.services.data_aggregator import SensorDataAggregator
+from app.services.ingest import IngestService
+from app.services.maiota_client import MAIoTAMultiSensorClient
+from app.services.metrics import Counter, Gauge
+from app.services.notifier import NotificationDispatcher
+from app.services.partitioning import SensorPartition
+from app.services.retention import RetentionJob
+
+logger = logging.getLogger(__name__)
+hot_logger = RateLimitedLogger(logger)
+
+INGEST_QUEUE_SIZE = Gauge(
+    "agroreto_ingest_queue_size", "Elementos en las colas de la ingesta asyncio (messages, readings)", ["queue"],
+)
+INGEST_DROPPED = Counter(
+    "agroreto_ingest_dropped_total", "Mensajes MQTT descartados con la cola de la ingesta asyncio llena",
+)
+
+
+class AsyncioPahoLoop:
+    """
+    Ejecuta la red de un cliente paho dentro de un event loop asyncio, sin
+    thread loop_forever: el loop vigila el socket (add_reader/add_writer) y
+    una tarea llama a loop_misc (keepalive) y reconecta con espera exponencial.
+    """
+
+    def __init__(self, transport: mqtt.Client, loop: asyncio.AbstractEventLoop):
+        self.transport = transport
+        self.loop = loop
+        self._loop_thread = threading.get_ident()
+        transport.on_socket_open = self._on_socket_open
+        transport.on_socket_close = self._on_socket_close
+        transport.on_socket_register_write = self._on_socket_register_write
+        transport.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def _in_loop(self, fn: Callable, *args):
+        # paho puede abrir el socket en un thread auxiliar (connect bloqueante)
+        if threading.get_ident() == self._loop_thread:
+            fn(*args)
+        else:
+            self.loop.call_soon_threadsafe(fn, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._in_loop(self.loop.add_reader, sock, client.loop_read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._in_loop(self.loop.remove_reader, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._in_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._in_loop(self.loop.remove_writer, sock)
+
+    async def run(self, host: str, port: int, keepalive: int, stop: asyncio.Event):
+        """Conecta y mantiene la conexión hasta que se activa stop"""
+        self.transport.connect_async(host, port, keepalive=keepalive)
+        delay = 1
+        while not stop.is_set():
+            if self.transport.socket() is None:
+                try:
+                    # El connect TCP es bloqueante: fuera del event loop
+                    await asyncio.to_thread(self.transport.reconnect)
+                    delay = 1
+                except OSError as e:
+                    logger.warning(f"⚠️ Sin conexión con {host}:{port} ({e}), reintento en {delay}s")
+                    await self._sleep(stop, delay)
+                    delay = min(delay * 2, 120)
+                    continue
+            self.transport.loop_misc()
+            await self._sleep(stop, 1)
+
+    @staticmethod
+    async def _sleep(stop: asyncio.Event, seconds: float):
+        try:
+            await asyncio.wait_for(stop.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+
+class AsyncIngestService:
+    """
+    Ingesta asyncio: cliente MQTT, parseo, agregación y alertas como tareas de
+    un único event loop, comunicadas por colas asyncio.
+
+        MQTT (socket en el loop) -> cola de mensajes -> parseo -> cola de lecturas
+        -> agregador (medias y reglas por lectura) -> guardados periódicos
+
+    Las lecturas no cruzan threads: add_reading y el motor de reglas sólo se
+    llaman desde el loop. El lock del agregador sólo compite con el guardado
+    de medias, que sale del loop con asyncio.to_thread y lo toma el tiempo de
+    copiar los buffers. La escritura en BD (medias, alertas) es el único paso
+    fuera del loop, mientras no haya un driver async de BD en las dependencias.
+    """
+
+    def __init__(self, client: Optional[MAIoTAMultiSensorClient] = None,
+                 aggregator: Optional[SensorDataAggregator] = None,
+                 partition: Optional[SensorPartition] = None,
+                 refresh_seconds: int = 60,
+                 retention: Optional[RetentionJob] = None,
+                 queue_size: int = 10000,
+                 dispatcher: Optional[NotificationDispatcher] = None):
+        """
+        Inicializa la ingesta asyncio.
+
+        Args:
+            client: Cliente MQTT (por defecto la instancia global)
+            aggregator: Agregador de datos (por defecto la instancia global)
+            partition: Partición de sensores de este worker (por defecto todos)
+            refresh_seconds: Cada cuántos segundos se recargan los sensores de la BD
+            retention: Job de retención (por defecto la instancia global; sólo partición 0)
+            queue_size: Capacidad de las colas; con la cola de mensajes llena se
+                descartan mensajes en lugar de bloquear la red
+            dispatcher: Envío de avisos de alertas (por defecto la instancia global)
+        """
+        # La carga de sensores por topic y la partición se reutilizan de la ingesta con threads
+        self.ingest = IngestService(client=client, aggregator=aggregator, partition=partition,
+                                    refresh_seconds=0, retention=retention, dispatcher=dispatcher)
+        self.client = self.ingest.client
+        self.aggregator = self.ingest.aggregator
+        self.refresh_seconds = refresh_seconds
+        self.queue_size = queue_size
+        self.running = False
+        self.received = 0
+        self.dropped = 0
+        self.readings = 0
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self.messages: Optional[asyncio.Queue] = None
+        self.readings_queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._stop: Optional[asyncio.Event] = None
+        self._alerts_pending: Optional[asyncio.Event] = None
+        self._reload_task: Optional[asyncio.Task] = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls, **kwargs) -> "AsyncIngestService":
+        """Configura la capacidad de las colas con AGRORETO_INGEST_QUEUE"""
+        return cls(queue_size=int(os.environ.get("AGRORETO_INGEST_QUEUE", 10000)), **kwargs)
+
+    # --- Entrada desde MQTT ---------------------------------------------------
+
+    def _on_mqtt_message(self, client, userdata, msg):
+        """Callback del transporte: sólo encola, el parseo se hace en su tarea"""
+        item = (msg.topic, msg.payload)
+        if threading.get_ident() == self._loop_thread:
+            self._enqueue(item)
+        else:
+            # Transportes que entregan desde otro thread (p. ej. el broker en memoria)
+            self.loop.call_soon_threadsafe(self._enqueue, item)
+
+    def _enqueue(self, item):
+        self.received += 1
+        try:
+            self.messages.put_nowait(item)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            INGEST_DROPPED.inc()
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning(f"⚠️ Cola de mensajes MQTT llena: {self.dropped} mensajes descartados")
+
+    def _on_connected(self):
+        """Listener de conexión: recarga los sensores sin bloquear el loop"""
+        self.loop.call_soon_threadsafe(self._schedule_reload)
+
+    def _schedule_reload(self):
+        if self._reload_task is None or self._reload_task.done():
+            self._reload_task = self.loop.create_task(self.reload_sensors())
+
+    async def reload_sensors(self):
+        """Recarga los sensores de la BD (fuera del loop) y actualiza las suscripciones"""
+        await asyncio.to_thread(self.ingest.load_sensors)
+
+    # --- Tareas del pipeline ------------------------------------------------
+
+    async def _parse_loop(self):
+        while True:
+            topic, payload = await self.messages.get()
+            try:
+                data = self.client.decode_message(topic, payload)
+                if data:
+                    for sensor_info in self.ingest.sensors_by_topic.get(topic, ()):
+                        await self.readings_queue.put((sensor_info['id'], sensor_info['maiota_type'], data))
+            except Exception as e:
+                hot_logger.exception(("parse", topic), "❌ Error procesando mensaje de %s: %s", topic, e)
+            finally:
+                self.messages.task_done()
+
+    async def _aggregate_loop(self):
+        while True:
+            sensor_id, sensor_type, data = await self.readings_queue.get()
+            try:
+                self.aggregator.add_reading(sensor_id, sensor_type, data)
+                self.readings += 1
+            except Exception as e:
+                hot_logger.exception("add_reading", "❌ Error añadiendo lectura al agregador: %s", e)
+            finally:
+                self.readings_queue.task_done()
+
+    async def _flush_loop(self):
+        """
+        Guarda las medias en cada límite de intervalo, alineado al reloj, y
+        avanza la rueda de sensores sin datos (alertas OFFLINE). Con threads lo
+        hace el guardado cuando aggregator.running; aquí el agregador no tiene
+        thread propio, así que el tick se hace desde el loop.
+        """
+        boundary = self.aggregator._next_boundary()
+        while not self._stop.is_set():
+            await AsyncioPahoLoop._sleep(self._stop, max(0.0, boundary - time.time()))
+            if self._stop.is_set():
+                break
+            self.aggregator.rule_engine.tick()
+            logger.info("⏰ Ejecutando agregación de datos...")
+            await asyncio.to_thread(self.aggregator._calculate_and_save_averages,
+                                    datetime.fromtimestamp(boundary))
+            boundary += self.aggregator.interval_seconds
+            if boundary <= time.time():
+                boundary = self.aggregator._next_boundary()
+
+    async def _alerts_loop(self):
+        """Guarda los episodios del motor de reglas en cuanto cambian (o cada flush_seconds)"""
+        writer = self.aggregator.alert_writer
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._alerts_pending.wait(), writer.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._alerts_pending.clear()
+            await asyncio.to_thread(writer.flush)
+
+    async def _refresh_loop(self):
+        while not self._stop.is_set():
+            await AsyncioPahoLoop._sleep(self._stop, self.refresh_seconds)
+            if not self._stop.is_set():
+                await self.reload_sensors()
+
+    # --- Ciclo de vida -------------------------------------------------------
+
+    async def start(self):
+        """Arranca la ingesta como tareas del event loop actual (no bloquea)"""
+        if self.running:
+            logger.warning("⚠️ La ingesta ya está en ejecución")
+            return
+        logger.info(f"🚀 Iniciando ingesta MAIoTA asyncio ({self.ingest.partition})...")
+        self.running = True
+        self.loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._stop = asyncio.Event()
+        self._alerts_pending = asyncio.Event()
+        self.messages = asyncio.Queue(maxsize=self.queue_size)
+        self.readings_queue = asyncio.Queue(maxsize=self.queue_size)
+        INGEST_QUEUE_SIZE.labels("messages").set_function(self.messages.qsize)
+        INGEST_QUEUE_SIZE.labels("readings").set_function(self.readings_queue.qsize)
+        self.aggregator.bind_metrics()
+
+        # Los episodios de las reglas se guardan desde una tarea, no desde el thread del writer
+        self.aggregator.rule_engine.on_change = lambda: self.loop.call_soon_threadsafe(self._alerts_pending.set)
+        self.client.add_connect_listener(self._on_connected)
+
+        transport = self.client.client
+        transport.on_message = self._on_mqtt_message
+        self._flush_task = self.loop.create_task(self._flush_loop(), name="ingest-flush")
+        self._tasks = [
+            self.loop.create_task(self._parse_loop(), name="ingest-parse"),
+            self.loop.create_task(self._aggregate_loop(), name="ingest-aggregate"),
+            self._flush_task,
+            self.loop.create_task(self._alerts_loop(), name="ingest-alerts"),
+        ]
+        if self.refresh_seconds > 0:
+            self._tasks.append(self.loop.create_task(self._refresh_loop(), name="ingest-refresh"))
+        if isinstance(transport, mqtt.Client):
+            network = AsyncioPahoLoop(transport, self.loop)
+            self._tasks.append(self.loop.create_task(
+                network.run(self.client.broker, self.client.port, self.client.keepalive, self._stop),
+                name="ingest-mqtt",
+            ))
+        else:
+            # Transportes sin socket (broker en memoria): conexión inmediata
+            transport.loop_start()
+        if self.ingest.partition.index == 0:
+            self.ingest.retention.start()
+        logger.info("✅ Ingesta asyncio iniciada")
+
+    @property
+    def flushing(self) -> bool:
+        """Indica si la tarea de guardados periódicos está en marcha"""
+        return self._flush_task is not None and not self._flush_task.done()
+
+    async def drain(self):
+        """Espera a que se procesen todos los mensajes y lecturas encolados"""
+        await self.messages.join()
+        await self.readings_queue.join()
+
+    async def stop(self):
+        """Detiene la ingesta procesando lo encolado y guardando las lecturas pendientes"""
+        if not self.running:
+            return
+        self.running = False
+        self.client.client.disconnect()
+        await self.drain()
+        self._stop.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.ingest.retention.stop()
+        # Últimos episodios y medias pendientes (y los avisos de alertas)
+        await asyncio.to_thread(self.aggregator.alert_writer.flush)
+        await asyncio.to_thread(self.aggregator.stop)
+        await asyncio.to_thread(self.ingest.dispatcher.stop)
+        self.aggregator.rule_engine.on_change = self.aggregator.alert_writer.notify
+        logger.info(f"✅ Ingesta asyncio detenida ({self.received} mensajes, {self.dropped} descartados)")
+
+    async def run_forever(self, on_started: Optional[Callable[[], None]] = None):
+        """
+        Ejecuta la ingesta hasta recibir SIGINT/SIGTERM (worker dedicado).
+
+        Args:
+            on_started: Función opcional a ejecutar cuando la ingesta ha arrancado
+        """
+        stop_requested = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop_requested.set)
+
+        await self.start()
+        if on_started:
+            on_started()
+        await stop_requested.wait()
+        logger.info("🛑 Señal recibida, deteniendo ingesta...")
+        await self.stop()
+
+
+# Instancia global de la ingesta asyncio (AGRORETO_INGEST_MODE=asyncio en el proceso web)
+async_ingest_service = AsyncIngestService.from_env(partition=SensorPartition.from_env())
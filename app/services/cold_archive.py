@@ -0,0 +1,465 @@
+# app/services/cold_archive.py
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import delete
+from sqlmodel import Session, func, select
+
+from app.models import SensorData
+from app.utils import engine
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+MANIFEST_NAME = "manifest.json"
+
+# Cabecera: magic, versión, flags, número de puntos, segundo base (desde EPOCH)
+# y número de bloques. Le sigue el índice de bloques (primer y último segundo,
+# puntos, desplazamiento y tamaño de cada columna) y después los bloques: los
+# segundos como deltas de deltas zigzag varint y los valores float64 con sus
+# bytes agrupados por posición, cada columna comprimida con zlib.
+_MAGIC = b"AGC1"
+_VERSION = 2
+_FLAG_ZLIB = 1
+_HEADER = struct.Struct("<4sHHIqI")
+_BLOCK = struct.Struct("<qqIIII")
+BLOCK_SIZE = 1024
+
+
+class HistoryPoint(NamedTuple):
+    """Punto del histórico de un sensor; id y raw sólo existen para datos de la BD"""
+    timestamp: datetime
+    value: float
+    id: Optional[int] = None
+    raw: Optional[str] = None
+
+
+@dataclass
+class ArchiveFile:
+    """Entrada del manifiesto: un fichero por sensor y mes"""
+    sensor_id: int
+    month: str  # YYYY-MM
+    path: str  # Relativa al directorio del archivo
+    count: int
+    start: str  # ISO del primer punto
+    end: str  # ISO del último punto
+    min: float
+    max: float
+    bytes: int
+
+    @property
+    def start_dt(self) -> datetime:
+        return datetime.fromisoformat(self.start)
+
+    @property
+    def end_dt(self) -> datetime:
+        return datetime.fromisoformat(self.end)
+
+
+def _month_start(moment: datetime) -> datetime:
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(moment: datetime) -> datetime:
+    return (_month_start(moment) + timedelta(days=32)).replace(day=1)
+
+
+def _encode_seconds(seconds: List[int]) -> bytes:
+    """Deltas de deltas de los segundos (el primero va en el índice) como varints zigzag"""
+    out = bytearray()
+    previous, previous_delta = seconds[0], 0
+    for second in seconds[1:]:
+        delta = second - previous
+        number = delta - previous_delta
+        number = number * 2 if number >= 0 else -number * 2 - 1
+        while number >= 0x80:
+            out.append((number & 0x7F) | 0x80)
+            number >>= 7
+        out.append(number)
+        previous, previous_delta = second, delta
+    return bytes(out)
+
+
+def _decode_seconds(first: int, data: bytes) -> List[int]:
+    seconds = [first]
+    second, delta, number, shift = first, 0, 0, 0
+    for byte in data:
+        number |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        delta += number >> 1 if not number & 1 else -(number >> 1) - 1
+        second += delta
+        seconds.append(second)
+        number = shift = 0
+    return seconds
+
+
+def _shuffle(data: bytes, width: int = 8) -> bytes:
+    """Agrupa los bytes por posición: exponente y bytes altos de valores parecidos se repiten"""
+    return b"".join(data[i::width] for i in range(width))
+
+
+def _unshuffle(data: bytes, count: int, width: int = 8) -> bytes:
+    out = bytearray(width * count)
+    for i in range(width):
+        out[i::width] = data[i * count:(i + 1) * count]
+    return bytes(out)
+
+
+def encode_points(points: List[Tuple[datetime, float]], block_size: int = BLOCK_SIZE) -> bytes:
+    """
+    Codifica puntos ordenados por tiempo en bloques columnares comprimidos:
+    segundos como deltas de deltas (varint zigzag) y valores float64 sin
+    pérdida, con los bytes agrupados por posición; cada columna con zlib.
+
+    Args:
+        points: Lista de (timestamp, valor) en orden ascendente
+        block_size: Puntos por bloque (unidad que se descomprime al leer un rango)
+
+    Returns:
+        Contenido del fichero
+    """
+    seconds = [int((ts - EPOCH).total_seconds()) for ts, _ in points]
+    block_starts = range(0, len(points), block_size)
+    offset = _HEADER.size + _BLOCK.size * len(block_starts)
+    index, columns = [], []
+    for start in block_starts:
+        block_seconds = seconds[start:start + block_size]
+        values = array("d", [value for _, value in points[start:start + block_size]])
+        if sys.byteorder == "big":
+            values.byteswap()
+        time_column = zlib.compress(_encode_seconds(block_seconds))
+        values_column = zlib.compress(_shuffle(values.tobytes()))
+        index.append(_BLOCK.pack(block_seconds[0], block_seconds[-1], len(block_seconds),
+                                 offset, len(time_column), len(values_column)))
+        columns += [time_column, values_column]
+        offset += len(time_column) + len(values_column)
+    header = _HEADER.pack(_MAGIC, _VERSION, _FLAG_ZLIB, len(points), seconds[0] if seconds else 0, len(index))
+    return header + b"".join(index) + b"".join(columns)
+
+
+def decode_points(buffer, start: Optional[int] = None,
+                  end: Optional[int] = None) -> Tuple[List[int], List[float]]:
+    """
+    Decodifica un fichero del archivo. Sólo lee cabecera e índice más los
+    bloques que solapan con el rango, así que con un mmap el resto del
+    fichero ni se carga ni se descomprime.
+
+    Args:
+        buffer: Contenido del fichero (bytes o mmap)
+        start: Primer segundo (desde EPOCH) de interés; None = sin límite
+        end: Último segundo (desde EPOCH) de interés; None = sin límite
+
+    Returns:
+        (segundos desde EPOCH de cada punto, valores) de los bloques leídos,
+        que pueden incluir puntos fuera del rango en sus extremos
+    """
+    magic, version, flags, _count, _base, block_count = _HEADER.unpack_from(buffer, 0)
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError("Fichero de archivo no reconocido")
+    decompress = zlib.decompress if flags & _FLAG_ZLIB else bytes
+    seconds: List[int] = []
+    values = array("d")
+    for i in range(block_count):
+        first, last, count, offset, time_size, values_size = _BLOCK.unpack_from(buffer, _HEADER.size + i * _BLOCK.size)
+        if (start is not None and last < start) or (end is not None and first > end):
+            continue
+        values_offset = offset + time_size
+        seconds.extend(_decode_seconds(first, decompress(buffer[offset:values_offset])))
+        block_values = array("d", _unshuffle(decompress(buffer[values_offset:values_offset + values_size]), count))
+        if sys.byteorder == "big":
+            block_values.byteswap()
+        values.extend(block_values)
+    return seconds, values.tolist()
+
+
+class ColdArchive:
+    """
+    Archivo frío del histórico: ficheros columnares por sensor y mes.
+
+    Los meses completos más antiguos que la frontera fría se exportan de la
+    BD a ficheros <dir>/<sensor_id>/<YYYY-MM>.agc (bloques comprimidos con
+    deltas de tiempo varint y valores float64 sin pérdida) y se borran de
+    SensorData. Un manifiesto JSON indexa los ficheros; las lecturas abren
+    sólo los que solapan con el rango pedido, mediante mmap, y descomprimen
+    sólo los bloques de ese rango.
+    """
+
+    def __init__(self, directory: str = "archive"):
+        """
+        Inicializa el archivo frío.
+
+        Args:
+            directory: Directorio de los ficheros y el manifiesto
+        """
+        self.directory = directory
+        self._files: Dict[Tuple[int, str], ArchiveFile] = {}
+        self._by_sensor: Dict[int, List[ArchiveFile]] = {}
+        self._manifest_mtime: Optional[int] = None
+        self.lock = threading.RLock()
+
+    @classmethod
+    def from_env(cls) -> "ColdArchive":
+        """Crea el archivo en el directorio AGRORETO_ARCHIVE_DIR (por defecto ./archive)"""
+        return cls(os.environ.get("AGRORETO_ARCHIVE_DIR", "archive"))
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.directory, MANIFEST_NAME)
+
+    # --- Manifiesto -------------------------------------------------------
+
+    def _index(self):
+        self._by_sensor = {}
+        for entry in sorted(self._files.values(), key=lambda e: e.month):
+            self._by_sensor.setdefault(entry.sensor_id, []).append(entry)
+
+    def _refresh(self):
+        """Recarga el manifiesto si otro proceso (la ingesta) lo ha reescrito"""
+        try:
+            mtime = os.stat(self.manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            if self._manifest_mtime is not None:
+                self._files, self._by_sensor, self._manifest_mtime = {}, {}, None
+            return
+        if mtime == self._manifest_mtime:
+            return
+        with open(self.manifest_path, encoding="utf-8") as manifest:
+            entries = json.load(manifest).get("files", [])
+        self._files = {(e["sensor_id"], e["month"]): ArchiveFile(**e) for e in entries}
+        self._index()
+        self._manifest_mtime = mtime
+
+    def _save_manifest(self):
+        """Escribe el manifiesto de forma atómica (fichero temporal + rename)"""
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as manifest:
+            json.dump({"version": 1, "files": [asdict(e) for e in self._files.values()]}, manifest, indent=1)
+            manifest.flush()
+            os.fsync(manifest.fileno())
+        os.replace(tmp_path, self.manifest_path)
+        self._manifest_mtime = os.stat(self.manifest_path).st_mtime_ns
+        self._index()
+
+    def files(self, sensor_id: Optional[int] = None) -> List[ArchiveFile]:
+        """Ficheros del manifiesto (de un sensor o de todos)"""
+        with self.lock:
+            self._refresh()
+            if sensor_id is not None:
+                return list(self._by_sensor.get(sensor_id, []))
+            return list(self._files.values())
+
+    def cold_end(self, sensor_id: int) -> Optional[datetime]:
+        """Último instante archivado del sensor (None si no tiene archivo)"""
+        entries = self.files(sensor_id)
+        return max(e.end_dt for e in entries) if entries else None
+
+    # --- Lectura ------------------------------------------------------------
+
+    def _read_file(self, entry: ArchiveFile, start: Optional[datetime],
+                   end: Optional[datetime]) -> List[Tuple[datetime, float]]:
+        path = os.path.join(self.directory, entry.path)
+        start_second = None if start is None else int((start - EPOCH).total_seconds())
+        end_second = None if end is None else int((end - EPOCH).total_seconds())
+        try:
+            with open(path, "rb") as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                seconds, values = decode_points(mapped, start_second, end_second)
+        except FileNotFoundError:
+            # Expirado por la retención después de leer el manifiesto
+            return []
+        low = 0 if start_second is None else bisect_left(seconds, start_second)
+        high = len(seconds) if end_second is None else bisect_right(seconds, end_second)
+        return [(EPOCH + timedelta(seconds=seconds[i]), values[i]) for i in range(low, high)]
+
+    def read(self, sensor_id: int, start: Optional[datetime] = None,
+             end: Optional[datetime] = None) -> List[Tuple[datetime, float]]:
+        """
+        Lee los puntos archivados de un sensor en un rango, en orden ascendente.
+
+        Args:
+            sensor_id: ID del sensor
+            start: Inicio del rango (incluido; None = sin límite)
+            end: Fin del rango (incluido; None = sin límite)
+
+        Returns:
+            Lista de (timestamp, valor)
+        """
+        points = []
+        for entry in self.files(sensor_id):
+            if (start and entry.end_dt < start) or (end and entry.start_dt > end):
+                continue
+            points.extend(self._read_file(entry, start, end))
+        return points
+
+    def read_history(self, session: Session, sensor_id: int, start: Optional[datetime] = None,
+                     end: Optional[datetime] = None, limit: Optional[int] = None,
+                     newest_first: bool = False) -> List[HistoryPoint]:
+        """
+        Histórico de un sensor combinando la BD y, si el rango cruza la
+        frontera fría, el archivo. Si el rango es reciente no se toca el archivo.
+
+        Args:
+            session: Sesión de BD
+            sensor_id: ID del sensor
+            start: Inicio del rango (incluido; None = sin límite)
+            end: Fin del rango (incluido; None = sin límite)
+            limit: Número máximo de puntos
+            newest_first: Ordenar de más reciente a más antiguo (con limit, los más recientes)
+
+        Returns:
+            Lista de HistoryPoint
+        """
+        query = select(SensorData).where(SensorData.sensor_id == sensor_id)
+        if start:
+            query = query.where(SensorData.timestamp >= start)
+        if end:
+            query = query.where(SensorData.timestamp <= end)
+        order = SensorData.timestamp.desc() if newest_first else SensorData.timestamp.asc()
+        query = query.order_by(order)
+        if limit:
+            query = query.limit(limit)
+        hot = [HistoryPoint(r.timestamp, r.value, r.id, r.raw) for r in session.exec(query).all()]
+
+        cold_end = self.cold_end(sensor_id)
+        if cold_end is None or (start and start > cold_end):
+            return hot
+        if limit and newest_first and len(hot) >= limit and hot[-1].timestamp > cold_end:
+            return hot
+
+        # Un mes recién exportado puede seguir en la BD hasta que termine su borrado
+        seen = {point.timestamp for point in hot}
+        cold = [HistoryPoint(ts, value) for ts, value in self.read(sensor_id, start, end) if ts not in seen]
+        merged = sorted(hot + cold, key=lambda point: point.timestamp, reverse=newest_first)
+        return merged[:limit] if limit else merged
+
+    # --- Escritura ------------------------------------------------------------
+
+    def _write_month(self, sensor_id: int, month: datetime, points: List[Tuple[datetime, float]]) -> ArchiveFile:
+        """Escribe (o reescribe fusionando) el fichero de un sensor y mes"""
+        key = (sensor_id, month.strftime("%Y-%m"))
+        existing = self._files.get(key)
+        if existing:
+            merged = dict(self._read_file(existing, None, None))
+            merged.update(points)  # Con el mismo instante, gana la BD
+            points = sorted(merged.items())
+
+        relative_path = os.path.join(str(sensor_id), f"{key[1]}.agc")
+        path = os.path.join(self.directory, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        content = encode_points(points)
+        with open(path + ".tmp", "wb") as handle:
+            handle.write(content)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(path + ".tmp", path)
+
+        values = [value for _, value in points]
+        entry = ArchiveFile(
+            sensor_id=sensor_id,
+            month=key[1],
+            path=relative_path,
+            count=len(points),
+            start=points[0][0].isoformat(),
+            end=points[-1][0].isoformat(),
+            min=min(values),
+            max=max(values),
+            bytes=len(content),
+        )
+        self._files[key] = entry
+        return entry
+
+    def export(self, before: datetime, chunk_size: int = 2000) -> Tuple[int, int]:
+        """
+        Exporta al archivo los meses completos anteriores a before y borra de
+        la BD las filas exportadas (en lotes, tras escribir fichero y manifiesto).
+
+        Args:
+            before: Frontera fría; se exportan los meses que terminan antes
+            chunk_size: Filas por lote de borrado
+
+        Returns:
+            (filas exportadas, ficheros escritos)
+        """
+        boundary = _month_start(before)
+        exported = written = 0
+        with self.lock:
+            self._refresh()
+            with Session(engine) as session:
+                oldest = session.exec(
+                    select(SensorData.sensor_id, func.min(SensorData.timestamp))
+                    .where(SensorData.timestamp < boundary)
+                    .group_by(SensorData.sensor_id)
+                ).all()
+
+            for sensor_id, first in oldest:
+                month = _month_start(first)
+                while month < boundary:
+                    next_month = _next_month(month)
+                    with Session(engine) as session:
+                        rows = session.exec(
+                            select(SensorData.id, SensorData.timestamp, SensorData.value)
+                            .where(
+                                SensorData.sensor_id == sensor_id,
+                                SensorData.timestamp >= month,
+                                SensorData.timestamp < next_month,
+                            )
+                            .order_by(SensorData.timestamp, SensorData.id)
+                        ).all()
+                    if rows:
+                        entry = self._write_month(sensor_id, month, [(ts, value) for _, ts, value in rows])
+                        self._save_manifest()
+                        ids = [row_id for row_id, _, _ in rows]
+                        for offset in range(0, len(ids), chunk_size):
+                            with Session(engine) as session:
+                                session.execute(
+                                    delete(SensorData).where(SensorData.id.in_(ids[offset:offset + chunk_size]))
+                                )
+                                session.commit()
+                        exported += len(rows)
+                        written += 1
+                        logger.info(
+                            f"🧊 Archivado sensor {sensor_id} {entry.month}: "
+                            f"{len(rows)} filas -> {entry.bytes / 1024:.1f} KiB"
+                        )
+                    month = next_month
+        return exported, written
+
+    def expire(self, before: datetime) -> int:
+        """
+        Borra los ficheros cuyos datos son todos anteriores a before.
+
+        Returns:
+            Número de ficheros borrados
+        """
+        removed = 0
+        with self.lock:
+            self._refresh()
+            for key, entry in list(self._files.items()):
+                if entry.end_dt >= before:
+                    continue
+                del self._files[key]
+                try:
+                    os.remove(os.path.join(self.directory, entry.path))
+                except FileNotFoundError:
+                    pass
+                removed += 1
+            if removed:
+                self._save_manifest()
+        return removed
+
+
+# Instancia global del archivo frío (directorio según AGRORETO_ARCHIVE_DIR)
+cold_archive = ColdArchive.from_env()
@@ -4,193 +4,660 @@ import logging
 import threading
 import time
 from collections import defaultdict
-from datetime import datetime
-from typing import Dict, List
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
 
-from sqlmodel import Session
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session, select
 
-from app.models import Alert, Sensor, SensorData
+from app.logging_config import RateLimitedLogger
+from app.models import Sensor, SensorData
+from app.services.alert_engine import AlertEngine
+from app.services.alert_rules import RuleEngine
+from app.services.alert_writer import AlertWriter
+from app.services.metrics import LOCK_WAIT_BUCKETS, Counter, Gauge, Histogram, timed
+from app.services.query_tracking import tracked
 from app.utils import engine
 
 logger = logging.getLogger(__name__)
+hot_logger = RateLimitedLogger(logger)
+
+AGGREGATOR_LOCK_WAIT = Histogram(
+    "agroreto_aggregator_lock_wait_seconds",
+    "Espera para tomar el lock del agregador en add_reading",
+    buckets=LOCK_WAIT_BUCKETS,
+)
+AGGREGATOR_READINGS = Counter(
+    "agroreto_aggregator_readings_total",
+    "Lecturas recibidas por el agregador por estado (on_time, late, dropped)",
+    ["status"],
+)
+AGGREGATOR_BUFFERED = Gauge(
+    "agroreto_aggregator_buffered_readings",
+    "Lecturas en memoria pendientes de guardar por buffer (open, closed, late)",
+    ["buffer"],
+)
+FLUSH_SECONDS = Histogram(
+    "agroreto_flush_duration_seconds",
+    "Duración de cada guardado de medias (incluye las consultas a la BD)",
+)
+LAST_FLUSH = Gauge(
+    "agroreto_aggregator_last_flush_timestamp_seconds",
+    "Instante (epoch) del último guardado de medias sin errores",
+)
+FLUSH_ROWS = Counter(
+    "agroreto_flush_rows_total",
+    "Registros agregados escritos por tipo (inserted, merged)",
+    ["kind"],
+)
+# Hijos resueltos una vez: add_reading no busca etiquetas en cada lectura
+_READINGS_BY_STATUS = {status: AGGREGATOR_READINGS.labels(status) for status in ("on_time", "late", "dropped")}
+# INSERT con ON CONFLICT por dialecto (índice único sensor_id, timestamp)
+_DIALECT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
 
 
 class SensorDataAggregator:
     """
     Agregador que acumula lecturas de sensores cada 5 segundos
-    y guarda la media aritmética cada 5 minutos
+    y guarda la media aritmética cada 5 minutos.
+    
+    Las lecturas se agrupan por tiempo de evento (el timestamp de la propia
+    lectura), no por tiempo de llegada. Las lecturas que llegan tarde para
+    un intervalo ya guardado se fusionan con su registro dentro del margen
+    de retraso permitido.
     """
     
-    def __init__(self, interval_minutes: int = 5):
+    def __init__(self, interval_minutes: int = 5, allowed_lateness_minutes: int = 60,
+                 alert_engine: Optional[AlertEngine] = None,
+                 rule_engine: Optional[RuleEngine] = None):
         """
         Inicializa el agregador de datos de sensores.
         
         Args:
             interval_minutes: Intervalo en minutos para calcular y guardar la media (por defecto 5)
+            allowed_lateness_minutes: Retraso máximo en minutos con el que una lectura
+                todavía se fusiona con su intervalo ya cerrado (por defecto 60)
+            alert_engine: Motor de alertas por episodios (por defecto configurado
+                con las variables de entorno AGRORETO_ALERT_*)
+            rule_engine: Reglas evaluadas con cada lectura: tasa de cambio, anomalías
+                y sensores sin datos (por defecto configurado con AGRORETO_ALERT_*)
         """
         self.interval_seconds = interval_minutes * 60
+        self.allowed_lateness = timedelta(minutes=allowed_lateness_minutes)
+        # Intervalo abierto: lecturas cuyo tiempo de evento cae en window_start
         self.buffer: Dict[int, Dict[str, List[float]]] = defaultdict(lambda: defaultdict(list))
         self.raw_data_buffer: Dict[int, List[dict]] = defaultdict(list)
+        self.window_start = self._bucket_start(datetime.now())
+        # Intervalos cerrados pendientes de guardar: inicio -> (buffer, raw_data_buffer)
+        self.closed_windows: Dict[datetime, Tuple[dict, dict]] = {}
+        # Lecturas tardías para intervalos ya guardados: inicio -> sensor -> tipo -> valores
+        self.late_buffer: Dict[datetime, Dict[int, Dict[str, List[float]]]] = self._new_late_buffer()
+        self.late_dropped = 0
+        # Estado para /api/health: último guardado correcto (epoch), último error,
+        # llegada de la última lectura (epoch) y su retraso respecto al tiempo de evento
+        self.last_flush_at: Optional[float] = None
+        self.last_flush_error: Optional[str] = None
+        self.last_reading_at: Optional[float] = None
+        self.last_reading_lag = 0.0
+        self.alert_engine = alert_engine or AlertEngine.from_env()
+        self.rule_engine = rule_engine or RuleEngine.from_env()
+        # Los episodios de las reglas se guardan en su propio thread, fuera del thread MQTT
+        self.alert_writer = AlertWriter(self.rule_engine, self.alert_engine)
+        self.rule_engine.on_change = self.alert_writer.notify
         self.lock = threading.Lock()
         self.running = False
         self.thread = None
+        # Evento para despertar el loop inmediatamente al detener el agregador
+        self._stop_event = threading.Event()
         
         logger.info(f"📊 Agregador inicializado: media cada {interval_minutes} minutos")
     
-    def add_reading(self, sensor_id: int, sensor_type: str, data: dict):
+    @staticmethod
+    def _new_late_buffer() -> dict:
+        return defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
+    
+    def _event_time(self, data: dict, now: datetime) -> datetime:
+        """
+        Obtiene el tiempo de evento de una lectura.
+        Usa el timestamp de la lectura si lo trae (en hora local, sin zona);
+        si no, o si está en el futuro, usa el tiempo de llegada.
+        
+        Args:
+            data: Diccionario con los datos del sensor
+            now: Tiempo de llegada
+        
+        Returns:
+            Tiempo de evento de la lectura
+        """
+        event_time = data.get('timestamp')
+        if not isinstance(event_time, datetime):
+            return now
+        if event_time.tzinfo is not None:
+            event_time = event_time.astimezone().replace(tzinfo=None)
+        return min(event_time, now)
+    
+    def add_reading(self, sensor_id: int, sensor_type: str, data: dict) -> str:
         """
         Añade una lectura de sensor al buffer en memoria para agregar posteriormente.
-        Las lecturas se acumulan hasta que se ejecuta el cálculo de medias.
+        Las lecturas se acumulan en el intervalo de su tiempo de evento hasta
+        que se ejecuta el cálculo de medias.
         Thread-safe mediante uso de lock.
         
         Args:
             sensor_id: ID del sensor en la base de datos
             sensor_type: Tipo de dato (temperatura, humedad_ambiente, iluminacion, etc.)
             data: Diccionario con todos los datos recibidos del sensor
+        
+        Returns:
+            "on_time" si cae en un intervalo aún no guardado, "late" si se fusionará
+            con un intervalo ya guardado o "dropped" si supera el retraso permitido
         """
+        # Obtener el valor específico del sensor
+        value = float(data.get(sensor_type, 0.0))
+        now = datetime.now()
+        event_time = self._event_time(data, now)
+        bucket = self._bucket_start(event_time)
+        self.last_reading_at = time.time()
+        self.last_reading_lag = (now - event_time).total_seconds()
+        
+        waiting_since = time.perf_counter()
         with self.lock:
-            # Obtener el valor específico del sensor
-            value = data.get(sensor_type, 0.0)
-            
-            # Guardar valor en buffer para calcular media
-            self.buffer[sensor_id][sensor_type].append(float(value))
+            AGGREGATOR_LOCK_WAIT.observe(time.perf_counter() - waiting_since)
+            if bucket > self.window_start:
+                # El reloj pasó un límite antes que el scheduler: cerrar el intervalo abierto
+                self._roll_window(bucket)
             
-            # Guardar también los datos completos (para el campo raw)
-            self.raw_data_buffer[sensor_id].append(data)
-            
-            logger.debug(
-                f"📥 Lectura añadida: Sensor {sensor_id} ({sensor_type}) = {value:.2f} "
-                f"[{len(self.buffer[sensor_id][sensor_type])} lecturas acumuladas]"
-            )
+            if bucket == self.window_start:
+                # Guardar valor en buffer para calcular media
+                self.buffer[sensor_id][sensor_type].append(value)
+                # Guardar también los datos completos (para el campo raw)
+                self.raw_data_buffer[sensor_id].append(data)
+                accumulated = len(self.buffer[sensor_id][sensor_type])
+                status = "on_time"
+            elif bucket in self.closed_windows:
+                # Intervalo cerrado pero todavía no guardado
+                values_buffer, raw_buffer = self.closed_windows[bucket]
+                values_buffer[sensor_id][sensor_type].append(value)
+                raw_buffer[sensor_id].append(data)
+                accumulated = len(values_buffer[sensor_id][sensor_type])
+                status = "on_time"
+            elif now - (bucket + timedelta(seconds=self.interval_seconds)) <= self.allowed_lateness:
+                self.late_buffer[bucket][sensor_id][sensor_type].append(value)
+                accumulated = len(self.late_buffer[bucket][sensor_id][sensor_type])
+                status = "late"
+            else:
+                self.late_dropped += 1
+                _READINGS_BY_STATUS["dropped"].inc()
+                hot_logger.warning(
+                    "late_dropped", "⌛ Lectura descartada por retraso: Sensor %s (%s) del intervalo %s",
+                    sensor_id, sensor_type, bucket,
+                )
+                return "dropped"
+        
+        _READINGS_BY_STATUS[status].inc()
+        # Reglas de flujo: sólo con lecturas en orden; las tardías sólo cuentan como actividad
+        if status == "on_time":
+            self.rule_engine.on_reading(sensor_id, sensor_type, value, event_time)
+        else:
+            self.rule_engine.touch(sensor_id, event_time)
+        
+        logger.debug(
+            "📥 Lectura añadida: Sensor %s (%s) = %.2f [%d lecturas acumuladas, %s]",
+            sensor_id, sensor_type, value, accumulated, status,
+        )
+        return status
+    
+    def _roll_window(self, new_start: datetime):
+        """
+        Cierra el intervalo abierto y abre uno nuevo. Debe llamarse con el lock tomado.
+        
+        Args:
+            new_start: Inicio del nuevo intervalo abierto
+        """
+        if self.buffer:
+            self.closed_windows[self.window_start] = (self.buffer, self.raw_data_buffer)
+            self.buffer = defaultdict(lambda: defaultdict(list))
+            self.raw_data_buffer = defaultdict(list)
+        self.window_start = new_start
     
-    def _calculate_and_save_averages(self):
+    def _bucket_start(self, moment: datetime) -> datetime:
         """
-        Calcula la media aritmética de todas las lecturas acumuladas en el buffer
-        y las guarda en la base de datos como un único registro por sensor.
+        Calcula el inicio del intervalo de reloj al que pertenece un instante.
+        Los intervalos se alinean con múltiplos de interval_seconds desde la
+        época Unix, de modo que con 5 minutos los límites caen en :00, :05, :10...
+        
+        Args:
+            moment: Instante a alinear
+        
+        Returns:
+            Inicio del intervalo que contiene al instante
+        """
+        epoch_seconds = moment.timestamp()
+        aligned = epoch_seconds - (epoch_seconds % self.interval_seconds)
+        return datetime.fromtimestamp(aligned, tz=moment.tzinfo)
+    
+    def _next_boundary(self, now: Optional[float] = None) -> float:
+        """
+        Calcula el próximo límite de intervalo en segundos desde la época.
+        Se recalcula a partir del reloj, así que el tiempo que tarda
+        el guardado no se acumula como deriva.
+        
+        Args:
+            now: Instante actual en segundos desde la época (por defecto time.time())
+        
+        Returns:
+            Instante del próximo límite (siempre posterior a now)
+        """
+        if now is None:
+            now = time.time()
+        return now - (now % self.interval_seconds) + self.interval_seconds
+    
+    @timed(FLUSH_SECONDS)
+    @tracked("aggregator.flush")
+    def _calculate_and_save_averages(self, until: Optional[datetime] = None):
+        """
+        Calcula la media aritmética de las lecturas de cada intervalo cerrado
+        y las guarda en la base de datos como un único registro por sensor,
+        marcado con el inicio del intervalo.
+        
+        Si ya existe un registro para ese sensor e intervalo (lecturas tardías,
+        un guardado parcial previo al detener el agregador o el de otro proceso),
+        se actualiza de forma incremental combinando número de muestras, media,
+        min y max (upsert sobre el índice único sensor_id, timestamp).
         
         También guarda metadatos (min, max, número de muestras) en el campo 'raw'.
-        Verifica umbrales después de guardar cada media.
+        Verifica umbrales después de guardar cada media de un intervalo a tiempo.
+        
+        Args:
+            until: Guardar sólo los intervalos que empiezan antes de este instante.
+                Por defecto se guarda todo, incluido el intervalo abierto.
         """
         with self.lock:
-            if not self.buffer:
-                logger.debug("📊 No hay lecturas para procesar")
-                return
+            if self.buffer and (until is None or self.window_start < until):
+                self._roll_window(self.window_start)
+            current_start = self._bucket_start(datetime.now())
+            if current_start > self.window_start:
+                self.window_start = current_start
             
             # Copiar y limpiar buffers
-            buffer_snapshot = dict(self.buffer)
-            raw_data_snapshot = dict(self.raw_data_buffer)
-            self.buffer.clear()
-            self.raw_data_buffer.clear()
+            windows_snapshot = {
+                start: buffers for start, buffers in self.closed_windows.items()
+                if until is None or start < until
+            }
+            for start in windows_snapshot:
+                del self.closed_windows[start]
+            late_snapshot = self.late_buffer
+            self.late_buffer = self._new_late_buffer()
+        
+        # Sensores sin datos: sólo con el loop en marcha (un proceso que sólo
+        # hace flush no recibe el flujo completo de lecturas)
+        if self.running:
+            self.rule_engine.tick()
+        # Episodios de las reglas de flujo (tasa de cambio, anomalías, sin datos):
+        # los guarda el writer en su thread o, sin él, aquí mismo
+        if self.alert_writer.running:
+            self.alert_writer.notify()
+        else:
+            self.alert_writer.flush()
+        
+        if not windows_snapshot and not late_snapshot:
+            logger.debug("📊 No hay lecturas para procesar")
+            self.last_flush_at = time.time()
+            self.last_flush_error = None
+            return
         
         # Procesar fuera del lock para no bloquear nuevas lecturas
-        timestamp = datetime.now()
+        entries = []
+        for bucket, (values_buffer, raw_buffer) in windows_snapshot.items():
+            for sensor_id, types_data in values_buffer.items():
+                last_data = raw_buffer[sensor_id][-1] if raw_buffer.get(sensor_id) else None
+                for sensor_type, values in types_data.items():
+                    if values:
+                        entries.append((bucket, sensor_id, sensor_type, values, last_data, True))
+        for bucket, sensors_data in late_snapshot.items():
+            for sensor_id, types_data in sensors_data.items():
+                for sensor_type, values in types_data.items():
+                    if values:
+                        entries.append((bucket, sensor_id, sensor_type, values, None, False))
         
         try:
             with Session(engine) as session:
-                for sensor_id, types_data in buffer_snapshot.items():
-                    for sensor_type, values in types_data.items():
-                        if not values:
-                            continue
-                        
-                        # Calcular media aritmética
-                        avg_value = sum(values) / len(values)
-                        
-                        # Crear resumen para el campo raw
-                        raw_summary = {
-                            'aggregated': True,
-                            'interval_minutes': self.interval_seconds // 60,
-                            'samples_count': len(values),
-                            'min': min(values),
-                            'max': max(values),
-                            'avg': avg_value,
-                            'sensor_type': sensor_type,
-                            'timestamp': timestamp.isoformat()
-                        }
-                        
-                        # Añadir datos adicionales del último mensaje completo si existen
-                        if sensor_id in raw_data_snapshot and raw_data_snapshot[sensor_id]:
-                            last_data = raw_data_snapshot[sensor_id][-1]
-                            # Convertir datetime a string si existe
-                            if 'timestamp' in last_data and isinstance(last_data['timestamp'], datetime):
-                                last_data = last_data.copy()
-                                last_data['timestamp'] = last_data['timestamp'].isoformat()
-                            raw_summary['last_sample'] = last_data
-                        
-                        # Guardar en BD
-                        reading = SensorData(
-                            sensor_id=sensor_id,
-                            timestamp=timestamp,
-                            value=round(avg_value, 2),
-                            raw=json.dumps(raw_summary)
-                        )
-                        
-                        session.add(reading)
-                        
-                        logger.info(
-                            f"💾 Media guardada: Sensor {sensor_id} ({sensor_type}) = {avg_value:.2f} "
-                            f"(de {len(values)} lecturas: min={min(values):.2f}, max={max(values):.2f})"
-                        )
-                        
-                        # Verificar umbrales con la media
+                saved, merged = self._upsert_entries(session, entries)
+                
+                for (bucket, sensor_id, sensor_type, values, last_data, on_time), (row, avg_value) in zip(entries, saved):
+                    if on_time and not self.rule_engine.covers_thresholds(sensor_id):
+                        # Verificar umbrales con la media (si no lo hace ya el camino rápido)
                         self._check_thresholds(session, sensor_id, sensor_type, avg_value)
                 
                 session.commit()
-                logger.info(f"✅ Guardado completado: {len(buffer_snapshot)} sensores procesados")
+                self.last_flush_at = time.time()
+                self.last_flush_error = None
+                FLUSH_ROWS.labels("inserted").inc(len(entries) - merged)
+                FLUSH_ROWS.labels("merged").inc(merged)
+                # Una línea por guardado; el detalle por sensor va a DEBUG
+                logger.info(
+                    "✅ Guardado completado: %d medias (%d nuevas, %d actualizadas) de %d lecturas "
+                    "en %d intervalos (%d con lecturas tardías)",
+                    len(entries), len(entries) - merged, merged, sum(len(entry[3]) for entry in entries),
+                    len(windows_snapshot), len(late_snapshot),
+                )
                 
         except Exception as e:
+            self.last_flush_error = str(e)
             logger.exception(f"❌ Error guardando medias: {e}")
     
+    def flush(self):
+        """
+        Guarda inmediatamente todas las lecturas pendientes, incluido el intervalo abierto.
+        El intervalo se sigue completando con actualizaciones incrementales en
+        guardados posteriores.
+        """
+        self._calculate_and_save_averages()
+    
+    @tracked("aggregator.save_reading")
+    def save_reading(self, sensor_id: int, sensor_type: str, data: dict) -> Tuple[str, Optional[int]]:
+        """
+        Guarda una lectura directamente en el registro de su intervalo, sin pasar
+        por los buffers: un upsert de un único sensor e intervalo. Pensado para
+        lecturas sueltas (POST de la API), que así no esperan al siguiente guardado
+        ni obligan a vaciar los buffers de todos los sensores; si otro proceso
+        guarda después el mismo intervalo, su upsert fusiona las muestras.
+        
+        Args:
+            sensor_id: ID del sensor en la base de datos
+            sensor_type: Tipo de dato (temperatura, humedad_ambiente, iluminacion, etc.)
+            data: Diccionario con todos los datos recibidos del sensor
+        
+        Returns:
+            (estado, id del registro del intervalo): "on_time" si es del intervalo
+            en curso, "late" si es de uno anterior y "dropped" (sin registro)
+            si supera el retraso permitido
+        """
+        value = float(data.get(sensor_type, 0.0))
+        now = datetime.now()
+        event_time = self._event_time(data, now)
+        bucket = self._bucket_start(event_time)
+        
+        if now - (bucket + timedelta(seconds=self.interval_seconds)) > self.allowed_lateness:
+            self.late_dropped += 1
+            _READINGS_BY_STATUS["dropped"].inc()
+            hot_logger.warning(
+                "late_dropped", "⌛ Lectura descartada por retraso: Sensor %s (%s) del intervalo %s",
+                sensor_id, sensor_type, bucket,
+            )
+            return "dropped", None
+        
+        on_time = bucket == self._bucket_start(now)
+        status = "on_time" if on_time else "late"
+        _READINGS_BY_STATUS[status].inc()
+        if on_time:
+            self.rule_engine.on_reading(sensor_id, sensor_type, value, event_time)
+        else:
+            self.rule_engine.touch(sensor_id, event_time)
+        
+        with Session(engine) as session:
+            ((row, avg_value),), merged = self._upsert_entries(
+                session, [(bucket, sensor_id, sensor_type, [value], data if on_time else None, on_time)]
+            )
+            if on_time and not self.rule_engine.covers_thresholds(sensor_id):
+                self._check_thresholds(session, sensor_id, sensor_type, avg_value)
+            row_id = row.id
+            session.commit()
+        FLUSH_ROWS.labels("merged" if merged else "inserted").inc()
+        
+        # Episodios de las reglas de flujo: como en los guardados periódicos
+        if self.alert_writer.running:
+            self.alert_writer.notify()
+        else:
+            self.alert_writer.flush()
+        
+        logger.debug(
+            "💾 Lectura guardada: Sensor %s (%s) = %.2f en el intervalo %s [%s]",
+            sensor_id, sensor_type, value, bucket, status,
+        )
+        return status, row_id
+    
+    def _upsert_entries(self, session: Session, entries: list) -> Tuple[List[Tuple[SensorData, float]], int]:
+        """
+        Guarda las medias de las entradas con un único registro por sensor e intervalo.
+        
+        Primero inserta los registros nuevos con ON CONFLICT DO NOTHING sobre el
+        índice único (sensor_id, timestamp); las entradas cuyo registro ya existía
+        (lecturas tardías, un guardado parcial o el de otro proceso) se fusionan
+        después con él. Los registros se releen bloqueados (FOR UPDATE) en la
+        misma transacción, así que dos procesos que guardan el mismo intervalo
+        no se pisan.
+        
+        Args:
+            session: Sesión en la que se guarda (el commit lo hace quien llama)
+            entries: Tuplas (intervalo, sensor, tipo, valores, último dato, a tiempo)
+        
+        Returns:
+            (registro y media de cada entrada, en el mismo orden; número de fusiones)
+        """
+        new_rows = {}
+        for bucket, sensor_id, sensor_type, values, last_data, on_time in entries:
+            if (sensor_id, bucket) not in new_rows:
+                new_rows[(sensor_id, bucket)] = self._average_row(bucket, sensor_id, sensor_type, values, last_data)
+        inserted = self._insert_new_rows(session, list(new_rows.values()))
+        existing = self._load_existing_rows(
+            session,
+            sensor_ids={key[0] for key in new_rows},
+            buckets={key[1] for key in new_rows},
+        )
+        
+        saved = []
+        merged = 0
+        for bucket, sensor_id, sensor_type, values, last_data, on_time in entries:
+            key = (sensor_id, bucket)
+            row = existing[key]
+            if key in inserted:
+                # Sólo la primera entrada de cada registro es la insertada
+                inserted.discard(key)
+                avg_value = sum(values) / len(values)
+                logger.debug(
+                    "💾 Media guardada: Sensor %s (%s) = %.2f (de %d lecturas: min=%.2f, max=%.2f)",
+                    sensor_id, sensor_type, avg_value, len(values), min(values), max(values),
+                )
+            else:
+                avg_value = self._merge_average(row, sensor_type, values, last_data, late=not on_time)
+                session.add(row)
+                merged += 1
+            saved.append((row, avg_value))
+        return saved, merged
+    
+    @staticmethod
+    def _insert_new_rows(session: Session, rows: List[dict]) -> set:
+        """
+        Inserta los registros agregados que todavía no existen (INSERT ... ON
+        CONFLICT DO NOTHING sobre el índice único sensor_id, timestamp).
+        
+        Returns:
+            Claves (sensor_id, timestamp) de los registros insertados
+        
+        Raises:
+            NotImplementedError: Si la base de datos no es SQLite ni PostgreSQL
+        """
+        if not rows:
+            return set()
+        dialect = session.get_bind().dialect.name
+        insert = _DIALECT_INSERTS.get(dialect)
+        if insert is None:
+            raise NotImplementedError(f"Upsert de medias no soportado para la base de datos {dialect}")
+        statement = (
+            insert(SensorData)
+            .on_conflict_do_nothing(index_elements=["sensor_id", "timestamp"])
+            .returning(SensorData.sensor_id, SensorData.timestamp)
+        )
+        return {(sensor_id, timestamp) for sensor_id, timestamp in session.execute(statement, rows)}
+    
+    def _load_existing_rows(self, session: Session, sensor_ids: set, buckets: set) -> dict:
+        """
+        Carga en una sola consulta, bloqueados hasta el commit, los registros
+        guardados para los sensores e intervalos indicados.
+        
+        Returns:
+            Diccionario (sensor_id, inicio de intervalo) -> SensorData
+        """
+        rows = session.exec(
+            select(SensorData)
+            .where(
+                SensorData.sensor_id.in_(sensor_ids),
+                SensorData.timestamp.in_(buckets),
+            )
+            .with_for_update()
+        ).all()
+        return {(row.sensor_id, row.timestamp): row for row in rows}
+    
+    @staticmethod
+    def _serializable_sample(last_data: dict) -> dict:
+        """Convierte el timestamp del último mensaje a string para guardarlo como JSON"""
+        if 'timestamp' in last_data and isinstance(last_data['timestamp'], datetime):
+            last_data = last_data.copy()
+            last_data['timestamp'] = last_data['timestamp'].isoformat()
+        return last_data
+    
+    def _average_row(self, bucket: datetime, sensor_id: int, sensor_type: str,
+                     values: List[float], last_data: Optional[dict]) -> dict:
+        """Columnas del registro agregado de un intervalo (para el INSERT)"""
+        # Calcular media aritmética
+        avg_value = sum(values) / len(values)
+        
+        # Crear resumen para el campo raw
+        raw_summary = {
+            'aggregated': True,
+            'interval_minutes': self.interval_seconds // 60,
+            'samples_count': len(values),
+            'min': min(values),
+            'max': max(values),
+            'avg': avg_value,
+            'sensor_type': sensor_type,
+            'timestamp': bucket.isoformat()
+        }
+        
+        # Añadir datos adicionales del último mensaje completo si existen
+        if last_data:
+            raw_summary['last_sample'] = self._serializable_sample(last_data)
+        
+        return {
+            'sensor_id': sensor_id,
+            'timestamp': bucket,
+            'value': round(avg_value, 2),
+            'raw': json.dumps(raw_summary),
+        }
+    
+    def _merge_average(self, row: SensorData, sensor_type: str, values: List[float],
+                       last_data: Optional[dict], late: bool) -> float:
+        """
+        Fusiona nuevas lecturas con un registro existente sin recalcular desde
+        las lecturas originales: combina número de muestras, media, min y max.
+        Un registro sin resumen agregado (una lectura suelta) cuenta como una muestra.
+        
+        Returns:
+            Nueva media del intervalo
+        """
+        try:
+            summary = json.loads(row.raw)
+        except (TypeError, ValueError):
+            summary = None
+        if not (isinstance(summary, dict) and summary.get('aggregated')):
+            summary = {
+                'aggregated': True,
+                'interval_minutes': self.interval_seconds // 60,
+                'samples_count': 1,
+                'min': row.value,
+                'max': row.value,
+                'avg': row.value,
+                'sensor_type': sensor_type,
+                'timestamp': row.timestamp.isoformat(),
+            }
+        previous_count = summary.get('samples_count', 0)
+        previous_avg = summary.get('avg', row.value)
+        
+        samples_count = previous_count + len(values)
+        avg_value = (previous_avg * previous_count + sum(values)) / samples_count
+        
+        summary['samples_count'] = samples_count
+        summary['avg'] = avg_value
+        summary['min'] = min([summary.get('min', min(values))] + values)
+        summary['max'] = max([summary.get('max', max(values))] + values)
+        if late:
+            summary['late_samples'] = summary.get('late_samples', 0) + len(values)
+        if last_data:
+            summary['last_sample'] = self._serializable_sample(last_data)
+        
+        row.value = round(avg_value, 2)
+        row.raw = json.dumps(summary)
+        
+        logger.debug(
+            "🔁 Media actualizada: Sensor %s (%s) = %.2f (+%d lecturas, %d en total)",
+            row.sensor_id, summary.get('sensor_type'), avg_value, len(values), samples_count,
+        )
+        return avg_value
+    
     def _check_thresholds(self, session: Session, sensor_id: int, sensor_type: str, value: float):
-        """Verifica umbrales y crea alertas si es necesario"""
+        """
+        Verifica umbrales con el motor de alertas: abre, actualiza o cierra
+        el episodio de alerta del sensor en lugar de crear una alerta por intervalo.
+        """
         try:
             sensor = session.get(Sensor, sensor_id)
             if not sensor:
                 return
-            
-            alert_type = None
-            alert_message = None
-            
-            if value < sensor.threshold_low:
-                alert_type = "LOW"
-                alert_message = (
-                    f"⚠️ {sensor.id_code}: {sensor_type} bajo el mínimo. "
-                    f"Media: {value:.2f} {sensor.unit} (límite: {sensor.threshold_low})"
-                )
-            elif value > sensor.threshold_high:
-                alert_type = "HIGH"
-                alert_message = (
-                    f"⚠️ {sensor.id_code}: {sensor_type} sobre el máximo. "
-                    f"Media: {value:.2f} {sensor.unit} (límite: {sensor.threshold_high})"
-                )
-
-            if alert_type and alert_message:
-                alert = Alert(
-                    sensor_id=sensor_id,
-                    timestamp=datetime.now(),
-                    type=alert_type,
-                    message=alert_message,
-                    acknowledged=False
-                )
-                session.add(alert)
-                session.commit()
-                logger.warning(f"🚨 ALERTA: {alert_message}")
-                
+            self.alert_engine.evaluate(session, sensor, sensor_type, value)
         except Exception as e:
             logger.exception(f"❌ Error verificando umbrales: {e}")
     
+    def buffered_readings(self) -> Dict[str, int]:
+        """
+        Cuenta las lecturas en memoria pendientes de guardar.
+        
+        Returns:
+            Lecturas por buffer: intervalo abierto, intervalos cerrados y tardías
+        """
+        def count(values_buffer) -> int:
+            return sum(len(values) for types_data in values_buffer.values() for values in types_data.values())
+        
+        with self.lock:
+            return {
+                "open": count(self.buffer),
+                "closed": sum(count(values_buffer) for values_buffer, _ in self.closed_windows.values()),
+                "late": sum(count(sensors_data) for sensors_data in self.late_buffer.values()),
+            }
+    
+    def bind_metrics(self):
+        """Expone los buffers de este agregador en las métricas (se calculan al exportar)"""
+        for name in ("open", "closed", "late"):
+            AGGREGATOR_BUFFERED.labels(name).set_function(lambda name=name: self.buffered_readings()[name])
+        LAST_FLUSH.set_function(lambda: self.last_flush_at or 0.0)
+    
     def _aggregation_loop(self):
         """
         Loop principal que ejecuta el cálculo y guardado de medias periódicamente.
-        Se ejecuta en un thread separado cada interval_seconds.
+        Se ejecuta en un thread separado y se despierta en cada límite de reloj
+        (múltiplos de interval_seconds), marcando cada registro con el inicio
+        del intervalo que cierra. stop() lo despierta inmediatamente.
         """
-        logger.info(f"🔄 Loop de agregación iniciado (cada {self.interval_seconds}s)")
+        logger.info(f"🔄 Loop de agregación iniciado (cada {self.interval_seconds}s, alineado al reloj)")
+        
+        boundary = self._next_boundary()
         
         while self.running:
-            time.sleep(self.interval_seconds)
+            remaining = boundary - time.time()
+            if remaining > 0:
+                # Event.wait en lugar de sleep: stop() despierta el loop al instante
+                if self._stop_event.wait(remaining):
+                    break
+                continue
+            
+            # Guardar los intervalos que terminan en este límite o antes
+            logger.info("⏰ Ejecutando agregación de datos...")
+            self._calculate_and_save_averages(until=datetime.fromtimestamp(boundary))
             
-            if self.running:  # Verificar nuevamente después del sleep
-                logger.info("⏰ Ejecutando agregación de datos...")
-                self._calculate_and_save_averages()
+            # Siguiente límite; si el guardado se comió algún límite, saltar al próximo
+            boundary += self.interval_seconds
+            if boundary <= time.time():
+                boundary = self._next_boundary()
     
     def start(self):
         """
@@ -202,6 +669,9 @@ class SensorDataAggregator:
             return
         
         self.running = True
+        self._stop_event.clear()
+        self.bind_metrics()
+        self.alert_writer.start()
         self.thread = threading.Thread(
             target=self._aggregation_loop,
             daemon=True,
@@ -217,9 +687,12 @@ class SensorDataAggregator:
         """
         logger.info("🛑 Deteniendo agregador de datos...")
         self.running = False
+        self._stop_event.set()
         
         if self.thread:
             self.thread.join(timeout=5)
+            self.thread = None
+        self.alert_writer.stop()
         
         # Guardar datos pendientes
         logger.info("💾 Guardando datos pendientes...")
@@ -0,0 +1,367 @@
+# app/services/fleet_simulator.py
+import heapq
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+import paho.mqtt.client as mqtt
+from sqlmodel import Session, func, select
+
+from app.models import Parcel, Sensor, SensorData
+from app.services.data_aggregator import SensorDataAggregator
+from app.services.ingest import IngestService
+from app.services.maiota_client import MAIoTAMultiSensorClient
+from app.services.mqtt_transport import InMemoryBroker
+from app.utils import engine
+
+logger = logging.getLogger(__name__)
+
+# Valores base y ruido de cada campo del frame MAIoTA (en unidades físicas)
+FIELD_PROFILES = {
+    "temperatura": (22.0, 0.3),
+    "humedad_ambiente": (55.0, 1.0),
+    "humedad_suelo": (35.0, 0.5),
+    "iluminacion": (450.0, 20.0),
+    "co2": (600.0, 15.0),
+    "cov": (100.0, 5.0),
+    "nox": (1.0, 0.2),
+}
+# Límites físicos (el formato MAIoTA no admite negativos)
+FIELD_LIMITS = {
+    "temperatura": (0.0, 60.0),
+    "humedad_ambiente": (0.0, 100.0),
+    "humedad_suelo": (0.0, 100.0),
+    "iluminacion": (0.0, 6000.0),
+    "co2": (300.0, 5000.0),
+    "cov": (0.0, 500.0),
+    "nox": (0.0, 50.0),
+}
+# Episodios fuera de rango: campo y valor objetivo
+EPISODES = (
+    ("temperatura", 45.0),
+    ("humedad_suelo", 8.0),
+    ("co2", 2500.0),
+)
+# Humedad del suelo por debajo de la que el dispositivo marca el valor con ↓
+SOIL_LOW_MARK = 15.0
+
+
+def encode_frame(values: Dict[str, float]) -> str:
+    """
+    Codifica valores físicos en un frame MAIoTA (CIoTA-D1=...&...&D7=...&).
+    Es la inversa de MAIoTAMultiSensorClient._parse_maiota_payload.
+
+    Args:
+        values: Valores por campo (temperatura, humedad_ambiente, ...)
+
+    Returns:
+        Payload MAIoTA
+    """
+    soil = values["humedad_suelo"]
+    return (
+        f"CIoTA-D1={round(values['temperatura'] * 100)}"
+        f"&D2={round(values['humedad_ambiente'] * 100)}"
+        f"&D3={'↓' if soil < SOIL_LOW_MARK else ''}{round(soil * 100)}"
+        f"&D4={round(values['iluminacion'] * 10)}"
+        f"&D5={round(values['co2'])}"
+        f"&D6={round(values['cov'])}"
+        f"&D7={round(values['nox'])}&"
+    )
+
+
+@dataclass
+class VirtualDevice:
+    """Dispositivo MAIoTA simulado: paseo aleatorio con episodios y cortes"""
+    index: int
+    topic: str
+    values: Dict[str, float] = field(default_factory=dict)
+    episode_field: Optional[str] = None
+    episode_target: float = 0.0
+    episode_left: int = 0
+    dropout_until: float = 0.0
+
+    def step(self, rng: random.Random):
+        """Avanza los valores un frame, tendiendo al objetivo del episodio si hay uno"""
+        for name, (base, noise) in FIELD_PROFILES.items():
+            current = self.values.get(name, base + rng.gauss(0, noise * 3))
+            target = self.episode_target if name == self.episode_field else base
+            # Reversión a la media (o al objetivo del episodio) más ruido
+            current += 0.2 * (target - current) + rng.gauss(0, noise)
+            low, high = FIELD_LIMITS[name]
+            self.values[name] = min(max(current, low), high)
+        if self.episode_left:
+            self.episode_left -= 1
+            if not self.episode_left:
+                self.episode_field = None
+
+
+@dataclass
+class SimulatorStats:
+    """Contadores de una ejecución del simulador"""
+    sent: int = 0
+    skipped: int = 0  # Frames no enviados por cortes de conexión
+    episodes: int = 0
+    dropouts: int = 0
+    errors: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def rate(self) -> float:
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class FleetSimulator:
+    """
+    Flota de dispositivos MAIoTA virtuales que emiten frames válidos.
+
+    Un único thread programa los envíos con un heap por instante de envío, así
+    que miles de dispositivos no necesitan miles de threads. Cada dispositivo
+    envía cada 1/rate segundos con un jitter relativo, y con cierta
+    probabilidad entra en un episodio fuera de rango o deja de enviar durante
+    un tiempo (corte). Los frames se entregan con publish(topic, payload):
+    un cliente MQTT contra un broker local o InMemoryBroker.publish.
+    """
+
+    def __init__(self, publish: Callable[[str, str], None], devices: int = 100, rate: float = 0.2,
+                 jitter: float = 0.1, episode_probability: float = 0.001, episode_frames: int = 30,
+                 dropout_probability: float = 0.0005, dropout_seconds: float = 120.0,
+                 topic_prefix: str = "agroreto/sim", seed: Optional[int] = None):
+        """
+        Inicializa la flota.
+
+        Args:
+            publish: Función que entrega un frame (topic, payload)
+            devices: Número de dispositivos virtuales
+            rate: Frames por segundo de cada dispositivo (0.2 = uno cada 5 s)
+            jitter: Variación relativa del periodo entre frames (0.1 = ±10%)
+            episode_probability: Probabilidad por frame de empezar un episodio fuera de rango
+            episode_frames: Duración de los episodios en frames
+            dropout_probability: Probabilidad por frame de un corte de conexión
+            dropout_seconds: Duración de los cortes
+            topic_prefix: Prefijo del topic de cada dispositivo (<prefijo>/<índice>)
+            seed: Semilla para reproducir la misma secuencia
+        """
+        if devices < 1 or rate <= 0:
+            raise ValueError("Se necesita al menos un dispositivo y una tasa positiva")
+        self.publish = publish
+        self.period = 1.0 / rate
+        self.jitter = jitter
+        self.episode_probability = episode_probability
+        self.episode_frames = episode_frames
+        self.dropout_probability = dropout_probability
+        self.dropout_seconds = dropout_seconds
+        self.rng = random.Random(seed)
+        self.devices: List[VirtualDevice] = [
+            VirtualDevice(index, self.topic_for(topic_prefix, index)) for index in range(devices)
+        ]
+        self.stats = SimulatorStats()
+        self.running = False
+        self.thread = None
+        self._stop_event = threading.Event()
+
+    @staticmethod
+    def topic_for(prefix: str, index: int) -> str:
+        return f"{prefix}/{index:05d}"
+
+    def _next_period(self) -> float:
+        return self.period * (1 + self.rng.uniform(-self.jitter, self.jitter))
+
+    def _emit(self, device: VirtualDevice, now: float):
+        """Genera y entrega el frame de un dispositivo (salvo si está en un corte)"""
+        if now < device.dropout_until:
+            self.stats.skipped += 1
+            return
+        if self.rng.random() < self.dropout_probability:
+            device.dropout_until = now + self.dropout_seconds
+            self.stats.dropouts += 1
+            self.stats.skipped += 1
+            return
+        if not device.episode_left and self.rng.random() < self.episode_probability:
+            device.episode_field, device.episode_target = self.rng.choice(EPISODES)
+            device.episode_left = self.episode_frames
+            self.stats.episodes += 1
+
+        device.step(self.rng)
+        try:
+            self.publish(device.topic, encode_frame(device.values))
+            self.stats.sent += 1
+        except Exception as e:
+            self.stats.errors += 1
+            logger.debug(f"⚠️ Error publicando en {device.topic}: {e}")
+
+    def run(self, duration: Optional[float] = None, max_frames: Optional[int] = None,
+            realtime: bool = True) -> SimulatorStats:
+        """
+        Ejecuta la flota en el thread actual.
+
+        Args:
+            duration: Segundos a simular (None = hasta stop() o max_frames)
+            max_frames: Número máximo de frames a generar
+            realtime: Respetar el reloj real; con False se genera lo más rápido
+                posible con un reloj simulado (para medir capacidad de ingesta)
+
+        Returns:
+            Estadísticas de la ejecución
+        """
+        self._stop_event.clear()
+        clock = 0.0
+        started = time.perf_counter()
+        # Arranque escalonado: cada dispositivo envía su primer frame en un instante aleatorio del periodo
+        schedule = [(self.rng.uniform(0, self.period), device.index) for device in self.devices]
+        heapq.heapify(schedule)
+        frames = 0
+        while schedule and not self._stop_event.is_set():
+            due, index = schedule[0]
+            if duration is not None and due > duration:
+                break
+            if max_frames is not None and frames >= max_frames:
+                break
+            if realtime:
+                wait = due - (time.perf_counter() - started)
+                if wait > 0 and self._stop_event.wait(wait):
+                    break
+                clock = time.perf_counter() - started
+            else:
+                clock = due
+            heapq.heapreplace(schedule, (due + self._next_period(), index))
+            self._emit(self.devices[index], clock)
+            frames += 1
+        self.stats.elapsed = time.perf_counter() - started
+        return self.stats
+
+    def start(self, **kwargs):
+        """Ejecuta la flota en un thread de background (mismos argumentos que run)"""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run, kwargs=kwargs, daemon=True, name="FleetSimulator-Thread")
+        self.thread.start()
+        logger.info(f"✅ Simulador con {len(self.devices)} dispositivos a {1 / self.period:g} frames/s cada uno")
+
+    def stop(self):
+        """Detiene la flota"""
+        self._stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+        self.running = False
+
+
+def register_fleet(session: Session, simulator: FleetSimulator, owner_id: int) -> List[int]:
+    """
+    Da de alta en la BD una parcela y un sensor de temperatura por dispositivo
+    virtual, con el topic del dispositivo. Es idempotente: reutiliza los
+    sensores SIM-xxxxx ya existentes.
+
+    Args:
+        session: Sesión de base de datos
+        simulator: Flota cuyos dispositivos se registran
+        owner_id: Usuario propietario de la parcela de simulación
+
+    Returns:
+        IDs de los sensores de la flota
+    """
+    codes = {f"SIM-{device.index:05d}": device.topic for device in simulator.devices}
+    existing = {
+        sensor.id_code: sensor
+        for sensor in session.exec(select(Sensor).where(Sensor.id_code.in_(list(codes)))).all()
+    }
+    missing = [code for code in codes if code not in existing]
+    if missing:
+        parcel = session.exec(select(Parcel).where(Parcel.name == "Simulación")).first()
+        if parcel is None:
+            parcel = Parcel(name="Simulación", location="Flota virtual", area=1.0, owner_id=owner_id)
+            session.add(parcel)
+            session.flush()
+        for code in missing:
+            existing[code] = Sensor(
+                id_code=code, parcel_id=parcel.id, type="temperature", unit="°C",
+                description="Dispositivo simulado", threshold_low=10.0, threshold_high=35.0,
+                mqtt_topic=codes[code],
+            )
+            session.add(existing[code])
+        session.commit()
+        logger.info(f"✅ {len(missing)} sensores simulados registrados")
+    return [existing[code].id for code in codes]
+
+
+def run_in_process(simulator: FleetSimulator, duration: Optional[float] = None,
+                   max_frames: Optional[int] = None, realtime: bool = False) -> dict:
+    """
+    Mide la capacidad de ingesta de extremo a extremo sin red: los frames
+    pasan por un broker en memoria, la suscripción y el parseo del cliente
+    MQTT, el reparto por topic de IngestService, el agregador con sus reglas
+    y el guardado en la BD. Los sensores de la flota deben estar registrados
+    (register_fleet).
+
+    Args:
+        simulator: Flota a ejecutar (su publish se sustituye por el del broker en memoria)
+        duration: Segundos a simular
+        max_frames: Número máximo de frames
+        realtime: Respetar el reloj real (por defecto, lo más rápido posible)
+
+    Returns:
+        Estadísticas del simulador y de la ingesta (frames/s, filas guardadas)
+    """
+    broker = InMemoryBroker()
+    client = MAIoTAMultiSensorClient(broker="memory", transport_factory=broker.client)
+    aggregator = SensorDataAggregator(interval_minutes=1)
+    service = IngestService(client=client, aggregator=aggregator, refresh_seconds=0)
+    # Como en la ingesta real: los sensores se suscriben al conectar con el broker
+    ready = threading.Event()
+    client.add_connect_listener(service.load_sensors)
+    client.add_connect_listener(ready.set)
+    client.start()
+    if not ready.wait(timeout=30):
+        raise RuntimeError("El cliente MQTT no ha conectado con el broker en memoria")
+    simulator.publish = broker.publish
+
+    with Session(engine) as session:
+        rows_before = session.exec(select(func.count()).select_from(SensorData)).one()
+
+    aggregator.start()
+    try:
+        stats = simulator.run(duration=duration, max_frames=max_frames, realtime=realtime)
+    finally:
+        client.stop()
+        started = time.perf_counter()
+        aggregator.stop()
+        flush_seconds = time.perf_counter() - started
+
+    with Session(engine) as session:
+        rows_after = session.exec(select(func.count()).select_from(SensorData)).one()
+
+    return {
+        "devices": len(simulator.devices),
+        "topics": len(service.sensors_by_topic),
+        "frames_sent": stats.sent,
+        "frames_delivered": broker.delivered,
+        "frames_skipped": stats.skipped,
+        "episodes": stats.episodes,
+        "dropouts": stats.dropouts,
+        "errors": stats.errors,
+        "seconds": round(stats.elapsed, 3),
+        "frames_per_second": round(stats.rate, 1),
+        "flush_seconds": round(flush_seconds, 3),
+        "rows_saved": rows_after - rows_before,
+    }
+
+
+class MqttPublisher:
+    """Publica los frames en un broker MQTT (p. ej. Mosquitto en localhost)"""
+
+    def __init__(self, host: str = "localhost", port: int = 1883, qos: int = 0):
+        self.qos = qos
+        self.client = mqtt.Client(client_id=f"AgroRetoSim_{random.getrandbits(32):08x}", clean_session=True)
+        self.client.connect(host, port)
+        self.client.loop_start()
+
+    def __call__(self, topic: str, payload: str):
+        self.client.publish(topic, payload, qos=self.qos)
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
@@ -0,0 +1,163 @@
+# app/services/health.py
+import logging
+import os
+import time
+from typing import Optional, Sequence
+
+from sqlalchemy import text
+
+from app.services.async_ingest import AsyncIngestService, async_ingest_service
+from app.services.ingest import ingest_service
+from app.utils import engine
+
+logger = logging.getLogger(__name__)
+
+# Aproximación al arranque del proceso (para la antigüedad antes del primer guardado)
+_STARTED_AT = time.time()
+
+
+def _age(moment: Optional[float], now: float) -> Optional[float]:
+    return round(now - moment, 3) if moment is not None else None
+
+
+class HealthMonitor:
+    """
+    Estado real del pipeline de este proceso para /api/health y /api/ready:
+    conexión al broker, retraso de la ingesta, antigüedad del último guardado
+    de medias, lecturas en memoria y latencia de la base de datos.
+
+    Cada comprobación devuelve sus datos y un campo "ok"; el proceso está
+    listo (ready) si todas lo están. Sin ingesta en el proceso
+    (AGRORETO_INGEST_MODE=external) sólo se comprueba la base de datos.
+    """
+
+    def __init__(self, services: Sequence = (), max_flush_age: Optional[float] = None,
+                 max_lag_seconds: float = 300, max_buffered: int = 100000,
+                 max_db_ms: float = 1000):
+        """
+        Args:
+            services: Servicios de ingesta candidatos (se usa el que esté en marcha)
+            max_flush_age: Segundos máximos sin guardar medias (por defecto dos
+                intervalos de agregación más un minuto)
+            max_lag_seconds: Retraso máximo entre el tiempo de evento de la última
+                lectura y su llegada al agregador
+            max_buffered: Lecturas máximas en memoria pendientes de guardar (incluye las colas)
+            max_db_ms: Latencia máxima de un SELECT 1 a la base de datos
+        """
+        self.services = list(services)
+        self.max_flush_age = max_flush_age
+        self.max_lag_seconds = max_lag_seconds
+        self.max_buffered = max_buffered
+        self.max_db_ms = max_db_ms
+
+    @classmethod
+    def from_env(cls, **kwargs) -> "HealthMonitor":
+        """
+        Configura los umbrales con AGRORETO_HEALTH_MAX_FLUSH_AGE,
+        AGRORETO_HEALTH_MAX_LAG_SECONDS, AGRORETO_HEALTH_MAX_BUFFERED
+        y AGRORETO_HEALTH_MAX_DB_MS.
+        """
+        max_flush_age = os.environ.get("AGRORETO_HEALTH_MAX_FLUSH_AGE")
+        return cls(
+            max_flush_age=float(max_flush_age) if max_flush_age else None,
+            max_lag_seconds=float(os.environ.get("AGRORETO_HEALTH_MAX_LAG_SECONDS", 300)),
+            max_buffered=int(os.environ.get("AGRORETO_HEALTH_MAX_BUFFERED", 100000)),
+            max_db_ms=float(os.environ.get("AGRORETO_HEALTH_MAX_DB_MS", 1000)),
+            **kwargs,
+        )
+
+    def _active_service(self):
+        return next((service for service in self.services if service.running), None)
+
+    def check_database(self) -> dict:
+        """Latencia de un SELECT 1 (incluye obtener la conexión del pool)"""
+        started = time.perf_counter()
+        try:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+        except Exception as e:
+            logger.warning(f"⚠️ Health: la base de datos no responde: {e}")
+            return {"ok": False, "error": str(e)}
+        latency_ms = (time.perf_counter() - started) * 1000
+        return {"ok": latency_ms <= self.max_db_ms, "latency_ms": round(latency_ms, 2),
+                "max_ms": self.max_db_ms}
+
+    def check_broker(self, service, now: float) -> dict:
+        """Conexión del cliente MQTT y antigüedad del último mensaje recibido"""
+        client = service.client
+        return {
+            "ok": client.is_connected,
+            "connected": client.is_connected,
+            "broker": f"{client.broker}:{client.port}",
+            "reconnect_attempts": client.reconnect_attempts,
+            "last_message_age_seconds": _age(client.last_message_at, now),
+        }
+
+    def check_aggregator(self, service, now: float) -> dict:
+        """Antigüedad del último guardado correcto y lecturas pendientes en memoria"""
+        aggregator = service.aggregator
+        max_flush_age = self.max_flush_age or 2 * aggregator.interval_seconds + 60
+        flush_age = _age(aggregator.last_flush_at or _STARTED_AT, now)
+        buffered = aggregator.buffered_readings()
+        if isinstance(service, AsyncIngestService) and service.messages is not None:
+            # En modo asyncio lo encolado también está pendiente de guardar
+            buffered["queued_messages"] = service.messages.qsize()
+            buffered["queued_readings"] = service.readings_queue.qsize()
+        total = sum(buffered.values())
+        return {
+            "ok": flush_age <= max_flush_age and total <= self.max_buffered,
+            # En modo asyncio los guardados los hace una tarea del loop, no el thread
+            "running": service.flushing if isinstance(service, AsyncIngestService) else aggregator.running,
+            "last_flush_age_seconds": flush_age,
+            "max_flush_age_seconds": max_flush_age,
+            "last_flush_error": aggregator.last_flush_error,
+            "buffered": buffered,
+            "buffered_total": total,
+            "max_buffered": self.max_buffered,
+        }
+
+    def check_ingest(self, service, now: float) -> dict:
+        """Retraso entre el tiempo de evento de la última lectura y su llegada al agregador"""
+        aggregator = service.aggregator
+        lag = round(aggregator.last_reading_lag, 3) if aggregator.last_reading_at is not None else None
+        return {
+            "ok": lag is None or lag <= self.max_lag_seconds,
+            "mode": "asyncio" if isinstance(service, AsyncIngestService) else "threads",
+            "partition": str(service.ingest.partition if isinstance(service, AsyncIngestService)
+                             else service.partition),
+            "lag_seconds": lag,
+            "max_lag_seconds": self.max_lag_seconds,
+            "last_reading_age_seconds": _age(aggregator.last_reading_at, now),
+        }
+
+    def report(self) -> dict:
+        """
+        Ejecuta todas las comprobaciones.
+
+        Returns:
+            Diccionario con "ready" (todas las comprobaciones correctas),
+            "status" ("ok" o "degraded") y el detalle de cada comprobación
+        """
+        now = time.time()
+        checks = {"database": self.check_database()}
+        mode = os.environ.get("AGRORETO_INGEST_MODE", "embedded")
+        service = self._active_service()
+        if service is not None:
+            checks["broker"] = self.check_broker(service, now)
+            checks["aggregator"] = self.check_aggregator(service, now)
+            checks["ingest"] = self.check_ingest(service, now)
+        elif mode != "external":
+            # La ingesta debería correr en este proceso y no está en marcha
+            checks["ingest"] = {"ok": False, "mode": mode, "error": "ingesta no iniciada"}
+        ready = all(check["ok"] for check in checks.values())
+        return {
+            "status": "ok" if ready else "degraded",
+            "ready": ready,
+            "pid": os.getpid(),
+            "uptime_seconds": _age(_STARTED_AT, now),
+            "checks": checks,
+        }
+
+
+# Instancia global del monitor de salud (ingesta con threads o asyncio del proceso web)
+health_monitor = HealthMonitor.from_env(services=[ingest_service, async_ingest_service])
@@ -0,0 +1,325 @@
+# app/services/ingest.py
+import asyncio
+import logging
+import multiprocessing
+import signal
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlmodel import Session, select
+
+from app.logging_config import RateLimitedLogger, configure_logging
+from app.models import Sensor
+from app.services.alert_rules import SensorThresholds
+from app.services.data_aggregator import SensorDataAggregator, data_aggregator
+from app.services.maiota_client import MAIOTA_TYPE_MAP, MAIoTAMultiSensorClient, maiota_client
+from app.services.metrics import start_http_server_from_env
+from app.services.notifier import NotificationDispatcher, notification_dispatcher
+from app.services.partitioning import SensorPartition
+from app.services.profiler import profiler
+from app.services.retention import RetentionJob, retention_job
+from app.startup_timing import startup_timer
+from app.utils import engine
+
+logger = logging.getLogger(__name__)
+hot_logger = RateLimitedLogger(logger)
+
+
+class IngestService:
+    """
+    Servicio de ingesta: cliente MQTT + agregador para una partición de sensores.
+
+    Puede ejecutarse embebido en el proceso web o como worker independiente.
+    Con varias particiones, cada worker se suscribe sólo a los topics que tienen
+    sensores suyos y sólo agrega las lecturas de esos sensores.
+    """
+
+    def __init__(self, client: Optional[MAIoTAMultiSensorClient] = None,
+                 aggregator: Optional[SensorDataAggregator] = None,
+                 partition: Optional[SensorPartition] = None,
+                 refresh_seconds: int = 60,
+                 retention: Optional[RetentionJob] = None,
+                 dispatcher: Optional[NotificationDispatcher] = None):
+        """
+        Inicializa el servicio de ingesta.
+
+        Args:
+            client: Cliente MQTT (por defecto la instancia global)
+            aggregator: Agregador de datos (por defecto la instancia global)
+            partition: Partición de sensores de este worker (por defecto todos)
+            refresh_seconds: Cada cuántos segundos se recargan los sensores de la BD
+            retention: Job de retención de datos (por defecto la instancia global);
+                sólo se ejecuta en la partición 0 para no repetirlo en cada worker
+            dispatcher: Envío de avisos de alertas (por defecto la instancia global);
+                se detiene al detener la ingesta, después del último guardado
+        """
+        self.client = client or maiota_client
+        self.aggregator = aggregator or data_aggregator
+        self.partition = partition or SensorPartition()
+        self.refresh_seconds = refresh_seconds
+        self.retention = retention or retention_job
+        self.dispatcher = dispatcher or notification_dispatcher
+        # topic -> lista de sensores registrados en ese topic
+        self.sensors_by_topic: Dict[str, List[dict]] = {}
+        self.running = False
+        self._stop_event = threading.Event()
+        self._refresh_thread = None
+
+    def save_reading(self, sensor_id: int, sensor_type: str, data: dict):
+        """
+        Añade una lectura de sensor al agregador para calcular medias por intervalo.
+        No guarda directamente en la base de datos, acumula en memoria.
+
+        Args:
+            sensor_id: ID del sensor en la base de datos
+            sensor_type: Tipo de dato (temperatura, humedad_ambiente, etc.)
+            data: Diccionario con los datos del sensor recibidos por MQTT
+        """
+        try:
+            self.aggregator.add_reading(sensor_id, sensor_type, data)
+        except Exception as e:
+            hot_logger.exception("add_reading", "❌ Error añadiendo lectura al agregador: %s", e)
+
+    def _make_topic_callback(self, topic_sensors: List[dict]):
+        """
+        Crea la función callback para un topic MQTT.
+        El callback distribuye los datos a todos los sensores del topic
+        que pertenecen a esta partición.
+
+        Args:
+            topic_sensors: Lista de sensores que comparten el mismo topic MQTT
+
+        Returns:
+            Función callback que procesa mensajes MQTT
+        """
+        def on_data(data: dict):
+            for sensor_info in topic_sensors:
+                try:
+                    self.save_reading(sensor_info['id'], sensor_info['maiota_type'], data)
+                except Exception as e:
+                    hot_logger.exception(("sensor", sensor_info['id']), "❌ Error procesando %s: %s",
+                                         sensor_info['code'], e)
+
+        return on_data
+
+    def _load_sensors_by_topic(self) -> Tuple[Dict[str, List[dict]], Dict[int, SensorThresholds]]:
+        """
+        Lee los sensores activos de esta partición agrupados por topic MQTT.
+
+        Returns:
+            Tupla (sensores por topic, umbrales por ID de sensor)
+        """
+        with Session(engine) as session:
+            active_sensors = session.exec(
+                select(Sensor).where(Sensor.active.is_(True))
+            ).all()
+
+        sensors_by_topic: Dict[str, List[dict]] = {}
+        thresholds: Dict[int, SensorThresholds] = {}
+        for sensor in active_sensors:
+            if not self.partition.owns(sensor.id):
+                continue
+            sensors_by_topic.setdefault(sensor.mqtt_topic, []).append({
+                'id': sensor.id,
+                'code': sensor.id_code,
+                'type': sensor.type,
+                'maiota_type': MAIOTA_TYPE_MAP.get(sensor.type, sensor.type),
+            })
+            thresholds[sensor.id] = SensorThresholds(sensor.threshold_low, sensor.threshold_high, sensor.unit)
+        return sensors_by_topic, thresholds
+
+    def load_sensors(self):
+        """
+        Carga los sensores activos de la partición y los registra en el cliente MQTT.
+        Agrupa sensores por topic para optimizar las suscripciones: un callback
+        por topic que reparte los datos entre sus sensores. Es incremental:
+        sólo (des)registra los topics que han cambiado desde la última carga.
+        También refresca los umbrales cacheados del motor de reglas.
+        """
+        try:
+            sensors_by_topic, thresholds = self._load_sensors_by_topic()
+        except Exception as e:
+            logger.exception(f"❌ Error cargando sensores existentes: {e}")
+            return
+
+        for topic in set(self.sensors_by_topic) - set(sensors_by_topic):
+            self.client.remove_sensor(topic)
+            logger.info(f"👋 Topic {topic} sin sensores en {self.partition}")
+
+        for topic, sensors_list in sensors_by_topic.items():
+            if self.sensors_by_topic.get(topic) == sensors_list:
+                continue
+
+            # Usar el primer sensor como referencia
+            first_sensor = sensors_list[0]
+            self.client.add_sensor(
+                sensor_id=first_sensor['id'],
+                sensor_code=f"Topic_{topic[:20]}",
+                sensor_type=first_sensor['maiota_type'],
+                topic=topic,
+                callback=self._make_topic_callback(sensors_list)
+            )
+            logger.info(f"✅ Topic {topic} con {len(sensors_list)} sensores registrados")
+
+        # Vigilar los sensores de la partición para detectar los que dejan de enviar datos
+        owned_ids = {info['id'] for sensors in sensors_by_topic.values() for info in sensors}
+        previous_ids = {info['id'] for sensors in self.sensors_by_topic.values() for info in sensors}
+        self.aggregator.rule_engine.forget(previous_ids - owned_ids)
+        self.aggregator.rule_engine.watch(owned_ids)
+        # Umbrales en memoria para evaluar alertas con cada lectura (camino rápido)
+        self.aggregator.rule_engine.thresholds.update(thresholds)
+
+        self.sensors_by_topic = sensors_by_topic
+        total_sensors = sum(len(sensors) for sensors in sensors_by_topic.values())
+        logger.info(
+            f"✅ Total: {total_sensors} sensores en {len(sensors_by_topic)} topics ({self.partition})"
+        )
+
+    def _refresh_loop(self):
+        """Recarga periódicamente los sensores para detectar altas y bajas hechas desde la web"""
+        while not self._stop_event.wait(self.refresh_seconds):
+            self.load_sensors()
+
+    def _on_broker_connected(self):
+        """Registra los sensores de la BD en cada (re)conexión al broker"""
+        logger.info("📡 Conectado al broker: cargando sensores existentes...")
+        self.load_sensors()
+
+    def start(self):
+        """
+        Inicia el cliente MQTT, el agregador y la recarga periódica de sensores.
+        No bloquea: los sensores se registran en el callback de conexión MQTT,
+        en lugar de esperar un tiempo fijo a que la conexión esté lista.
+        """
+        if self.running:
+            logger.warning("⚠️ La ingesta ya está en ejecución")
+            return
+
+        logger.info(f"🚀 Iniciando ingesta MAIoTA ({self.partition})...")
+        self.running = True
+        self._stop_event.clear()
+        self.client.add_connect_listener(self._on_broker_connected)
+        self.client.start()
+        self.aggregator.start()
+        if self.partition.index == 0:
+            self.retention.start()
+
+        if self.refresh_seconds > 0:
+            self._refresh_thread = threading.Thread(
+                target=self._refresh_loop,
+                daemon=True,
+                name="IngestRefresh-Thread"
+            )
+            self._refresh_thread.start()
+        logger.info("✅ Sistema de monitoreo MAIoTA iniciado")
+
+    def stop(self):
+        """Detiene la ingesta guardando las lecturas pendientes del agregador"""
+        if not self.running:
+            return
+        self.running = False
+        self._stop_event.set()
+        self.client.stop()
+        self.retention.stop()
+        self.aggregator.stop()
+        # Entregar los avisos de las últimas alertas antes de salir
+        self.dispatcher.stop()
+
+    def run_forever(self, on_started: Optional[Callable[[], None]] = None):
+        """
+        Ejecuta la ingesta en primer plano hasta recibir SIGINT/SIGTERM.
+        Pensado para procesos worker dedicados.
+
+        Args:
+            on_started: Función opcional a ejecutar cuando la ingesta ha arrancado
+        """
+        stop_requested = threading.Event()
+
+        def request_stop(signum, frame):
+            logger.info(f"🛑 Señal {signum} recibida, deteniendo ingesta...")
+            stop_requested.set()
+
+        signal.signal(signal.SIGINT, request_stop)
+        signal.signal(signal.SIGTERM, request_stop)
+
+        self.start()
+        if on_started:
+            on_started()
+        stop_requested.wait()
+        self.stop()
+
+
+def _run_partition_worker(index: int, count: int, asyncio_mode: bool = False):
+    """Punto de entrada de cada proceso worker de una partición"""
+    configure_logging(process_name=True)
+    def report_startup():
+        startup_timer.mark("ingest_start")
+        startup_timer.write_report(f"ingest-{index}of{count}")
+
+    # Un puerto de métricas por worker: AGRORETO_METRICS_PORT + índice
+    start_http_server_from_env(offset=index)
+    # kill -USR2 <pid del worker> deja un perfil .collapsed en AGRORETO_PROFILE_DIR
+    profiler.install_signal_handler()
+    if asyncio_mode:
+        # Importación local: async_ingest depende de este módulo
+        from app.services.async_ingest import AsyncIngestService
+
+        service = AsyncIngestService.from_env(partition=SensorPartition(index, count))
+        asyncio.run(service.run_forever(on_started=report_startup))
+    else:
+        IngestService(partition=SensorPartition(index, count)).run_forever(on_started=report_startup)
+
+
+def run_partitioned_workers(count: int, asyncio_mode: bool = False, stop_timeout: float = 10.0):
+    """
+    Lanza un proceso worker de ingesta por partición y espera a que terminen.
+    Cada proceso tiene su propio cliente MQTT y agregador. SIGINT/SIGTERM en
+    el proceso padre (Ctrl+C, systemd, docker stop) se reenvía a todos los
+    workers para que guarden sus datos pendientes; ningún worker queda huérfano.
+
+    Args:
+        count: Número de particiones (procesos worker)
+        asyncio_mode: Ejecutar cada worker con la ingesta asyncio (AsyncIngestService)
+        stop_timeout: Segundos de espera a cada worker antes de matarlo
+    """
+    stop_requested = threading.Event()
+
+    def request_stop(signum, frame):
+        logger.info(f"🛑 Señal {signum} recibida, deteniendo workers de ingesta...")
+        stop_requested.set()
+
+    previous_handlers = {
+        signum: signal.signal(signum, request_stop) for signum in (signal.SIGINT, signal.SIGTERM)
+    }
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(
+            target=_run_partition_worker,
+            args=(index, count, asyncio_mode),
+            name=f"Ingest-{index}of{count}",
+        )
+        for index in range(count)
+    ]
+    try:
+        for worker in workers:
+            worker.start()
+        logger.info(f"✅ {count} workers de ingesta en ejecución")
+        while any(worker.is_alive() for worker in workers) and not stop_requested.wait(0.5):
+            pass
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+        # terminate() envía SIGTERM: cada worker guarda lo pendiente antes de salir
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        for worker in workers:
+            worker.join(timeout=stop_timeout)
+            if worker.is_alive():
+                logger.warning(f"⚠️ {worker.name} no ha terminado en {stop_timeout:g}s, se fuerza la salida")
+                worker.kill()
+                worker.join()
+
+
+# Instancia global del servicio de ingesta (partición según AGRORETO_INGEST_PARTITION)
+ingest_service = IngestService(partition=SensorPartition.from_env())
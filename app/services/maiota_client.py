@@ -1,39 +1,81 @@
 # app/services/maiota_client.py
 import json
 import logging
+import os
 import re
 import threading
 import time
 import uuid
 from datetime import datetime
-from typing import Callable, Dict
+from typing import Callable, Dict, List, Optional
 
 import paho.mqtt.client as mqtt
 
+from app.logging_config import RateLimitedLogger
+from app.services.metrics import Counter
+from app.services.mqtt_transport import TransportFactory, paho_transport
+
 logger = logging.getLogger(__name__)
+hot_logger = RateLimitedLogger(logger)
+
+MQTT_MESSAGES_RECEIVED = Counter(
+    "agroreto_mqtt_messages_received_total", "Mensajes MQTT recibidos por topic", ["topic"],
+)
+MQTT_MESSAGES_PARSED = Counter(
+    "agroreto_mqtt_messages_parsed_total", "Mensajes MQTT parseados correctamente por topic", ["topic"],
+)
+MQTT_MESSAGES_REJECTED = Counter(
+    "agroreto_mqtt_messages_rejected_total",
+    "Mensajes MQTT descartados por topic y motivo (invalid_payload, unknown_topic)",
+    ["topic", "reason"],
+)
+
+# Mapeo de tipos de sensor de la BD a los campos del payload MAIoTA
+MAIOTA_TYPE_MAP = {
+    "temperature": "temperatura",
+    "humidity_ambient": "humedad_ambiente",
+    "humidity_soil": "humedad_suelo",
+    "luminosity": "iluminacion",
+    "co2": "co2",
+    "cov": "cov",
+    "nox": "nox"
+}
 
 class MAIoTAMultiSensorClient:
     """Cliente MQTT para gestionar múltiples sensores MAIoTA del Reto Agrotech"""
     
-    def __init__(self):
+    def __init__(self, broker: Optional[str] = None, port: Optional[int] = None,
+                 transport_factory: Optional[TransportFactory] = None):
         """
         Inicializa el cliente MQTT para sensores MAIoTA.
         Crea un client_id único y configura los parámetros de conexión.
+        
+        Args:
+            broker: Host del broker (por defecto MQTT_BROKER o broker.emqx.io)
+            port: Puerto del broker (por defecto MQTT_PORT o 1883)
+            transport_factory: Crea el transporte MQTT a partir del client_id
+                (por defecto paho; InMemoryBroker().client para tests y benchmarks)
         """
         # ✅ Client ID único usando UUID
         unique_id = str(uuid.uuid4())[:8]
         self.client_id = f"Equipo3_{unique_id}"
         
-        self.broker = "broker.emqx.io"
-        self.port = 1883
+        # Broker configurable: p. ej. un Mosquitto local con el simulador de dispositivos
+        self.broker = broker or os.environ.get("MQTT_BROKER", "broker.emqx.io")
+        self.port = port or int(os.environ.get("MQTT_PORT", 1883))
         self.keepalive = 60
+        self.transport_factory = transport_factory or paho_transport
         
         self.topic_callbacks: Dict[str, Callable] = {}
         self.active_sensors: Dict[str, dict] = {}
+        # Funciones a ejecutar en cada conexión (o reconexión) exitosa
+        self.connect_listeners: List[Callable[[], None]] = []
         
         self.is_connected = False
         self.reconnect_attempts = 0
         self.max_reconnect_attempts = 5
+        # Llegada del último mensaje (epoch), para /api/health
+        self.last_message_at: Optional[float] = None
         
         self.client = None
         self._init_client()
@@ -43,11 +85,7 @@ class MAIoTAMultiSensorClient:
         Inicializa el cliente MQTT con configuración optimizada.
         Configura callbacks y reconexion automática.
         """
-        self.client = mqtt.Client(
-            client_id=self.client_id,
-            clean_session=True,  # ✅ Limpiar sesión anterior
-            protocol=mqtt.MQTTv311
-        )
+        self.client = self.transport_factory(self.client_id)
         
         # Callbacks
         self.client.on_connect = self._on_connect
@@ -71,14 +109,21 @@ class MAIoTAMultiSensorClient:
             rc: Código de resultado (0 = éxito)
         """
         if rc == 0:
-            logger.info("✅ Conectado al broker MAIoTA (EMQX)")
+            logger.info(f"✅ Conectado al broker MAIoTA ({self.broker})")
             self.is_connected = True
             self.reconnect_attempts = 0
             
             # Resuscribirse a todos los topics
-            for topic in self.topic_callbacks.keys():
+            for topic in list(self.topic_callbacks.keys()):
                 client.subscribe(topic)
                 logger.info(f"  📡 Suscrito a: {topic}")
+            
+            # Notificar la conexión (p. ej. para registrar sensores de la BD)
+            for listener in list(self.connect_listeners):
+                try:
+                    listener()
+                except Exception as e:
+                    logger.exception(f"❌ Error en listener de conexión: {e}")
         else:
             error_messages = {
                 1: "Versión de protocolo incorrecta",
@@ -125,28 +170,51 @@ class MAIoTAMultiSensorClient:
             msg: Mensaje MQTT con topic y payload
         """
         topic = msg.topic
-        payload = str(msg.payload.decode("utf-8"))
-        
-        logger.debug(f"📨 Mensaje recibido [{topic}]: {payload[:50]}...")
-        
-        # Parsear payload MAIoTA
-        sensor_data = self._parse_maiota_payload(payload)
+        sensor_data = self.decode_message(topic, msg.payload)
         
-        if sensor_data and topic in self.topic_callbacks:
-            sensor_info = self.active_sensors.get(topic, {})
-            sensor_data.update({
-                'sensor_code': sensor_info.get('code', 'Unknown'),
-                'sensor_id': sensor_info.get('id'),
-                'sensor_type': sensor_info.get('type', 'temperatura'),
-                'topic': topic,
-                'raw_payload': payload
-            })
-            
+        if sensor_data:
             # Ejecutar callback
             try:
                 self.topic_callbacks[topic](sensor_data)
             except Exception as e:
-                logger.exception(f"❌ Error en callback para {topic}: {e}")
+                hot_logger.exception(("callback", topic), "❌ Error en callback para %s: %s", topic, e)
+    
+    def decode_message(self, topic: str, raw_payload: bytes) -> Optional[dict]:
+        """
+        Parsea un mensaje de un topic registrado y le añade los datos del sensor.
+        
+        Args:
+            topic: Topic MQTT del mensaje
+            raw_payload: Payload MQTT sin decodificar
+        
+        Returns:
+            Datos del sensor, o None si el topic no está registrado o el payload no es válido
+        """
+        MQTT_MESSAGES_RECEIVED.labels(topic).inc()
+        self.last_message_at = time.time()
+        payload = str(raw_payload.decode("utf-8"))
+        
+        logger.debug("📨 Mensaje recibido [%s]: %.50s...", topic, payload)
+        
+        # Parsear payload MAIoTA
+        sensor_data = self._parse_maiota_payload(payload)
+        
+        if not sensor_data:
+            MQTT_MESSAGES_REJECTED.labels(topic, "invalid_payload").inc()
+            return None
+        if topic not in self.topic_callbacks:
+            MQTT_MESSAGES_REJECTED.labels(topic, "unknown_topic").inc()
+            return None
+        MQTT_MESSAGES_PARSED.labels(topic).inc()
+        sensor_info = self.active_sensors.get(topic, {})
+        sensor_data.update({
+            'sensor_code': sensor_info.get('code', 'Unknown'),
+            'sensor_id': sensor_info.get('id'),
+            'sensor_type': sensor_info.get('type', 'temperatura'),
+            'topic': topic,
+            'raw_payload': payload
+        })
+        return sensor_data
     
     def _parse_maiota_payload(self, payload: str) -> dict:
         """
@@ -170,7 +238,7 @@ class MAIoTAMultiSensorClient:
             Diccionario con los datos parseados o None si el formato es inválido
         """
         if not payload.startswith("CIoTA-"):
-            logger.warning(f"⚠️ Payload no reconocido: {payload}")
+            hot_logger.warning("invalid_payload", "⚠️ Payload no reconocido: %.200s", payload)
             return None
         
         pattern = r'D(\d+)=([↓]?)(\d+)'
@@ -220,6 +288,17 @@ class MAIoTAMultiSensorClient:
         else:
             logger.warning(f"⏳ Sensor {sensor_code} pendiente de conexión")
     
+    def add_connect_listener(self, listener: Callable[[], None]):
+        """
+        Registra una función que se ejecuta en el thread MQTT tras cada conexión
+        exitosa al broker, después de resuscribir los topics conocidos.
+        
+        Args:
+            listener: Función sin argumentos
+        """
+        if listener not in self.connect_listeners:
+            self.connect_listeners.append(listener)
+    
     def remove_sensor(self, topic: str):
         """
         Elimina un sensor del monitoreo y cancela la suscripción al topic.
@@ -236,25 +315,45 @@ class MAIoTAMultiSensorClient:
                 self.client.unsubscribe(topic)
                 logger.info(f"✅ Sensor {sensor_info.get('code')} desvinculado del topic {topic}")
     
+    def publish(self, topic: str, payload: str, qos: int = 1) -> bool:
+        """
+        Publica un mensaje en el broker (p. ej. notificaciones de alertas).
+        
+        Args:
+            topic: Topic MQTT de destino
+            payload: Contenido del mensaje
+            qos: Calidad de servicio MQTT
+        
+        Returns:
+            True si el mensaje se ha encolado en el cliente, False si no hay conexión
+        """
+        if not self.is_connected:
+            return False
+        result = self.client.publish(topic, payload, qos=qos)
+        return result.rc == mqtt.MQTT_ERR_SUCCESS
+    
     def start(self):
         """
         Inicia la conexión MQTT en un thread de background.
-        El cliente se ejecuta de forma asíncrona sin bloquear la aplicación.
+        El cliente se ejecuta de forma asíncrona sin bloquear la aplicación:
+        la conexión (y sus reintentos) ocurre en el thread MQTT y _on_connect
+        avisa a los listeners cuando está lista.
         """
         try:
             logger.info(f"🔌 Conectando a {self.broker}:{self.port}...")
             logger.info(f"🆔 Client ID: {self.client_id}")
             
-            # ✅ Conectar con timeout
-            self.client.connect(
+            # ✅ Conexión no bloqueante: se establece dentro de loop_forever
+            self.client.connect_async(
                 self.broker,
                 self.port,
                 keepalive=self.keepalive
             )
             
-            # Ejecutar loop en thread separado
+            # Ejecutar loop en thread separado, reintentando también la primera conexión
             thread = threading.Thread(
                 target=self.client.loop_forever,
+                kwargs={'retry_first_connection': True},
                 daemon=True,
                 name="MAIoTA-MQTT-Thread"
             )
@@ -0,0 +1,348 @@
+# app/services/metrics.py
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Tipo de contenido del formato de texto de Prometheus
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Buckets por defecto en segundos (de 0.5 ms a 10 s)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Esperas de lock: la mayoría no esperan nada, interesa la cola
+LOCK_WAIT_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value != value:
+        return "NaN"
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base de las métricas: hijos por combinación de etiquetas"""
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional["MetricsRegistry"] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        # Sin etiquetas: el único hijo se crea ya y se usa sin búsquedas
+        self._unlabelled = self.labels() if not self.labelnames else None
+        (registry or REGISTRY).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values) -> object:
+        """
+        Devuelve el hijo de una combinación de etiquetas (se crea la primera vez).
+        Guardar el hijo evita incluso la búsqueda en el camino caliente.
+        """
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} espera las etiquetas {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _default(self):
+        if self._unlabelled is None:
+            raise ValueError(f"{self.name} tiene etiquetas: usa labels()")
+        return self._unlabelled
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """Muestras (sufijo, etiquetas formateadas, valor) para la exposición"""
+        raise NotImplementedError
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    """Contador monótono (el nombre debe acabar en _total)"""
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+    def samples(self):
+        return [("", _format_labels(self.labelnames, key), child.value)
+                for key, child in list(self._children.items())]
+
+
+class _GaugeChild:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]):
+        """Calcula el valor sólo al exponer las métricas (coste cero en el camino caliente)"""
+        self.function = function
+
+    def get(self) -> float:
+        if self.function is None:
+            return self.value
+        try:
+            return float(self.function())
+        except Exception as e:
+            logger.debug(f"⚠️ Error calculando gauge: {e}")
+            return float("nan")
+
+
+class Gauge(_Metric):
+    """Valor que sube y baja (tamaños de buffers, colas, etc.)"""
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self._default().set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        self._default().set_function(function)
+
+    def samples(self):
+        return [("", _format_labels(self.labelnames, key), child.get())
+                for key, child in list(self._children.items())]
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self) -> "_Timer":
+        """Context manager que observa la duración del bloque"""
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("child", "started")
+
+    def __init__(self, child: _HistogramChild):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.started)
+
+
+class Histogram(_Metric):
+    """Distribución en buckets acumulativos, con suma y número de observaciones"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional["MetricsRegistry"] = None):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def time(self) -> _Timer:
+        return self._default().time()
+
+    def samples(self):
+        result = []
+        for key, child in list(self._children.items()):
+            with child._lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                result.append(("_bucket", _format_labels(self.labelnames, key, le), cumulative))
+            result.append(("_sum", _format_labels(self.labelnames, key), total))
+            result.append(("_count", _format_labels(self.labelnames, key), cumulative))
+        return result
+
+
+class MetricsRegistry:
+    """Conjunto de métricas de un proceso, exportables en formato de texto de Prometheus"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Métrica duplicada: {metric.name}")
+            self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """
+        Exporta todas las métricas.
+
+        Returns:
+            Texto en el formato de exposición de Prometheus (versión 0.0.4)
+        """
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def get_sample_value(self, name: str, labels: Optional[Dict[str, str]] = None) -> Optional[float]:
+        """
+        Valor de una muestra exportada (para tests y diagnósticos).
+
+        Args:
+            name: Nombre completo de la muestra (con sufijo _bucket, _sum, _count si aplica)
+            labels: Etiquetas en el orden en que se declararon (le la última)
+
+        Returns:
+            Valor de la muestra, o None si no existe
+        """
+        labels = labels or {}
+        prefix = name + _format_labels(list(labels), list(labels.values())) + " "
+        for line in self.render().splitlines():
+            if line.startswith(prefix):
+                return float(line[len(prefix):])
+        return None
+
+
+REGISTRY = MetricsRegistry()
+
+
+def timed(histogram: Histogram):
+    """
+    Decorador que observa la duración de cada llamada (funciones y corutinas).
+
+    Args:
+        histogram: Histograma sin etiquetas donde se registra la duración
+    """
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with histogram.time():
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with histogram.time():
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# --- Servidor de métricas para los workers de ingesta ------------------------
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server_from_env(offset: int = 0) -> Optional[ThreadingHTTPServer]:
+    """
+    Arranca el servidor de métricas si está configurado AGRORETO_METRICS_PORT.
+
+    Args:
+        offset: Desplazamiento del puerto (índice de partición con varios workers)
+
+    Returns:
+        Servidor en ejecución, o None si no está configurado
+    """
+    port = os.environ.get("AGRORETO_METRICS_PORT")
+    if not port:
+        return None
+    return start_http_server(int(port) + offset)
+
+
+def start_http_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    Expone /metrics en un puerto propio (procesos sin API web, como la ingesta).
+
+    Args:
+        port: Puerto TCP (0 = uno libre cualquiera)
+        host: Interfaz de escucha
+
+    Returns:
+        Servidor en ejecución en un thread de background
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True, name="Metrics-HTTP-Thread")
+    thread.start()
+    logger.info(f"📈 Métricas en http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,246 @@
+# app/services/mqtt_transport.py
+import itertools
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Protocol, Set, Tuple
+
+import paho.mqtt.client as mqtt
+
+logger = logging.getLogger(__name__)
+
+
+class MqttTransport(Protocol):
+    """
+    Subconjunto de la API de paho.mqtt.client.Client que usa
+    MAIoTAMultiSensorClient. Cualquier transporte con estos métodos y
+    callbacks (on_connect, on_message, on_disconnect con las firmas de paho)
+    se puede usar: paho (por defecto), el broker en memoria o un adaptador
+    sobre un cliente asyncio.
+    """
+    on_connect: Optional[Callable]
+    on_message: Optional[Callable]
+    on_disconnect: Optional[Callable]
+
+    def reconnect_delay_set(self, min_delay: int = 1, max_delay: int = 120): ...
+
+    def connect_async(self, host: str, port: int = 1883, keepalive: int = 60): ...
+
+    def loop_forever(self, retry_first_connection: bool = False): ...
+
+    def loop_stop(self): ...
+
+    def disconnect(self): ...
+
+    def subscribe(self, topic: str, qos: int = 0): ...
+
+    def unsubscribe(self, topic: str): ...
+
+    def publish(self, topic: str, payload=None, qos: int = 0, retain: bool = False): ...
+
+
+# Factoría de transportes: recibe el client_id y devuelve un transporte sin conectar
+TransportFactory = Callable[[str], MqttTransport]
+
+
+def paho_transport(client_id: str) -> mqtt.Client:
+    """
+    Transporte por defecto: cliente paho contra un broker real.
+
+    Args:
+        client_id: Identificador único del cliente MQTT
+
+    Returns:
+        Cliente paho sin conectar
+    """
+    return mqtt.Client(
+        client_id=client_id,
+        clean_session=True,  # ✅ Limpiar sesión anterior
+        protocol=mqtt.MQTTv311
+    )
+
+
+def _to_bytes(payload) -> bytes:
+    if payload is None:
+        return b""
+    if isinstance(payload, (bytes, bytearray)):
+        return bytes(payload)
+    return str(payload).encode("utf-8")
+
+
+class InMemoryBroker:
+    """
+    Broker MQTT en memoria para tests y benchmarks: sin sockets ni servicio externo.
+
+    La entrega es síncrona, en el thread de quien publica, así que tras
+    publish() el mensaje ya ha pasado por el callback de cada suscriptor y
+    el resultado es determinista. Admite los comodines + y # de MQTT.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Suscripciones exactas (topic -> clientes) y con comodines (filtro -> clientes)
+        self._exact: Dict[str, Set["InMemoryTransport"]] = {}
+        self._wildcards: Dict[str, Set["InMemoryTransport"]] = {}
+        self.clients: Dict[str, "InMemoryTransport"] = {}
+        self._mids = itertools.count(1)
+        self.published = 0
+        self.delivered = 0
+
+    def client(self, client_id: str) -> "InMemoryTransport":
+        """Factoría de transportes conectados a este broker (usable como TransportFactory)"""
+        return InMemoryTransport(self, client_id)
+
+    def subscribe(self, transport: "InMemoryTransport", topic_filter: str):
+        table = self._wildcards if ("+" in topic_filter or "#" in topic_filter) else self._exact
+        with self._lock:
+            table.setdefault(topic_filter, set()).add(transport)
+
+    def unsubscribe(self, transport: "InMemoryTransport", topic_filter: str):
+        with self._lock:
+            for table in (self._exact, self._wildcards):
+                subscribers = table.get(topic_filter)
+                if subscribers is not None:
+                    subscribers.discard(transport)
+                    if not subscribers:
+                        del table[topic_filter]
+
+    def _forget(self, transport: "InMemoryTransport"):
+        """Sesión limpia: al desconectarse se pierden las suscripciones del cliente"""
+        with self._lock:
+            for table in (self._exact, self._wildcards):
+                for topic_filter in [f for f, subscribers in table.items() if transport in subscribers]:
+                    table[topic_filter].discard(transport)
+                    if not table[topic_filter]:
+                        del table[topic_filter]
+
+    def _subscribers(self, topic: str) -> List["InMemoryTransport"]:
+        with self._lock:
+            subscribers = set(self._exact.get(topic, ()))
+            for topic_filter, transports in self._wildcards.items():
+                if mqtt.topic_matches_sub(topic_filter, topic):
+                    subscribers.update(transports)
+        return list(subscribers)
+
+    def publish(self, topic: str, payload=None, qos: int = 0) -> int:
+        """
+        Publica un mensaje y lo entrega a los suscriptores conectados.
+
+        Args:
+            topic: Topic del mensaje
+            payload: Contenido (str, bytes o número)
+            qos: Calidad de servicio (se conserva en el mensaje; la entrega siempre es única)
+
+        Returns:
+            Número de suscriptores que han recibido el mensaje
+        """
+        body = _to_bytes(payload)
+        subscribers = self._subscribers(topic)
+        self.published += 1
+        delivered = 0
+        for transport in subscribers:
+            message = mqtt.MQTTMessage(mid=next(self._mids), topic=topic.encode("utf-8"))
+            message.payload = body
+            message.qos = qos
+            if transport.deliver(message):
+                delivered += 1
+        self.delivered += delivered
+        return delivered
+
+    def restart(self):
+        """
+        Simula un reinicio del broker: todos los clientes se desconectan de
+        forma inesperada, pierden sus suscripciones y se reconectan.
+        """
+        transports = list(self.clients.values())
+        for transport in transports:
+            transport.drop(rc=mqtt.MQTT_ERR_CONN_LOST)
+        for transport in transports:
+            transport.reconnect()
+
+
+class InMemoryTransport:
+    """Transporte con la API de paho conectado a un InMemoryBroker"""
+
+    def __init__(self, broker: InMemoryBroker, client_id: str):
+        self.broker = broker
+        self.client_id = client_id
+        self.on_connect: Optional[Callable] = None
+        self.on_message: Optional[Callable] = None
+        self.on_disconnect: Optional[Callable] = None
+        self.address: Optional[Tuple[str, int]] = None
+        self.connected = threading.Event()
+        self._stopped = threading.Event()
+
+    def reconnect_delay_set(self, min_delay: int = 1, max_delay: int = 120):
+        pass
+
+    def connect_async(self, host: str, port: int = 1883, keepalive: int = 60, **kwargs):
+        self.address = (host, port)
+
+    def connect(self, host: str, port: int = 1883, keepalive: int = 60, **kwargs) -> int:
+        self.connect_async(host, port, keepalive)
+        self.reconnect()
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def reconnect(self):
+        """Conecta con el broker y ejecuta on_connect (como hace paho al reconectar)"""
+        self.broker.clients[self.client_id] = self
+        self.connected.set()
+        if self.on_connect:
+            self.on_connect(self, None, {}, 0)
+
+    def loop_forever(self, retry_first_connection: bool = False, **kwargs):
+        """Conecta y bloquea hasta disconnect() o loop_stop(), como el loop de paho"""
+        self._stopped.clear()
+        self.reconnect()
+        self._stopped.wait()
+
+    def loop_start(self):
+        self.reconnect()
+
+    def loop_stop(self, *args):
+        self._stopped.set()
+
+    def drop(self, rc: int = mqtt.MQTT_ERR_CONN_LOST):
+        """Cierra la conexión con el código indicado (0 = desconexión limpia)"""
+        self.broker._forget(self)
+        self.broker.clients.pop(self.client_id, None)
+        self.connected.clear()
+        if self.on_disconnect:
+            self.on_disconnect(self, None, rc)
+
+    def disconnect(self, *args, **kwargs) -> int:
+        if self.connected.is_set():
+            self.drop(rc=mqtt.MQTT_ERR_SUCCESS)
+        self._stopped.set()
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def subscribe(self, topic: str, qos: int = 0) -> Tuple[int, Optional[int]]:
+        if not self.connected.is_set():
+            return mqtt.MQTT_ERR_NO_CONN, None
+        self.broker.subscribe(self, topic)
+        return mqtt.MQTT_ERR_SUCCESS, next(self.broker._mids)
+
+    def unsubscribe(self, topic: str) -> Tuple[int, Optional[int]]:
+        self.broker.unsubscribe(self, topic)
+        return mqtt.MQTT_ERR_SUCCESS, next(self.broker._mids)
+
+    def publish(self, topic: str, payload=None, qos: int = 0, retain: bool = False) -> mqtt.MQTTMessageInfo:
+        info = mqtt.MQTTMessageInfo(next(self.broker._mids))
+        if not self.connected.is_set():
+            info.rc = mqtt.MQTT_ERR_NO_CONN
+            return info
+        self.broker.publish(topic, payload, qos)
+        info.rc = mqtt.MQTT_ERR_SUCCESS
+        return info
+
+    def deliver(self, message: mqtt.MQTTMessage) -> bool:
+        """Entrega un mensaje del broker al callback on_message"""
+        if not self.connected.is_set() or not self.on_message:
+            return False
+        try:
+            self.on_message(self, None, message)
+        except Exception as e:
+            # Como paho: un fallo del callback no tumba al que publica
+            logger.exception(f"❌ Error en on_message de {self.client_id}: {e}")
+        return True
@@ -0,0 +1,387 @@
+# app/services/notifier.py
+import json
+import logging
+import os
+import smtplib
+import threading
+import time
+import urllib.request
+from dataclasses import dataclass, field
+from datetime import datetime
+from email.message import EmailMessage
+from typing import Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session as OrmSession
+
+from app.models import Alert
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Notification:
+    """Aviso de una alerta que se abre o se cierra"""
+    alert_id: int
+    sensor_id: int
+    alert_type: str
+    message: str
+    timestamp: datetime
+    event: str = "opened"  # opened, closed
+
+    def to_dict(self) -> dict:
+        return {
+            "alert_id": self.alert_id,
+            "sensor_id": self.sensor_id,
+            "type": self.alert_type,
+            "message": self.message,
+            "timestamp": self.timestamp.isoformat(),
+            "event": self.event,
+        }
+
+
+class NotificationChannel:
+    """Canal de entrega hacia un destinatario (URL, dirección de correo o topic)"""
+    name = ""
+
+    def __init__(self, recipient: str):
+        self.recipient = recipient
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}:{self.recipient}"
+
+    def send(self, batch: List[Notification]):
+        """Entrega un lote de avisos; lanza una excepción si falla"""
+        raise NotImplementedError
+
+
+class WebhookChannel(NotificationChannel):
+    """POST JSON {"alerts": [...]} a una URL"""
+    name = "webhook"
+
+    def __init__(self, url: str, timeout: float = 10.0):
+        super().__init__(url)
+        self.timeout = timeout
+
+    def send(self, batch: List[Notification]):
+        body = json.dumps({"alerts": [n.to_dict() for n in batch]}).encode("utf-8")
+        request = urllib.request.Request(
+            self.recipient, data=body, method="POST",
+            headers={"Content-Type": "application/json"},
+        )
+        # urlopen lanza HTTPError con respuestas 4xx/5xx
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class EmailChannel(NotificationChannel):
+    """Un correo por lote de avisos, vía SMTP"""
+    name = "email"
+
+    def __init__(self, recipient: str, host: str, port: int = 25, sender: str = "agroreto@localhost",
+                 username: Optional[str] = None, password: Optional[str] = None,
+                 starttls: bool = False, timeout: float = 10.0):
+        super().__init__(recipient)
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+
+    def send(self, batch: List[Notification]):
+        message = EmailMessage()
+        message["Subject"] = f"[AGRORETO] {len(batch)} alerta(s)"
+        message["From"] = self.sender
+        message["To"] = self.recipient
+        message.set_content("\n".join(
+            f"{n.timestamp:%Y-%m-%d %H:%M} [{n.alert_type}] "
+            f"{'(resuelta) ' if n.event == 'closed' else ''}{n.message}"
+            for n in batch
+        ))
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password or "")
+            smtp.send_message(message)
+
+
+class MqttChannel(NotificationChannel):
+    """Publica el lote como JSON en un topic del broker MQTT"""
+    name = "mqtt"
+
+    def __init__(self, topic: str, publish: Callable[[str, str], bool]):
+        super().__init__(topic)
+        self.publish = publish
+
+    def send(self, batch: List[Notification]):
+        payload = json.dumps({"alerts": [n.to_dict() for n in batch]})
+        if not self.publish(self.recipient, payload):
+            raise ConnectionError("Cliente MQTT sin conexión")
+
+
+@dataclass
+class _Outbox:
+    """Avisos pendientes de un destinatario, coalescidos por alerta"""
+    channel: NotificationChannel
+    pending: Dict[int, Notification] = field(default_factory=dict)
+    first_pending_at: Optional[float] = None
+    attempts: int = 0
+    next_attempt_at: float = 0.0
+
+
+class NotificationDispatcher:
+    """
+    Envía los avisos de alertas en un worker propio, agrupados por destinatario.
+
+    enqueue() nunca bloquea: sólo añade los avisos a la cola de cada canal. El
+    worker envía un lote por destinatario cuando pasan batch_seconds desde el
+    primer aviso pendiente (o se llega a max_batch) y reintenta los fallos con
+    espera exponencial. Varios avisos de la misma alerta en un lote se
+    coalescen en el último (p. ej. abierta y cerrada: se envía el cierre).
+    """
+
+    def __init__(self, channels: Optional[Iterable[NotificationChannel]] = None,
+                 batch_seconds: float = 5.0, max_batch: int = 50, max_attempts: int = 5,
+                 backoff_base: float = 2.0, backoff_max: float = 300.0, max_pending: int = 1000):
+        """
+        Inicializa el dispatcher.
+
+        Args:
+            channels: Canales de entrega (uno por destinatario)
+            batch_seconds: Espera máxima para agrupar avisos en un lote
+            max_batch: Avisos por lote a partir de los cuales se envía sin esperar
+            max_attempts: Intentos de entrega de un lote antes de descartarlo
+            backoff_base: Espera en segundos tras el primer fallo (se duplica en cada intento)
+            backoff_max: Espera máxima entre reintentos
+            max_pending: Avisos pendientes por destinatario; se descartan los más antiguos
+        """
+        self.outboxes = [_Outbox(channel) for channel in (channels or [])]
+        self.batch_seconds = batch_seconds
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_pending = max_pending
+        self.sent = 0
+        self.dropped = 0
+        self.running = False
+        self.thread = None
+        self._condition = threading.Condition()
+        self._send_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, publish: Optional[Callable[[str, str], bool]] = None) -> "NotificationDispatcher":
+        """
+        Crea el dispatcher con los canales configurados en variables de entorno:
+        AGRORETO_NOTIFY_WEBHOOKS (URLs separadas por comas), AGRORETO_NOTIFY_EMAILS
+        con AGRORETO_SMTP_HOST/PORT/FROM/USER/PASSWORD/STARTTLS, y
+        AGRORETO_NOTIFY_MQTT_TOPIC (publicado con el cliente MQTT de la ingesta).
+        """
+        def split(variable):
+            return [value.strip() for value in os.environ.get(variable, "").split(",") if value.strip()]
+
+        channels: List[NotificationChannel] = [WebhookChannel(url) for url in split("AGRORETO_NOTIFY_WEBHOOKS")]
+
+        smtp_host = os.environ.get("AGRORETO_SMTP_HOST")
+        if smtp_host:
+            for address in split("AGRORETO_NOTIFY_EMAILS"):
+                channels.append(EmailChannel(
+                    address,
+                    host=smtp_host,
+                    port=int(os.environ.get("AGRORETO_SMTP_PORT", 25)),
+                    sender=os.environ.get("AGRORETO_SMTP_FROM", "agroreto@localhost"),
+                    username=os.environ.get("AGRORETO_SMTP_USER") or None,
+                    password=os.environ.get("AGRORETO_SMTP_PASSWORD") or None,
+                    starttls=os.environ.get("AGRORETO_SMTP_STARTTLS", "0").lower() in ("1", "true", "yes"),
+                ))
+
+        mqtt_topic = os.environ.get("AGRORETO_NOTIFY_MQTT_TOPIC")
+        if mqtt_topic:
+            if publish is None:
+                from app.services.maiota_client import maiota_client
+                publish = maiota_client.publish
+            channels.append(MqttChannel(mqtt_topic, publish))
+
+        return cls(
+            channels,
+            batch_seconds=float(os.environ.get("AGRORETO_NOTIFY_BATCH_SECONDS", 5.0)),
+        )
+
+    def enqueue(self, notifications: Iterable[Notification]):
+        """
+        Añade avisos a la cola de todos los canales (no bloquea).
+
+        Args:
+            notifications: Avisos a entregar
+        """
+        notifications = list(notifications)
+        if not notifications or not self.outboxes:
+            return
+        now = time.monotonic()
+        with self._condition:
+            for outbox in self.outboxes:
+                for notification in notifications:
+                    outbox.pending.pop(notification.alert_id, None)
+                    outbox.pending[notification.alert_id] = notification
+                while len(outbox.pending) > self.max_pending:
+                    del outbox.pending[next(iter(outbox.pending))]
+                    self.dropped += 1
+                if outbox.first_pending_at is None:
+                    outbox.first_pending_at = now
+            self._condition.notify()
+        self._ensure_worker()
+
+    def _ensure_worker(self):
+        if self.running:
+            return
+        with self._condition:
+            if self.running:
+                return
+            self.running = True
+            self.thread = threading.Thread(target=self._worker_loop, daemon=True, name="Notifier-Thread")
+            self.thread.start()
+
+    def _ready_at(self, outbox: _Outbox) -> Optional[float]:
+        """Momento (monotonic) en que el lote del destinatario debe enviarse"""
+        if not outbox.pending:
+            return None
+        if len(outbox.pending) >= self.max_batch:
+            return outbox.next_attempt_at
+        return max(outbox.first_pending_at + self.batch_seconds, outbox.next_attempt_at)
+
+    def _deliver(self, outbox: _Outbox, force: bool = False) -> bool:
+        """
+        Envía el lote pendiente de un destinatario. Debe llamarse con _send_lock.
+
+        Returns:
+            True si se ha entregado (o no había nada que entregar)
+        """
+        with self._condition:
+            if not outbox.pending:
+                return True
+            batch = list(outbox.pending.values())[:self.max_batch]
+            for notification in batch:
+                del outbox.pending[notification.alert_id]
+            outbox.first_pending_at = time.monotonic() if outbox.pending else None
+
+        try:
+            outbox.channel.send(batch)
+        except Exception as e:
+            with self._condition:
+                # Devolver el lote a la cola sin pisar avisos más nuevos de las mismas alertas
+                for notification in batch:
+                    outbox.pending.setdefault(notification.alert_id, notification)
+                outbox.first_pending_at = outbox.first_pending_at or time.monotonic()
+                outbox.attempts += 1
+                if outbox.attempts >= self.max_attempts and not force:
+                    for notification in batch:
+                        outbox.pending.pop(notification.alert_id, None)
+                    self.dropped += len(batch)
+                    outbox.attempts = 0
+                    outbox.next_attempt_at = 0.0
+                    logger.error(f"❌ {len(batch)} aviso(s) descartados para {outbox.channel.key}: {e}")
+                else:
+                    delay = min(self.backoff_max, self.backoff_base * 2 ** (outbox.attempts - 1))
+                    outbox.next_attempt_at = time.monotonic() + delay
+                    logger.warning(
+                        f"⚠️ Fallo enviando a {outbox.channel.key} (intento {outbox.attempts}), "
+                        f"reintento en {delay:.0f}s: {e}"
+                    )
+            return False
+
+        with self._condition:
+            outbox.attempts = 0
+            outbox.next_attempt_at = 0.0
+            self.sent += len(batch)
+        logger.info(f"📨 {len(batch)} aviso(s) enviados a {outbox.channel.key}")
+        return True
+
+    def _worker_loop(self):
+        while True:
+            with self._condition:
+                if not self.running:
+                    return
+                now = time.monotonic()
+                ready_times = [t for t in (self._ready_at(o) for o in self.outboxes) if t is not None]
+                due = [o for o in self.outboxes if (self._ready_at(o) or float("inf")) <= now]
+                if not due:
+                    timeout = min(ready_times) - now if ready_times else None
+                    self._condition.wait(timeout)
+                    continue
+            with self._send_lock:
+                for outbox in due:
+                    self._deliver(outbox)
+
+    def flush(self) -> bool:
+        """
+        Intenta entregar ya todos los avisos pendientes, sin esperar al lote.
+
+        Returns:
+            True si no queda nada pendiente
+        """
+        delivered = True
+        with self._send_lock:
+            for outbox in self.outboxes:
+                while outbox.pending:
+                    if not self._deliver(outbox, force=True):
+                        delivered = False
+                        break
+        return delivered
+
+    def stop(self):
+        """Detiene el worker intentando entregar los avisos pendientes"""
+        with self._condition:
+            was_running = self.running
+            self.running = False
+            self._condition.notify_all()
+        if was_running and self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+        self.flush()
+
+
+def _alert_notifications(session) -> List[Notification]:
+    """Avisos de las alertas creadas o cerradas en un flush"""
+    notifications = []
+    for obj in session.new:
+        if isinstance(obj, Alert):
+            notifications.append(Notification(
+                obj.id, obj.sensor_id, obj.type, obj.message, obj.timestamp or datetime.now(),
+            ))
+    for obj in session.dirty:
+        if isinstance(obj, Alert) and obj.closed_at is not None:
+            history = inspect(obj).attrs.closed_at.history
+            if history.added and not any(history.deleted):
+                notifications.append(Notification(
+                    obj.id, obj.sensor_id, obj.type, obj.message, obj.closed_at, event="closed",
+                ))
+    return notifications
+
+
+@event.listens_for(OrmSession, "after_flush")
+def _collect_alert_notifications(session, flush_context):
+    """Guarda en la sesión los avisos de las alertas escritas en este flush"""
+    notifications = _alert_notifications(session)
+    if notifications:
+        session.info.setdefault("alert_notifications", []).extend(notifications)
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _dispatch_on_commit(session):
+    """Encola los avisos sólo cuando las alertas quedan confirmadas en la BD"""
+    notifications = session.info.pop("alert_notifications", None)
+    if notifications:
+        notification_dispatcher.enqueue(notifications)
+
+
+@event.listens_for(OrmSession, "after_rollback")
+def _discard_on_rollback(session):
+    session.info.pop("alert_notifications", None)
+
+
+# Instancia global del dispatcher (canales según AGRORETO_NOTIFY_*)
+notification_dispatcher = NotificationDispatcher.from_env()
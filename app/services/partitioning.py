@@ -0,0 +1,75 @@
+# app/services/partitioning.py
+import logging
+import os
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+class SensorPartition:
+    """
+    Partición de sensores para repartir la ingesta entre varios workers.
+    Cada sensor pertenece exactamente a una partición según un hash estable
+    de su ID, así que cada worker agrega en exclusiva los intervalos de sus sensores.
+    """
+
+    def __init__(self, index: int = 0, count: int = 1):
+        """
+        Inicializa la partición.
+
+        Args:
+            index: Índice de esta partición (0 <= index < count)
+            count: Número total de particiones
+        """
+        if count < 1:
+            raise ValueError(f"El número de particiones debe ser >= 1 (recibido: {count})")
+        if not 0 <= index < count:
+            raise ValueError(f"Índice de partición fuera de rango: {index}/{count}")
+        self.index = index
+        self.count = count
+
+    @staticmethod
+    def partition_of(sensor_id: int, count: int) -> int:
+        """
+        Calcula la partición de un sensor.
+        Usa CRC32 en lugar de hash() para que el resultado sea el mismo
+        en todos los procesos y nodos.
+
+        Args:
+            sensor_id: ID del sensor en la base de datos
+            count: Número total de particiones
+
+        Returns:
+            Índice de la partición propietaria del sensor
+        """
+        return zlib.crc32(str(sensor_id).encode("utf-8")) % count
+
+    def owns(self, sensor_id: int) -> bool:
+        """Indica si el sensor pertenece a esta partición"""
+        return self.count == 1 or self.partition_of(sensor_id, self.count) == self.index
+
+    @classmethod
+    def parse(cls, value: str) -> "SensorPartition":
+        """
+        Crea la partición a partir de un texto con formato "indice/total"
+        (por ejemplo "0/4"). Un texto vacío equivale a una única partición.
+        """
+        value = value.strip()
+        if not value:
+            return cls()
+        try:
+            index, count = (int(part) for part in value.split("/", 1))
+        except ValueError:
+            raise ValueError(f"La partición debe tener el formato indice/total (recibido: {value!r})")
+        return cls(index, count)
+
+    @classmethod
+    def from_env(cls, variable: str = "AGRORETO_INGEST_PARTITION") -> "SensorPartition":
+        """
+        Crea la partición a partir de una variable de entorno con formato "indice/total".
+        Sin la variable, una única partición con todos los sensores.
+        """
+        return cls.parse(os.environ.get(variable, ""))
+
+    def __repr__(self) -> str:
+        return f"SensorPartition({self.index}/{self.count})"
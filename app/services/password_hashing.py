@@ -0,0 +1,124 @@
+# app/services/password_hashing.py
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from passlib.context import CryptContext
+
+from app.services.metrics import Counter, Histogram
+from app.utils import pwd_context
+
+logger = logging.getLogger(__name__)
+
+PASSWORD_SECONDS = Histogram(
+    "agroreto_password_hash_seconds",
+    "Duración de cada hash o verificación bcrypt por operación (incluye la espera en el pool)",
+    ["operation"],
+)
+PASSWORD_REJECTED = Counter(
+    "agroreto_password_rejected_total",
+    "Operaciones bcrypt rechazadas por tener el pool lleno",
+)
+
+
+class PasswordHasherBusy(RuntimeError):
+    """Demasiadas operaciones de contraseña en espera"""
+
+
+class PasswordHasher:
+    """
+    Hash y verificación bcrypt fuera del event loop, en un pool de threads
+    acotado. bcrypt libera el GIL mientras calcula, así que los threads
+    bastan y el loop sigue atendiendo eventos y websockets mientras tanto.
+
+    Como mucho `workers` operaciones a la vez y `max_pending` en total
+    (en curso más en espera): por encima se rechaza la operación en lugar
+    de acumular una cola que sólo alarga la espera de todos los usuarios.
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 32,
+                 context: Optional[CryptContext] = None):
+        """
+        Args:
+            workers: Threads del pool (operaciones bcrypt simultáneas)
+            max_pending: Operaciones en curso o en espera como máximo
+            context: Contexto de passlib (por defecto el de app.utils)
+        """
+        self.workers = workers
+        self.max_pending = max_pending
+        self.context = context or pwd_context
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, **kwargs) -> "PasswordHasher":
+        """Configura el pool con AGRORETO_PASSWORD_WORKERS y AGRORETO_PASSWORD_MAX_PENDING"""
+        return cls(
+            workers=int(os.environ.get("AGRORETO_PASSWORD_WORKERS", min(4, os.cpu_count() or 1))),
+            max_pending=int(os.environ.get("AGRORETO_PASSWORD_MAX_PENDING", 32)),
+            **kwargs,
+        )
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # El pool se crea con la primera operación: importar el módulo no arranca threads
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="PasswordHasher")
+            return self._executor
+
+    async def _run(self, operation: str, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            PASSWORD_REJECTED.inc()
+            logger.warning(f"⚠️ Pool de contraseñas lleno ({self.max_pending} operaciones), se rechaza un {operation}")
+            raise PasswordHasherBusy("Demasiadas operaciones de contraseña en curso")
+        try:
+            with PASSWORD_SECONDS.labels(operation).time():
+                return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self._slots.release()
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """
+        Verifica una contraseña contra su hash sin bloquear el event loop.
+
+        Args:
+            plain_password: Contraseña en texto plano
+            hashed_password: Hash bcrypt guardado
+
+        Returns:
+            True si coinciden
+
+        Raises:
+            PasswordHasherBusy: Si el pool tiene max_pending operaciones pendientes
+        """
+        return await self._run("verify", self.context.verify, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        """
+        Genera el hash bcrypt de una contraseña sin bloquear el event loop.
+
+        Args:
+            password: Contraseña en texto plano
+
+        Returns:
+            Hash bcrypt
+
+        Raises:
+            PasswordHasherBusy: Si el pool tiene max_pending operaciones pendientes
+        """
+        return await self._run("hash", self.context.hash, password)
+
+    def shutdown(self):
+        """Detiene los threads del pool (se vuelve a crear si se usa de nuevo)"""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+# Instancia global del pool de contraseñas (login y registro)
+password_hasher = PasswordHasher.from_env()
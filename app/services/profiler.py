@@ -0,0 +1,163 @@
+# app/services/profiler.py
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+_APP_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) + os.sep
+
+
+class ProfilerBusy(RuntimeError):
+    """Ya hay un perfilado en curso en este proceso"""
+
+
+def _frame_label(code) -> str:
+    """Función y fichero de un frame, con la ruta relativa al proyecto o a site-packages"""
+    filename = code.co_filename
+    if filename.startswith(_APP_ROOT):
+        filename = filename[len(_APP_ROOT):]
+    elif "site-packages" + os.sep in filename:
+        filename = filename.split("site-packages" + os.sep, 1)[1]
+    else:
+        filename = os.path.basename(filename)
+    return f"{code.co_name} ({filename})"
+
+
+class SamplingProfiler:
+    """
+    Perfilador por muestreo de todos los threads del proceso (thread MQTT,
+    agregador, writer de alertas, event loop...). Un thread aparte lee la
+    pila de cada thread con sys._current_frames() cada `interval` segundos.
+    Sin perfilado en curso no hay thread ni hooks: el coste es nulo.
+
+    El resultado está en formato "collapsed stacks" (una línea por pila,
+    frames separados por ';' y el número de muestras), compatible con
+    flamegraph.pl, speedscope o inferno.
+    """
+
+    def __init__(self, interval: float = 0.005, max_seconds: float = 120.0):
+        """
+        Args:
+            interval: Segundos entre muestras (por defecto 5 ms)
+            max_seconds: Duración máxima de un perfilado
+        """
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+        self.running = False
+
+    def _sample(self, stacks: Counter, own_ident: int, names: Dict[int, str]):
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            name = names.get(ident)
+            if name is None:
+                # Thread nuevo desde la última muestra
+                names.update((t.ident, t.name) for t in threading.enumerate())
+                name = names.get(ident, f"thread-{ident}")
+            labels.append(name.replace(";", "_").replace(" ", "_"))
+            stacks[";".join(reversed(labels))] += 1
+
+    def profile(self, seconds: float) -> str:
+        """
+        Muestrea todos los threads durante `seconds` segundos (bloquea).
+
+        Args:
+            seconds: Duración del perfilado (limitada a max_seconds)
+
+        Returns:
+            Pilas en formato collapsed, de la más frecuente a la menos
+
+        Raises:
+            ProfilerBusy: Si ya hay un perfilado en curso
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("Ya hay un perfilado en curso")
+        try:
+            self.running = True
+            seconds = max(0.0, min(seconds, self.max_seconds))
+            stacks: Counter = Counter()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            own_ident = threading.get_ident()
+            samples = 0
+            deadline = time.monotonic() + seconds
+            logger.info(f"🔬 Perfilando {seconds:g}s (muestra cada {self.interval * 1000:g} ms)")
+            while time.monotonic() < deadline:
+                self._sample(stacks, own_ident, names)
+                samples += 1
+                time.sleep(self.interval)
+            logger.info(f"🔬 Perfilado terminado: {samples} muestras, {len(stacks)} pilas distintas")
+            return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+        finally:
+            self.running = False
+            self._lock.release()
+
+    def profile_to_file(self, seconds: float, directory: Optional[str] = None) -> Optional[str]:
+        """
+        Perfila y guarda el resultado en un fichero .collapsed.
+
+        Args:
+            seconds: Duración del perfilado
+            directory: Carpeta de destino (por defecto AGRORETO_PROFILE_DIR o la actual)
+
+        Returns:
+            Ruta del fichero, o None si ya había un perfilado en curso
+        """
+        directory = directory or os.environ.get("AGRORETO_PROFILE_DIR", ".")
+        try:
+            collapsed = self.profile(seconds)
+        except ProfilerBusy:
+            logger.warning("⚠️ Ya hay un perfilado en curso, se ignora la petición")
+            return None
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(
+            directory, f"profile-{os.getpid()}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.collapsed"
+        )
+        # Escritura atómica: quien vigile la carpeta nunca ve un fichero a medias
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(collapsed)
+        os.replace(path + ".tmp", path)
+        logger.info(f"🔬 Perfil guardado en {path}")
+        return path
+
+    def install_signal_handler(self, signum: Optional[int] = None, seconds: Optional[float] = None) -> bool:
+        """
+        Perfila en background al recibir una señal (SIGUSR2 por defecto):
+        kill -USR2 <pid> deja un fichero .collapsed en AGRORETO_PROFILE_DIR.
+        Sólo se puede llamar desde el thread principal.
+
+        Args:
+            signum: Señal (por defecto SIGUSR2)
+            seconds: Duración (por defecto AGRORETO_PROFILE_SECONDS o 30)
+
+        Returns:
+            True si se ha instalado, False si la plataforma no tiene la señal
+        """
+        signum = signum if signum is not None else getattr(signal, "SIGUSR2", None)
+        if signum is None:
+            return False
+        seconds = seconds if seconds is not None else float(os.environ.get("AGRORETO_PROFILE_SECONDS", 30))
+
+        def handle(received, frame):
+            # El handler corre en el thread principal: el perfilado va aparte
+            threading.Thread(
+                target=self.profile_to_file, args=(seconds,), daemon=True, name="Profiler-Thread",
+            ).start()
+
+        signal.signal(signum, handle)
+        return True
+
+
+# Instancia global del perfilador
+profiler = SamplingProfiler()
@@ -0,0 +1,417 @@
+# app/services/query_tracking.py
+import contextlib
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter as StatementCounter
+from typing import Dict, Iterator, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.services.metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+DB_QUERY_SECONDS = Histogram(
+    "agroreto_db_query_seconds",
+    "Latencia de las consultas SQL por punto de llamada (modulo:funcion)",
+    ["call_site"],
+)
+SCOPE_QUERIES = Counter(
+    "agroreto_scope_queries_total",
+    "Consultas SQL por evento de Reflex o ruta de la API",
+    ["scope"],
+)
+SCOPE_QUERY_SECONDS = Counter(
+    "agroreto_scope_query_seconds_total",
+    "Tiempo total en consultas SQL por evento de Reflex o ruta de la API",
+    ["scope"],
+)
+SCOPE_QUERIES_PER_RUN = Histogram(
+    "agroreto_scope_queries_per_run",
+    "Consultas SQL en cada ejecución de un evento o ruta (un N+1 desplaza la distribución)",
+    ["scope"],
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100, 250),
+)
+SLOW_QUERIES = Counter(
+    "agroreto_slow_queries_total",
+    "Consultas SQL más lentas que AGRORETO_SLOW_QUERY_MS por evento, ruta o punto de llamada",
+    ["site"],
+)
+
+# Prefijo del plan de ejecución por dialecto
+EXPLAIN_PREFIXES = {
+    "sqlite": "EXPLAIN QUERY PLAN ",
+    "postgresql": "EXPLAIN ",
+    "mysql": "EXPLAIN ",
+}
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Un evento o ruta ha hecho más consultas SQL que su presupuesto (típicamente un N+1)"""
+
+
+class QueryScope:
+    """
+    Consultas SQL de una unidad de trabajo (evento de Reflex, ruta de la API o
+    bloque de un test): número, tiempo total y sentencias repetidas.
+    """
+
+    def __init__(self, name: str, budget: Optional[int] = None, strict: bool = False):
+        """
+        Args:
+            name: Nombre del evento o ruta (etiqueta de las métricas)
+            budget: Máximo de consultas permitidas (None = sin límite)
+            strict: Lanzar QueryBudgetExceeded al superarlo en lugar de avisar en el log
+        """
+        self.name = name
+        self.budget = budget
+        self.strict = strict
+        self.queries = 0
+        self.seconds = 0.0
+        self.statements: StatementCounter = StatementCounter()
+        # Token de _current_scope cuando lo abre el middleware de Reflex
+        self._token: Optional[contextvars.Token] = None
+
+    def record(self, statement: str, seconds: float):
+        self.queries += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+
+    def over_budget(self) -> bool:
+        return self.budget is not None and self.queries > self.budget
+
+    def describe(self) -> str:
+        """Resumen con las sentencias más repetidas (la firma de un N+1)"""
+        repeated = "; ".join(
+            f"{count}x {' '.join(statement.split())[:120]}"
+            for statement, count in self.statements.most_common(3)
+        )
+        return (f"{self.name}: {self.queries} consultas en {self.seconds * 1000:.1f} ms "
+                f"(presupuesto {self.budget}). Más repetidas: {repeated}")
+
+    def finish(self):
+        """Registra las métricas del scope y comprueba el presupuesto"""
+        if self.queries:
+            SCOPE_QUERIES.labels(self.name).inc(self.queries)
+            SCOPE_QUERY_SECONDS.labels(self.name).inc(self.seconds)
+        SCOPE_QUERIES_PER_RUN.labels(self.name).observe(self.queries)
+        if self.over_budget():
+            if self.strict:
+                raise QueryBudgetExceeded(self.describe())
+            logger.warning(f"⚠️ Presupuesto de consultas superado en {self.describe()}")
+
+
+_current_scope: contextvars.ContextVar[Optional[QueryScope]] = contextvars.ContextVar(
+    "agroreto_query_scope", default=None
+)
+
+
+def current_scope() -> Optional[QueryScope]:
+    """Scope activo en este contexto (hereda en asyncio.to_thread y en tareas nuevas)"""
+    return _current_scope.get()
+
+
+def _default_budget() -> Optional[int]:
+    budget = int(os.environ.get("AGRORETO_QUERY_BUDGET", 0))
+    return budget or None
+
+
+def _strict_budget() -> bool:
+    return os.environ.get("AGRORETO_QUERY_BUDGET_STRICT", "").lower() in ("1", "true", "yes")
+
+
+@contextlib.contextmanager
+def track_queries(name: str, budget: Optional[int] = None, strict: Optional[bool] = None) -> Iterator[QueryScope]:
+    """
+    Atribuye al scope `name` las consultas SQL del bloque.
+
+    Args:
+        name: Nombre del evento o ruta
+        budget: Máximo de consultas (por defecto AGRORETO_QUERY_BUDGET; 0 = sin límite)
+        strict: Fallar al superar el presupuesto (por defecto AGRORETO_QUERY_BUDGET_STRICT)
+
+    Returns:
+        Context manager que devuelve el QueryScope
+    """
+    scope = QueryScope(
+        name,
+        budget=_default_budget() if budget is None else budget,
+        strict=_strict_budget() if strict is None else strict,
+    )
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    except BaseException:
+        _current_scope.reset(token)
+        raise
+    _current_scope.reset(token)
+    scope.finish()
+
+
+def query_budget(max_queries: int, name: str = "test") -> "contextlib.AbstractContextManager[QueryScope]":
+    """
+    Falla si el bloque hace más de max_queries consultas. Pensado para que
+    los tests detecten la vuelta de un patrón N+1.
+
+    Args:
+        max_queries: Máximo de consultas permitidas
+        name: Nombre del scope en el mensaje de error
+
+    Returns:
+        Context manager que lanza QueryBudgetExceeded al salir si se supera
+    """
+    return track_queries(name, budget=max_queries, strict=True)
+
+
+def tracked(name: Optional[str] = None, budget: Optional[int] = None):
+    """
+    Decorador que atribuye las consultas de cada llamada a un scope (funciones, corutinas
+    y generadores asíncronos).
+
+    Args:
+        name: Nombre del scope (por defecto modulo:funcion)
+        budget: Máximo de consultas por llamada
+    """
+    def decorator(fn):
+        scope_name = name or f"{fn.__module__}:{fn.__qualname__}"
+        if inspect.isasyncgenfunction(fn):
+            # Handlers de Reflex que encadenan eventos con yield
+            @functools.wraps(fn)
+            async def async_gen_wrapper(*args, **kwargs):
+                with track_queries(scope_name, budget):
+                    async for item in fn(*args, **kwargs):
+                        yield item
+            return async_gen_wrapper
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with track_queries(scope_name, budget):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with track_queries(scope_name, budget):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# --- Integración con Reflex y con la API -------------------------------------
+
+def event_scope_name(event_name: str) -> str:
+    """
+    Nombre corto de un evento de Reflex.
+
+    Args:
+        event_name: Nombre completo (p. ej. "reflex___state____state.app___states___dashboard_state____dashboard_state.load_dashboard_stats")
+
+    Returns:
+        Estado y handler (p. ej. "dashboard_state.load_dashboard_stats")
+    """
+    state_path, _, handler = event_name.rpartition(".")
+    state = state_path.rpartition(".")[2].rpartition("____")[2]
+    return f"{state}.{handler}" if state else handler
+
+
+def _is_background(state, event) -> bool:
+    """Si el evento lo atiende un handler background=True"""
+    try:
+        _, handler = state._get_event_handler(event)
+    except Exception:
+        return False
+    return bool(getattr(handler, "is_background", False))
+
+
+class QueryTrackingMiddleware:
+    """
+    Middleware de Reflex: abre un scope de consultas al empezar cada evento y
+    lo cierra con su última actualización. Cada evento se procesa en su propia
+    tarea, así que el scope no se mezcla con otros eventos.
+
+    Los handlers background=True no pasan por el postprocess del evento que
+    los lanza: el middleware no les abre scope y se instrumentan con tracked().
+    """
+
+    async def preprocess(self, app, state, event):
+        if _is_background(state, event):
+            return None
+        scope = QueryScope(event_scope_name(event.name), budget=_default_budget(), strict=_strict_budget())
+        scope._token = _current_scope.set(scope)
+        return None
+
+    async def postprocess(self, app, state, event, update):
+        scope = _current_scope.get()
+        if scope is None or scope._token is None or not getattr(update, "final", True):
+            return update
+        try:
+            _current_scope.reset(scope._token)
+        except ValueError:
+            # Token de otro contexto: al menos no dejar el scope activo
+            _current_scope.set(None)
+        scope._token = None
+        try:
+            scope.finish()
+        except QueryBudgetExceeded as e:
+            # En un evento ya no se puede fallar: el presupuesto estricto es para los tests
+            logger.error(f"❌ {e}")
+        return update
+
+
+class QueryTrackingASGIMiddleware:
+    """Middleware ASGI de la API: un scope por petición, con el patrón de la ruta como nombre"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        query_scope = QueryScope(
+            f"{scope['method']} (sin ruta)", budget=_default_budget(), strict=_strict_budget(),
+        )
+        token = _current_scope.set(query_scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current_scope.reset(token)
+            route = scope.get("route")
+            if route is not None:
+                query_scope.name = f"{scope['method']} {route.path}"
+            try:
+                query_scope.finish()
+            except QueryBudgetExceeded as e:
+                logger.error(f"❌ {e}")
+
+
+# --- Listeners del Engine ------------------------------------------------------
+
+_APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+# Módulos de instrumentación: sus frames nunca son el punto de llamada
+_SKIPPED_FILES = {
+    os.path.abspath(__file__),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "metrics.py"),
+}
+# Etiqueta por objeto de código ("" = no es de la app): recorrer la pila cuesta
+# una búsqueda en un dict por frame
+_call_site_labels: Dict[object, str] = {}
+
+
+def _call_site() -> str:
+    """Primera función de la app (fuera de SQLAlchemy y de la instrumentación) en la pila"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        code = frame.f_code
+        label = _call_site_labels.get(code)
+        if label is None:
+            filename = code.co_filename
+            if filename.startswith(_APP_DIR) and filename not in _SKIPPED_FILES:
+                module = filename[len(_APP_DIR):].rsplit(".", 1)[0].replace(os.sep, ".")
+                label = f"app.{module}:{code.co_name}"
+            else:
+                label = ""
+            _call_site_labels[code] = label
+        if label:
+            return label
+        frame = frame.f_back
+    return "other"
+
+
+class SlowQueryLog:
+    """
+    Registra en el log las consultas más lentas que un umbral, con sus
+    parámetros y el plan de ejecución (EXPLAIN), y guarda las últimas.
+    """
+
+    def __init__(self, threshold_ms: float = 250.0, explain: bool = True, keep: int = 50):
+        """
+        Args:
+            threshold_ms: Umbral en milisegundos (0 = desactivado)
+            explain: Obtener el plan de las SELECT lentas
+            keep: Número de consultas lentas recientes que se conservan
+        """
+        self.threshold = threshold_ms / 1000
+        self.explain = explain
+        self.keep = keep
+        self.recent = []
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "SlowQueryLog":
+        """Configura el log con AGRORETO_SLOW_QUERY_MS y AGRORETO_SLOW_QUERY_EXPLAIN"""
+        return cls(
+            threshold_ms=float(os.environ.get("AGRORETO_SLOW_QUERY_MS", 250)),
+            explain=os.environ.get("AGRORETO_SLOW_QUERY_EXPLAIN", "1").lower() not in ("0", "false", "no"),
+        )
+
+    def _plan(self, conn, cursor, statement: str, parameters) -> Optional[str]:
+        prefix = EXPLAIN_PREFIXES.get(conn.dialect.name)
+        if not self.explain or prefix is None or not statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            return None
+        try:
+            # Cursor DBAPI aparte: no vuelve a pasar por los listeners del Engine
+            explain_cursor = cursor.connection.cursor()
+            try:
+                explain_cursor.execute(prefix + statement, parameters)
+                return " | ".join(" ".join(str(col) for col in row) for row in explain_cursor.fetchall())
+            finally:
+                explain_cursor.close()
+        except Exception as e:
+            logger.debug(f"⚠️ No se pudo obtener el plan: {e}")
+            return None
+
+    def check(self, conn, cursor, statement: str, parameters, executemany: bool,
+              seconds: float, site: str):
+        """Registra la consulta si supera el umbral"""
+        if not self.threshold or seconds < self.threshold:
+            return
+        plan = None if executemany else self._plan(conn, cursor, statement, parameters)
+        entry = {
+            "site": site,
+            "ms": round(seconds * 1000, 1),
+            "statement": " ".join(statement.split()),
+            "parameters": repr(parameters)[:500],
+            "plan": plan,
+        }
+        with self.lock:
+            self.recent.append(entry)
+            del self.recent[:-self.keep]
+        SLOW_QUERIES.labels(site).inc()
+        logger.warning(
+            f"🐢 Consulta lenta ({entry['ms']} ms) en {site}: {entry['statement']} "
+            f"| parámetros={entry['parameters']} | plan={plan}"
+        )
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._agroreto_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_agroreto_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    call_site = _call_site()
+    DB_QUERY_SECONDS.labels(call_site).observe(elapsed)
+    scope = _current_scope.get()
+    if scope is not None:
+        scope.record(statement, elapsed)
+    slow_query_log.check(conn, cursor, statement, parameters, executemany, elapsed,
+                         scope.name if scope is not None else call_site)
+
+
+# Instancia global del log de consultas lentas
+slow_query_log = SlowQueryLog.from_env()
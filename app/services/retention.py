@@ -0,0 +1,422 @@
+# app/services/retention.py
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, insert, text
+from sqlmodel import Session, select
+
+from app.models import Alert, AlertArchive, SensorData
+from app.services.cold_archive import ColdArchive, cold_archive
+from app.utils import engine
+
+logger = logging.getLogger(__name__)
+
+# Marca de los registros compactados a una media por hora
+HOURLY_RESOLUTION = "hourly"
+_HOURLY_MARKER = f'"resolution": "{HOURLY_RESOLUTION}"'
+
+_ARCHIVED_COLUMNS = (
+    "id", "sensor_id", "timestamp", "type", "message", "acknowledged", "created_at",
+    "last_seen", "peak_value", "occurrences", "closed_at",
+)
+
+
+@dataclass
+class RetentionReport:
+    """Resultado de una ejecución de la retención"""
+    started_at: datetime = field(default_factory=datetime.now)
+    duration_seconds: float = 0.0
+    compacted_rows: int = 0
+    hourly_rows: int = 0
+    deleted_rows: int = 0
+    cold_rows: int = 0
+    cold_files: int = 0
+    expired_files: int = 0
+    archived_alerts: int = 0
+    analyzed: bool = False
+    vacuumed: bool = False
+    size_before: Optional[int] = None
+    size_after: Optional[int] = None
+
+    @property
+    def reclaimed_bytes(self) -> Optional[int]:
+        if self.size_before is None or self.size_after is None:
+            return None
+        return self.size_before - self.size_after
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["started_at"] = self.started_at.isoformat()
+        data["reclaimed_bytes"] = self.reclaimed_bytes
+        return data
+
+
+def _summary(row: SensorData) -> dict:
+    """Resumen JSON de un registro agregado (las lecturas sueltas cuentan como una muestra)"""
+    try:
+        summary = json.loads(row.raw)
+    except (TypeError, ValueError):
+        summary = None
+    if not isinstance(summary, dict):
+        return {"samples_count": 1, "avg": row.value, "min": row.value, "max": row.value}
+    return summary
+
+
+class RetentionJob:
+    """
+    Retención y compactación de SensorData y Alert.
+
+    En cada ejecución:
+    - Los registros más antiguos que hourly_days se borran (de la BD y del
+      archivo frío).
+    - Las medias por intervalo más antiguas que interval_days se compactan en
+      una media por hora (combinando muestras, media, min y max).
+    - Los meses completos más antiguos que cold_days se exportan al archivo
+      frío (app/services/cold_archive.py) y salen de la BD.
+    - Las alertas confirmadas y cerradas hace más de alert_days se mueven a
+      alertarchive.
+    - Se actualizan las estadísticas del planificador (ANALYZE) y se hace
+      VACUUM si el espacio libre supera vacuum_free_ratio.
+
+    Todo se hace en lotes de chunk_size filas, cada uno en su propia
+    transacción, para no bloquear las escrituras de la ingesta.
+    """
+
+    def __init__(self, interval_days: int = 30, hourly_days: int = 365, alert_days: int = 90,
+                 chunk_size: int = 2000, pause_seconds: float = 0.05, vacuum_free_ratio: float = 0.2,
+                 every_hours: float = 24.0, cold_days: int = 0,
+                 archive: Optional[ColdArchive] = None):
+        """
+        Inicializa el job de retención.
+
+        Args:
+            interval_days: Días que se conservan las medias por intervalo (0 = no compactar)
+            hourly_days: Días que se conserva cualquier dato de sensores (0 = para siempre)
+            alert_days: Días tras su cierre que se conservan las alertas confirmadas (0 = no archivar)
+            chunk_size: Filas por lote (y por transacción)
+            pause_seconds: Pausa entre lotes para dejar paso a otras escrituras
+            vacuum_free_ratio: Fracción de páginas libres a partir de la que se hace VACUUM
+            every_hours: Cada cuántas horas se ejecuta en background
+            cold_days: Días en la BD antes de pasar al archivo frío (0 = no archivar)
+            archive: Archivo frío (por defecto la instancia global)
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size debe ser >= 1")
+        self.interval_days = interval_days
+        self.hourly_days = hourly_days
+        self.alert_days = alert_days
+        self.chunk_size = chunk_size
+        self.pause_seconds = pause_seconds
+        self.vacuum_free_ratio = vacuum_free_ratio
+        self.every_hours = every_hours
+        self.cold_days = cold_days
+        self.archive = archive or cold_archive
+        self.last_report: Optional[RetentionReport] = None
+        self.running = False
+        self.thread = None
+        self._stop_event = threading.Event()
+        self._run_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "RetentionJob":
+        """
+        Crea el job con la configuración de las variables de entorno
+        AGRORETO_RETENTION_INTERVAL_DAYS, AGRORETO_RETENTION_HOURLY_DAYS,
+        AGRORETO_RETENTION_ALERT_DAYS, AGRORETO_RETENTION_COLD_DAYS,
+        AGRORETO_RETENTION_CHUNK y AGRORETO_RETENTION_EVERY_HOURS.
+        """
+        return cls(
+            interval_days=int(os.environ.get("AGRORETO_RETENTION_INTERVAL_DAYS", 30)),
+            hourly_days=int(os.environ.get("AGRORETO_RETENTION_HOURLY_DAYS", 365)),
+            alert_days=int(os.environ.get("AGRORETO_RETENTION_ALERT_DAYS", 90)),
+            chunk_size=int(os.environ.get("AGRORETO_RETENTION_CHUNK", 2000)),
+            every_hours=float(os.environ.get("AGRORETO_RETENTION_EVERY_HOURS", 24)),
+            cold_days=int(os.environ.get("AGRORETO_RETENTION_COLD_DAYS", 90)),
+        )
+
+    def _pause(self):
+        if self.pause_seconds > 0:
+            self._stop_event.wait(self.pause_seconds)
+
+    # --- SensorData -------------------------------------------------------
+
+    @staticmethod
+    def _merge(target: dict, summary: dict):
+        """Combina el resumen de un registro en el de su hora"""
+        count = summary.get("samples_count", 1)
+        total = target.get("samples_count", 0)
+        if total + count == 0:
+            return
+        target["avg"] = (target.get("avg", 0.0) * total + summary.get("avg", 0.0) * count) / (total + count)
+        target["samples_count"] = total + count
+        target["min"] = min(target.get("min", summary["min"]), summary["min"])
+        target["max"] = max(target.get("max", summary["max"]), summary["max"])
+        target["late_samples"] = target.get("late_samples", 0) + summary.get("late_samples", 0)
+        if summary.get("last_sample"):
+            target["last_sample"] = summary["last_sample"]
+
+    def _compact_chunk(self, cutoff: datetime) -> Tuple[int, int]:
+        """
+        Compacta un lote de medias por intervalo anteriores a cutoff.
+
+        Returns:
+            (registros compactados, registros horarios creados)
+        """
+        with Session(engine) as session:
+            rows = session.exec(
+                select(SensorData)
+                .where(SensorData.timestamp < cutoff, ~SensorData.raw.contains(_HOURLY_MARKER))
+                .order_by(SensorData.timestamp, SensorData.id)
+                .limit(self.chunk_size)
+            ).all()
+            if not rows:
+                return 0, 0
+
+            # Un registro horario por sensor y hora (índice único sensor_id, timestamp):
+            # las lecturas sueltas sin sensor_type se fusionan con las medias de su hora
+            groups: Dict[Tuple[int, datetime], List[SensorData]] = defaultdict(list)
+            for row in rows:
+                hour = row.timestamp.replace(minute=0, second=0, microsecond=0)
+                groups[(row.sensor_id, hour)].append(row)
+
+            # Horas ya compactadas en lotes anteriores: se fusionan, no se duplican
+            existing = {}
+            for row in session.exec(
+                select(SensorData).where(
+                    SensorData.sensor_id.in_({key[0] for key in groups}),
+                    SensorData.timestamp.in_({key[1] for key in groups}),
+                    SensorData.raw.contains(_HOURLY_MARKER),
+                )
+            ).all():
+                existing[(row.sensor_id, row.timestamp)] = row
+
+            # Borrar antes de crear las horas: la hora en punto coincide con el
+            # registro del primer intervalo (índice único sensor_id, timestamp)
+            summaries = {key: [_summary(row) for row in members] for key, members in groups.items()}
+            session.execute(delete(SensorData).where(SensorData.id.in_([row.id for row in rows])))
+
+            created = 0
+            for key, members in summaries.items():
+                sensor_id, hour = key
+                sensor_type = next((member["sensor_type"] for member in members if member.get("sensor_type")), None)
+                hourly = existing.get(key)
+                if hourly is None:
+                    hourly = SensorData(sensor_id=sensor_id, timestamp=hour, value=0.0, raw="")
+                    summary = {
+                        "aggregated": True,
+                        "resolution": HOURLY_RESOLUTION,
+                        "interval_minutes": 60,
+                        "sensor_type": sensor_type,
+                        "timestamp": hour.isoformat(),
+                    }
+                    created += 1
+                else:
+                    summary = _summary(hourly)
+                    summary["sensor_type"] = summary.get("sensor_type") or sensor_type
+                for member in members:
+                    self._merge(summary, member)
+                summary["compacted_rows"] = summary.get("compacted_rows", 0) + len(members)
+                hourly.value = round(summary["avg"], 2)
+                hourly.raw = json.dumps(summary)
+                session.add(hourly)
+
+            session.commit()
+            return len(rows), created
+
+    def compact_sensor_data(self, now: datetime, report: RetentionReport):
+        """Compacta en medias horarias las medias por intervalo más antiguas que interval_days"""
+        if self.interval_days <= 0:
+            return
+        cutoff = (now - timedelta(days=self.interval_days)).replace(minute=0, second=0, microsecond=0)
+        while not self._stop_event.is_set():
+            compacted, created = self._compact_chunk(cutoff)
+            if not compacted:
+                break
+            report.compacted_rows += compacted
+            report.hourly_rows += created
+            self._pause()
+
+    def _delete_chunked(self, model, *conditions) -> int:
+        """Borra las filas que cumplen las condiciones en lotes, una transacción por lote"""
+        deleted = 0
+        while not self._stop_event.is_set():
+            with Session(engine) as session:
+                ids = session.exec(select(model.id).where(*conditions).limit(self.chunk_size)).all()
+                if not ids:
+                    break
+                session.execute(delete(model).where(model.id.in_(ids)))
+                session.commit()
+            deleted += len(ids)
+            self._pause()
+        return deleted
+
+    def expire_sensor_data(self, now: datetime, report: RetentionReport):
+        """Borra los datos de sensores más antiguos que hourly_days"""
+        if self.hourly_days <= 0:
+            return
+        cutoff = now - timedelta(days=self.hourly_days)
+        report.deleted_rows += self._delete_chunked(SensorData, SensorData.timestamp < cutoff)
+        report.expired_files += self.archive.expire(cutoff)
+
+    def export_cold(self, now: datetime, report: RetentionReport):
+        """Pasa al archivo frío los meses completos más antiguos que cold_days"""
+        if self.cold_days <= 0:
+            return
+        rows, files = self.archive.export(now - timedelta(days=self.cold_days), chunk_size=self.chunk_size)
+        report.cold_rows += rows
+        report.cold_files += files
+
+    # --- Alert ------------------------------------------------------------
+
+    def archive_alerts(self, now: datetime, report: RetentionReport):
+        """Mueve a alertarchive las alertas confirmadas y cerradas hace más de alert_days"""
+        if self.alert_days <= 0:
+            return
+        cutoff = now - timedelta(days=self.alert_days)
+        columns = [getattr(Alert, name) for name in _ARCHIVED_COLUMNS]
+        while not self._stop_event.is_set():
+            with Session(engine) as session:
+                ids = session.exec(
+                    select(Alert.id)
+                    .where(Alert.acknowledged == True, Alert.closed_at.is_not(None), Alert.closed_at < cutoff)
+                    .order_by(Alert.id)
+                    .limit(self.chunk_size)
+                ).all()
+                if not ids:
+                    break
+                # INSERT ... SELECT y DELETE en la misma transacción: nunca se pierde ni se duplica
+                session.execute(
+                    insert(AlertArchive).from_select(
+                        list(_ARCHIVED_COLUMNS),
+                        select(*columns).where(Alert.id.in_(ids)),
+                    )
+                )
+                session.execute(delete(Alert).where(Alert.id.in_(ids)))
+                session.commit()
+            report.archived_alerts += len(ids)
+            self._pause()
+
+    # --- Mantenimiento ----------------------------------------------------
+
+    def _database_size(self) -> Optional[int]:
+        """Tamaño de la BD en bytes (None si el backend no lo expone)"""
+        try:
+            with engine.connect() as connection:
+                if engine.dialect.name == "sqlite":
+                    page_count = connection.exec_driver_sql("PRAGMA page_count").scalar()
+                    page_size = connection.exec_driver_sql("PRAGMA page_size").scalar()
+                    return page_count * page_size
+                if engine.dialect.name == "postgresql":
+                    return connection.execute(text("SELECT pg_database_size(current_database())")).scalar()
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo medir el tamaño de la BD: {e}")
+        return None
+
+    def _needs_vacuum(self) -> bool:
+        if engine.dialect.name != "sqlite":
+            # En PostgreSQL VACUUM no bloquea la tabla: se hace siempre
+            return engine.dialect.name == "postgresql"
+        with engine.connect() as connection:
+            page_count = connection.exec_driver_sql("PRAGMA page_count").scalar() or 0
+            free_pages = connection.exec_driver_sql("PRAGMA freelist_count").scalar() or 0
+        return page_count > 0 and free_pages / page_count >= self.vacuum_free_ratio
+
+    def maintain(self, report: RetentionReport):
+        """Actualiza estadísticas (ANALYZE) y recupera espacio libre (VACUUM) si compensa"""
+        dialect = engine.dialect.name
+        if dialect not in ("sqlite", "postgresql"):
+            logger.info(f"ℹ️ Mantenimiento no soportado para {dialect}")
+            return
+        try:
+            vacuum = self._needs_vacuum()
+            # VACUUM no puede ejecutarse dentro de una transacción
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                if dialect == "postgresql":
+                    for table in (SensorData.__tablename__, Alert.__tablename__, AlertArchive.__tablename__):
+                        connection.exec_driver_sql(f"VACUUM (ANALYZE) {table}")
+                    report.analyzed = report.vacuumed = True
+                    return
+                if vacuum:
+                    connection.exec_driver_sql("VACUUM")
+                    report.vacuumed = True
+                connection.exec_driver_sql("ANALYZE")
+                report.analyzed = True
+        except Exception as e:
+            logger.exception(f"❌ Error en el mantenimiento de la BD: {e}")
+
+    # --- Ejecución ----------------------------------------------------------
+
+    def run(self, now: Optional[datetime] = None) -> RetentionReport:
+        """
+        Ejecuta una pasada completa de retención.
+
+        Args:
+            now: Momento de referencia para las antigüedades (por defecto ahora)
+
+        Returns:
+            Informe con filas compactadas, borradas y archivadas y espacio recuperado
+        """
+        now = now or datetime.now()
+        report = RetentionReport(started_at=now)
+        started = time.perf_counter()
+        with self._run_lock:
+            if not self.running:
+                # Pasada manual (p. ej. tras stop()): no debe quedar cancelada de antemano
+                self._stop_event.clear()
+            report.size_before = self._database_size()
+            # Primero lo que caduca: no tiene sentido compactar filas que se van a borrar
+            for step in (self.expire_sensor_data, self.compact_sensor_data, self.export_cold, self.archive_alerts):
+                try:
+                    step(now, report)
+                except Exception as e:
+                    logger.exception(f"❌ Error en la retención ({step.__name__}): {e}")
+            self.maintain(report)
+            report.size_after = self._database_size()
+        report.duration_seconds = time.perf_counter() - started
+        self.last_report = report
+
+        reclaimed = report.reclaimed_bytes
+        logger.info(
+            f"🧹 Retención: {report.compacted_rows} medias compactadas en {report.hourly_rows} horarias, "
+            f"{report.deleted_rows} registros borrados, {report.cold_rows} al archivo frío "
+            f"({report.cold_files} ficheros), {report.archived_alerts} alertas archivadas"
+            + (f", {reclaimed / 1024:.0f} KiB recuperados" if reclaimed is not None else "")
+            + f" ({report.duration_seconds:.1f}s)"
+        )
+        return report
+
+    def _retention_loop(self):
+        interval = self.every_hours * 3600
+        while not self._stop_event.wait(interval):
+            self.run()
+
+    def start(self):
+        """Inicia la retención periódica en background (la primera pasada tras every_hours)"""
+        if self.running or self.every_hours <= 0:
+            return
+        self.running = True
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._retention_loop, daemon=True, name="Retention-Thread")
+        self.thread.start()
+        logger.info(f"✅ Retención de datos programada cada {self.every_hours:g}h")
+
+    def stop(self):
+        """Detiene la retención periódica (interrumpe la pasada en curso entre lotes)"""
+        if not self.running:
+            return
+        self.running = False
+        self._stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=10)
+            self.thread = None
+
+
+# Instancia global del job de retención (configuración según AGRORETO_RETENTION_*)
+retention_job = RetentionJob.from_env()
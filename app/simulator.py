@@ -0,0 +1,124 @@
+"""
+Simulador de flota de dispositivos MAIoTA para pruebas de carga locales.
+
+Emite frames CIoTA válidos para miles de dispositivos virtuales, con jitter,
+episodios fuera de rango y cortes, contra un broker MQTT local (Mosquitto)
+o directamente en proceso para medir la capacidad de ingesta de extremo a
+extremo sin red.
+
+Uso:
+    python -m app.simulator --register --devices 2000           # alta de sensores SIM-xxxxx
+    python -m app.simulator --devices 2000 --rate 1 --duration 60 --broker localhost
+    python -m app.simulator --in-process --devices 2000 --frames 100000
+"""
+import argparse
+import json
+import logging
+import sys
+
+from sqlmodel import Session, select
+
+from app.logging_config import configure_logging
+from app.models import User
+from app.services.fleet_simulator import FleetSimulator, MqttPublisher, register_fleet, run_in_process
+from app.utils import engine, init_database
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """Parsea los argumentos de línea de comandos"""
+    parser = argparse.ArgumentParser(
+        prog="python -m app.simulator",
+        description="Simulador de dispositivos MAIoTA (generador de carga MQTT)",
+    )
+    parser.add_argument("--devices", type=int, default=100, help="Dispositivos virtuales (por defecto 100)")
+    parser.add_argument("--rate", type=float, default=0.2,
+                        help="Frames por segundo de cada dispositivo (por defecto 0.2)")
+    parser.add_argument("--jitter", type=float, default=0.1,
+                        help="Variación relativa del periodo entre frames (por defecto 0.1)")
+    parser.add_argument("--duration", type=float, default=None, help="Segundos a simular")
+    parser.add_argument("--frames", type=int, default=None, help="Número máximo de frames")
+    parser.add_argument("--episodes", type=float, default=0.001,
+                        help="Probabilidad por frame de un episodio fuera de rango")
+    parser.add_argument("--dropouts", type=float, default=0.0005,
+                        help="Probabilidad por frame de un corte de conexión")
+    parser.add_argument("--topic-prefix", default="agroreto/sim", help="Prefijo de los topics")
+    parser.add_argument("--seed", type=int, default=None, help="Semilla para reproducir la secuencia")
+    parser.add_argument("--broker", default="localhost", help="Broker MQTT (por defecto localhost)")
+    parser.add_argument("--port", type=int, default=1883, help="Puerto del broker (por defecto 1883)")
+    parser.add_argument("--register", action="store_true",
+                        help="Dar de alta en la BD un sensor por dispositivo y salir")
+    parser.add_argument("--in-process", action="store_true",
+                        help="Registrar la flota y entregar los frames en proceso a la ingesta (broker en memoria)")
+    parser.add_argument("--fast", action="store_true",
+                        help="Ignorar el reloj real y generar lo más rápido posible")
+    parser.add_argument("--log-level", default="WARNING", help="Nivel de logging (por defecto WARNING)")
+    return parser.parse_args(argv)
+
+
+def _register(simulator: FleetSimulator) -> int:
+    """
+    Registra los sensores de la flota a nombre del primer agricultor.
+
+    Returns:
+        Número de sensores de la flota (0 si no hay agricultor)
+    """
+    with Session(engine) as session:
+        owner = session.exec(select(User).where(User.role == "farmer")).first()
+        if owner is None:
+            logging.getLogger(__name__).error("❌ No hay ningún agricultor al que asignar la parcela")
+            return 0
+        return len(register_fleet(session, simulator, owner.id))
+
+
+def main(argv=None) -> int:
+    """Ejecuta el simulador según los argumentos"""
+    args = parse_args(argv)
+    configure_logging(level=args.log_level)
+    if args.duration is None and args.frames is None and (args.in_process or args.fast):
+        logging.getLogger(__name__).error("❌ Indica --duration o --frames")
+        return 2
+
+    try:
+        simulator = FleetSimulator(
+            publish=lambda topic, payload: None,
+            devices=args.devices, rate=args.rate, jitter=args.jitter,
+            episode_probability=args.episodes, dropout_probability=args.dropouts,
+            topic_prefix=args.topic_prefix, seed=args.seed,
+        )
+    except ValueError as e:
+        logging.getLogger(__name__).error(f"❌ {e}")
+        return 2
+
+    if args.register or args.in_process:
+        init_database()
+        registered = _register(simulator)
+        if not registered:
+            return 1
+        if args.register:
+            print(json.dumps({"registered": registered, "topic_prefix": args.topic_prefix}))
+            return 0
+
+    if args.in_process:
+        report = run_in_process(simulator, duration=args.duration, max_frames=args.frames,
+                                realtime=not args.fast)
+        print(json.dumps(report, indent=2))
+        return 0
+
+    publisher = MqttPublisher(args.broker, args.port)
+    simulator.publish = publisher
+    try:
+        stats = simulator.run(duration=args.duration, max_frames=args.frames, realtime=not args.fast)
+    except KeyboardInterrupt:
+        stats = simulator.stats
+    finally:
+        publisher.close()
+    print(json.dumps({
+        "devices": args.devices, "frames_sent": stats.sent, "frames_skipped": stats.skipped,
+        "episodes": stats.episodes, "dropouts": stats.dropouts, "errors": stats.errors,
+        "seconds": round(stats.elapsed, 3), "frames_per_second": round(stats.rate, 1),
+    }, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
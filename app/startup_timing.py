@@ -0,0 +1,86 @@
+"""
+Medición del tiempo de arranque (importación y puesta en marcha).
+
+Cada proceso registra fases con startup_timer.mark() y, al quedar listo,
+escribe un informe. Con AGRORETO_STARTUP_REPORT=ruta.jsonl el informe se
+añade como una línea JSON al fichero, etiquetado con AGRORETO_RELEASE, para
+comparar arranques en frío y recargas entre versiones.
+Para el desglose por módulo: python -X importtime -c "import app.app"
+"""
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """Cronómetro de fases de arranque de un proceso"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.phases: dict = {}
+        self.reported = False
+
+    def mark(self, phase: str) -> float:
+        """
+        Cierra una fase: registra el tiempo transcurrido desde la marca anterior.
+
+        Args:
+            phase: Nombre de la fase (ej. "imports", "app_setup")
+
+        Returns:
+            Duración de la fase en segundos
+        """
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self.phases[phase] = round(self.phases.get(phase, 0.0) + elapsed, 4)
+        self._last = now
+        return elapsed
+
+    def report(self, component: str) -> dict:
+        """Construye el informe de arranque del proceso"""
+        return {
+            "component": component,
+            "release": os.environ.get("AGRORETO_RELEASE", "dev"),
+            "timestamp": datetime.now().isoformat(),
+            "pid": os.getpid(),
+            "python": sys.version.split()[0],
+            "total_seconds": round(time.perf_counter() - self.started, 4),
+            "phases": dict(self.phases),
+        }
+
+    def write_report(self, component: str, path: Optional[str] = None) -> dict:
+        """
+        Registra el informe en el log y, si hay ruta configurada, lo añade
+        como una línea JSON. Sólo se escribe una vez por proceso.
+
+        Args:
+            component: Proceso que arranca ("web" o "ingest")
+            path: Fichero JSONL de destino (por defecto AGRORETO_STARTUP_REPORT)
+        """
+        report = self.report(component)
+        if self.reported:
+            return report
+        self.reported = True
+
+        phases = ", ".join(f"{name}={seconds:.2f}s" for name, seconds in report["phases"].items())
+        logger.info(f"⏱️ Arranque {component} en {report['total_seconds']:.2f}s ({phases})")
+
+        path = path or os.environ.get("AGRORETO_STARTUP_REPORT")
+        if path:
+            try:
+                with open(path, "a", encoding="utf-8") as report_file:
+                    report_file.write(json.dumps(report) + "\n")
+            except OSError as e:
+                logger.warning(f"⚠️ No se pudo escribir el informe de arranque en {path}: {e}")
+        return report
+
+
+# Instancia global: el origen es la primera importación de este módulo
+startup_timer = StartupTimer()
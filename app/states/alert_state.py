@@ -1,26 +1,57 @@
 # app/states/alert_state.py
 import reflex as rx
-from sqlmodel import Session, desc, select
+from sqlmodel import Session
 
-from app.models import Alert, Parcel, ParcelTechnician, Sensor
+from app.models import Alert
+from app.services.access_control import access_resolver
+from app.services.alert_queries import acknowledge_alerts, count_alerts, list_alerts
 from app.states.auth_state import AuthState
 from app.utils import engine
 
 
+PAGE_SIZE = 25
+
+
 class AlertState(rx.State):
     alerts: list[dict] = []
     filter_type: str = "all"
     show_history: bool = False
+    # Paginación en servidor
+    page: int = 0
+    total_alerts: int = 0
 
     @rx.event
-    def set_filter_type(self, value: str):
+    async def set_filter_type(self, value: str):
         self.filter_type = value
-        self.load_alerts()
+        self.page = 0
+        await self.load_alerts()
 
     @rx.event
-    def toggle_history(self, checked: bool):
+    async def toggle_history(self, checked: bool):
         self.show_history = checked
-        self.load_alerts()
+        self.page = 0
+        await self.load_alerts()
+
+    @rx.event
+    async def next_page(self):
+        if self.page + 1 < self.total_pages:
+            self.page += 1
+            await self.load_alerts()
+
+    @rx.event
+    async def prev_page(self):
+        if self.page > 0:
+            self.page -= 1
+            await self.load_alerts()
+
+    @rx.var
+    def total_pages(self) -> int:
+        """Número de páginas del listado actual (mínimo 1)"""
+        return max(1, (self.total_alerts + PAGE_SIZE - 1) // PAGE_SIZE)
+
+    @rx.var
+    def page_label(self) -> str:
+        return f"Página {self.page + 1} de {self.total_pages} ({self.total_alerts} alertas)"
 
     @rx.event
     async def load_alerts(self):
@@ -32,74 +63,46 @@ class AlertState(rx.State):
         
         if not user_id:
             self.alerts = []
+            self.total_alerts = 0
             return
         
         with Session(engine) as session:
-            # ✅ Determinar parcelas accesibles
-            if user_role == "farmer":
-                # Farmers ven todas las parcelas
-                accessible_parcels = session.exec(select(Parcel)).all()
-            else:
-                # Técnicos: parcelas propias + asignadas
-                assigned_parcel_ids = session.exec(
-                    select(ParcelTechnician.parcel_id).where(
-                        ParcelTechnician.user_id == user_id
-                    )
-                ).all()
-                
-                if assigned_parcel_ids:
-                    accessible_parcels = session.exec(
-                        select(Parcel).where(
-                            (Parcel.owner_id == user_id) | 
-                            (Parcel.id.in_(assigned_parcel_ids))
-                        )
-                    ).all()
-                else:
-                    accessible_parcels = session.exec(
-                        select(Parcel).where(Parcel.owner_id == user_id)
-                    ).all()
-            
-            parcel_ids = [p.id for p in accessible_parcels]
-            
-            if not parcel_ids:
-                self.alerts = []
-                return
-            
-            # ✅ Obtener sensores de parcelas accesibles
-            accessible_sensors = session.exec(
-                select(Sensor).where(Sensor.parcel_id.in_(parcel_ids))
-            ).all()
-            
-            sensor_ids = [s.id for s in accessible_sensors]
+            # ✅ Sensores accesibles (resolución cacheada)
+            sensor_ids = access_resolver.resolve(user_id, user_role, session=session).sensor_ids
             
             if not sensor_ids:
                 self.alerts = []
+                self.total_alerts = 0
                 return
             
-            # ✅ Consulta de alertas filtradas por sensores accesibles
-            query = select(Alert).where(Alert.sensor_id.in_(sensor_ids))
-            
-            if not self.show_history:
-                query = query.where(Alert.acknowledged == False)
+            # ✅ Filtros: sin historial sólo pendientes
+            acknowledged = None if self.show_history else False
+            self.total_alerts = count_alerts(session, sensor_ids, acknowledged, self.filter_type)
             
-            if self.filter_type != "all":
-                query = query.where(Alert.type == self.filter_type)
+            # Si el total ha bajado (p. ej. tras confirmar), volver a la última página válida
+            self.page = min(self.page, self.total_pages - 1)
             
-            query = query.order_by(desc(Alert.timestamp))
-            results = session.exec(query).all()
+            # ✅ Una sola consulta (JOIN con Sensor) y sólo la página visible
+            results = list_alerts(
+                session, sensor_ids, acknowledged, self.filter_type,
+                limit=PAGE_SIZE, offset=self.page * PAGE_SIZE,
+            )
             
             display_list = []
-            for a in results:
-                s = session.get(Sensor, a.sensor_id)
+            for a, sensor_code, sensor_type in results:
                 display_list.append({
                     "id": a.id,
-                    "sensor_code": s.id_code if s else "Desconocido",
-                    "sensor_type": s.type if s else "",
+                    "sensor_code": sensor_code,
+                    "sensor_type": sensor_type,
                     "type": a.type,
                     "message": a.message,
                     "timestamp": a.timestamp.strftime("%Y-%m-%d %H:%M"),
                     "acknowledged": a.acknowledged,
                     "color": "red" if a.type == "HIGH" else "amber",
+                    # Episodio: veces evaluado fuera de rango y si sigue activo
+                    "occurrences": a.occurrences or 1,
+                    "last_seen": (a.last_seen or a.timestamp).strftime("%Y-%m-%d %H:%M"),
+                    "ongoing": a.closed_at is None,
                 })
             
             self.alerts = display_list
@@ -128,50 +131,11 @@ class AlertState(rx.State):
             return
         
         with Session(engine) as session:
-            # ✅ Determinar sensores accesibles
-            if user_role == "farmer":
-                accessible_parcels = session.exec(select(Parcel)).all()
-            else:
-                assigned_parcel_ids = session.exec(
-                    select(ParcelTechnician.parcel_id).where(
-                        ParcelTechnician.user_id == user_id
-                    )
-                ).all()
-                
-                if assigned_parcel_ids:
-                    accessible_parcels = session.exec(
-                        select(Parcel).where(
-                            (Parcel.owner_id == user_id) | 
-                            (Parcel.id.in_(assigned_parcel_ids))
-                        )
-                    ).all()
-                else:
-                    accessible_parcels = session.exec(
-                        select(Parcel).where(Parcel.owner_id == user_id)
-                    ).all()
-            
-            parcel_ids = [p.id for p in accessible_parcels]
-            accessible_sensors = session.exec(
-                select(Sensor).where(Sensor.parcel_id.in_(parcel_ids))
-            ).all()
-            sensor_ids = [s.id for s in accessible_sensors]
-            
-            # ✅ Actualizar solo alertas de sensores accesibles
-            query = select(Alert).where(
-                (Alert.sensor_id.in_(sensor_ids)) & 
-                (Alert.acknowledged == False)
-            )
-            
-            if self.filter_type != "all":
-                query = query.where(Alert.type == self.filter_type)
-            
-            alerts_to_ack = session.exec(query).all()
-            count = len(alerts_to_ack)
-            
-            for alert in alerts_to_ack:
-                alert.acknowledged = True
-                session.add(alert)
+            # ✅ Determinar sensores accesibles (resolución cacheada)
+            sensor_ids = access_resolver.resolve(user_id, user_role, session=session).sensor_ids
             
+            # ✅ Un único UPDATE sobre las alertas pendientes de sensores accesibles
+            count = acknowledge_alerts(session, sensor_ids, alert_type=self.filter_type)
             session.commit()
         
         await self.load_alerts()
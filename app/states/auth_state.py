@@ -1,10 +1,13 @@
 import asyncio
 
 import reflex as rx
-from sqlmodel import select
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
 
 from app.models import User
-from app.utils import seed_database, verify_password
+from app.services.password_hashing import PasswordHasherBusy, password_hasher
+from app.services.query_tracking import tracked
+from app.utils import engine, init_database
 
 
 class AuthState(rx.State):
@@ -22,8 +25,13 @@ class AuthState(rx.State):
         self.is_loading = not self.is_loading
 
     @rx.event(background=True)
+    @tracked("auth_state.check_login")
     async def check_login(self, form_data: dict):
-        """Attempt to log the user in."""
+        """Attempt to log the user in.
+
+        bcrypt runs in the password pool, outside `async with self`: the state
+        lock is only held to read the form and to write the result.
+        """
         async with self:
             self.username = form_data.get("username", "")
             self.password = form_data.get("password", "")
@@ -32,32 +40,40 @@ class AuthState(rx.State):
                 return
             self.is_loading = True
             self.error_message = ""
-        await asyncio.sleep(0.8)
+            username, password = self.username, self.password
+        with Session(engine) as session:
+            user = session.exec(
+                select(User).where(User.username == username)
+            ).first()
+        try:
+            valid = user is not None and await password_hasher.verify(password, user.password_hash)
+        except PasswordHasherBusy:
+            async with self:
+                self.is_loading = False
+                self.error_message = "Demasiados inicios de sesión a la vez. Inténtalo de nuevo en unos segundos."
+            return
         async with self:
-            with rx.session() as session:
-                user = session.exec(
-                    select(User).where(User.username == self.username)
-                ).first()
-                if user and verify_password(self.password, user.password_hash):
-                    # Bloquear si el rol es "registered" (pendiente de aprobación)
-                    if user.role == "registered":
-                        self.is_loading = False
-                        self.error_message = "Tu cuenta está pendiente de aprobación del administrador. Por favor, espera a que se confirme tu acceso."
-                        return
-                    
-                    self.user_id = user.id
-                    self.user_role = user.role
-                    self.user_name = user.username
-                    self.is_loading = False
-                    self.password = ""
-                    return rx.redirect("/info")  
-                else:
-                    self.is_loading = False
-                    self.error_message = "Usuario o contraseña inválidos."
+            self.is_loading = False
+            if not valid:
+                self.error_message = "Usuario o contraseña inválidos."
+                return
+            # Bloquear si el rol es "registered" (pendiente de aprobación)
+            if user.role == "registered":
+                self.error_message = "Tu cuenta está pendiente de aprobación del administrador. Por favor, espera a que se confirme tu acceso."
+                return
+            self.user_id = user.id
+            self.user_role = user.role
+            self.user_name = user.username
+            self.password = ""
+            return rx.redirect("/info")
 
     @rx.event(background=True)
+    @tracked("auth_state.register_user")
     async def register_user(self, form_data: dict):
-        """Registrar un nuevo usuario con rol 'tech' por defecto."""
+        """Registrar un nuevo usuario con rol 'registered' (pendiente de aprobación).
+
+        El hash bcrypt se calcula en el pool de contraseñas, sin el lock del estado.
+        """
         async with self:
             username = form_data.get("username", "").strip()
             password = form_data.get("password", "")
@@ -85,35 +101,41 @@ class AuthState(rx.State):
             
             self.is_loading = True
         
-        await asyncio.sleep(0.5)
-        
-        async with self:
-            from app.utils import get_password_hash
-            
-            with rx.session() as session:
-                # Verificar si el usuario ya existe
+        try:
+            with Session(engine) as session:
+                # Verificar si el usuario ya existe (antes de gastar un hash)
                 existing_user = session.exec(
                     select(User).where(User.username == username)
                 ).first()
-                
-                if existing_user:
-                    self.is_loading = False
+            if existing_user:
+                async with self:
                     self.error_message = "El nombre de usuario ya está en uso."
-                    return
-                
+                return
+            
+            try:
+                password_hash = await password_hasher.hash(password)
+            except PasswordHasherBusy:
+                async with self:
+                    self.error_message = "Demasiados registros a la vez. Inténtalo de nuevo en unos segundos."
+                return
+            
+            with Session(engine) as session:
                 # Crear nuevo usuario con rol 'registered' (pendiente de aprobación)
-                new_user = User(
-                    username=username,
-                    password_hash=get_password_hash(password),
-                    role="registered"
-                )
-                
-                session.add(new_user)
-                session.commit()
-                session.refresh(new_user)
-                
-                self.is_loading = False
+                session.add(User(username=username, password_hash=password_hash, role="registered"))
+                try:
+                    session.commit()
+                except IntegrityError:
+                    # Otro registro con el mismo nombre entre la comprobación y el commit
+                    session.rollback()
+                    async with self:
+                        self.error_message = "El nombre de usuario ya está en uso."
+                    return
+            
+            async with self:
                 self.success_message = "¡Cuenta creada exitosamente! Tu cuenta está pendiente de aprobación del administrador. Redirigiendo..."
+        finally:
+            async with self:
+                self.is_loading = False
                 
         await asyncio.sleep(1.5)
         return rx.redirect("/")
@@ -132,8 +154,11 @@ class AuthState(rx.State):
 
     @rx.event
     def ensure_db_seeded(self):
-        """Called on app load to ensure DB has data."""
-        seed_database()
+        """
+        Se mantiene por compatibilidad: la BD se inicializa una vez en el arranque
+        (init_database), así que aquí no se repite el DDL salvo en un proceso sin arrancar.
+        """
+        init_database()
     
     @rx.event
     def check_authentication(self):
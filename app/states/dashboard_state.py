@@ -3,12 +3,21 @@ import asyncio
 from datetime import datetime
 
 import reflex as rx
-from sqlmodel import Session, func, select
+from sqlmodel import Session, select
 
-from app.models import Alert, Parcel, ParcelTechnician, Sensor, SensorData
+from app.models import Alert, Sensor
+from app.services.access_control import access_resolver
+from app.services.alert_queries import count_alerts, latest_readings, list_alerts
+from app.services.metrics import Histogram, timed
+from app.services.query_tracking import track_queries
 from app.states.auth_state import AuthState
 from app.utils import engine
 
+DASHBOARD_LOAD_SECONDS = Histogram(
+    "agroreto_dashboard_load_seconds",
+    "Duración de cada carga/poll de las estadísticas del dashboard",
+)
+
 
 class DashboardState(rx.State):
     total_sensors: int = 0
@@ -18,15 +27,8 @@ class DashboardState(rx.State):
     active_alerts_list: list[dict] = []
     is_polling: bool = False
 
-    def _get_latest_reading(self, session, sensor_id):
-        return session.exec(
-            select(SensorData)
-            .where(SensorData.sensor_id == sensor_id)
-            .order_by(SensorData.timestamp.desc())
-            .limit(1)
-        ).first()
-
     @rx.event
+    @timed(DASHBOARD_LOAD_SECONDS)
     async def load_dashboard_stats(self):
         """Carga estadísticas del dashboard según permisos del usuario"""
         # Obtener info del usuario
@@ -40,31 +42,9 @@ class DashboardState(rx.State):
             return
 
         with Session(engine) as session:
-            # Determinar parcelas accesibles
-            if user_role == "farmer":
-                # Farmers ven todas las parcelas
-                accessible_parcels = session.exec(select(Parcel)).all()
-            else:
-                # Técnicos: parcelas propias + asignadas
-                assigned_parcel_ids = session.exec(
-                    select(ParcelTechnician.parcel_id).where(
-                        ParcelTechnician.user_id == user_id
-                    )
-                ).all()
-                
-                if assigned_parcel_ids:
-                    accessible_parcels = session.exec(
-                        select(Parcel).where(
-                            (Parcel.owner_id == user_id) | 
-                            (Parcel.id.in_(assigned_parcel_ids))
-                        )
-                    ).all()
-                else:
-                    accessible_parcels = session.exec(
-                        select(Parcel).where(Parcel.owner_id == user_id)
-                    ).all()
-            
-            parcel_ids = [p.id for p in accessible_parcels]
+            # Determinar parcelas y sensores accesibles (resolución cacheada)
+            scope = access_resolver.resolve(user_id, user_role, session=session)
+            parcel_ids = scope.parcel_ids
             
             if not parcel_ids:
                 self.total_sensors = 0
@@ -79,14 +59,17 @@ class DashboardState(rx.State):
             
             # Obtener sensores de parcelas accesibles
             sensors = session.exec(
-                select(Sensor).where(Sensor.parcel_id.in_(parcel_ids))
-            ).all()
+                select(Sensor).where(Sensor.id.in_(scope.sensor_ids))
+            ).all() if scope.sensor_ids else []
             
             self.total_sensors = len(sensors)
             
+            # Última lectura de todos los sensores en una sola consulta
+            readings = latest_readings(session, scope.sensor_ids)
+            
             status_list = []
             for sensor in sensors:
-                latest = self._get_latest_reading(session, sensor.id)
+                latest = readings.get(sensor.id)
                 status = "gray"
                 value_display = "--"
                 last_update = "Nunca"
@@ -128,30 +111,12 @@ class DashboardState(rx.State):
             # Alertas solo de sensores accesibles
             sensor_ids = [s.id for s in sensors]
             
-            if sensor_ids:
-                self.active_alerts = session.exec(
-                    select(func.count(Alert.id)).where(
-                        (Alert.sensor_id.in_(sensor_ids)) & 
-                        (Alert.acknowledged == False)
-                    )
-                ).one()
-                
-                alerts = session.exec(
-                    select(Alert)
-                    .where(
-                        (Alert.sensor_id.in_(sensor_ids)) & 
-                        (Alert.acknowledged == False)
-                    )
-                    .order_by(Alert.timestamp.desc())
-                    .limit(5)
-                ).all()
-            else:
-                self.active_alerts = 0
-                alerts = []
+            self.active_alerts = count_alerts(session, sensor_ids, acknowledged=False)
+            # Últimas 5 pendientes con el código del sensor en la misma consulta
+            alerts = list_alerts(session, sensor_ids, acknowledged=False, limit=5)
             
             alerts_display = []
-            for a in alerts:
-                s = session.get(Sensor, a.sensor_id)
+            for a, sensor_code, _sensor_type in alerts:
                 diff = datetime.now() - a.timestamp
                 if diff.total_seconds() < 3600:
                     time_ago = f"{int(diff.total_seconds() / 60)}m atrás"
@@ -162,7 +127,7 @@ class DashboardState(rx.State):
                 
                 alerts_display.append({
                     "id": a.id,
-                    "sensor_code": s.id_code if s else "Desconocido",
+                    "sensor_code": sensor_code,
                     "type": a.type,
                     "message": a.message,
                     "time_ago": time_ago,
@@ -195,7 +160,9 @@ class DashboardState(rx.State):
             async with self:
                 if not self.is_polling:
                     break
-                await self.load_dashboard_stats()
+                # Un scope por poll: el bucle nunca termina y el middleware no lo ve
+                with track_queries("dashboard_state.load_dashboard_stats"):
+                    await self.load_dashboard_stats()
             await asyncio.sleep(5)
 
     @rx.event
@@ -4,6 +4,7 @@ import reflex as rx
 from sqlmodel import Session, select
 
 from app.models import Parcel, ParcelTechnician, Sensor, User
+from app.services.access_control import access_resolver
 from app.states.auth_state import AuthState
 from app.utils import engine
 
@@ -32,17 +33,10 @@ class ParcelState(rx.State):
             return
 
         with Session(engine) as session:
-            if user_role == "farmer":
-                self.parcels = session.exec(select(Parcel)).all()
-            else:
-                assigned_subq = select(ParcelTechnician.parcel_id).where(
-                    ParcelTechnician.user_id == user_id
-                )
-                self.parcels = session.exec(
-                    select(Parcel).where(
-                        (Parcel.owner_id == user_id) | (Parcel.id.in_(assigned_subq))
-                    )
-                ).all()
+            parcel_ids = access_resolver.resolve(user_id, user_role, session=session).parcel_ids
+            self.parcels = session.exec(
+                select(Parcel).where(Parcel.id.in_(parcel_ids))
+            ).all() if parcel_ids else []
 
     @rx.event
     def open_add_modal(self):
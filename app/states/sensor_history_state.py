@@ -2,9 +2,10 @@ import logging
 from datetime import datetime, timedelta
 
 import reflex as rx
-from sqlmodel import Session, select
+from sqlmodel import Session
 
-from app.models import Parcel, Sensor, SensorData
+from app.models import Parcel, Sensor
+from app.services.cold_archive import cold_archive
 from app.utils import engine
 
 
@@ -91,12 +92,8 @@ class SensorHistoryState(rx.State):
                 start_time = now - timedelta(days=30)
             else:
                 start_time = now - timedelta(days=365)
-            query = (
-                select(SensorData)
-                .where(SensorData.sensor_id == sid, SensorData.timestamp >= start_time)
-                .order_by(SensorData.timestamp.asc())
-            )
-            data_points = session.exec(query).all()
+            # Los rangos largos cruzan al archivo frío; los recientes sólo leen la BD
+            data_points = cold_archive.read_history(session, sid, start=start_time)
             chart_data = []
             values = []
             for pt in data_points:
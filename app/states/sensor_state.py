@@ -1,13 +1,13 @@
 # app/states/sensor_state.py
-import json
 import logging
 from datetime import datetime
 
 import reflex as rx
 from sqlmodel import Session, select
 
-from app.models import Alert, Parcel, ParcelTechnician, Sensor, SensorData
-from app.services.maiota_client import maiota_client
+from app.models import Alert, Parcel, Sensor
+from app.services.access_control import access_resolver
+from app.services.ingest import ingest_service
 from app.states.auth_state import AuthState
 from app.utils import engine
 
@@ -78,20 +78,7 @@ class SensorState(rx.State):
             if not parcel_obj:
                 return
 
-            allowed = False
-            if user_role == "farmer":
-                allowed = True
-            elif parcel_obj.owner_id == user_id:
-                allowed = True
-            else:
-                # Comprobar asignación en ParcelTechnician
-                assigned = session.exec(
-                    select(ParcelTechnician).where(
-                        (ParcelTechnician.parcel_id == pid) & (ParcelTechnician.user_id == user_id)
-                    )
-                ).first()
-                if assigned:
-                    allowed = True
+            allowed = pid in access_resolver.resolve(user_id, user_role, session=session).parcel_ids
 
             if not allowed:
                 # No autorizado para ver esta parcela
@@ -180,8 +167,10 @@ class SensorState(rx.State):
                 session.commit()
                 session.refresh(new_sensor)
                 
-                # Registrar en MQTT
-                self._register_sensor_mqtt(new_sensor)
+                # Registrar en MQTT (recarga incremental de los topics de la partición).
+                # Con la ingesta en otro proceso, el worker lo detecta en su próxima recarga.
+                if ingest_service.running:
+                    ingest_service.load_sensors()
                 
                 logging.info(f"✓ Sensor {new_sensor.id_code} creado con ID {new_sensor.id}")
         
@@ -201,54 +190,6 @@ class SensorState(rx.State):
         self.new_sensor_high = 100.0
         self.new_sensor_mqtt_topic = "Awi7LJfyyn6LPjg/15046220"
 
-    def _register_sensor_mqtt(self, sensor: Sensor):
-        """Registra el sensor en el cliente MQTT"""
-        
-        # Obtener el tipo MAIoTA correspondiente
-        maiota_type = self.maiota_type_map.get(sensor.type, "temperatura")
-        
-        def on_sensor_data(data: dict):
-            """Callback cuando llegan datos del sensor"""
-            self._save_sensor_reading(sensor.id, maiota_type, data)
-            self._check_thresholds(sensor, maiota_type, data)
-        
-        maiota_client.add_sensor(
-            sensor_id=sensor.id,
-            sensor_code=sensor.id_code,
-            sensor_type=maiota_type,
-            topic=sensor.mqtt_topic,
-            callback=on_sensor_data
-        )
-        
-        logging.info(f"✓ Sensor {sensor.id_code} registrado en MQTT topic {sensor.mqtt_topic}")
-
-    def _save_sensor_reading(self, sensor_id: int, sensor_type: str, data: dict):
-        """Guarda lectura en la base de datos"""
-        try:
-            with Session(engine) as session:
-                # Extraer valor según el tipo de sensor
-                value = data.get(sensor_type, 0.0)
-                
-                # Convertir datetime a string para JSON
-                data_for_json = data.copy()
-                if 'timestamp' in data_for_json:
-                    if isinstance(data_for_json['timestamp'], datetime):
-                        data_for_json['timestamp'] = data_for_json['timestamp'].isoformat()
-                
-                reading = SensorData(
-                    sensor_id=sensor_id,
-                    timestamp=data.get('timestamp', datetime.now()),
-                    value=float(value),
-                    raw=data.get('raw_payload', json.dumps(data_for_json))  # ← Usa data_for_json
-                )
-                
-                session.add(reading)
-                session.commit()
-                
-                logging.debug(f"💾 Lectura guardada: Sensor {sensor_id} = {value}")
-                
-        except Exception as e:
-            logging.exception(f"Error guardando lectura: {e}")
     #Comentada por duplicado de mensaje
 
     # def _check_thresholds(self, sensor: Sensor, sensor_type: str, data: dict):
@@ -302,12 +243,14 @@ class SensorState(rx.State):
             with Session(engine) as session:
                 sensor = session.get(Sensor, sensor_id)
                 if sensor:
-                    # Desregistrar de MQTT antes de eliminar
-                    maiota_client.remove_sensor(sensor.mqtt_topic)
-                    logging.info(f"✓ Sensor {sensor.id_code} desvinculado de MQTT")
-                    
+                    sensor_code = sensor.id_code
                     session.delete(sensor)
                     session.commit()
+                    
+                    # Desregistrar de MQTT sin afectar a otros sensores del mismo topic
+                    if ingest_service.running:
+                        ingest_service.load_sensors()
+                    logging.info(f"✓ Sensor {sensor_code} desvinculado de MQTT")
             
             self.load_sensors()
             
@@ -1,12 +1,20 @@
+import threading
+
 from passlib.context import CryptContext
 from sqlmodel import Session, SQLModel, create_engine, select
 
 from app.models import Alert, Parcel, Sensor, SensorData, User
+# Registra los listeners del Engine: latencia por punto de llamada, consultas por evento y consultas lentas
+import app.services.query_tracking  # noqa: F401
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 DATABASE_URL = "sqlite:///reflex.db"
 engine = create_engine(DATABASE_URL)
 
+# Guarda en proceso: el esquema y los datos iniciales se preparan una sola vez
+_db_initialized = False
+_db_init_lock = threading.Lock()
+
 
 def verify_password(plain_password, hashed_password):
     """Verifica si una contraseña en texto plano coincide con su hash"""
@@ -18,6 +26,29 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 
+def init_database(force: bool = False) -> bool:
+    """
+    Crea el esquema y los datos iniciales una sola vez por proceso.
+    Se llama en el arranque (backend web o ingesta), no al cargar páginas;
+    las llamadas posteriores no tocan la base de datos.
+
+    Args:
+        force: Ejecutar aunque el proceso ya esté inicializado
+
+    Returns:
+        True si se ha ejecutado la inicialización, False si ya estaba hecha
+    """
+    global _db_initialized
+    if _db_initialized and not force:
+        return False
+    with _db_init_lock:
+        if _db_initialized and not force:
+            return False
+        seed_database()
+        _db_initialized = True
+        return True
+
+
 def seed_database():
     """Inicializa la base de datos con datos de ejemplo si está vacía (usuarios, parcelas y sensores)"""
     SQLModel.metadata.create_all(engine)
@@ -0,0 +1,5 @@
+"""
+Benchmarks de rendimiento de AgroReto (ingesta, guardado de medias, dashboard e histórico).
+
+Uso: python -m benchmarks.run --help
+"""
@@ -0,0 +1,534 @@
+"""
+Suite de benchmarks de los caminos críticos.
+
+Mide, sobre una BD SQLite temporal en fichero:
+- parse_payload: parseo de payloads MAIoTA (_parse_maiota_payload)
+- add_reading_contention: add_reading desde varios threads a la vez
+- ingest_pipeline: frames de una flota simulada por el broker MQTT en memoria
+  hasta el agregador (parseo, reparto por topic, reglas por lectura)
+- ingest_pipeline_asyncio: el mismo recorrido con la ingesta asyncio (AsyncIngestService)
+- flush_<N>: _calculate_and_save_averages con N sensores (100, 1000, 10000)
+- dashboard_stats: DashboardState.load_dashboard_stats con histórico sembrado
+- history_api: latencia de GET /api/sensors/{id}/data
+- login_concurrent: N logins simultáneos (AuthState.check_login) con bcrypt en el
+  pool de contraseñas; incluye el mayor bloqueo del event loop frente a verificar inline
+
+Uso:
+    python -m benchmarks.run                                  # JSON por stdout
+    python -m benchmarks.run --output bench.json              # guardar resultados
+    python -m benchmarks.run --baseline bench.json            # comparar (exit 1 si empeora)
+    python -m benchmarks.run --history bench_history.jsonl    # añadir una línea por commit
+    python -m benchmarks.run --quick --only parse,flush       # tamaños reducidos
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+from unittest.mock import patch
+
+from sqlmodel import Session, SQLModel, create_engine
+
+from app.models import Alert, Parcel, Sensor, SensorData, User
+
+# Módulos que usan el engine global de app.utils
+ENGINE_TARGETS = (
+    "app.services.data_aggregator.engine",
+    "app.services.alert_writer.engine",
+    "app.services.cold_archive.engine",
+    "app.services.fleet_simulator.engine",
+    "app.services.ingest.engine",
+    "app.states.dashboard_state.engine",
+    "app.states.auth_state.engine",
+    "app.api.routes.engine",
+)
+
+# Umbral por defecto: más de un 25% más lento que la referencia es una regresión
+DEFAULT_THRESHOLD = 0.25
+
+SAMPLE_PAYLOAD = "CIoTA-D1=2603&D2=5411&D3=2542&D4=43&D5=580&D6=103&D7=1&"
+
+
+def measure(fn: Callable[[], None], repeat: int, setup: Optional[Callable[[], None]] = None) -> List[float]:
+    """
+    Ejecuta fn repeat veces y devuelve la duración de cada ejecución.
+
+    Args:
+        fn: Función a medir
+        repeat: Número de ejecuciones
+        setup: Preparación antes de cada ejecución (no se mide)
+
+    Returns:
+        Duraciones en segundos
+    """
+    durations = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - started)
+    return durations
+
+
+def summarize(durations: List[float], operations: int = 1, **params) -> dict:
+    """Resumen de un benchmark: mediana, p95 y operaciones por segundo"""
+    ordered = sorted(durations)
+    median = statistics.median(ordered)
+    p95 = ordered[min(len(ordered) - 1, round(0.95 * (len(ordered) - 1)))]
+    return {
+        "median_seconds": round(median, 6),
+        "p95_seconds": round(p95, 6),
+        "ops_per_second": round(operations / median, 1) if median > 0 else None,
+        "repeat": len(durations),
+        "params": params,
+    }
+
+
+@contextlib.contextmanager
+def bench_database(directory: str):
+    """BD SQLite en fichero, con el esquema creado y usada por todos los módulos"""
+    engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+    SQLModel.metadata.create_all(engine)
+    with contextlib.ExitStack() as stack:
+        for target in ENGINE_TARGETS:
+            stack.enter_context(patch(target, engine))
+        yield engine
+    engine.dispose()
+
+
+def seed_sensors(engine, count: int, history: int = 0, alerts: int = 0) -> dict:
+    """
+    Siembra un agricultor con una parcela cada 10 sensores, histórico de
+    `history` puntos cada 5 minutos por sensor y `alerts` alertas pendientes.
+
+    Returns:
+        {"user_id": ..., "sensor_ids": [...]}
+    """
+    now = datetime.now()
+    with Session(engine) as session:
+        user = User(username=f"bench-{count}", password_hash="-", role="farmer")
+        session.add(user)
+        session.commit()
+        parcels = [
+            Parcel(name=f"Parcela {i}", location="-", area=1.0, owner_id=user.id)
+            for i in range(max(1, count // 10))
+        ]
+        session.add_all(parcels)
+        session.commit()
+        sensors = [
+            Sensor(
+                id_code=f"BENCH-{count}-{i}", parcel_id=parcels[i % len(parcels)].id,
+                type="temperatura", unit="°C", description="-",
+                threshold_low=-50.0, threshold_high=100.0, mqtt_topic="bench/topic",
+            )
+            for i in range(count)
+        ]
+        session.add_all(sensors)
+        session.commit()
+        sensor_ids = [sensor.id for sensor in sensors]
+        user_id = user.id
+
+    if history:
+        rows = [
+            {"sensor_id": sid, "timestamp": now - timedelta(minutes=5 * i),
+             "value": 20.0 + (i % 7), "raw": json.dumps({"aggregated": True, "avg": 20.0})}
+            for sid in sensor_ids for i in range(history)
+        ]
+        with engine.begin() as connection:
+            connection.execute(SensorData.__table__.insert(), rows)
+    if alerts:
+        rows = [
+            {"sensor_id": sensor_ids[i % len(sensor_ids)], "timestamp": now - timedelta(minutes=i),
+             "type": "HIGH", "message": "bench", "acknowledged": False, "created_at": now,
+             "occurrences": 1}
+            for i in range(alerts)
+        ]
+        with engine.begin() as connection:
+            connection.execute(Alert.__table__.insert(), rows)
+    return {"user_id": user_id, "sensor_ids": sensor_ids}
+
+
+# --- Benchmarks ------------------------------------------------------------
+
+def bench_parse_payload(quick: bool) -> Dict[str, dict]:
+    from app.services.maiota_client import MAIoTAMultiSensorClient
+    from app.services.mqtt_transport import InMemoryBroker
+
+    client = MAIoTAMultiSensorClient(broker="memory", transport_factory=InMemoryBroker().client)
+    number = 2_000 if quick else 50_000
+
+    def run():
+        for _ in range(number):
+            client._parse_maiota_payload(SAMPLE_PAYLOAD)
+
+    return {"parse_payload": summarize(measure(run, 3 if quick else 7), number, payloads=number)}
+
+
+def bench_add_reading(quick: bool) -> Dict[str, dict]:
+    from app.services.data_aggregator import SensorDataAggregator
+
+    threads, per_thread, sensors = (4, 500, 50) if quick else (8, 10_000, 500)
+    aggregator = None
+
+    def setup():
+        nonlocal aggregator
+        aggregator = SensorDataAggregator(interval_minutes=5)
+
+    def worker(offset: int):
+        for i in range(per_thread):
+            sensor_id = (offset * per_thread + i) % sensors + 1
+            aggregator.add_reading(sensor_id, "temperatura", {"temperatura": 20.0 + i % 5})
+
+    def run():
+        pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+
+    durations = measure(run, 3 if quick else 5, setup=setup)
+    return {"add_reading_contention": summarize(
+        durations, threads * per_thread, threads=threads, readings=threads * per_thread, sensors=sensors,
+    )}
+
+
+def bench_ingest_pipeline(quick: bool, engine) -> Dict[str, dict]:
+    from app.services.data_aggregator import SensorDataAggregator
+    from app.services.fleet_simulator import FleetSimulator, register_fleet
+    from app.services.ingest import IngestService
+    from app.services.maiota_client import MAIoTAMultiSensorClient
+    from app.services.mqtt_transport import InMemoryBroker
+
+    devices, frames = (50, 2_000) if quick else (2_000, 50_000)
+    broker = InMemoryBroker()
+    simulator = FleetSimulator(publish=broker.publish, devices=devices, rate=1, seed=1)
+    with Session(engine) as session:
+        register_fleet(session, simulator, seed_sensors(engine, 1)["user_id"])
+
+    client = MAIoTAMultiSensorClient(broker="memory", transport_factory=broker.client)
+    aggregator = SensorDataAggregator(interval_minutes=5)
+    service = IngestService(client=client, aggregator=aggregator, refresh_seconds=0)
+    client.add_connect_listener(service.load_sensors)
+    client.client.loop_start()
+    try:
+        durations = measure(lambda: simulator.run(max_frames=frames, realtime=False), 3 if quick else 5)
+    finally:
+        client.stop()
+    assert broker.delivered == simulator.stats.sent
+    results = {"ingest_pipeline": summarize(durations, frames, devices=devices, frames=frames)}
+
+    # Mismo recorrido con la ingesta asyncio: colas en un único event loop en lugar de locks
+    from app.services.async_ingest import AsyncIngestService
+
+    broker = InMemoryBroker()
+    simulator.publish = broker.publish
+    client = MAIoTAMultiSensorClient(broker="memory", transport_factory=broker.client)
+    service = AsyncIngestService(client=client, aggregator=SensorDataAggregator(interval_minutes=5),
+                                 refresh_seconds=0, retention=SimpleNamespace(start=lambda: None, stop=lambda: None),
+                                 queue_size=frames)
+
+    async def run_async() -> List[float]:
+        await service.start()
+        await service.reload_sensors()
+        durations = []
+        for _ in range(3 if quick else 5):
+            started = time.perf_counter()
+            simulator.run(max_frames=frames, realtime=False)
+            await service.drain()
+            durations.append(time.perf_counter() - started)
+        await service.stop()
+        return durations
+
+    durations = asyncio.run(run_async())
+    assert service.dropped == 0
+    results["ingest_pipeline_asyncio"] = summarize(durations, frames, devices=devices, frames=frames)
+    return results
+
+
+def bench_flush(quick: bool, engine) -> Dict[str, dict]:
+    from app.services.data_aggregator import SensorDataAggregator
+
+    results = {}
+    for count in ((10, 100) if quick else (100, 1_000, 10_000)):
+        sensor_ids = seed_sensors(engine, count)["sensor_ids"]
+        aggregator = SensorDataAggregator(interval_minutes=5)
+        bucket = aggregator._bucket_start(datetime.now())
+
+        def setup():
+            # Un intervalo nuevo por ejecución: todas las medias son inserciones
+            nonlocal bucket
+            bucket -= timedelta(minutes=5)
+            aggregator.window_start = bucket
+            for sensor_id in sensor_ids:
+                aggregator.buffer[sensor_id]["temperatura"] = [20.0, 21.0, 22.0, 21.5, 20.5]
+                aggregator.raw_data_buffer[sensor_id] = [{"temperatura": 20.5}]
+
+        durations = measure(aggregator._calculate_and_save_averages, 3 if quick else 5, setup=setup)
+        results[f"flush_{count}"] = summarize(durations, count, sensors=count, readings_per_sensor=5)
+    return results
+
+
+def bench_dashboard(quick: bool, engine) -> Dict[str, dict]:
+    from app.services.access_control import access_resolver
+    from app.states.dashboard_state import DashboardState
+
+    sensors, history, alerts = (10, 50, 20) if quick else (100, 2_000, 500)
+    seeded = seed_sensors(engine, sensors, history=history, alerts=alerts)
+    auth = SimpleNamespace(user_id=seeded["user_id"], user_role="farmer")
+
+    class FakeState(SimpleNamespace):
+        async def get_state(self, _state_cls):
+            return auth
+
+    state = FakeState()
+    handler = DashboardState.load_dashboard_stats.fn
+    loop = asyncio.new_event_loop()
+    try:
+        access_resolver.invalidate()
+        durations = measure(lambda: loop.run_until_complete(handler(state)), 5 if quick else 30)
+    finally:
+        loop.close()
+    assert state.total_sensors == sensors
+    return {"dashboard_stats": summarize(
+        durations, sensors=sensors, history_per_sensor=history, pending_alerts=alerts,
+    )}
+
+
+def bench_history_api(quick: bool, engine, directory: str) -> Dict[str, dict]:
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    from app.api.routes import router
+    from app.services.cold_archive import ColdArchive
+
+    history = 500 if quick else 20_000
+    sensor_id = seed_sensors(engine, 1, history=history)["sensor_ids"][0]
+    api = FastAPI()
+    api.include_router(router, prefix="/api")
+    start = (datetime.now() - timedelta(days=7)).isoformat()
+
+    with patch("app.api.routes.cold_archive", ColdArchive(os.path.join(directory, "archive"))), \
+         TestClient(api) as client:
+        def run():
+            response = client.get(f"/api/sensors/{sensor_id}/data", params={"from": start, "limit": 500})
+            response.raise_for_status()
+
+        durations = measure(run, 10 if quick else 100)
+    return {"history_api": summarize(durations, history_rows=history, limit=500)}
+
+
+def bench_login(quick: bool, engine) -> Dict[str, dict]:
+    from passlib.context import CryptContext
+
+    from app.services.password_hashing import PasswordHasher
+    from app.states.auth_state import AuthState
+
+    # Coste bcrypt reducido en --quick; el completo es el de producción (12 rondas)
+    logins, rounds = (8, 4) if quick else (32, 12)
+    context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=rounds)
+    with Session(engine) as session:
+        session.add(User(username="bench-login", password_hash=context.hash("bench-pass"), role="farmer"))
+        session.commit()
+    workers = min(4, os.cpu_count() or 1)
+    hasher = PasswordHasher(workers=workers, max_pending=logins, context=context)
+    form = {"username": "bench-login", "password": "bench-pass"}
+
+    class FakeAuthState(SimpleNamespace):
+        # `async with self` toma el lock del estado, como en Reflex
+        async def __aenter__(self):
+            await self._lock.acquire()
+            return self
+
+        async def __aexit__(self, *exc_info):
+            self._lock.release()
+
+    async def max_loop_stall(coroutines) -> float:
+        """Ejecuta las corrutinas a la vez y devuelve el mayor retraso del event loop"""
+        loop = asyncio.get_running_loop()
+        stalls = [0.0]
+        done = asyncio.Event()
+
+        async def ticker():
+            while not done.is_set():
+                started = loop.time()
+                await asyncio.sleep(0.001)
+                stalls.append(loop.time() - started - 0.001)
+
+        task = asyncio.create_task(ticker())
+        await asyncio.sleep(0)
+        await asyncio.gather(*coroutines)
+        done.set()
+        await task
+        return max(stalls)
+
+    hashed = context.hash(form["password"])
+
+    async def verify_inline():
+        # Como antes: bcrypt dentro del event loop
+        context.verify(form["password"], hashed)
+
+    handler = AuthState.check_login.fn
+    stalls: List[float] = []
+
+    def run():
+        states = [FakeAuthState(_lock=asyncio.Lock()) for _ in range(logins)]
+        stalls.append(loop.run_until_complete(max_loop_stall(handler(state, form) for state in states)))
+        assert all(state.user_id is not None for state in states)
+
+    loop = asyncio.new_event_loop()
+    try:
+        with patch("app.states.auth_state.password_hasher", hasher):
+            durations = measure(run, 3 if quick else 5)
+        inline_stall = loop.run_until_complete(max_loop_stall(verify_inline() for _ in range(logins)))
+    finally:
+        loop.close()
+        hasher.shutdown()
+    return {"login_concurrent": summarize(
+        durations, logins, logins=logins, bcrypt_rounds=rounds, workers=workers,
+        max_loop_stall_ms=round(max(stalls) * 1000, 2), inline_max_loop_stall_ms=round(inline_stall * 1000, 2),
+    )}
+
+
+SUITES = ("parse", "add_reading", "ingest", "flush", "dashboard", "history", "login")
+
+
+def run_suite(quick: bool = False, only: Optional[List[str]] = None) -> dict:
+    """
+    Ejecuta los benchmarks y construye el informe.
+
+    Args:
+        quick: Tamaños reducidos (para CI o como prueba de humo)
+        only: Subconjunto de SUITES a ejecutar (por defecto todas)
+
+    Returns:
+        Informe con metadatos del entorno y resultados por benchmark
+    """
+    selected = only or list(SUITES)
+    suites = {
+        "parse": lambda engine, directory: bench_parse_payload(quick),
+        "add_reading": lambda engine, directory: bench_add_reading(quick),
+        "ingest": lambda engine, directory: bench_ingest_pipeline(quick, engine),
+        "flush": lambda engine, directory: bench_flush(quick, engine),
+        "dashboard": lambda engine, directory: bench_dashboard(quick, engine),
+        "history": lambda engine, directory: bench_history_api(quick, engine, directory),
+        "login": lambda engine, directory: bench_login(quick, engine),
+    }
+    results: Dict[str, dict] = {}
+    for name in SUITES:
+        if name not in selected:
+            continue
+        # BD nueva por benchmark: los datos sembrados por uno no afectan a otro
+        with tempfile.TemporaryDirectory(prefix=f"agroreto-bench-{name}-") as directory, \
+             bench_database(directory) as engine:
+            results.update(suites[name](engine, directory))
+    return {
+        "commit": _git_commit(),
+        "release": os.environ.get("AGRORETO_RELEASE", "dev"),
+        "timestamp": datetime.now().isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "quick": quick,
+        "results": results,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(report: dict, baseline: dict, threshold: float = DEFAULT_THRESHOLD) -> List[dict]:
+    """
+    Compara las medianas con un informe de referencia.
+
+    Args:
+        report: Informe actual (run_suite)
+        baseline: Informe de referencia
+        threshold: Empeoramiento relativo tolerado (0.25 = 25% más lento)
+
+    Returns:
+        Una fila por benchmark común a ambos informes, con su ratio y si es regresión
+    """
+    rows = []
+    for name, result in report["results"].items():
+        reference = baseline.get("results", {}).get(name)
+        if not reference or not reference.get("median_seconds"):
+            continue
+        ratio = result["median_seconds"] / reference["median_seconds"]
+        rows.append({
+            "name": name,
+            "baseline_seconds": reference["median_seconds"],
+            "current_seconds": result["median_seconds"],
+            "ratio": round(ratio, 3),
+            "regression": ratio > 1 + threshold,
+        })
+    return rows
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description="Benchmarks de AgroReto")
+    parser.add_argument("--output", default="-", help="Fichero JSON de resultados (- = stdout)")
+    parser.add_argument("--history", default=None, help="Fichero JSONL al que añadir una línea por ejecución")
+    parser.add_argument("--baseline", default=None, help="Informe JSON de referencia para detectar regresiones")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Empeoramiento relativo tolerado frente a la referencia (por defecto 0.25)")
+    parser.add_argument("--quick", action="store_true", help="Tamaños reducidos")
+    parser.add_argument("--only", default=None, help=f"Benchmarks a ejecutar, separados por comas: {','.join(SUITES)}")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    """Ejecuta la suite, escribe los resultados y devuelve 1 si hay regresiones"""
+    args = parse_args(argv)
+    only = [name.strip() for name in args.only.split(",")] if args.only else None
+    unknown = set(only or []) - set(SUITES)
+    if unknown:
+        print(f"Benchmarks desconocidos: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+
+    report = run_suite(quick=args.quick, only=only)
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            rows = compare(report, json.load(baseline_file), args.threshold)
+        report["comparison"] = {"baseline": args.baseline, "threshold": args.threshold, "rows": rows}
+        for row in rows:
+            flag = "REGRESIÓN" if row["regression"] else "ok"
+            print(
+                f"{row['name']:<24} {row['baseline_seconds'] * 1000:10.2f} ms -> "
+                f"{row['current_seconds'] * 1000:10.2f} ms  x{row['ratio']:.2f}  {flag}",
+                file=sys.stderr,
+            )
+        if any(row["regression"] for row in rows):
+            exit_code = 1
+
+    content = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(content)
+    else:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(content + "\n")
+    if args.history:
+        with open(args.history, "a", encoding="utf-8") as history_file:
+            history_file.write(json.dumps(report) + "\n")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+Tests para el resolvedor de accesos a parcelas y sensores
+"""
+import pytest
+from unittest.mock import patch
+
+from app.models import Parcel, ParcelTechnician, Sensor, User
+from app.services.access_control import EMPTY_SCOPE, AccessResolver
+
+
+@pytest.fixture(name="farm")
+def farm_fixture(session, test_user):
+    """Dos parcelas del agricultor (una con sensor) y un técnico sin asignar"""
+    tech = User(username="tech", password_hash="hash", role="technician")
+    session.add(tech)
+    parcels = [
+        Parcel(name="A", location="", area=1.0, owner_id=test_user.id),
+        Parcel(name="B", location="", area=1.0, owner_id=test_user.id),
+    ]
+    for parcel in parcels:
+        session.add(parcel)
+    session.commit()
+    sensor = Sensor(
+        id_code="S-1", parcel_id=parcels[0].id, type="temperature", unit="°C",
+        description="", threshold_low=0.0, threshold_high=50.0,
+    )
+    session.add(sensor)
+    session.commit()
+    return {"farmer": test_user, "tech": tech, "parcels": parcels, "sensor": sensor}
+
+
+def test_farmer_sees_everything(session, farm):
+    """Test: El agricultor ve todas las parcelas y sensores"""
+    resolver = AccessResolver()
+    scope = resolver.resolve(farm["farmer"].id, "farmer", session=session)
+    
+    assert scope.parcel_ids == {p.id for p in farm["parcels"]}
+    assert scope.sensor_ids == {farm["sensor"].id}
+
+
+def test_technician_sees_only_assigned(session, farm):
+    """Test: El técnico sólo ve parcelas propias o asignadas"""
+    resolver = AccessResolver()
+    tech_id = farm["tech"].id
+    
+    assert resolver.resolve(tech_id, "technician", session=session) == EMPTY_SCOPE
+    
+    session.add(ParcelTechnician(parcel_id=farm["parcels"][0].id, user_id=tech_id))
+    session.commit()
+    resolver.invalidate()
+    scope = resolver.resolve(tech_id, "technician", session=session)
+    
+    assert scope.parcel_ids == {farm["parcels"][0].id}
+    assert scope.sensor_ids == {farm["sensor"].id}
+
+
+def test_anonymous_user_has_no_access(session):
+    """Test: Sin usuario no hay acceso"""
+    assert AccessResolver().resolve(None, None, session=session) == EMPTY_SCOPE
+
+
+def test_resolution_is_cached_per_user(session, farm):
+    """Test: Resoluciones repetidas no vuelven a consultar la BD"""
+    resolver = AccessResolver()
+    
+    with patch.object(resolver, "_query_scope", wraps=resolver._query_scope) as query:
+        resolver.resolve(farm["farmer"].id, "farmer", session=session)
+        resolver.resolve(farm["farmer"].id, "farmer", session=session)
+        resolver.resolve(farm["tech"].id, "technician", session=session)
+    
+    assert query.call_count == 2
+
+
+def test_assignment_commit_invalidates_cache(session, farm):
+    """Test: Confirmar cambios en ParcelTechnician invalida la caché global"""
+    from app.services import access_control
+    
+    tech_id = farm["tech"].id
+    resolver = access_control.access_resolver
+    resolver.invalidate()
+    assert resolver.resolve(tech_id, "technician", session=session) == EMPTY_SCOPE
+    
+    session.add(ParcelTechnician(parcel_id=farm["parcels"][1].id, user_id=tech_id))
+    session.commit()
+    
+    scope = resolver.resolve(tech_id, "technician", session=session)
+    assert scope.parcel_ids == {farm["parcels"][1].id}
+    assert scope.sensor_ids == frozenset()
+
+
+def test_cache_expires_after_ttl(session, farm):
+    """Test: Los resultados caducan tras ttl_seconds (cambios de otros procesos)"""
+    resolver = AccessResolver(ttl_seconds=0)
+    
+    with patch.object(resolver, "_query_scope", wraps=resolver._query_scope) as query:
+        resolver.resolve(farm["farmer"].id, "farmer", session=session)
+        resolver.resolve(farm["farmer"].id, "farmer", session=session)
+    
+    assert query.call_count == 2
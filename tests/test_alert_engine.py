@@ -0,0 +1,79 @@
+"""
+Tests para el motor de alertas por episodios
+"""
+from datetime import datetime, timedelta
+
+from sqlmodel import select
+
+from app.models import Alert
+from app.services.alert_engine import AlertEngine
+
+
+def evaluate_series(engine_, session, sensor, values):
+    """Evalúa una serie de valores (uno por minuto) confirmando tras cada uno"""
+    base = datetime(2025, 1, 1, 12, 0)
+    for i, value in enumerate(values):
+        engine_.evaluate(session, sensor, "temperatura", value, now=base + timedelta(minutes=i))
+        session.commit()
+    return session.exec(select(Alert).order_by(Alert.id)).all()
+
+
+def test_stuck_sensor_creates_single_episode(session, test_sensor):
+    """Test: Un sensor fuera de rango de forma continua genera una sola alerta"""
+    alerts = evaluate_series(AlertEngine(), session, test_sensor, [35.0, 38.0, 36.0, 40.0, 37.0])
+    
+    assert len(alerts) == 1
+    alert = alerts[0]
+    assert alert.type == "HIGH"
+    assert alert.occurrences == 5
+    assert alert.peak_value == 40.0
+    assert alert.last_seen == datetime(2025, 1, 1, 12, 4)
+    assert alert.closed_at is None
+
+
+def test_episode_closes_after_recovery(session, test_sensor):
+    """Test: El episodio se cierra tras clear_after evaluaciones recuperadas"""
+    alerts = evaluate_series(AlertEngine(clear_after=2), session, test_sensor, [35.0, 20.0, 20.0, 35.0])
+    
+    assert len(alerts) == 2
+    assert alerts[0].closed_at == datetime(2025, 1, 1, 12, 2)
+    assert alerts[1].closed_at is None
+
+
+def test_hysteresis_keeps_episode_open(session, test_sensor):
+    """Test: Valores justo bajo el umbral (dentro del margen) no cierran el episodio"""
+    # Umbrales 10-30 con histéresis del 10% -> recuperado por debajo de 28
+    engine_ = AlertEngine(clear_after=1, hysteresis=0.1)
+    alerts = evaluate_series(engine_, session, test_sensor, [31.0, 29.5, 31.0, 29.0, 31.0])
+    
+    assert len(alerts) == 1
+    assert alerts[0].occurrences == 3
+    assert alerts[0].closed_at is None
+
+
+def test_debounce_requires_consecutive_breaches(session, test_sensor):
+    """Test: Con raise_after=3 los picos aislados no abren episodio"""
+    engine_ = AlertEngine(raise_after=3)
+    
+    assert evaluate_series(engine_, session, test_sensor, [35.0, 35.0, 20.0, 35.0]) == []
+    
+    alerts = evaluate_series(engine_, session, test_sensor, [35.0, 35.0])
+    assert len(alerts) == 1
+
+
+def test_direct_switch_between_high_and_low(session, test_sensor):
+    """Test: Pasar de HIGH a LOW cierra un episodio y abre otro"""
+    alerts = evaluate_series(AlertEngine(), session, test_sensor, [35.0, 5.0])
+    
+    assert [a.type for a in alerts] == ["HIGH", "LOW"]
+    assert alerts[0].closed_at is not None
+    assert alerts[1].peak_value == 5.0
+
+
+def test_open_episode_survives_restart(session, test_sensor):
+    """Test: Un motor nuevo (reinicio) continúa el episodio abierto en la BD"""
+    evaluate_series(AlertEngine(), session, test_sensor, [35.0])
+    alerts = evaluate_series(AlertEngine(), session, test_sensor, [36.0])
+    
+    assert len(alerts) == 1
+    assert alerts[0].occurrences == 2
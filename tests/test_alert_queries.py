@@ -0,0 +1,147 @@
+"""
+Tests para las consultas de alertas y últimas lecturas
+"""
+import json
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import event
+
+from app.models import Alert, Sensor, SensorData
+from app.services.alert_queries import acknowledge_alerts, count_alerts, latest_readings, list_alerts
+
+
+@pytest.fixture(name="alerts")
+def alerts_fixture(session, test_sensor):
+    """30 alertas alternando HIGH/LOW; las 10 más antiguas confirmadas"""
+    base = datetime(2025, 1, 1, 12, 0)
+    alerts = []
+    for i in range(30):
+        alert = Alert(
+            sensor_id=test_sensor.id,
+            timestamp=base + timedelta(minutes=i),
+            type="HIGH" if i % 2 else "LOW",
+            message=f"alerta {i}",
+            acknowledged=i < 10,
+        )
+        session.add(alert)
+        alerts.append(alert)
+    session.commit()
+    return alerts
+
+
+def count_queries(engine):
+    """Registra las sentencias SQL ejecutadas en el motor"""
+    statements = []
+    event.listen(engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    return statements
+
+
+def test_list_alerts_includes_sensor_in_single_query(engine, session, test_sensor, alerts):
+    """Test: El listado trae código y tipo del sensor con una sola consulta"""
+    sensor_ids = [test_sensor.id]
+    statements = count_queries(engine)
+    rows = list_alerts(session, sensor_ids, limit=50)
+    
+    assert len(statements) == 1
+    assert len(rows) == 30
+    alert, sensor_code, sensor_type = rows[0]
+    assert alert.message == "alerta 29"
+    assert sensor_code == "TEST-TEMP-01"
+    assert sensor_type == "temperatura"
+
+
+def test_list_alerts_pagination(session, test_sensor, alerts):
+    """Test: Las páginas no se solapan y siguen el orden por fecha descendente"""
+    first = list_alerts(session, [test_sensor.id], limit=8, offset=0)
+    second = list_alerts(session, [test_sensor.id], limit=8, offset=8)
+    
+    assert [a.message for a, _, _ in first] == [f"alerta {i}" for i in range(29, 21, -1)]
+    assert [a.message for a, _, _ in second] == [f"alerta {i}" for i in range(21, 13, -1)]
+
+
+def test_filters_and_counts(session, test_sensor, alerts):
+    """Test: Filtros por estado y tipo coherentes entre listado y recuento"""
+    sensor_ids = [test_sensor.id]
+    
+    assert count_alerts(session, sensor_ids) == 30
+    assert count_alerts(session, sensor_ids, acknowledged=False) == 20
+    assert count_alerts(session, sensor_ids, acknowledged=False, alert_type="HIGH") == 10
+    assert count_alerts(session, sensor_ids, alert_type="all") == 30
+    
+    pending_high = list_alerts(session, sensor_ids, acknowledged=False, alert_type="HIGH")
+    assert len(pending_high) == 10
+    assert all(a.type == "HIGH" and not a.acknowledged for a, _, _ in pending_high)
+
+
+def test_no_sensors_returns_nothing(engine, session, alerts):
+    """Test: Sin sensores accesibles no se consulta la BD"""
+    statements = count_queries(engine)
+    
+    assert list_alerts(session, []) == []
+    assert count_alerts(session, []) == 0
+    assert statements == []
+
+
+def test_latest_readings(session, test_sensor, test_parcel):
+    """Test: Última lectura de cada sensor en una sola consulta"""
+    other = Sensor(
+        id_code="TEST-HUM-01", parcel_id=test_parcel.id, type="humedad_ambiente",
+        unit="%", description="", threshold_low=20.0, threshold_high=80.0,
+    )
+    session.add(other)
+    session.commit()
+    
+    base = datetime(2025, 1, 1, 12, 0)
+    for i in range(3):
+        session.add(SensorData(sensor_id=test_sensor.id, timestamp=base + timedelta(minutes=i),
+                               value=20.0 + i, raw="{}"))
+    session.commit()
+    
+    readings = latest_readings(session, [test_sensor.id, other.id])
+    
+    assert set(readings) == {test_sensor.id}
+    assert readings[test_sensor.id].value == 22.0
+
+
+def test_acknowledge_alerts_single_update(engine, session, test_sensor, alerts):
+    """Test: La confirmación en bloque es un único UPDATE y devuelve el recuento"""
+    sensor_ids = [test_sensor.id]
+    statements = count_queries(engine)
+    
+    count = acknowledge_alerts(session, sensor_ids, alert_type="HIGH")
+    session.commit()
+    
+    assert count == 10
+    assert len(statements) == 1
+    assert statements[0].startswith("UPDATE alert")
+    assert count_alerts(session, sensor_ids, acknowledged=False) == 10
+    assert count_alerts(session, sensor_ids, acknowledged=False, alert_type="HIGH") == 0
+
+
+def test_acknowledge_alerts_time_range(session, test_sensor, alerts):
+    """Test: El rango temporal limita las alertas confirmadas"""
+    start = datetime(2025, 1, 1, 12, 20)
+    end = datetime(2025, 1, 1, 12, 24)
+    
+    count = acknowledge_alerts(session, [test_sensor.id], start=start, end=end)
+    session.commit()
+    
+    assert count == 5
+    assert acknowledge_alerts(session, []) == 0
+
+
+def test_bulk_acknowledge_endpoint(engine, session, test_sensor, test_parcel, alerts):
+    """Test: El endpoint REST aplica los filtros y devuelve el número confirmado"""
+    from app.api.routes import AlertBulkAcknowledge, acknowledge_alerts_bulk
+    
+    filters = AlertBulkAcknowledge.model_validate(
+        {"parcel_id": test_parcel.id, "type": "LOW", "from": "2025-01-01T12:20:00"}
+    )
+    with patch('app.api.routes.engine', engine):
+        response = acknowledge_alerts_bulk(None, filters)
+    
+    assert json.loads(response.body) == {"status": "success", "acknowledged": 5}
+    assert count_alerts(session, [test_sensor.id], acknowledged=False, alert_type="LOW") == 5
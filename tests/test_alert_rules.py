@@ -0,0 +1,172 @@
+"""
+Tests para las reglas de alerta sobre el flujo de lecturas
+"""
+import random
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from sqlmodel import Session, select
+
+from app.models import Alert
+from app.services.alert_engine import AlertEngine
+from app.services.alert_rules import (
+    RateOfChangeRule,
+    RuleEngine,
+    StaleSensorWheel,
+    ZScoreRule,
+)
+from app.services.data_aggregator import SensorDataAggregator
+
+BASE = datetime(2025, 1, 1, 12, 0)
+
+
+def feed(engine_, sensor_id, values, step_seconds=5, start=BASE):
+    """Alimenta el motor con una serie de lecturas equiespaciadas"""
+    for i, value in enumerate(values):
+        at = start + timedelta(seconds=i * step_seconds)
+        engine_.on_reading(sensor_id, "temperatura", value, at, received=at.timestamp())
+
+
+def test_rate_of_change_rule():
+    """Test: La tasa se mide contra una referencia de al menos min_span_seconds"""
+    rule = RateOfChangeRule(limits={"temperatura": 2.0}, min_span_seconds=60)
+    state = rule.new_state()
+    
+    assert rule.evaluate(state, 1, "temperatura", 20.0, BASE) is None
+    assert rule.evaluate(state, 1, "temperatura", 25.0, BASE + timedelta(seconds=5)) is None
+    
+    result = rule.evaluate(state, 1, "temperatura", 21.0, BASE + timedelta(seconds=60))
+    assert not result.breached
+    assert result.metric == 1.0
+    
+    result = rule.evaluate(state, 1, "temperatura", 27.0, BASE + timedelta(seconds=120))
+    assert result.breached
+    assert result.metric == 6.0
+    
+    assert rule.evaluate(rule.new_state(), 1, "iluminacion", 500.0, BASE) is None
+
+
+def test_zscore_rule_detects_outlier():
+    """Test: El z-score ignora el ruido normal y detecta un valor atípico"""
+    rule = ZScoreRule(threshold=4.0, warmup=30)
+    state = rule.new_state()
+    rng = random.Random(42)
+    
+    results = [rule.evaluate(state, 1, "temperatura", 20.0 + rng.gauss(0, 0.5), BASE) for _ in range(200)]
+    
+    assert results[0] is None
+    assert not any(r.breached for r in results[30:])
+    outlier = rule.evaluate(state, 1, "temperatura", 30.0, BASE)
+    assert outlier.breached
+    assert outlier.metric > 10
+
+
+def test_stale_wheel_expires_only_silent_sensors():
+    """Test: La rueda sólo vence sensores sin datos y los recupera al llegar datos"""
+    wheel = StaleSensorWheel(timeout_seconds=300, tick_seconds=10, slots=8)
+    t0 = BASE.timestamp()
+    wheel.touch(1, t0)
+    wheel.touch(2, t0)
+    
+    for minute in range(1, 5):
+        wheel.touch(2, t0 + minute * 60)
+        assert wheel.advance(t0 + minute * 60) == []
+    
+    expired = wheel.advance(t0 + 310)
+    assert [sensor_id for sensor_id, _ in expired] == [1]
+    assert wheel.stale == {1}
+    assert wheel.touch(1, t0 + 320) is True
+    assert wheel.stale == set()
+
+
+def test_stale_wheel_repeats_while_silent():
+    """Test: Un sensor sin datos vuelve a vencer cada timeout"""
+    wheel = StaleSensorWheel(timeout_seconds=60, tick_seconds=10, slots=4)
+    t0 = BASE.timestamp()
+    wheel.touch(7, t0)
+    
+    expired = []
+    for second in range(0, 200, 10):
+        expired.extend(wheel.advance(t0 + second))
+    
+    assert [round(silent) for _, silent in expired] == [60, 120, 180]
+
+
+def test_rule_engine_episode_lifecycle():
+    """Test: Un episodio se abre una vez, acumula evaluaciones y se cierra al normalizarse"""
+    engine_ = RuleEngine(rules=[RateOfChangeRule(min_span_seconds=60)], stale_after_minutes=0, clear_after=2)
+    
+    # 20 -> 30 en un minuto y sigue subiendo: dos evaluaciones fuera de límite
+    feed(engine_, 1, [20.0] * 12 + [30.0] * 12 + [40.0] * 12)
+    episodes = engine_.drain()
+    assert len(episodes) == 1
+    assert episodes[0].alert_type == "RATE"
+    assert episodes[0].occurrences == 2
+    assert episodes[0].closed_at is None
+    
+    feed(engine_, 1, [40.0] * 25, start=BASE + timedelta(minutes=3))
+    episodes = engine_.drain()
+    assert len(episodes) == 1
+    assert episodes[0].occurrences == 0
+    assert episodes[0].closed_at is not None
+    assert engine_.drain() == []
+
+
+def test_rule_engine_offline_episode():
+    """Test: tick() abre el episodio OFFLINE y una lectura nueva lo cierra"""
+    engine_ = RuleEngine(rules=[], stale_after_minutes=5)
+    engine_.watch([3], now=BASE.timestamp())
+    
+    assert engine_.tick(now=BASE.timestamp() + 120) == 0
+    assert engine_.tick(now=BASE.timestamp() + 310) == 1
+    episode, = engine_.drain()
+    assert (episode.sensor_id, episode.alert_type, episode.occurrences) == (3, "OFFLINE", 1)
+    
+    feed(engine_, 3, [20.0], start=BASE + timedelta(minutes=6))
+    episode, = engine_.drain()
+    assert episode.closed_at == BASE + timedelta(minutes=6)
+
+
+def test_rule_episodes_persisted_as_single_alert(engine, session, test_sensor):
+    """Test: Los episodios de reglas se guardan como una alerta deduplicada"""
+    alert_engine = AlertEngine()
+    rule_engine = RuleEngine(rules=[], stale_after_minutes=5)
+    rule_engine.watch([test_sensor.id], now=BASE.timestamp())
+    
+    for minutes in (6, 12):
+        rule_engine.tick(now=BASE.timestamp() + minutes * 60)
+        alert_engine.apply_rule_episodes(session, rule_engine.drain())
+        session.commit()
+    
+    alerts = session.exec(select(Alert)).all()
+    assert len(alerts) == 1
+    assert alerts[0].type == "OFFLINE"
+    assert alerts[0].occurrences == 2
+    assert alerts[0].message.startswith("⚠️ TEST-TEMP-01: sin datos")
+    
+    feed(rule_engine, test_sensor.id, [20.0], start=BASE + timedelta(minutes=13))
+    alert_engine.apply_rule_episodes(session, rule_engine.drain())
+    session.commit()
+    session.refresh(alerts[0])
+    assert alerts[0].closed_at == BASE + timedelta(minutes=13)
+
+
+def test_aggregator_persists_rule_alerts(engine, test_sensor):
+    """Test: El agregador evalúa las reglas con cada lectura y guarda sus alertas"""
+    rule_engine = RuleEngine(rules=[RateOfChangeRule(min_span_seconds=0)], stale_after_minutes=0)
+    aggregator = SensorDataAggregator(interval_minutes=5, rule_engine=rule_engine)
+    now = datetime.now()
+    earlier = now - timedelta(seconds=30)
+    # Ambas lecturas a tiempo aunque caigan a ambos lados de un límite de intervalo
+    aggregator.window_start = aggregator._bucket_start(earlier)
+    
+    aggregator.add_reading(test_sensor.id, 'temperatura', {'temperatura': 20.0, 'timestamp': earlier})
+    aggregator.add_reading(test_sensor.id, 'temperatura', {'temperatura': 24.0, 'timestamp': now})
+    with patch('app.services.data_aggregator.engine', engine), \
+            patch('app.services.alert_writer.engine', engine):
+        aggregator._calculate_and_save_averages()
+    
+    with Session(engine) as session:
+        alerts = session.exec(select(Alert)).all()
+    assert [a.type for a in alerts] == ["RATE"]
+    assert alerts[0].peak_value == 8.0
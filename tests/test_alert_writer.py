@@ -0,0 +1,163 @@
+"""
+Tests para las alertas de umbral en el camino rápido y su writer asíncrono
+"""
+import time
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from sqlalchemy import event
+from sqlmodel import Session, select
+
+from app.models import Alert
+from app.services.alert_rules import RuleEngine, SensorThresholds, ThresholdCache, ThresholdRule
+from app.services.data_aggregator import SensorDataAggregator
+
+BASE = datetime(2025, 1, 1, 6, 0)
+
+
+def fast_path_engine(sensor, **settings):
+    """Motor de reglas sólo con umbrales HIGH/LOW cacheados para el sensor"""
+    thresholds = ThresholdCache()
+    thresholds.update({sensor.id: SensorThresholds(sensor.threshold_low, sensor.threshold_high, sensor.unit)})
+    return RuleEngine(
+        rules=[ThresholdRule("HIGH", thresholds, **settings), ThresholdRule("LOW", thresholds, **settings)],
+        stale_after_minutes=0,
+        thresholds=thresholds,
+    )
+
+
+def test_threshold_rule_debounce_and_hysteresis():
+    """Test: raise_after lecturas para abrir y margen de histéresis para cerrar"""
+    thresholds = ThresholdCache()
+    thresholds.update({1: SensorThresholds(10.0, 30.0, "°C")})
+    rule = ThresholdRule("LOW", thresholds, raise_after=2, hysteresis=0.1)
+    state = rule.new_state()
+    
+    assert rule.evaluate(state, 1, "temperatura", 5.0, BASE) is None
+    assert rule.evaluate(state, 1, "temperatura", 4.0, BASE).breached
+    # 11.0 está dentro del margen (10 + 10% de 20 = 12): sin decisión
+    assert rule.evaluate(state, 1, "temperatura", 11.0, BASE) is None
+    assert rule.evaluate(state, 1, "temperatura", 12.5, BASE).breached is False
+    assert rule.evaluate(state, 2, "temperatura", 0.0, BASE) is None
+
+
+def test_fast_path_episode_keeps_lowest_value(test_sensor):
+    """Test: El pico de un episodio LOW es el valor mínimo"""
+    rule_engine = fast_path_engine(test_sensor)
+    for i, value in enumerate([5.0, 2.0, 4.0]):
+        rule_engine.on_reading(test_sensor.id, "temperatura", value, BASE + timedelta(seconds=5 * i))
+    
+    episode, = rule_engine.drain()
+    assert (episode.alert_type, episode.peak, episode.occurrences) == ("LOW", 2.0, 3)
+
+
+def test_add_reading_alerts_within_seconds_without_db_io(engine, test_sensor):
+    """Test: Una lectura fuera de rango se guarda como alerta en segundo plano, sin I/O en add_reading"""
+    aggregator = SensorDataAggregator(interval_minutes=5, rule_engine=fast_path_engine(test_sensor))
+    statements = []
+    
+    with patch('app.services.alert_writer.engine', engine):
+        aggregator.alert_writer.start()
+        try:
+            event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+            aggregator.add_reading(test_sensor.id, 'temperatura', {'temperatura': -2.0})
+            # add_reading sólo encola: el writer escribe en su propio thread
+            add_reading_statements = len(statements)
+            
+            deadline = time.time() + 5
+            alerts = []
+            while not alerts and time.time() < deadline:
+                time.sleep(0.05)
+                with Session(engine) as session:
+                    alerts = session.exec(select(Alert)).all()
+        finally:
+            aggregator.alert_writer.stop()
+    
+    assert add_reading_statements == 0
+    assert len(alerts) == 1
+    assert alerts[0].type == "LOW"
+    assert alerts[0].message.startswith("⚠️ TEST-TEMP-01: temperatura bajo el mínimo")
+
+
+def test_fast_path_replaces_average_threshold_check(engine, test_sensor):
+    """Test: Con el camino rápido, la media no crea una segunda alerta del mismo episodio"""
+    aggregator = SensorDataAggregator(interval_minutes=5, rule_engine=fast_path_engine(test_sensor))
+    
+    with patch('app.services.data_aggregator.engine', engine), \
+            patch('app.services.alert_writer.engine', engine):
+        aggregator.add_reading(test_sensor.id, 'temperatura', {'temperatura': 40.0})
+        aggregator.add_reading(test_sensor.id, 'temperatura', {'temperatura': 42.0})
+        aggregator._calculate_and_save_averages()
+    
+    with Session(engine) as session:
+        alerts = session.exec(select(Alert)).all()
+    
+    assert len(alerts) == 1
+    assert alerts[0].type == "HIGH"
+    assert alerts[0].occurrences == 2
+    assert alerts[0].peak_value == 42.0
+
+
+def test_failed_flush_requeues_openings_and_closings(engine, test_sensor):
+    """Test: si falla la escritura, los episodios vuelven al motor y se guardan en el siguiente flush"""
+    from app.services.alert_engine import AlertEngine
+    from app.services.alert_writer import AlertWriter
+
+    rule_engine = fast_path_engine(test_sensor, clear_after=1)
+    writer = AlertWriter(rule_engine, AlertEngine())
+
+    def failing_session(*args, **kwargs):
+        raise RuntimeError("BD caída")
+
+    for i, value in enumerate([5.0, 2.0]):
+        rule_engine.on_reading(test_sensor.id, "temperatura", value, BASE + timedelta(seconds=5 * i))
+    with patch('app.services.alert_writer.Session', failing_session):
+        assert writer.flush() == 0
+    rule_engine.on_reading(test_sensor.id, "temperatura", 4.0, BASE + timedelta(seconds=10))
+    with patch('app.services.alert_writer.engine', engine):
+        assert writer.flush() == 1
+
+    with Session(engine) as session:
+        alert = session.exec(select(Alert)).one()
+        assert (alert.type, alert.occurrences, alert.peak_value) == ("LOW", 3, 2.0)
+
+    # Un cierre perdido dejaría la alerta abierta para siempre
+    rule_engine.on_reading(test_sensor.id, "temperatura", 20.0, BASE + timedelta(seconds=15))
+    with patch('app.services.alert_writer.Session', failing_session):
+        assert writer.flush() == 0
+    with patch('app.services.alert_writer.engine', engine):
+        assert writer.flush() == 1
+
+    with Session(engine) as session:
+        alert = session.exec(select(Alert)).one()
+        assert alert.closed_at == BASE + timedelta(seconds=15)
+
+
+def test_requeued_close_applies_before_newer_episode(engine, test_sensor):
+    """Test: un cierre reencolado se aplica antes que una apertura posterior del mismo sensor y tipo"""
+    from app.services.alert_engine import AlertEngine
+    from app.services.alert_writer import AlertWriter
+
+    rule_engine = fast_path_engine(test_sensor, clear_after=1)
+    writer = AlertWriter(rule_engine, AlertEngine())
+
+    def failing_session(*args, **kwargs):
+        # Mientras se escribe, el thread MQTT abre un episodio nuevo; después falla la BD
+        rule_engine.on_reading(test_sensor.id, "temperatura", 3.0, BASE + timedelta(seconds=10))
+        raise RuntimeError("BD caída")
+
+    rule_engine.on_reading(test_sensor.id, "temperatura", 5.0, BASE)
+    with patch('app.services.alert_writer.engine', engine):
+        assert writer.flush() == 1
+    rule_engine.on_reading(test_sensor.id, "temperatura", 20.0, BASE + timedelta(seconds=5))
+    with patch('app.services.alert_writer.Session', failing_session):
+        assert writer.flush() == 0
+    with patch('app.services.alert_writer.engine', engine):
+        assert writer.flush() == 2
+
+    with Session(engine) as session:
+        first, second = session.exec(select(Alert).order_by(Alert.id)).all()
+    assert first.closed_at == BASE + timedelta(seconds=5)
+    assert first.peak_value == 5.0
+    assert second.closed_at is None
+    assert second.peak_value == 3.0
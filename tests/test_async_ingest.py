@@ -0,0 +1,183 @@
+"""
+Tests para la ingesta asyncio (MQTT, parseo y agregación en un único event loop)
+"""
+import asyncio
+import time
+from contextlib import ExitStack
+from unittest.mock import Mock, patch
+
+import paho.mqtt.client as mqtt
+from sqlmodel import select
+
+from app.models import Sensor, SensorData
+from app.services.async_ingest import AsyncIngestService, AsyncioPahoLoop
+from app.services.data_aggregator import SensorDataAggregator
+from app.services.maiota_client import MAIoTAMultiSensorClient
+from app.services.mqtt_transport import InMemoryBroker
+
+FRAME = "CIoTA-D1=2603&D2=5411&D3=2542&D4=43&D5=580&D6=103&D7=1&"
+ENGINE_TARGETS = (
+    "app.services.ingest.engine",
+    "app.services.data_aggregator.engine",
+    "app.services.alert_writer.engine",
+)
+
+
+def add_sensors(session, parcel_id, topics):
+    sensors = [
+        Sensor(id_code=f"S-{i}", parcel_id=parcel_id, type="temperature", unit="°C",
+               description="", threshold_low=0.0, threshold_high=50.0, mqtt_topic=topic)
+        for i, topic in enumerate(topics)
+    ]
+    session.add_all(sensors)
+    session.commit()
+    return sensors
+
+
+def make_service(broker, aggregator=None, queue_size=1000):
+    client = MAIoTAMultiSensorClient(broker="memory", transport_factory=broker.client)
+    return AsyncIngestService(client=client, aggregator=aggregator or SensorDataAggregator(interval_minutes=5),
+                              refresh_seconds=0, retention=Mock(), queue_size=queue_size)
+
+
+async def wait_subscribed(broker, topic):
+    while not broker._exact.get(topic):
+        await asyncio.sleep(0.01)
+
+
+def test_pipeline_saves_averages_on_stop(engine, session, test_parcel):
+    """Test: los frames pasan por las colas hasta el agregador y stop() guarda las medias"""
+    sensors = add_sensors(session, test_parcel.id, ["farm/a", "farm/a", "farm/b"])
+    broker = InMemoryBroker()
+    service = make_service(broker)
+
+    async def scenario():
+        await service.start()
+        await asyncio.wait_for(wait_subscribed(broker, "farm/b"), 5)
+        for _ in range(10):
+            broker.publish("farm/a", FRAME)
+            broker.publish("farm/b", FRAME)
+        await service.drain()
+        readings = service.readings
+        await service.stop()
+        return readings
+
+    with ExitStack() as stack:
+        for target in ENGINE_TARGETS:
+            stack.enter_context(patch(target, engine))
+        readings = asyncio.run(scenario())
+
+    assert readings == 30  # 2 sensores en farm/a y 1 en farm/b
+    assert service.received == 20
+    rows = session.exec(select(SensorData)).all()
+    assert {row.sensor_id for row in rows} == {s.id for s in sensors}
+    assert all(row.value == 26.03 for row in rows)
+    service.ingest.retention.start.assert_called_once()
+    service.ingest.retention.stop.assert_called_once()
+
+
+def test_full_queue_drops_instead_of_blocking(engine, session, test_parcel):
+    """Test: con la cola de mensajes llena se descartan mensajes sin bloquear al que publica"""
+    add_sensors(session, test_parcel.id, ["farm/a"])
+    broker = InMemoryBroker()
+    aggregator = Mock()
+    service = make_service(broker, aggregator=aggregator, queue_size=5)
+
+    async def scenario():
+        await service.start()
+        await asyncio.wait_for(wait_subscribed(broker, "farm/a"), 5)
+        # Sin ceder el loop: el parseo no puede vaciar la cola mientras se publica
+        for _ in range(20):
+            broker.publish("farm/a", FRAME)
+        await service.drain()
+        service.running = False  # Evitar el guardado final del agregador simulado
+        service._stop.set()
+        for task in service._tasks:
+            task.cancel()
+        await asyncio.gather(*service._tasks, return_exceptions=True)
+
+    with patch("app.services.ingest.engine", engine):
+        asyncio.run(scenario())
+
+    assert (service.received, service.dropped) == (20, 15)
+    assert aggregator.add_reading.call_count == 5
+
+
+def test_rule_episodes_are_saved_from_the_loop(engine, session, test_parcel):
+    """Test: los episodios del motor de reglas se guardan desde la tarea de alertas"""
+    add_sensors(session, test_parcel.id, ["farm/a"])
+    broker = InMemoryBroker()
+    aggregator = SensorDataAggregator(interval_minutes=5)
+    service = make_service(broker, aggregator=aggregator)
+
+    async def scenario():
+        await service.start()
+        await asyncio.wait_for(wait_subscribed(broker, "farm/a"), 5)
+        with patch.object(aggregator.alert_writer, "flush", wraps=aggregator.alert_writer.flush) as flush:
+            aggregator.rule_engine.on_change()
+            await asyncio.sleep(0.1)
+            assert flush.called
+        await service.stop()
+
+    with ExitStack() as stack:
+        for target in ENGINE_TARGETS:
+            stack.enter_context(patch(target, engine))
+        asyncio.run(scenario())
+
+    # Al terminar, el motor de reglas vuelve a avisar al writer con threads
+    assert aggregator.rule_engine.on_change == aggregator.alert_writer.notify
+    assert aggregator.alert_writer.thread is None
+
+
+def test_flush_loop_ticks_stale_sensor_wheel(engine, session, test_parcel):
+    """Test: sin thread de agregación, la tarea de guardados avanza la rueda de sensores sin datos"""
+    add_sensors(session, test_parcel.id, ["farm/a"])
+    broker = InMemoryBroker()
+    aggregator = SensorDataAggregator(interval_minutes=60)
+    service = make_service(broker, aggregator=aggregator)
+
+    async def scenario():
+        with patch.object(aggregator, "_next_boundary", return_value=time.time() + 0.05), \
+             patch.object(aggregator.rule_engine, "tick", wraps=aggregator.rule_engine.tick) as tick:
+            await service.start()
+            assert service.flushing
+            await asyncio.sleep(0.3)
+            assert tick.call_count == 1
+            await service.stop()
+        assert not service.flushing
+
+    with ExitStack() as stack:
+        for target in ENGINE_TARGETS:
+            stack.enter_context(patch(target, engine))
+        asyncio.run(scenario())
+
+    assert aggregator.running is False  # El agregador no tiene thread propio en modo asyncio
+
+
+def test_paho_sockets_are_watched_by_the_loop():
+    """Test: con paho, el socket se registra en el event loop en lugar de un thread loop_forever"""
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        transport = Mock(spec=mqtt.Client)
+        network = AsyncioPahoLoop(transport, loop)
+        sock = Mock()
+        with patch.object(loop, "add_reader") as add_reader, patch.object(loop, "add_writer") as add_writer:
+            network._on_socket_open(transport, None, sock)
+            network._on_socket_register_write(transport, None, sock)
+        add_reader.assert_called_once_with(sock, transport.loop_read)
+        add_writer.assert_called_once_with(sock, transport.loop_write)
+
+    asyncio.run(scenario())
+
+
+def test_cli_runs_asyncio_worker():
+    """Test: --asyncio ejecuta la ingesta asyncio con la partición indicada"""
+    from app.ingest import main
+
+    with patch("app.ingest.AsyncIngestService") as service_cls, \
+         patch("app.ingest.asyncio.run") as run, patch("app.ingest.init_database"):
+        assert main(["--asyncio", "--partition", "1/2"]) == 0
+
+    partition = service_cls.from_env.call_args.kwargs["partition"]
+    assert (partition.index, partition.count) == (1, 2)
+    run.assert_called_once()
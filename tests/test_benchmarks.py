@@ -0,0 +1,56 @@
+"""
+Tests para la suite de benchmarks (ejecución reducida y detección de regresiones)
+"""
+import json
+
+from benchmarks.run import SUITES, compare, main, run_suite
+
+
+def test_quick_suite_reports_every_benchmark():
+    """Test: la suite reducida produce un resultado por benchmark con mediana y p95"""
+    report = run_suite(quick=True)
+
+    assert set(report["results"]) == {
+        "parse_payload", "add_reading_contention", "ingest_pipeline", "ingest_pipeline_asyncio", "flush_10", "flush_100", "dashboard_stats", "history_api",
+        "login_concurrent",
+    }
+    for result in report["results"].values():
+        assert 0 < result["median_seconds"] <= result["p95_seconds"]
+    assert report["quick"] is True
+    assert len(SUITES) == 7
+
+
+def test_compare_flags_regressions_over_threshold():
+    """Test: sólo se marca regresión al superar el umbral relativo"""
+    baseline = {"results": {"a": {"median_seconds": 1.0}, "b": {"median_seconds": 1.0}}}
+    report = {"results": {
+        "a": {"median_seconds": 1.2},
+        "b": {"median_seconds": 1.3},
+        "nuevo": {"median_seconds": 5.0},  # Sin referencia: no se compara
+    }}
+
+    rows = {row["name"]: row for row in compare(report, baseline, threshold=0.25)}
+
+    assert set(rows) == {"a", "b"}
+    assert rows["a"]["regression"] is False
+    assert rows["b"]["regression"] is True
+    assert rows["b"]["ratio"] == 1.3
+
+
+def test_cli_writes_json_and_fails_on_regression(tmp_path):
+    """Test: la CLI escribe el informe y sale con 1 si empeora respecto a la referencia"""
+    baseline_path = tmp_path / "baseline.json"
+    baseline_path.write_text(json.dumps({"results": {"parse_payload": {"median_seconds": 1e-9}}}))
+    output_path = tmp_path / "bench.json"
+    history_path = tmp_path / "history.jsonl"
+
+    exit_code = main([
+        "--quick", "--only", "parse", "--output", str(output_path),
+        "--history", str(history_path), "--baseline", str(baseline_path),
+    ])
+
+    assert exit_code == 1
+    report = json.loads(output_path.read_text())
+    assert report["comparison"]["rows"][0]["regression"] is True
+    assert len(history_path.read_text().splitlines()) == 1
+    assert main(["--only", "desconocido"]) == 2
@@ -0,0 +1,157 @@
+"""
+Tests para el archivo frío del histórico (ficheros columnares por sensor y mes)
+"""
+import json
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytest
+from sqlmodel import select
+
+from app.models import SensorData
+from app.services.cold_archive import ColdArchive, decode_points, encode_points
+from app.services.retention import RetentionJob
+
+NOW = datetime(2025, 6, 15, 12, 0)
+
+
+@pytest.fixture(name="archive")
+def archive_fixture(engine, tmp_path):
+    with patch("app.services.cold_archive.engine", engine):
+        yield ColdArchive(str(tmp_path / "archive"))
+
+
+def add_hourly(session, sensor_id, start, hours, value=lambda i: 20.0 + i % 5):
+    for i in range(hours):
+        session.add(SensorData(sensor_id=sensor_id, timestamp=start + timedelta(hours=i),
+                               value=value(i), raw=json.dumps({"aggregated": True})))
+    session.commit()
+
+
+def test_encode_decode_roundtrip():
+    """Test: los deltas de tiempo y los valores se recuperan sin pérdida y comprimidos"""
+    points = [(datetime(2025, 1, 1) + timedelta(minutes=5 * i), 20.0 + i / 100) for i in range(100)]
+
+    content = encode_points(points)
+    seconds, values = decode_points(content)
+
+    # Frente a 12 bytes por punto sin comprimir (deltas int32 y float64)
+    assert len(content) < 4 * 100
+    assert [datetime(1970, 1, 1) + timedelta(seconds=s) for s in seconds] == [ts for ts, _ in points]
+    assert list(values) == [value for _, value in points]
+
+
+def test_decode_range_reads_only_overlapping_blocks():
+    """Test: con un rango sólo se descomprimen los bloques que lo solapan"""
+    points = [(datetime(2025, 1, 1) + timedelta(minutes=i), float(i)) for i in range(100)]
+    content = encode_points(points, block_size=10)
+    start = int((datetime(2025, 1, 1, 0, 42) - datetime(1970, 1, 1)).total_seconds())
+
+    seconds, values = decode_points(content, start, start + 60 * 5)
+
+    assert values == [float(i) for i in range(40, 50)]
+    assert len(seconds) == 10
+
+
+def test_export_moves_complete_months(archive, session, test_sensor):
+    """Test: sólo se exportan los meses completos anteriores a la frontera, y salen de la BD"""
+    add_hourly(session, test_sensor.id, datetime(2025, 1, 1), 24 * 31)  # Enero completo
+    add_hourly(session, test_sensor.id, datetime(2025, 2, 1), 24 * 3)
+    add_hourly(session, test_sensor.id, datetime(2025, 3, 10), 24)  # Mes de la frontera
+
+    rows, files = archive.export(datetime(2025, 3, 20), chunk_size=100)
+
+    assert (rows, files) == (24 * 34, 2)
+    remaining = session.exec(select(SensorData)).all()
+    assert len(remaining) == 24
+    assert all(r.timestamp >= datetime(2025, 3, 1) for r in remaining)
+
+    entries = {e.month: e for e in archive.files(test_sensor.id)}
+    assert set(entries) == {"2025-01", "2025-02"}
+    assert entries["2025-01"].count == 24 * 31
+    assert entries["2025-01"].end == datetime(2025, 1, 31, 23).isoformat()
+    # Comprimido: muy por debajo de los 12 bytes por punto de las columnas en bruto
+    assert entries["2025-01"].bytes < 24 * 31 * 2
+
+
+def test_history_crosses_hot_cold_boundary(archive, session, test_sensor):
+    """Test: el histórico combina archivo y BD de forma transparente"""
+    add_hourly(session, test_sensor.id, datetime(2025, 1, 30), 24 * 4, value=lambda i: float(i))
+    archive.export(datetime(2025, 2, 10))
+
+    points = archive.read_history(session, test_sensor.id, start=datetime(2025, 1, 31, 22))
+    assert [p.timestamp for p in points][:3] == [
+        datetime(2025, 1, 31, 22), datetime(2025, 1, 31, 23), datetime(2025, 2, 1, 0),
+    ]
+    assert points[0].id is None and points[2].id is not None
+    assert [p.value for p in points] == [float(i) for i in range(46, 96)]
+
+    newest = archive.read_history(session, test_sensor.id, limit=3, newest_first=True)
+    assert [p.value for p in newest] == [95.0, 94.0, 93.0]
+
+    # Un rango sólo frío y acotado por los dos extremos
+    cold = archive.read_history(session, test_sensor.id, start=datetime(2025, 1, 30, 1),
+                                end=datetime(2025, 1, 30, 3))
+    assert [p.value for p in cold] == [1.0, 2.0, 3.0]
+
+
+def test_manifest_is_shared_between_instances(archive, session, test_sensor, tmp_path):
+    """Test: otro proceso (otra instancia) ve los ficheros exportados por la ingesta"""
+    add_hourly(session, test_sensor.id, datetime(2025, 1, 1), 24)
+    reader = ColdArchive(str(tmp_path / "archive"))
+    assert reader.cold_end(test_sensor.id) is None
+
+    archive.export(datetime(2025, 3, 1))
+
+    assert reader.cold_end(test_sensor.id) == datetime(2025, 1, 1, 23)
+    assert len(reader.read(test_sensor.id)) == 24
+
+
+def test_export_merges_into_existing_month(archive, session, test_sensor):
+    """Test: datos tardíos de un mes ya archivado se fusionan en su fichero"""
+    add_hourly(session, test_sensor.id, datetime(2025, 1, 1), 10)
+    archive.export(datetime(2025, 3, 1))
+    add_hourly(session, test_sensor.id, datetime(2025, 1, 20), 5)
+
+    rows, files = archive.export(datetime(2025, 3, 1))
+
+    assert (rows, files) == (5, 1)
+    (entry,) = archive.files(test_sensor.id)
+    assert entry.count == 15
+    assert len(archive.read(test_sensor.id)) == 15
+
+
+def test_retention_exports_and_expires_cold_files(archive, engine, session, test_sensor):
+    """Test: la retención exporta al archivo frío y aplica el TTL también a los ficheros"""
+    add_hourly(session, test_sensor.id, datetime(2024, 4, 1), 24)  # Más antiguo que el TTL
+    add_hourly(session, test_sensor.id, datetime(2025, 1, 1), 24)
+    job = RetentionJob(interval_days=0, hourly_days=365, alert_days=0, cold_days=90,
+                       pause_seconds=0, archive=archive)
+
+    with patch("app.services.retention.engine", engine):
+        report = job.run(now=NOW)
+
+    assert report.deleted_rows == 24
+    assert (report.cold_rows, report.cold_files) == (24, 1)
+    assert session.exec(select(SensorData)).all() == []
+
+    with patch("app.services.retention.engine", engine):
+        report = job.run(now=NOW + timedelta(days=365))
+    assert report.expired_files == 1
+    assert archive.files() == []
+
+
+def test_history_api_reads_archive(archive, engine, session, test_sensor):
+    """Test: GET /sensors/{id}/data devuelve también los puntos archivados"""
+    from app.api.routes import get_sensor_history
+
+    add_hourly(session, test_sensor.id, datetime(2025, 1, 31, 22), 4, value=lambda i: float(i))
+    archive.export(datetime(2025, 2, 10))
+
+    with patch("app.api.routes.engine", engine), patch("app.api.routes.cold_archive", archive):
+        response = get_sensor_history(None, test_sensor.id, start=None, end=None, limit=3)
+
+    data = json.loads(response.body)
+    assert [point["value"] for point in data] == [3.0, 2.0, 1.0]
+    assert data[0]["id"] is not None
+    assert data[2]["id"] is None and data[2]["timestamp"] == "2025-01-31T23:00:00"
@@ -2,11 +2,17 @@
 """
 Tests para el agregador de datos de sensores
 """
+import json
+import os
 import pytest
 import time
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from unittest.mock import Mock, patch
 
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from app.models import Alert, SensorData
 from app.services.data_aggregator import SensorDataAggregator
 
 
@@ -150,3 +156,224 @@ def test_average_calculation(values, expected_avg):
     # Calcular media manualmente para verificar
     calculated_avg = sum(values) / len(values)
     assert abs(calculated_avg - expected_avg) < 0.01  # Tolerancia de precisión
+
+
+def test_bucket_start_aligned_to_wall_clock():
+    """Test: Los intervalos se alinean con el reloj (:00, :05, :10...)"""
+    aggregator = SensorDataAggregator(interval_minutes=5)
+    
+    assert aggregator._bucket_start(datetime(2025, 1, 1, 10, 7, 42)) == datetime(2025, 1, 1, 10, 5)
+    assert aggregator._bucket_start(datetime(2025, 1, 1, 10, 5, 0)) == datetime(2025, 1, 1, 10, 5)
+    assert aggregator._bucket_start(datetime(2025, 1, 1, 10, 4, 59)) == datetime(2025, 1, 1, 10, 0)
+
+
+def test_next_boundary_does_not_drift():
+    """Test: El próximo límite depende del reloj, no del inicio del proceso"""
+    aggregator = SensorDataAggregator(interval_minutes=1)
+    
+    assert aggregator._next_boundary(120.0) == 180.0
+    assert aggregator._next_boundary(125.3) == 180.0
+    assert aggregator._next_boundary(179.99) == 180.0
+
+
+def test_stop_wakes_loop_immediately():
+    """Test: stop() no espera al siguiente intervalo"""
+    aggregator = SensorDataAggregator(interval_minutes=5)
+    
+    with patch.object(aggregator, '_calculate_and_save_averages'):
+        aggregator.start()
+        started = time.monotonic()
+        aggregator.stop()
+        elapsed = time.monotonic() - started
+    
+    assert elapsed < 1.0
+    assert aggregator.running is False
+    assert aggregator.thread is None
+
+
+def test_averages_stamped_with_bucket_start(engine):
+    """Test: Las medias se guardan con el inicio del intervalo, no con datetime.now()"""
+    aggregator = SensorDataAggregator(interval_minutes=5)
+    now = datetime.now()
+    aggregator.add_reading(1, 'temperatura', {'temperatura': 20.0, 'timestamp': now})
+    aggregator.add_reading(1, 'temperatura', {'temperatura': 22.0, 'timestamp': now})
+    
+    with patch('app.services.data_aggregator.engine', engine):
+        aggregator._calculate_and_save_averages()
+    
+    with Session(engine) as session:
+        rows = session.exec(select(SensorData)).all()
+    
+    assert len(rows) == 1
+    assert rows[0].timestamp == aggregator._bucket_start(now)
+    assert rows[0].value == 21.0
+
+
+def test_reading_bucketed_by_event_time():
+    """Test: Las lecturas con timestamp propio van al intervalo de su tiempo de evento"""
+    aggregator = SensorDataAggregator(interval_minutes=5, allowed_lateness_minutes=60)
+    event_time = aggregator.window_start - timedelta(minutes=12)
+    
+    status = aggregator.add_reading(1, 'temperatura', {'temperatura': 18.0, 'timestamp': event_time})
+    
+    assert status == "late"
+    assert len(aggregator.buffer) == 0
+    bucket = aggregator._bucket_start(event_time)
+    assert aggregator.late_buffer[bucket][1]['temperatura'] == [18.0]
+
+
+def test_reading_beyond_allowed_lateness_dropped():
+    """Test: Las lecturas más antiguas que el retraso permitido se descartan"""
+    aggregator = SensorDataAggregator(interval_minutes=5, allowed_lateness_minutes=10)
+    old_time = datetime.now() - timedelta(hours=2)
+    
+    status = aggregator.add_reading(1, 'temperatura', {'temperatura': 18.0, 'timestamp': old_time})
+    
+    assert status == "dropped"
+    assert aggregator.late_dropped == 1
+    assert len(aggregator.late_buffer) == 0
+
+
+def test_late_readings_merged_into_flushed_bucket(engine):
+    """Test: Las lecturas tardías actualizan el registro ya guardado de su intervalo"""
+    aggregator = SensorDataAggregator(interval_minutes=5)
+    now = datetime.now()
+    aggregator.add_reading(1, 'temperatura', {'temperatura': 20.0, 'timestamp': now})
+    aggregator.add_reading(1, 'temperatura', {'temperatura': 22.0, 'timestamp': now})
+    
+    with patch('app.services.data_aggregator.engine', engine):
+        aggregator._calculate_and_save_averages()
+        
+        # El intervalo ya está guardado: simular que el reloj avanzó al siguiente
+        aggregator.window_start += timedelta(minutes=5)
+        status = aggregator.add_reading(1, 'temperatura', {'temperatura': 30.0, 'timestamp': now})
+        aggregator._calculate_and_save_averages()
+    
+    assert status == "late"
+    with Session(engine) as session:
+        rows = session.exec(select(SensorData)).all()
+    
+    assert len(rows) == 1
+    assert rows[0].value == 24.0
+    summary = json.loads(rows[0].raw)
+    assert summary['samples_count'] == 3
+    assert summary['min'] == 20.0
+    assert summary['max'] == 30.0
+    assert summary['late_samples'] == 1
+
+
+def test_out_of_range_intervals_update_single_alert(engine, test_sensor):
+    """Test: Varios intervalos fuera de rango actualizan una única alerta (episodio)"""
+    aggregator = SensorDataAggregator(interval_minutes=5)
+    
+    with patch('app.services.data_aggregator.engine', engine):
+        for value in (35.0, 38.0, 36.0):
+            aggregator.add_reading(test_sensor.id, 'temperatura', {'temperatura': value})
+            aggregator._calculate_and_save_averages()
+    
+    with Session(engine) as session:
+        alerts = session.exec(select(Alert)).all()
+    
+    assert len(alerts) == 1
+    assert alerts[0].occurrences == 3
+    # Mismo intervalo fusionado: medias 35.0, 36.5 y 36.33
+    assert alerts[0].peak_value == 36.5
+
+
+def test_flush_merges_into_row_saved_by_another_process(engine):
+    """Test: Si otro proceso ya guardó el intervalo, el upsert fusiona en lugar de duplicar"""
+    aggregator = SensorDataAggregator(interval_minutes=5)
+    now = datetime.now()
+    bucket = aggregator._bucket_start(now)
+    other = {'aggregated': True, 'samples_count': 2, 'avg': 10.0, 'min': 9.0, 'max': 11.0,
+             'sensor_type': 'temperatura'}
+    with Session(engine) as session:
+        session.add(SensorData(sensor_id=1, timestamp=bucket, value=10.0, raw=json.dumps(other)))
+        session.commit()
+    aggregator.add_reading(1, 'temperatura', {'temperatura': 40.0, 'timestamp': now})
+    
+    with patch('app.services.data_aggregator.engine', engine):
+        aggregator._calculate_and_save_averages()
+    
+    with Session(engine) as session:
+        rows = session.exec(select(SensorData)).all()
+        assert len(rows) == 1
+        assert rows[0].value == 20.0
+        assert json.loads(rows[0].raw)['samples_count'] == 3
+        # El índice único impide un segundo registro del mismo sensor e intervalo
+        session.add(SensorData(sensor_id=1, timestamp=bucket, value=0.0, raw="{}"))
+        with pytest.raises(IntegrityError):
+            session.commit()
+
+
+def test_api_reading_saved_without_flushing_other_sensors(engine, test_sensor):
+    """Test: POST de una lectura guarda sólo su intervalo, devuelve data_id y no vacía los buffers"""
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    
+    from app.api.routes import router
+    
+    api = FastAPI()
+    api.include_router(router)
+    aggregator = SensorDataAggregator(interval_minutes=5)
+    aggregator.add_reading(99, 'temperatura', {'temperatura': 15.0})
+    
+    with patch('app.api.routes.engine', engine), \
+         patch('app.api.routes.data_aggregator', aggregator), \
+         patch('app.services.data_aggregator.engine', engine), \
+         patch('app.services.alert_writer.engine', engine):
+        client = TestClient(api)
+        first = client.post(f"/sensors/{test_sensor.id}/data", json={"value": 20.0})
+        second = client.post(f"/sensors/{test_sensor.id}/data", json={"value": 22.0})
+    
+    assert first.status_code == 200
+    assert first.json()["data_id"] is not None
+    assert second.json()["data_id"] == first.json()["data_id"]
+    assert aggregator.buffer[99]['temperatura'] == [15.0]
+    with Session(engine) as session:
+        rows = session.exec(select(SensorData)).all()
+    assert len(rows) == 1
+    assert rows[0].value == 21.0
+    assert json.loads(rows[0].raw)['samples_count'] == 2
+
+
+@pytest.fixture
+def madrid_tz():
+    previous = os.environ.get('TZ')
+    os.environ['TZ'] = 'Europe/Madrid'
+    time.tzset()
+    yield
+    if previous is None:
+        os.environ.pop('TZ')
+    else:
+        os.environ['TZ'] = previous
+    time.tzset()
+
+
+def test_api_reading_timestamps_are_local_time(engine, test_sensor, madrid_tz):
+    """Test: sin timestamp se usa la hora de llegada y uno con zona se pasa a hora local (UTC+N)"""
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    
+    from app.api.routes import router
+    
+    api = FastAPI()
+    api.include_router(router)
+    aggregator = SensorDataAggregator(interval_minutes=5)
+    utc_now = datetime.now(timezone.utc).isoformat()
+    
+    with patch('app.api.routes.engine', engine), \
+         patch('app.api.routes.data_aggregator', aggregator), \
+         patch('app.services.data_aggregator.engine', engine), \
+         patch('app.services.alert_writer.engine', engine):
+        client = TestClient(api)
+        missing = client.post(f"/sensors/{test_sensor.id}/data", json={"value": 20.0})
+        aware = client.post(f"/sensors/{test_sensor.id}/data", json={"value": 22.0, "timestamp": utc_now})
+    
+    assert missing.status_code == 200
+    assert missing.json()["aggregation"] == "on_time"
+    assert aware.json()["aggregation"] == "on_time"
+    with Session(engine) as session:
+        rows = session.exec(select(SensorData)).all()
+    assert len(rows) == 1
+    assert rows[0].timestamp == aggregator._bucket_start(datetime.now())
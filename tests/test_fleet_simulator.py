@@ -0,0 +1,124 @@
+"""
+Tests para el simulador de flota de dispositivos MAIoTA
+"""
+from contextlib import ExitStack
+from unittest.mock import patch
+
+from sqlmodel import select
+
+from app.models import Sensor, SensorData
+from app.services.fleet_simulator import FleetSimulator, encode_frame, register_fleet, run_in_process
+from app.services.maiota_client import MAIoTAMultiSensorClient
+
+ENGINE_TARGETS = (
+    "app.services.fleet_simulator.engine",
+    "app.services.ingest.engine",
+    "app.services.data_aggregator.engine",
+    "app.services.alert_writer.engine",
+)
+
+
+def collect(**kwargs):
+    frames = []
+    simulator = FleetSimulator(publish=lambda topic, payload: frames.append((topic, payload)), seed=7, **kwargs)
+    return simulator, frames
+
+
+def test_frames_roundtrip_through_parser():
+    """Test: los frames generados se parsean con los mismos valores (incluido el ↓ de suelo seco)"""
+    values = {"temperatura": 26.03, "humedad_ambiente": 54.11, "humedad_suelo": 8.5,
+              "iluminacion": 4.3, "co2": 580, "cov": 103, "nox": 1}
+
+    payload = encode_frame(values)
+    parsed = MAIoTAMultiSensorClient()._parse_maiota_payload(payload)
+
+    assert payload == "CIoTA-D1=2603&D2=5411&D3=↓850&D4=43&D5=580&D6=103&D7=1&"
+    assert parsed["temperatura"] == 26.03
+    assert parsed["humedad_suelo"] == 8.5
+    assert parsed["humedad_suelo_baja"] is True
+
+
+def test_schedule_respects_rate_per_device():
+    """Test: con reloj simulado cada dispositivo envía ~rate·duración frames, repartidos en el tiempo"""
+    simulator, frames = collect(devices=50, rate=2, jitter=0.2, episode_probability=0, dropout_probability=0)
+
+    stats = simulator.run(duration=10, realtime=False)
+
+    assert stats.sent == len(frames)
+    per_topic = {}
+    for topic, _ in frames:
+        per_topic[topic] = per_topic.get(topic, 0) + 1
+    assert len(per_topic) == 50
+    assert all(18 <= count <= 22 for count in per_topic.values())
+    # Arranque escalonado: los primeros frames no son todos del mismo dispositivo ni en bloque
+    assert len({topic for topic, _ in frames[:50]}) > 25
+
+
+def test_episodes_and_dropouts():
+    """Test: los episodios llevan valores fuera de rango y los cortes dejan de enviar frames"""
+    simulator, frames = collect(devices=20, rate=1, episode_probability=0.05, dropout_probability=0.01,
+                                dropout_seconds=30)
+
+    stats = simulator.run(duration=300, realtime=False)
+
+    assert stats.episodes > 0 and stats.dropouts > 0
+    assert abs(stats.sent + stats.skipped - 20 * 300) < 200
+    assert stats.skipped >= stats.dropouts
+    client = MAIoTAMultiSensorClient()
+    parsed = [client._parse_maiota_payload(payload) for _, payload in frames]
+    assert any(p["temperatura"] > 40 or p["humedad_suelo_baja"] or p["co2"] > 2000 for p in parsed)
+
+
+def test_seed_reproduces_sequence():
+    """Test: misma semilla, misma secuencia de frames"""
+    first, first_frames = collect(devices=5, rate=1)
+    second, second_frames = collect(devices=5, rate=1)
+
+    first.run(max_frames=100, realtime=False)
+    second.run(max_frames=100, realtime=False)
+
+    assert first_frames == second_frames
+
+
+def test_start_and_stop_in_background():
+    """Test: en tiempo real el simulador corre en su thread y se detiene con stop()"""
+    simulator, frames = collect(devices=10, rate=50, dropout_probability=0)
+
+    simulator.start()
+    simulator.stop()
+
+    assert simulator.thread is None
+    assert simulator.running is False
+
+
+def test_in_process_ingest_end_to_end(engine, session, test_user):
+    """Test: los frames simulados llegan en proceso hasta las medias guardadas en la BD"""
+    simulator = FleetSimulator(publish=None, devices=30, rate=1, seed=1,
+                               episode_probability=0, dropout_probability=0)
+    sensor_ids = register_fleet(session, simulator, test_user.id)
+    # Idempotente: no duplica sensores
+    assert register_fleet(session, simulator, test_user.id) == sensor_ids
+    assert len(session.exec(select(Sensor)).all()) == 30
+
+    with ExitStack() as stack:
+        for target in ENGINE_TARGETS:
+            stack.enter_context(patch(target, engine))
+        report = run_in_process(simulator, max_frames=300)
+
+    assert report["topics"] == 30
+    assert report["frames_sent"] == 300
+    assert report["rows_saved"] >= 30  # Una media por sensor (dos si se cruza un minuto)
+    saved = session.exec(select(SensorData)).all()
+    assert {row.sensor_id for row in saved} == set(sensor_ids)
+    assert all(15 < row.value < 30 for row in saved)
+
+
+def test_cli_requires_a_bound_for_in_process_runs():
+    """Test: python -m app.simulator --in-process sin --duration ni --frames falla sin tocar la BD"""
+    from app.simulator import main
+
+    with patch("app.simulator.init_database") as init_database:
+        assert main(["--in-process"]) == 2
+        assert main(["--devices", "0", "--frames", "10"]) == 2
+
+    init_database.assert_not_called()
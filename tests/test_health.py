@@ -0,0 +1,108 @@
+"""
+Tests para las comprobaciones de salud y disponibilidad (/api/health y /api/ready)
+"""
+import os
+import time
+from datetime import datetime, timedelta
+from unittest.mock import Mock, patch
+
+import pytest
+
+from app.services.data_aggregator import SensorDataAggregator
+from app.services.health import HealthMonitor
+from app.services.ingest import IngestService
+from app.services.maiota_client import MAIoTAMultiSensorClient
+from app.services.mqtt_transport import InMemoryBroker
+
+
+@pytest.fixture
+def service(engine):
+    client = MAIoTAMultiSensorClient(broker="memory", transport_factory=InMemoryBroker().client)
+    aggregator = SensorDataAggregator(interval_minutes=1)
+    service = IngestService(client=client, aggregator=aggregator, retention=Mock())
+    service.running = True
+    client.is_connected = True
+    aggregator.last_flush_at = time.time()
+    with patch("app.services.health.engine", engine):
+        yield service
+
+
+def test_healthy_pipeline_is_ready(service):
+    """Test: broker conectado, guardado reciente, sin retraso y BD rápida -> listo"""
+    service.aggregator.add_reading(1, "temperatura", {"temperatura": 20.0})
+
+    report = HealthMonitor(services=[service]).report()
+
+    assert report["ready"] is True
+    assert report["status"] == "ok"
+    checks = report["checks"]
+    assert checks["broker"]["connected"] is True
+    assert checks["aggregator"]["buffered"]["open"] == 1
+    assert checks["ingest"]["lag_seconds"] < 1
+    assert checks["database"]["latency_ms"] >= 0
+
+
+def test_disconnected_broker_is_not_ready(service):
+    """Test: sin conexión al broker el proceso no está listo y se ven los reintentos"""
+    service.client._on_disconnect(None, None, 1)
+
+    report = HealthMonitor(services=[service]).report()
+
+    assert report["ready"] is False
+    assert report["checks"]["broker"] == {
+        "ok": False, "connected": False, "broker": "memory:1883",
+        "reconnect_attempts": 1, "last_message_age_seconds": None,
+    }
+
+
+def test_stale_flush_and_ingest_lag_are_not_ready(service):
+    """Test: un guardado atascado o lecturas que llegan con mucho retraso degradan el proceso"""
+    service.aggregator.last_flush_at = time.time() - 600
+    old = {"temperatura": 20.0, "timestamp": datetime.now() - timedelta(minutes=10)}
+    service.aggregator.add_reading(1, "temperatura", old)
+
+    checks = HealthMonitor(services=[service], max_lag_seconds=300).report()["checks"]
+
+    assert checks["aggregator"]["ok"] is False
+    assert checks["aggregator"]["max_flush_age_seconds"] == 180
+    assert checks["ingest"]["ok"] is False
+    assert checks["ingest"]["lag_seconds"] >= 600
+
+
+def test_successful_flush_updates_last_flush(engine, service):
+    """Test: cada guardado correcto actualiza el instante del último guardado"""
+    service.aggregator.last_flush_at = None
+    service.aggregator.add_reading(1, "temperatura", {"temperatura": 20.0})
+
+    with patch("app.services.data_aggregator.engine", engine), \
+         patch("app.services.alert_writer.engine", engine):
+        service.aggregator.flush()
+
+    assert service.aggregator.last_flush_error is None
+    assert time.time() - service.aggregator.last_flush_at < 5
+
+
+def test_endpoints_report_status_codes(engine):
+    """Test: /health siempre responde 200; /ready devuelve 503 si la ingesta esperada no está en marcha"""
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    from app.api.routes import router
+
+    api = FastAPI()
+    api.include_router(router)
+    client = TestClient(api)
+
+    with patch("app.services.health.engine", engine):
+        with patch.dict(os.environ, {"AGRORETO_INGEST_MODE": "embedded"}):
+            health = client.get("/health")
+            not_ready = client.get("/ready")
+        with patch.dict(os.environ, {"AGRORETO_INGEST_MODE": "external"}):
+            ready = client.get("/ready")
+
+    assert health.status_code == 200
+    assert health.json()["status"] == "degraded"
+    assert not_ready.status_code == 503
+    assert not_ready.json()["checks"]["ingest"]["error"] == "ingesta no iniciada"
+    assert ready.status_code == 200
+    assert set(ready.json()["checks"]) == {"database"}
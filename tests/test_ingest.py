@@ -0,0 +1,262 @@
+"""
+Tests para el servicio de ingesta particionada
+"""
+import os
+import signal
+import subprocess
+import sys
+import threading
+
+import pytest
+from unittest.mock import Mock, patch
+
+from app.models import Sensor
+from app.services.data_aggregator import SensorDataAggregator
+from app.services.ingest import IngestService
+from app.services.partitioning import SensorPartition
+
+
+def test_partition_owns_each_sensor_once():
+    """Test: Cada sensor pertenece exactamente a una partición"""
+    partitions = [SensorPartition(i, 4) for i in range(4)]
+    
+    for sensor_id in range(1, 200):
+        owners = [p for p in partitions if p.owns(sensor_id)]
+        assert len(owners) == 1
+
+
+def test_single_partition_owns_everything():
+    """Test: Sin particionar, el worker es dueño de todos los sensores"""
+    partition = SensorPartition()
+    
+    assert all(partition.owns(sensor_id) for sensor_id in range(1, 50))
+
+
+def test_partition_from_env(monkeypatch):
+    """Test: La partición se configura con AGRORETO_INGEST_PARTITION=indice/total"""
+    monkeypatch.setenv("AGRORETO_INGEST_PARTITION", "2/3")
+    partition = SensorPartition.from_env()
+    
+    assert partition.index == 2
+    assert partition.count == 3
+
+
+@pytest.mark.parametrize("index,count", [(0, 0), (3, 3), (-1, 2)])
+def test_partition_invalid(index, count):
+    """Test: Índices o totales inválidos se rechazan"""
+    with pytest.raises(ValueError):
+        SensorPartition(index, count)
+
+
+def _add_sensors(session, parcel_id, count, topic="farm/topic"):
+    sensors = [
+        Sensor(
+            id_code=f"S-{i}", parcel_id=parcel_id, type="temperature", unit="°C",
+            description="", threshold_low=0.0, threshold_high=50.0, mqtt_topic=topic,
+        )
+        for i in range(count)
+    ]
+    for sensor in sensors:
+        session.add(sensor)
+    session.commit()
+    return sensors
+
+
+def test_load_sensors_registers_only_owned_sensors(engine, session, test_parcel):
+    """Test: Cada worker sólo agrega las lecturas de los sensores de su partición"""
+    sensors = _add_sensors(session, test_parcel.id, 10)
+    client = Mock()
+    aggregator = Mock()
+    partition = SensorPartition(1, 2)
+    service = IngestService(client=client, aggregator=aggregator, partition=partition)
+    
+    with patch('app.services.ingest.engine', engine):
+        service.load_sensors()
+    
+    client.add_sensor.assert_called_once()
+    callback = client.add_sensor.call_args.kwargs['callback']
+    callback({'temperatura': 21.0})
+    
+    fed_ids = {c.args[0] for c in aggregator.add_reading.call_args_list}
+    assert fed_ids == {s.id for s in sensors if partition.owns(s.id)}
+    assert all(c.args[1] == 'temperatura' for c in aggregator.add_reading.call_args_list)
+
+
+def test_load_sensors_is_incremental(engine, session, test_parcel):
+    """Test: Recargar sin cambios no vuelve a suscribir; los topics vacíos se eliminan"""
+    sensors = _add_sensors(session, test_parcel.id, 2, topic="farm/a")
+    client = Mock()
+    service = IngestService(client=client, aggregator=Mock())
+    
+    with patch('app.services.ingest.engine', engine):
+        service.load_sensors()
+        service.load_sensors()
+        assert client.add_sensor.call_count == 1
+        
+        for sensor in sensors:
+            sensor.active = False
+            session.add(sensor)
+        session.commit()
+        service.load_sensors()
+    
+    client.remove_sensor.assert_called_once_with("farm/a")
+    assert service.sensors_by_topic == {}
+
+
+def test_cli_rejects_invalid_partition():
+    """Test: python -m app.ingest falla con una partición inválida sin arrancar nada"""
+    from app.ingest import main
+    
+    with patch('app.ingest.IngestService') as service_cls:
+        assert main(["--partition", "5/2"]) == 2
+    
+    service_cls.assert_not_called()
+
+
+@pytest.mark.parametrize("partitions", ["0", "-2"])
+def test_cli_rejects_non_positive_partitions(partitions):
+    """Test: --partitions 0 o negativo es un error de uso, no una ingesta sin workers"""
+    from app.ingest import main
+    
+    with patch('app.ingest.run_partitioned_workers') as run_workers, pytest.raises(SystemExit) as exit_info:
+        main(["--partitions", partitions])
+    
+    assert exit_info.value.code == 2
+    run_workers.assert_not_called()
+
+
+def test_cli_does_not_import_reflex():
+    """Test: el worker de ingesta no carga Reflex (ni a través de los modelos)"""
+    code = "import sys, app.ingest; print('reflex' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    
+    assert result.stdout.strip() == "False"
+
+
+def test_cli_runs_single_partition():
+    """Test: --partition arranca un único worker con esa partición"""
+    from app.ingest import main
+    
+    with patch('app.ingest.IngestService') as service_cls, patch('app.ingest.init_database'):
+        assert main(["--partition", "1/3"]) == 0
+    
+    partition = service_cls.call_args.kwargs['partition']
+    assert (partition.index, partition.count) == (1, 3)
+    service_cls.return_value.run_forever.assert_called_once()
+
+
+def test_cli_spawns_partitioned_workers():
+    """Test: --partitions N lanza N procesos worker"""
+    from app.ingest import main
+    
+    with patch('app.ingest.run_partitioned_workers') as run_workers, \
+         patch('app.ingest.init_database') as init_database:
+        assert main(["--partitions", "3"]) == 0
+    
+    init_database.assert_called_once()
+    
+    run_workers.assert_called_once_with(3)
+
+
+def test_sigterm_stops_partitioned_workers():
+    """Test: SIGTERM al proceso padre termina y espera a todos los workers (sin huérfanos)"""
+    from app.services.ingest import run_partitioned_workers
+
+    class FakeProcess:
+        def __init__(self, target, args, name):
+            self.name = name
+            self.alive = False
+            self.terminated = False
+            self.joined = False
+
+        def start(self):
+            self.alive = True
+
+        def is_alive(self):
+            return self.alive
+
+        def terminate(self):
+            self.terminated = True
+            self.alive = False
+
+        def join(self, timeout=None):
+            self.joined = True
+
+    processes = []
+
+    def make_process(**kwargs):
+        processes.append(FakeProcess(**kwargs))
+        return processes[-1]
+
+    context = Mock(Process=Mock(side_effect=make_process))
+    previous = signal.getsignal(signal.SIGTERM)
+    timer = threading.Timer(0.2, os.kill, (os.getpid(), signal.SIGTERM))
+    with patch('app.services.ingest.multiprocessing.get_context', return_value=context):
+        timer.start()
+        run_partitioned_workers(3)
+
+    assert len(processes) == 3
+    assert all(p.terminated and p.joined for p in processes)
+    assert signal.getsignal(signal.SIGTERM) is previous
+
+
+def test_start_registers_sensors_on_connect():
+    """Test: Los sensores se cargan en el callback de conexión, sin esperas fijas"""
+    client = Mock()
+    aggregator = Mock()
+    service = IngestService(client=client, aggregator=aggregator, refresh_seconds=0)
+    
+    with patch.object(service, 'load_sensors') as load_sensors:
+        service.start()
+        load_sensors.assert_not_called()
+        
+        listener = client.add_connect_listener.call_args.args[0]
+        listener()
+        load_sensors.assert_called_once()
+    
+    client.start.assert_called_once()
+    aggregator.start.assert_called_once()
+    service.stop()
+    assert service.running is False
+
+
+def test_cli_retention_once():
+    """Test: --retention-once ejecuta una pasada de retención sin arrancar la ingesta"""
+    from app.ingest import main
+    from app.services.retention import RetentionReport
+    
+    with patch('app.ingest.IngestService') as service_cls, \
+         patch('app.ingest.init_database'), \
+         patch('app.ingest.retention_job') as job:
+        job.run.return_value = RetentionReport(deleted_rows=3)
+        assert main(["--retention-once"]) == 0
+    
+    job.run.assert_called_once()
+    service_cls.assert_not_called()
+
+
+def test_retention_runs_only_in_first_partition():
+    """Test: la retención se programa sólo en la partición 0"""
+    for index, expected in ((0, 1), (1, 0)):
+        retention = Mock()
+        service = IngestService(client=Mock(), aggregator=Mock(), partition=SensorPartition(index, 2),
+                                refresh_seconds=0, retention=retention)
+        service.start()
+        service.stop()
+        assert retention.start.call_count == expected
+        retention.stop.assert_called_once()
+
+
+def test_service_stops_dispatcher_after_last_flush():
+    """Test: el dispatcher de avisos lo detiene la ingesta, después del agregador (no el agregador)"""
+    calls = Mock()
+    aggregator = SensorDataAggregator(interval_minutes=5)
+    service = IngestService(client=Mock(), aggregator=aggregator, refresh_seconds=0,
+                            retention=Mock(), dispatcher=calls.dispatcher)
+    
+    with patch.object(aggregator, 'stop', calls.aggregator_stop):
+        service.start()
+        service.stop()
+    aggregator.stop()
+    
+    assert [name for name, _, _ in calls.mock_calls] == ['aggregator_stop', 'dispatcher.stop']
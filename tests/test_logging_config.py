@@ -0,0 +1,141 @@
+"""
+Tests para la configuración de logging (JSON, cola no bloqueante y límite de frecuencia)
+"""
+import json
+import logging
+import queue
+import subprocess
+import sys
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytest
+
+from app.logging_config import JsonFormatter, NonBlockingQueueHandler, RateLimitedLogger, configure_logging
+from app.services.data_aggregator import SensorDataAggregator
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def restore_root_logger():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield root
+    configure_logging(use_queue=False, force=True)  # Detiene el listener si lo hay
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+def test_rate_limited_logger_suppresses_and_reports(caplog):
+    """Test: un mensaje por clave e intervalo; el siguiente indica cuántos se suprimieron"""
+    clock = FakeClock()
+    hot = RateLimitedLogger(logging.getLogger("test.hot"), interval=10, clock=clock)
+
+    with caplog.at_level(logging.WARNING, logger="test.hot"):
+        results = [hot.warning("late", "Lectura %d descartada", i) for i in range(5)]
+        assert hot.warning("other", "Otra clave") is True
+        clock.now = 11
+        hot.warning("late", "Lectura %d descartada", 5)
+
+    assert results == [True, False, False, False, False]
+    assert [r.getMessage() for r in caplog.records] == [
+        "Lectura 0 descartada",
+        "Otra clave",
+        "Lectura 5 descartada (+4 similares suprimidos en 10s)",
+    ]
+
+
+def test_rate_limited_logger_skips_disabled_levels():
+    """Test: con el nivel desactivado no se formatea ni se cuenta nada"""
+    logger = logging.getLogger("test.hot.disabled")
+    logger.setLevel(logging.ERROR)
+    hot = RateLimitedLogger(logger, interval=10)
+
+    class Exploding:
+        def __str__(self):
+            raise AssertionError("no debería formatearse")
+
+    assert hot.warning("key", "%s", Exploding()) is False
+    assert hot._state == {}
+
+
+def test_json_formatter_includes_extra_fields_and_exception():
+    """Test: cada mensaje es una línea JSON con los campos de extra= y el traceback"""
+    logger = logging.getLogger("test.json")
+    try:
+        raise ValueError("fallo")
+    except ValueError:
+        record = logger.makeRecord("test.json", logging.ERROR, __file__, 1, "Sensor %s sin datos", (7,),
+                                   exc_info=sys.exc_info(), extra={"sensor_id": 7})
+
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry["message"] == "Sensor 7 sin datos"
+    assert entry["level"] == "ERROR"
+    assert entry["logger"] == "test.json"
+    assert entry["sensor_id"] == 7
+    assert "ValueError: fallo" in entry["exc"]
+
+
+def test_queue_handler_never_blocks():
+    """Test: con la cola llena los mensajes se descartan y se cuentan"""
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=2))
+    logger = logging.getLogger("test.queue")
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        for i in range(5):
+            logger.warning("mensaje %d", i)
+    finally:
+        logger.removeHandler(handler)
+        logger.propagate = True
+
+    assert handler.dropped == 3
+    record = handler.queue.get_nowait()
+    assert (record.msg, record.args) == ("mensaje 0", None)
+
+
+def test_configure_logging_json_through_queue(restore_root_logger, capsys):
+    """Test: configure_logging escribe JSON desde el thread de la cola"""
+    assert configure_logging(level="info", fmt="json", use_queue=True, force=True) is True
+    assert configure_logging() is False  # Ya configurado: como basicConfig, no hace nada
+
+    logging.getLogger("test.configure").info("Hola %s", "mundo", extra={"topic": "farm/a"})
+    configure_logging(use_queue=False, force=True)  # Vacía la cola antes de leer la salida
+
+    lines = [json.loads(line) for line in capsys.readouterr().err.splitlines() if line.startswith("{")]
+    assert {"message": "Hola mundo", "topic": "farm/a"}.items() <= lines[-1].items()
+
+
+def test_late_readings_storm_logs_once(caplog):
+    """Test: una ráfaga de lecturas fuera de plazo produce un único aviso"""
+    aggregator = SensorDataAggregator(interval_minutes=5, allowed_lateness_minutes=1)
+    old = {"temperatura": 20.0, "timestamp": datetime.now() - timedelta(hours=2)}
+
+    hot = RateLimitedLogger(logging.getLogger("app.services.data_aggregator"), interval=60)
+    with patch("app.services.data_aggregator.hot_logger", hot), \
+         caplog.at_level(logging.WARNING, logger="app.services.data_aggregator"):
+        statuses = [aggregator.add_reading(1000 + i, "temperatura", old) for i in range(50)]
+
+    assert statuses == ["dropped"] * 50
+    assert aggregator.late_dropped == 50
+    warnings = [r for r in caplog.records if "descartada por retraso" in r.getMessage()]
+    assert len(warnings) == 1
+
+
+def test_importing_web_app_does_not_configure_logging():
+    """Test: importar app.app no toca el logging raíz (lo configura la tarea de ciclo de vida)"""
+    code = "import logging, app.app; print(len(logging.getLogger().handlers))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+
+    assert result.stdout.strip().splitlines()[-1] == "0"
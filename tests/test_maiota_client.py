@@ -225,3 +225,44 @@ def test_on_message():
         assert 'sensor_code' in call_args
         assert call_args['sensor_code'] == 'TEMP-01'
         assert call_args['sensor_id'] == 1
+
+
+def test_on_connect_notifies_listeners():
+    """Test: Los listeners de conexión se ejecutan tras cada conexión exitosa"""
+    with patch('app.services.maiota_client.mqtt.Client'):
+        client = MAIoTAMultiSensorClient()
+        
+        listener = Mock()
+        client.add_connect_listener(listener)
+        client.add_connect_listener(listener)  # No se duplica
+        
+        client._on_connect(Mock(), None, None, 0)
+        client._on_connect(Mock(), None, None, 5)  # Conexión fallida: no notifica
+        
+        listener.assert_called_once_with()
+
+
+def test_start_does_not_block_on_connect():
+    """Test: start() usa conexión asíncrona en el thread MQTT"""
+    with patch('app.services.maiota_client.mqtt.Client'), \
+         patch('app.services.maiota_client.threading.Thread') as thread_cls:
+        client = MAIoTAMultiSensorClient()
+        client.start()
+        
+        client.client.connect_async.assert_called_once()
+        client.client.connect.assert_not_called()
+        thread_cls.return_value.start.assert_called_once()
+
+
+def test_publish_requires_connection():
+    """Test: publish() sólo encola mensajes con el cliente conectado"""
+    with patch('app.services.maiota_client.mqtt.Client'):
+        client = MAIoTAMultiSensorClient()
+        
+        assert client.publish("agroreto/alerts", "{}") is False
+        client.client.publish.assert_not_called()
+        
+        client.is_connected = True
+        client.client.publish.return_value.rc = 0
+        assert client.publish("agroreto/alerts", "{}") is True
+        client.client.publish.assert_called_once_with("agroreto/alerts", "{}", qos=1)
@@ -0,0 +1,183 @@
+"""
+Tests para las métricas en formato Prometheus
+"""
+import asyncio
+import urllib.request
+from datetime import datetime
+from unittest.mock import Mock, patch
+
+import pytest
+
+from app.models import Alert
+from app.services.data_aggregator import SensorDataAggregator
+from app.services.maiota_client import MAIoTAMultiSensorClient
+from app.services.metrics import (
+    CONTENT_TYPE, REGISTRY, Counter, Gauge, Histogram, MetricsRegistry, start_http_server, timed,
+)
+
+FRAME = "CIoTA-D1=2603&D2=5411&D3=2542&D4=43&D5=580&D6=103&D7=1&"
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_render_counter_and_gauge():
+    """Test: contadores y gauges se exportan con HELP, TYPE y etiquetas escapadas"""
+    registry = MetricsRegistry()
+    counter = Counter("jobs_total", "Trabajos", ["queue"], registry=registry)
+    gauge = Gauge("depth", "Profundidad", registry=registry)
+    counter.labels('a"b').inc()
+    counter.labels('a"b').inc(2)
+    gauge.set(7)
+
+    text = registry.render()
+
+    assert "# HELP jobs_total Trabajos\n# TYPE jobs_total counter\n" in text
+    assert 'jobs_total{queue="a\\"b"} 3.0\n' in text
+    assert "# TYPE depth gauge\ndepth 7\n" in text
+    with pytest.raises(ValueError):
+        counter.inc()  # Métrica con etiquetas sin labels()
+    with pytest.raises(ValueError):
+        Counter("jobs_total", "Duplicada", registry=registry)
+
+
+def test_gauge_function_is_evaluated_on_render():
+    """Test: set_function calcula el valor al exportar y un fallo da NaN sin romper el resto"""
+    registry = MetricsRegistry()
+    items = []
+    Gauge("items", "Elementos", registry=registry).set_function(lambda: len(items))
+    Gauge("broken", "Falla", registry=registry).set_function(lambda: 1 / 0)
+
+    items.extend([1, 2, 3])
+
+    assert registry.get_sample_value("items") == 3
+    assert "broken NaN" in registry.render()
+
+
+def test_histogram_buckets_are_cumulative():
+    """Test: el histograma exporta buckets acumulados, +Inf, suma y número de observaciones"""
+    registry = MetricsRegistry()
+    histogram = Histogram("latency_seconds", "Latencia", buckets=(0.1, 1.0), registry=registry)
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value)
+
+    assert registry.get_sample_value("latency_seconds_bucket", {"le": "0.1"}) == 2
+    assert registry.get_sample_value("latency_seconds_bucket", {"le": "1.0"}) == 3
+    assert registry.get_sample_value("latency_seconds_bucket", {"le": "+Inf"}) == 4
+    assert registry.get_sample_value("latency_seconds_count") == 4
+    assert registry.get_sample_value("latency_seconds_sum") == pytest.approx(3.65)
+
+
+def test_timed_decorator_sync_and_async():
+    """Test: timed observa la duración de funciones y corutinas"""
+    registry = MetricsRegistry()
+    histogram = Histogram("call_seconds", "Llamadas", registry=registry)
+
+    @timed(histogram)
+    def work(x):
+        return x * 2
+
+    @timed(histogram)
+    async def async_work(x):
+        await asyncio.sleep(0)
+        return x + 1
+
+    assert work(2) == 4
+    assert asyncio.run(async_work(2)) == 3
+    assert asyncio.iscoroutinefunction(async_work)
+    assert registry.get_sample_value("call_seconds_count") == 2
+
+
+def test_db_queries_are_labelled_by_call_site(engine, session, test_sensor):
+    """Test: la latencia SQL se etiqueta con la primera función de la app en la pila"""
+    from app.services.alert_queries import latest_readings
+
+    site = "app.services.alert_queries:latest_readings"
+    before = sample("agroreto_db_query_seconds_count", call_site=site)
+
+    latest_readings(session, [test_sensor.id])
+
+    assert sample("agroreto_db_query_seconds_count", call_site=site) == before + 1
+
+
+def test_mqtt_messages_are_counted_per_topic():
+    """Test: mensajes recibidos, parseados y descartados por topic y motivo"""
+    client = MAIoTAMultiSensorClient(broker="memory", transport_factory=Mock())
+    client.add_sensor(1, "M-TEMP-01", "temperatura", "metrics/a", Mock())
+    before = {
+        "received": sample("agroreto_mqtt_messages_received_total", topic="metrics/a"),
+        "parsed": sample("agroreto_mqtt_messages_parsed_total", topic="metrics/a"),
+        "invalid": sample("agroreto_mqtt_messages_rejected_total", topic="metrics/a", reason="invalid_payload"),
+        "unknown": sample("agroreto_mqtt_messages_rejected_total", topic="metrics/b", reason="unknown_topic"),
+    }
+
+    client.decode_message("metrics/a", FRAME.encode())
+    client.decode_message("metrics/a", b"basura")
+    client.decode_message("metrics/b", FRAME.encode())
+
+    assert sample("agroreto_mqtt_messages_received_total", topic="metrics/a") == before["received"] + 2
+    assert sample("agroreto_mqtt_messages_parsed_total", topic="metrics/a") == before["parsed"] + 1
+    assert sample("agroreto_mqtt_messages_rejected_total",
+                  topic="metrics/a", reason="invalid_payload") == before["invalid"] + 1
+    assert sample("agroreto_mqtt_messages_rejected_total",
+                  topic="metrics/b", reason="unknown_topic") == before["unknown"] + 1
+
+
+def test_aggregator_metrics(engine, session, test_sensor):
+    """Test: lecturas, espera de lock, buffers y guardado del agregador aparecen en las métricas"""
+    aggregator = SensorDataAggregator(interval_minutes=5)
+    aggregator.bind_metrics()
+    on_time = sample("agroreto_aggregator_readings_total", status="on_time")
+    waits = sample("agroreto_aggregator_lock_wait_seconds_count")
+    flushes = sample("agroreto_flush_duration_seconds_count")
+    inserted = sample("agroreto_flush_rows_total", kind="inserted")
+
+    for value in (20.0, 22.0, 24.0):
+        aggregator.add_reading(test_sensor.id, "temperatura", {"temperatura": value, "timestamp": datetime.now()})
+
+    assert sample("agroreto_aggregator_readings_total", status="on_time") == on_time + 3
+    assert sample("agroreto_aggregator_lock_wait_seconds_count") == waits + 3
+    assert sample("agroreto_aggregator_buffered_readings", buffer="open") == 3
+
+    with patch("app.services.data_aggregator.engine", engine):
+        aggregator._calculate_and_save_averages()
+
+    assert sample("agroreto_aggregator_buffered_readings", buffer="open") == 0
+    assert sample("agroreto_flush_duration_seconds_count") == flushes + 1
+    assert sample("agroreto_flush_rows_total", kind="inserted") == inserted + 1
+
+
+def test_alerts_created_are_counted(session, test_sensor):
+    """Test: cada alerta insertada suma en su tipo"""
+    before = sample("agroreto_alerts_created_total", type="HIGH")
+
+    session.add(Alert(sensor_id=test_sensor.id, type="HIGH", message="Alta"))
+    session.commit()
+
+    assert sample("agroreto_alerts_created_total", type="HIGH") == before + 1
+
+
+def test_api_metrics_endpoint():
+    """Test: /api/metrics devuelve el registro en formato de texto de Prometheus"""
+    from app.api.routes import get_metrics
+
+    response = get_metrics()
+
+    assert response.media_type == CONTENT_TYPE
+    body = response.body.decode()
+    assert "# TYPE agroreto_db_query_seconds histogram" in body
+    assert "# TYPE agroreto_mqtt_messages_received_total counter" in body
+
+
+def test_standalone_http_server():
+    """Test: los procesos de ingesta exponen /metrics en su propio puerto"""
+    server = start_http_server(0, host="127.0.0.1")
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            assert response.headers["Content-Type"] == CONTENT_TYPE
+            assert b"agroreto_aggregator_lock_wait_seconds_bucket" in response.read()
+    finally:
+        server.shutdown()
+        server.server_close()
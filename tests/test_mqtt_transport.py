@@ -0,0 +1,113 @@
+"""
+Tests para los transportes MQTT (paho por defecto y broker en memoria)
+"""
+from unittest.mock import Mock, patch
+
+from app.services.ingest import IngestService
+from app.services.maiota_client import MAIoTAMultiSensorClient
+from app.services.mqtt_transport import InMemoryBroker, paho_transport
+
+FRAME = "CIoTA-D1=2603&D2=5411&D3=2542&D4=43&D5=580&D6=103&D7=1&"
+
+
+def connected_client(broker):
+    client = MAIoTAMultiSensorClient(broker="memory", transport_factory=broker.client)
+    client.client.loop_start()
+    return client
+
+
+def test_default_transport_is_paho():
+    """Test: sin factoría el cliente usa paho con sesión limpia"""
+    with patch("app.services.maiota_client.mqtt.Client") as paho_cls:
+        client = MAIoTAMultiSensorClient()
+
+    assert client.transport_factory is paho_transport
+    assert client.client is paho_cls.return_value
+    assert paho_cls.call_args.kwargs["client_id"] == client.client_id
+    assert paho_cls.call_args.kwargs["clean_session"] is True
+
+
+def test_in_memory_delivery_is_synchronous():
+    """Test: tras publish() el callback del sensor ya ha recibido los datos parseados"""
+    broker = InMemoryBroker()
+    client = connected_client(broker)
+    callback = Mock()
+    client.add_sensor(1, "M-TEMP-01", "temperatura", "farm/a", callback)
+
+    assert broker.publish("farm/a", FRAME) == 1
+    assert broker.publish("farm/b", FRAME) == 0
+
+    data = callback.call_args.args[0]
+    assert data["temperatura"] == 26.03
+    assert data["topic"] == "farm/a"
+    assert (broker.published, broker.delivered) == (2, 1)
+
+
+def test_wildcards_and_unsubscribe():
+    """Test: los filtros + y # reciben los topics que encajan; al desuscribir dejan de recibir"""
+    broker = InMemoryBroker()
+    transport = broker.client("listener")
+    transport.on_message = Mock()
+    transport.loop_start()
+    transport.subscribe("farm/+/temp")
+    transport.subscribe("alerts/#")
+
+    broker.publish("farm/p1/temp", "1")
+    broker.publish("farm/p1/soil", "2")
+    broker.publish("alerts/p1/high", "3")
+    transport.unsubscribe("alerts/#")
+    broker.publish("alerts/p1/low", "4")
+
+    payloads = [c.args[2].payload for c in transport.on_message.call_args_list]
+    assert payloads == [b"1", b"3"]
+
+
+def test_publish_without_connection_fails():
+    """Test: publicar sin conexión devuelve MQTT_ERR_NO_CONN, como paho"""
+    broker = InMemoryBroker()
+    client = MAIoTAMultiSensorClient(broker="memory", transport_factory=broker.client)
+
+    assert client.client.publish("agroreto/alerts", "{}").rc != 0
+    client.client.loop_start()
+    client.is_connected = True
+    assert client.publish("agroreto/alerts", "{}") is True
+    assert broker.published == 1
+
+
+def test_restart_resubscribes_registered_topics():
+    """Test: tras un reinicio del broker el cliente se resuscribe y sigue recibiendo"""
+    broker = InMemoryBroker()
+    client = connected_client(broker)
+    callback = Mock()
+    client.add_sensor(1, "M-TEMP-01", "temperatura", "farm/a", callback)
+
+    broker.restart()
+
+    assert client.is_connected is True
+    assert client.reconnect_attempts == 0
+    broker.publish("farm/a", FRAME)
+    callback.assert_called_once()
+
+
+def test_ingest_pipeline_over_in_memory_broker(engine, session, test_parcel):
+    """Test: la ingesta se suscribe al conectar y reparte cada frame entre los sensores del topic"""
+    from app.models import Sensor
+
+    for code in ("S-1", "S-2"):
+        session.add(Sensor(id_code=code, parcel_id=test_parcel.id, type="temperature", unit="°C",
+                           description="", threshold_low=0.0, threshold_high=50.0, mqtt_topic="farm/a"))
+    session.commit()
+    broker = InMemoryBroker()
+    client = MAIoTAMultiSensorClient(broker="memory", transport_factory=broker.client)
+    aggregator = Mock()
+    service = IngestService(client=client, aggregator=aggregator, refresh_seconds=0)
+    client.add_connect_listener(service.load_sensors)
+
+    with patch("app.services.ingest.engine", engine):
+        client.client.loop_start()
+    for _ in range(100):
+        broker.publish("farm/a", FRAME)
+    client.stop()
+
+    assert aggregator.add_reading.call_count == 200
+    assert broker.publish("farm/a", FRAME) == 0
@@ -0,0 +1,270 @@
+"""
+Tests para el envío de avisos de alertas (webhook, SMTP y MQTT)
+"""
+import json
+import socketserver
+import threading
+import time
+from datetime import datetime
+from email import message_from_bytes
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest.mock import MagicMock, patch
+
+from sqlmodel import Session
+
+from app.models import Alert
+from app.services.notifier import (
+    EmailChannel,
+    MqttChannel,
+    Notification,
+    NotificationChannel,
+    NotificationDispatcher,
+    WebhookChannel,
+)
+
+BASE = datetime(2025, 1, 1, 6, 0)
+
+
+def notification(alert_id, event="opened", message="Temperatura alta"):
+    return Notification(alert_id, 1, "HIGH", message, BASE, event=event)
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+class RecordingChannel(NotificationChannel):
+    """Canal que guarda los lotes recibidos"""
+    name = "test"
+
+    def __init__(self):
+        super().__init__("memoria")
+        self.batches = []
+
+    def send(self, batch):
+        self.batches.append(batch)
+
+
+class HttpSink:
+    """Servidor HTTP local que recibe los webhooks; responde 500 a las primeras peticiones"""
+
+    def __init__(self, fail_first=0):
+        self.bodies = []
+        self.requests = 0
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                sink.requests += 1
+                if sink.requests <= fail_first:
+                    self.send_response(500)
+                else:
+                    sink.bodies.append(json.loads(body))
+                    self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/hook"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SmtpSink:
+    """Servidor SMTP mínimo (EHLO, MAIL, RCPT, DATA, QUIT) que guarda los mensajes"""
+
+    def __init__(self):
+        self.messages = []
+        sink = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(line.encode() + b"\r\n")
+
+            def handle(self):
+                self.reply("220 localhost test")
+                recipients = []
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.decode().strip().upper()
+                    if command.startswith(("EHLO", "HELO")):
+                        self.reply("250 localhost")
+                    elif command.startswith("MAIL"):
+                        self.reply("250 OK")
+                    elif command.startswith("RCPT"):
+                        recipients.append(line.decode().split(":", 1)[1].strip().strip("<>"))
+                        self.reply("250 OK")
+                    elif command == "DATA":
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                        data = b""
+                        while True:
+                            chunk = self.rfile.readline()
+                            if chunk in (b".\r\n", b""):
+                                break
+                            data += chunk
+                        sink.messages.append((recipients, message_from_bytes(data)))
+                        self.reply("250 OK")
+                    elif command == "QUIT":
+                        self.reply("221 Bye")
+                        return
+                    else:
+                        self.reply("250 OK")
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def test_batches_and_coalesces_per_recipient():
+    """Test: los avisos de una misma alerta se coalescen y se envía un lote por destinatario"""
+    first, second = RecordingChannel(), RecordingChannel()
+    dispatcher = NotificationDispatcher([first, second], batch_seconds=60)
+
+    dispatcher.enqueue([notification(1), notification(2)])
+    dispatcher.enqueue([notification(1, event="closed")])
+    assert first.batches == []  # Esperando a completar el lote
+
+    assert dispatcher.flush()
+    for channel in (first, second):
+        assert len(channel.batches) == 1
+        events = {n.alert_id: n.event for n in channel.batches[0]}
+        assert events == {1: "closed", 2: "opened"}
+    assert dispatcher.sent == 4
+    dispatcher.stop()
+
+
+def test_worker_sends_after_batch_window():
+    """Test: el worker entrega el lote al cumplirse batch_seconds sin bloquear enqueue"""
+    channel = RecordingChannel()
+    dispatcher = NotificationDispatcher([channel], batch_seconds=0.1)
+    try:
+        dispatcher.enqueue([notification(1)])
+        dispatcher.enqueue([notification(2)])
+        assert wait_until(lambda: channel.batches)
+        assert [n.alert_id for n in channel.batches[0]] == [1, 2]
+    finally:
+        dispatcher.stop()
+
+
+def test_webhook_retries_with_backoff():
+    """Test: un 500 del webhook se reintenta hasta entregar el lote"""
+    sink = HttpSink(fail_first=1)
+    dispatcher = NotificationDispatcher([WebhookChannel(sink.url)], batch_seconds=0, backoff_base=0.05)
+    try:
+        dispatcher.enqueue([notification(1), notification(2)])
+        assert wait_until(lambda: sink.bodies)
+        assert sink.requests == 2
+        assert [a["alert_id"] for a in sink.bodies[0]["alerts"]] == [1, 2]
+        assert sink.bodies[0]["alerts"][0]["type"] == "HIGH"
+    finally:
+        dispatcher.stop()
+        sink.close()
+
+
+def test_drops_batch_after_max_attempts():
+    """Test: un destinatario que siempre falla no acumula avisos indefinidamente"""
+    channel = MqttChannel("agroreto/alerts", publish=lambda topic, payload: False)
+    dispatcher = NotificationDispatcher([channel], batch_seconds=0, max_attempts=2, backoff_base=0.01)
+    try:
+        dispatcher.enqueue([notification(1)])
+        assert wait_until(lambda: dispatcher.dropped == 1)
+        assert dispatcher.sent == 0
+        assert not dispatcher.outboxes[0].pending
+    finally:
+        dispatcher.stop()
+
+
+def test_email_channel_sends_one_message_per_batch():
+    """Test: un correo por lote al servidor SMTP"""
+    sink = SmtpSink()
+    channel = EmailChannel("tecnico@example.com", host="127.0.0.1", port=sink.port, sender="agroreto@example.com")
+    dispatcher = NotificationDispatcher([channel], batch_seconds=60)
+    try:
+        dispatcher.enqueue([notification(1), notification(2, event="closed", message="Humedad baja")])
+        assert dispatcher.flush()
+        assert len(sink.messages) == 1
+        recipients, message = sink.messages[0]
+        assert recipients == ["tecnico@example.com"]
+        assert message["Subject"] == "[AGRORETO] 2 alerta(s)"
+        body = message.get_payload()
+        assert "Temperatura alta" in body
+        assert "(resuelta) Humedad baja" in body
+    finally:
+        dispatcher.stop()
+        sink.close()
+
+
+def test_mqtt_channel_publishes_batch():
+    """Test: el canal MQTT publica el lote como JSON en el topic configurado"""
+    publish = MagicMock(return_value=True)
+    dispatcher = NotificationDispatcher([MqttChannel("agroreto/alerts", publish)], batch_seconds=60)
+
+    dispatcher.enqueue([notification(7)])
+    assert dispatcher.flush()
+
+    topic, payload = publish.call_args[0]
+    assert topic == "agroreto/alerts"
+    assert json.loads(payload)["alerts"][0]["alert_id"] == 7
+    dispatcher.stop()
+
+
+def test_from_env_builds_channels(monkeypatch):
+    """Test: los canales se configuran con variables de entorno"""
+    monkeypatch.setenv("AGRORETO_NOTIFY_WEBHOOKS", "http://a/hook, http://b/hook")
+    monkeypatch.setenv("AGRORETO_SMTP_HOST", "smtp.example.com")
+    monkeypatch.setenv("AGRORETO_NOTIFY_EMAILS", "tecnico@example.com")
+    monkeypatch.setenv("AGRORETO_NOTIFY_MQTT_TOPIC", "agroreto/alerts")
+
+    dispatcher = NotificationDispatcher.from_env(publish=lambda topic, payload: True)
+
+    assert [o.channel.key for o in dispatcher.outboxes] == [
+        "webhook:http://a/hook",
+        "webhook:http://b/hook",
+        "email:tecnico@example.com",
+        "mqtt:agroreto/alerts",
+    ]
+
+
+def test_alerts_are_enqueued_on_commit(engine, test_sensor):
+    """Test: abrir y cerrar alertas encola avisos sólo tras el commit"""
+    dispatcher = MagicMock()
+    with patch("app.services.notifier.notification_dispatcher", dispatcher):
+        with Session(engine) as session:
+            alert = Alert(sensor_id=test_sensor.id, timestamp=BASE, type="HIGH", message="Temperatura alta")
+            session.add(alert)
+            session.flush()
+            assert not dispatcher.enqueue.called
+            session.commit()
+
+            (opened,), _ = dispatcher.enqueue.call_args
+            assert [(n.alert_id, n.event) for n in opened] == [(alert.id, "opened")]
+
+            alert.closed_at = BASE
+            session.add(alert)
+            session.commit()
+            (closed,), _ = dispatcher.enqueue.call_args
+            assert [(n.alert_id, n.event) for n in closed] == [(alert.id, "closed")]
+
+            # Un rollback descarta los avisos
+            session.add(Alert(sensor_id=test_sensor.id, timestamp=BASE, type="LOW", message="Baja"))
+            session.flush()
+            session.rollback()
+            assert dispatcher.enqueue.call_count == 2
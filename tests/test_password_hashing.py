@@ -0,0 +1,202 @@
+"""
+Tests para el pool de contraseñas (bcrypt fuera del event loop) y su uso en login y registro
+"""
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+from passlib.context import CryptContext
+from sqlmodel import Session, select
+
+from app.models import User
+from app.services.metrics import REGISTRY
+from app.services.password_hashing import PasswordHasher, PasswordHasherBusy
+from app.states.auth_state import AuthState
+
+FAST_CONTEXT = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4)
+
+
+class SlowContext:
+    """Contexto de passlib falso: tarda `seconds` y apunta en qué thread se ejecuta"""
+
+    def __init__(self, seconds=0.2, result=True):
+        self.seconds = seconds
+        self.result = result
+        self.threads = []
+        self.started = threading.Event()
+
+    def verify(self, plain_password, hashed_password):
+        self.threads.append(threading.current_thread().name)
+        self.started.set()
+        time.sleep(self.seconds)
+        return self.result
+
+
+class FakeAuthState(SimpleNamespace):
+    """Estado con el lock de `async with self` de Reflex"""
+
+    async def __aenter__(self):
+        await self._lock.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._lock.release()
+
+
+def make_state():
+    return FakeAuthState(_lock=asyncio.Lock(), user_id=None, error_message="", success_message="")
+
+
+def test_verify_runs_in_pool_without_blocking_the_loop():
+    """Test: la verificación corre en un thread del pool y el event loop sigue atendiendo"""
+    context = SlowContext(seconds=0.2)
+    hasher = PasswordHasher(workers=2, context=context)
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        assert await hasher.verify("secreto", "hash") is True
+        task.cancel()
+        return ticks
+
+    try:
+        ticks = asyncio.run(scenario())
+    finally:
+        hasher.shutdown()
+
+    assert context.threads[0].startswith("PasswordHasher")
+    assert ticks >= 5
+
+
+def test_pool_rejects_when_full():
+    """Test: por encima de max_pending se rechaza en lugar de encolar sin límite"""
+    hasher = PasswordHasher(workers=1, max_pending=1, context=SlowContext(seconds=0.2))
+    before = REGISTRY.get_sample_value("agroreto_password_rejected_total") or 0.0
+
+    async def scenario():
+        first = asyncio.create_task(hasher.verify("a", "hash"))
+        await asyncio.sleep(0)
+        with pytest.raises(PasswordHasherBusy):
+            await hasher.verify("b", "hash")
+        assert await first is True
+        # Con el hueco liberado vuelve a aceptar
+        assert await hasher.verify("c", "hash") is True
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        hasher.shutdown()
+
+    assert REGISTRY.get_sample_value("agroreto_password_rejected_total") == before + 1
+
+
+def test_login_does_not_hold_state_lock_while_hashing(engine, test_user):
+    """Test: durante bcrypt el lock del estado está libre y el login termina correctamente"""
+    context = SlowContext(seconds=0.2)
+    hasher = PasswordHasher(workers=1, context=context)
+    state = make_state()
+    form = {"username": "testuser", "password": "testpass123"}
+
+    async def scenario():
+        login = asyncio.create_task(AuthState.check_login.fn(state, form))
+        while not context.started.is_set():
+            await asyncio.sleep(0.001)
+        # Otro evento del mismo cliente entra mientras se verifica la contraseña
+        async with state:
+            lock_free_during_hash = state.user_id is None
+        await login
+        return lock_free_during_hash
+
+    try:
+        with patch("app.states.auth_state.engine", engine), \
+             patch("app.states.auth_state.password_hasher", hasher):
+            assert asyncio.run(scenario()) is True
+    finally:
+        hasher.shutdown()
+
+    assert state.user_id == test_user.id
+    assert state.user_role == "farmer"
+    assert state.is_loading is False
+    assert state.password == ""
+
+
+def test_login_with_wrong_password_or_busy_pool(engine, test_user):
+    """Test: contraseña incorrecta y pool lleno muestran su mensaje sin iniciar sesión"""
+    wrong = PasswordHasher(workers=1, context=SlowContext(seconds=0, result=False))
+    wrong_state, busy_state = make_state(), make_state()
+    form = {"username": "testuser", "password": "otra"}
+
+    class BusyHasher:
+        async def verify(self, plain_password, hashed_password):
+            raise PasswordHasherBusy("lleno")
+
+    try:
+        with patch("app.states.auth_state.engine", engine):
+            with patch("app.states.auth_state.password_hasher", wrong):
+                asyncio.run(AuthState.check_login.fn(wrong_state, form))
+            with patch("app.states.auth_state.password_hasher", BusyHasher()):
+                asyncio.run(AuthState.check_login.fn(busy_state, form))
+    finally:
+        wrong.shutdown()
+
+    assert wrong_state.user_id is None
+    assert wrong_state.error_message == "Usuario o contraseña inválidos."
+    assert busy_state.user_id is None
+    assert "Demasiados inicios de sesión" in busy_state.error_message
+    assert busy_state.is_loading is False
+
+
+def test_register_hashes_in_pool(engine, session, test_user):
+    """Test: el registro guarda un hash bcrypt válido y rechaza nombres ya usados"""
+    hasher = PasswordHasher(workers=1, context=FAST_CONTEXT)
+    state, duplicate = make_state(), make_state()
+    form = {"username": "nuevo", "password": "secreto1", "confirm_password": "secreto1"}
+
+    try:
+        with patch("app.states.auth_state.engine", engine), \
+             patch("app.states.auth_state.password_hasher", hasher), \
+             patch("app.states.auth_state.asyncio.sleep"):
+            asyncio.run(AuthState.register_user.fn(state, form))
+            asyncio.run(AuthState.register_user.fn(duplicate, {**form, "username": "testuser"}))
+    finally:
+        hasher.shutdown()
+
+    user = session.exec(select(User).where(User.username == "nuevo")).one()
+    assert user.role == "registered"
+    assert FAST_CONTEXT.verify("secreto1", user.password_hash)
+    assert "Cuenta creada" in state.success_message
+    assert duplicate.error_message == "El nombre de usuario ya está en uso."
+    assert len(session.exec(select(User).where(User.username == "testuser")).all()) == 1
+
+
+def test_register_race_on_username_reports_duplicate(engine, session):
+    """Test: si otro registro gana la carrera durante el hash, se muestra el error y se libera is_loading"""
+    state = make_state()
+    form = {"username": "carrera", "password": "secreto1", "confirm_password": "secreto1"}
+
+    class RacingHasher:
+        async def hash(self, password):
+            # Otra petición crea el mismo usuario mientras se calcula el hash
+            with Session(engine) as other:
+                other.add(User(username="carrera", password_hash="x", role="registered"))
+                other.commit()
+            return "hash"
+
+    with patch("app.states.auth_state.engine", engine), \
+         patch("app.states.auth_state.password_hasher", RacingHasher()):
+        asyncio.run(AuthState.register_user.fn(state, form))
+
+    assert state.error_message == "El nombre de usuario ya está en uso."
+    assert state.success_message == ""
+    assert state.is_loading is False
+    assert len(session.exec(select(User).where(User.username == "carrera")).all()) == 1
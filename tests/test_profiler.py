@@ -0,0 +1,126 @@
+"""
+Tests para el perfilador por muestreo
+"""
+import asyncio
+import os
+import signal
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from app.services.profiler import ProfilerBusy, SamplingProfiler
+
+
+def busy_loop(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+@pytest.fixture
+def busy_thread():
+    stop = threading.Event()
+    thread = threading.Thread(target=busy_loop, args=(stop,), name="Busy Thread", daemon=True)
+    thread.start()
+    yield thread
+    stop.set()
+    thread.join()
+
+
+def test_profile_collapses_stacks_of_all_threads(busy_thread):
+    """Test: cada línea es una pila de un thread (raíz primero) con su número de muestras"""
+    profiler = SamplingProfiler(interval=0.001)
+
+    collapsed = profiler.profile(0.2)
+
+    lines = collapsed.splitlines()
+    stacks = {line.rsplit(" ", 1)[0]: int(line.rsplit(" ", 1)[1]) for line in lines}
+    busy = [stack for stack in stacks if stack.startswith("Busy_Thread;")]
+    assert busy, collapsed
+    assert any("busy_loop (tests/test_profiler.py)" in stack for stack in busy)
+    assert all(count > 0 for count in stacks.values())
+    # El propio thread del perfilador no aparece
+    assert not any("profile (app/services/profiler.py)" in stack for stack in stacks)
+
+
+def test_only_one_profile_at_a_time():
+    """Test: un segundo perfilado simultáneo falla en lugar de duplicar el coste"""
+    profiler = SamplingProfiler(interval=0.001)
+    thread = threading.Thread(target=profiler.profile, args=(0.3,))
+    thread.start()
+    while not profiler.running:
+        time.sleep(0.001)
+
+    with pytest.raises(ProfilerBusy):
+        profiler.profile(0.1)
+    thread.join()
+    assert profiler.running is False
+
+
+def test_signal_handler_writes_collapsed_file(tmp_path, busy_thread):
+    """Test: la señal lanza el perfilado en background y deja un fichero .collapsed"""
+    profiler = SamplingProfiler(interval=0.001)
+    previous = signal.getsignal(signal.SIGUSR2)
+    try:
+        with patch.dict(os.environ, {"AGRORETO_PROFILE_DIR": str(tmp_path)}):
+            assert profiler.install_signal_handler(seconds=0.1) is True
+            os.kill(os.getpid(), signal.SIGUSR2)
+            deadline = time.monotonic() + 5
+            while not list(tmp_path.glob("*.collapsed")) and time.monotonic() < deadline:
+                time.sleep(0.01)
+    finally:
+        signal.signal(signal.SIGUSR2, previous)
+
+    files = list(tmp_path.glob(f"profile-{os.getpid()}-*.collapsed"))
+    assert len(files) == 1
+    assert "Busy_Thread;" in files[0].read_text()
+
+
+def test_profile_endpoint_requires_token(busy_thread):
+    """Test: el endpoint no existe sin token configurado y exige la cabecera correcta"""
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    from app.api.routes import router
+
+    api = FastAPI()
+    api.include_router(router)
+    client = TestClient(api)
+
+    with patch.dict(os.environ, {}, clear=False):
+        os.environ.pop("AGRORETO_PROFILER_TOKEN", None)
+        assert client.get("/debug/profile?seconds=0.1").status_code == 404
+    with patch.dict(os.environ, {"AGRORETO_PROFILER_TOKEN": "secreto"}):
+        assert client.get("/debug/profile?seconds=0.1", headers={"X-Profiler-Token": "otro"}).status_code == 403
+        response = client.get("/debug/profile?seconds=0.1", headers={"X-Profiler-Token": "secreto"})
+
+    assert response.status_code == 200
+    assert response.headers["content-disposition"].endswith('.collapsed"')
+    assert "Busy_Thread;" in response.text
+
+
+def test_profile_endpoint_does_not_block_event_loop():
+    """Test: mientras se muestrea, el event loop sigue atendiendo otras tareas"""
+    from app.api.routes import get_profile
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        response = await get_profile(seconds=0.3, x_profiler_token="secreto")
+        task.cancel()
+        return response, ticks
+
+    with patch.dict(os.environ, {"AGRORETO_PROFILER_TOKEN": "secreto"}), \
+         patch("app.api.routes.profiler", SamplingProfiler(interval=0.005)):
+        response, ticks = asyncio.run(scenario())
+
+    assert response.status_code == 200
+    assert ticks >= 10
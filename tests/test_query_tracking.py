@@ -0,0 +1,224 @@
+"""
+Tests para la instrumentación SQL (consultas por evento o ruta, consultas lentas y presupuesto)
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+from sqlmodel import select
+
+from app.models import Alert, Sensor, SensorData
+from app.services.alert_queries import latest_readings, list_alerts
+from app.services.metrics import REGISTRY
+from app.services.query_tracking import (
+    QueryBudgetExceeded, QueryTrackingASGIMiddleware, QueryTrackingMiddleware, SlowQueryLog,
+    current_scope, event_scope_name, query_budget, track_queries,
+)
+
+DASHBOARD_EVENT = ("reflex___state____state.app___states___dashboard_state____dashboard_state"
+                   ".load_dashboard_stats")
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def add_sensors(session, parcel_id, count):
+    sensors = [
+        Sensor(id_code=f"S-{i}", parcel_id=parcel_id, type="temperatura", unit="°C",
+               description="", threshold_low=0.0, threshold_high=50.0)
+        for i in range(count)
+    ]
+    session.add_all(sensors)
+    session.commit()
+    now = datetime.now()
+    for sensor in sensors:
+        session.add_all([
+            SensorData(sensor_id=sensor.id, timestamp=now - timedelta(minutes=m), value=20.0 + m, raw="{}")
+            for m in range(3)
+        ])
+        session.add(Alert(sensor_id=sensor.id, type="HIGH", message="Alta"))
+    session.commit()
+    return sensors
+
+
+def test_scope_counts_queries_and_exports_metrics(session, test_sensor):
+    """Test: las consultas del bloque se atribuyen al scope y se exportan por nombre"""
+    before = sample("agroreto_scope_queries_total", scope="test.scope")
+
+    with track_queries("test.scope") as scope:
+        session.exec(select(Sensor)).all()
+        session.exec(select(SensorData)).all()
+
+    assert scope.queries == 2
+    assert scope.seconds > 0
+    assert sample("agroreto_scope_queries_total", scope="test.scope") == before + 2
+    assert sample("agroreto_scope_queries_per_run_count", scope="test.scope") >= 1
+
+
+def test_query_budget_detects_n_plus_one(session, test_parcel):
+    """Test: un bucle de consultas por sensor supera el presupuesto y el error muestra la sentencia repetida"""
+    sensors = add_sensors(session, test_parcel.id, 5)
+    ids = [s.id for s in sensors]
+
+    with pytest.raises(QueryBudgetExceeded, match="5x SELECT"):
+        with query_budget(2):
+            for sensor_id in ids:
+                session.exec(select(SensorData).where(SensorData.sensor_id == sensor_id)).first()
+
+    with query_budget(1):
+        readings = latest_readings(session, ids)
+    assert set(readings) == set(ids)
+
+
+def test_budget_without_strict_only_warns(session, test_sensor, caplog):
+    """Test: fuera de los tests el presupuesto sólo avisa en el log"""
+    with caplog.at_level(logging.WARNING, logger="app.services.query_tracking"):
+        with track_queries("warn.scope", budget=1, strict=False):
+            session.exec(select(Sensor)).all()
+            session.exec(select(Sensor)).all()
+
+    assert "Presupuesto de consultas superado en warn.scope" in caplog.text
+
+
+def test_dashboard_query_count_does_not_grow_with_sensors(engine, session, test_user, test_parcel):
+    """Test: load_dashboard_stats hace las mismas consultas con 1 y con 20 sensores (sin N+1)"""
+    from app.services.access_control import access_resolver
+    from app.states.dashboard_state import DashboardState
+
+    auth = SimpleNamespace(user_id=test_user.id, user_role="farmer")
+
+    class FakeState(SimpleNamespace):
+        async def get_state(self, _state_cls):
+            return auth
+
+    def run_dashboard():
+        state = FakeState()
+        access_resolver.invalidate()
+        with patch("app.states.dashboard_state.engine", engine), \
+             patch("app.services.access_control.engine", engine):
+            with track_queries("test.dashboard") as scope:
+                asyncio.run(DashboardState.load_dashboard_stats.fn(state))
+        return state, scope.queries
+
+    add_sensors(session, test_parcel.id, 1)
+    _, few = run_dashboard()
+    add_sensors(session, test_parcel.id, 19)
+    state, many = run_dashboard()
+
+    assert state.total_sensors == 20
+    assert many == few
+    with query_budget(few):
+        with patch("app.states.dashboard_state.engine", engine):
+            asyncio.run(DashboardState.load_dashboard_stats.fn(state))
+
+
+def test_alert_listing_is_a_single_query(session, test_parcel):
+    """Test: el listado de alertas con sensor es una única consulta (JOIN)"""
+    ids = [s.id for s in add_sensors(session, test_parcel.id, 10)]
+
+    with query_budget(1):
+        rows = list_alerts(session, ids)
+
+    assert len(rows) == 10
+
+
+def test_slow_query_log_includes_parameters_and_plan(session, test_sensor, caplog):
+    """Test: las consultas lentas se registran con parámetros y plan de ejecución"""
+    log = SlowQueryLog(threshold_ms=0.000001)
+    with patch("app.services.query_tracking.slow_query_log", log), \
+         caplog.at_level(logging.WARNING, logger="app.services.query_tracking"):
+        with track_queries("slow.scope"):
+            session.exec(select(SensorData).where(SensorData.sensor_id == test_sensor.id)).all()
+
+    entry = log.recent[-1]
+    assert entry["site"] == "slow.scope"
+    assert str(test_sensor.id) in entry["parameters"]
+    assert "sensordata" in entry["plan"].lower()
+    assert "Consulta lenta" in caplog.text
+
+
+def test_reflex_middleware_scopes_each_event(session, test_sensor):
+    """Test: el middleware de Reflex atribuye las consultas al evento hasta su última actualización"""
+    middleware = QueryTrackingMiddleware()
+    event = SimpleNamespace(name=DASHBOARD_EVENT)
+    scope_name = "dashboard_state.load_dashboard_stats"
+    before = sample("agroreto_scope_queries_total", scope=scope_name)
+
+    async def scenario():
+        assert await middleware.preprocess(None, None, event) is None
+        session.exec(select(Sensor)).all()
+        await middleware.postprocess(None, None, event, SimpleNamespace(final=False))
+        session.exec(select(Sensor)).all()
+        await middleware.postprocess(None, None, event, SimpleNamespace(final=True))
+        assert current_scope() is None  # El token del scope se restaura
+        session.exec(select(Sensor)).all()  # Fuera del evento
+
+    asyncio.run(scenario())
+
+    assert event_scope_name(DASHBOARD_EVENT) == scope_name
+    assert sample("agroreto_scope_queries_total", scope=scope_name) == before + 2
+
+
+def test_api_middleware_names_scope_by_route(engine, test_sensor):
+    """Test: las consultas de una petición se atribuyen al patrón de su ruta"""
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    from app.api.routes import router
+
+    api = FastAPI()
+    api.include_router(router)
+    api.add_middleware(QueryTrackingASGIMiddleware)
+    scope_name = "GET /sensors/{sensor_id}/data"
+    before = sample("agroreto_scope_queries_total", scope=scope_name)
+
+    with patch("app.api.routes.engine", engine):
+        response = TestClient(api).get(f"/sensors/{test_sensor.id}/data")
+
+    assert response.status_code == 200
+    assert sample("agroreto_scope_queries_total", scope=scope_name) > before
+
+
+def test_background_events_are_tracked_by_their_handler(engine, test_user):
+    """Test: el middleware no abre scope a los eventos background; el handler tracked() sí lo cierra"""
+    from app.services.password_hashing import PasswordHasher
+    from app.states.auth_state import AuthState
+
+    class FakeAuthState(SimpleNamespace):
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc_info):
+            pass
+
+    class BackgroundParent:
+        def _get_event_handler(self, event):
+            return None, SimpleNamespace(is_background=True)
+
+    middleware = QueryTrackingMiddleware()
+    event = SimpleNamespace(name="reflex___state____state.app___states___auth_state____auth_state.check_login")
+    state = FakeAuthState(user_id=None)
+    hasher = PasswordHasher(workers=1, context=SimpleNamespace(verify=lambda plain, hashed: True))
+    before = sample("agroreto_scope_queries_per_run_count", scope="auth_state.check_login")
+
+    async def scenario():
+        assert await middleware.preprocess(None, BackgroundParent(), event) is None
+        assert current_scope() is None
+        # Reflex responde al evento padre sin postprocess y lanza el handler en su tarea
+        await asyncio.create_task(AuthState.check_login.fn(state, {"username": "testuser", "password": "x"}))
+        return current_scope()
+
+    try:
+        with patch("app.states.auth_state.engine", engine), \
+             patch("app.states.auth_state.password_hasher", hasher):
+            assert asyncio.run(scenario()) is None
+    finally:
+        hasher.shutdown()
+
+    assert state.user_id == test_user.id
+    assert sample("agroreto_scope_queries_per_run_count", scope="auth_state.check_login") == before + 1
+    assert sample("agroreto_scope_queries_total", scope="auth_state.check_login") >= 1
@@ -0,0 +1,169 @@
+"""
+Tests para la retención y compactación de datos de sensores y alertas
+"""
+import json
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytest
+from sqlmodel import select
+
+from app.models import Alert, AlertArchive, SensorData
+from app.services.cold_archive import ColdArchive
+from app.services.retention import RetentionJob
+
+NOW = datetime(2025, 6, 1, 12, 0)
+
+
+def interval_row(sensor_id, timestamp, avg, samples=5, low=None, high=None):
+    """Media por intervalo con el formato del agregador"""
+    return SensorData(
+        sensor_id=sensor_id,
+        timestamp=timestamp,
+        value=round(avg, 2),
+        raw=json.dumps({
+            "aggregated": True,
+            "interval_minutes": 5,
+            "samples_count": samples,
+            "min": low if low is not None else avg,
+            "max": high if high is not None else avg,
+            "avg": avg,
+            "sensor_type": "temperatura",
+            "timestamp": timestamp.isoformat(),
+        }),
+    )
+
+
+@pytest.fixture(name="job")
+def job_fixture(engine, tmp_path):
+    with patch("app.services.retention.engine", engine), patch("app.services.cold_archive.engine", engine):
+        yield RetentionJob(interval_days=30, hourly_days=365, alert_days=90, chunk_size=3, pause_seconds=0,
+                           archive=ColdArchive(str(tmp_path / "archive")))
+
+
+def test_compacts_old_intervals_into_hourly_rows(job, session, test_sensor):
+    """Test: las medias antiguas se combinan en una por hora, en varios lotes"""
+    old_hour = NOW - timedelta(days=40)
+    for minute, avg, samples in ((0, 20.0, 5), (5, 22.0, 5), (10, 26.0, 10), (15, 18.0, 5), (20, 24.0, 5)):
+        session.add(interval_row(test_sensor.id, old_hour + timedelta(minutes=minute), avg, samples))
+    recent = interval_row(test_sensor.id, NOW - timedelta(days=1), 21.0)
+    session.add(recent)
+    session.commit()
+
+    report = job.run(now=NOW)
+
+    assert report.compacted_rows == 5
+    assert report.hourly_rows == 1  # El segundo lote se fusiona en la misma hora
+    rows = session.exec(select(SensorData).order_by(SensorData.timestamp)).all()
+    assert len(rows) == 2
+    hourly = json.loads(rows[0].raw)
+    assert rows[0].timestamp == old_hour
+    assert hourly["resolution"] == "hourly"
+    assert hourly["samples_count"] == 30
+    assert hourly["compacted_rows"] == 5
+    assert hourly["min"] == 18.0 and hourly["max"] == 26.0
+    assert rows[0].value == pytest.approx((20 * 5 + 22 * 5 + 26 * 10 + 18 * 5 + 24 * 5) / 30, abs=0.01)
+    assert rows[1].id == recent.id
+
+    # Una segunda pasada no vuelve a tocar las medias horarias
+    assert job.run(now=NOW).compacted_rows == 0
+
+
+def test_compacts_plain_readings(job, session, test_sensor):
+    """Test: las lecturas sin resumen JSON cuentan como una muestra"""
+    old = NOW - timedelta(days=45)
+    session.add(SensorData(sensor_id=test_sensor.id, timestamp=old, value=10.0, raw="10.0"))
+    session.add(SensorData(sensor_id=test_sensor.id, timestamp=old + timedelta(minutes=1), value=20.0, raw="20.0"))
+    session.commit()
+
+    job.run(now=NOW)
+
+    row = session.exec(select(SensorData)).one()
+    assert row.value == 15.0
+    assert json.loads(row.raw)["samples_count"] == 2
+
+
+def test_compacts_legacy_and_aggregated_rows_of_same_hour(job, session, test_sensor):
+    """Test: lecturas sueltas y medias de una misma hora dan un único registro horario"""
+    old_hour = NOW - timedelta(days=40)
+    session.add(interval_row(test_sensor.id, old_hour, 20.0, 5))
+    session.add(SensorData(sensor_id=test_sensor.id, timestamp=old_hour + timedelta(minutes=2), value=8.0, raw="8.0"))
+    session.add(interval_row(test_sensor.id, old_hour + timedelta(minutes=5), 20.0, 5))
+    # En el lote siguiente: se fusiona con la hora ya creada
+    session.add(SensorData(sensor_id=test_sensor.id, timestamp=old_hour + timedelta(minutes=30), value=8.0, raw="8.0"))
+    session.commit()
+
+    report = job.run(now=NOW)
+
+    assert report.compacted_rows == 4
+    assert report.hourly_rows == 1
+    row = session.exec(select(SensorData)).one()
+    hourly = json.loads(row.raw)
+    assert row.timestamp == old_hour
+    assert row.value == 18.0
+    assert hourly["samples_count"] == 12
+    assert hourly["sensor_type"] == "temperatura"
+
+def test_expires_data_older_than_ttl(job, session, test_sensor):
+    """Test: los datos más antiguos que hourly_days se borran en lotes"""
+    for day in range(7):
+        session.add(interval_row(test_sensor.id, NOW - timedelta(days=400 + day), 20.0))
+    session.add(interval_row(test_sensor.id, NOW - timedelta(days=2), 20.0))
+    session.commit()
+
+    report = job.run(now=NOW)
+
+    assert report.deleted_rows == 7
+    assert len(session.exec(select(SensorData)).all()) == 1
+
+
+def test_archives_acknowledged_closed_alerts(job, session, test_sensor):
+    """Test: sólo se archivan las alertas confirmadas y cerradas hace más de alert_days"""
+    old = NOW - timedelta(days=120)
+    archived = Alert(sensor_id=test_sensor.id, timestamp=old, type="HIGH", message="Antigua",
+                     acknowledged=True, closed_at=old, peak_value=35.0, occurrences=4)
+    pending = Alert(sensor_id=test_sensor.id, timestamp=old, type="HIGH", message="Sin confirmar",
+                    acknowledged=False, closed_at=old)
+    ongoing = Alert(sensor_id=test_sensor.id, timestamp=old, type="LOW", message="Abierta", acknowledged=True)
+    recent = Alert(sensor_id=test_sensor.id, timestamp=NOW, type="HIGH", message="Reciente",
+                   acknowledged=True, closed_at=NOW)
+    session.add_all([archived, pending, ongoing, recent])
+    session.commit()
+    archived_id = archived.id
+
+    report = job.run(now=NOW)
+
+    assert report.archived_alerts == 1
+    session.expire_all()
+    assert {a.message for a in session.exec(select(Alert)).all()} == {"Sin confirmar", "Abierta", "Reciente"}
+    copy = session.exec(select(AlertArchive)).one()
+    assert copy.id == archived_id
+    assert (copy.message, copy.peak_value, copy.occurrences) == ("Antigua", 35.0, 4)
+
+
+def test_report_includes_maintenance_and_space(job, session, test_sensor):
+    """Test: el informe registra ANALYZE, VACUUM y el espacio recuperado"""
+    job.vacuum_free_ratio = 0.0
+    for day in range(200):
+        session.add(interval_row(test_sensor.id, NOW - timedelta(days=500, minutes=day), 20.0))
+    session.commit()
+
+    report = job.run(now=NOW)
+
+    assert report.analyzed and report.vacuumed
+    assert report.size_before is not None
+    assert report.reclaimed_bytes >= 0
+    assert report.to_dict()["deleted_rows"] == 200
+    assert job.last_report is report
+
+
+def test_disabled_steps(job, session, test_sensor):
+    """Test: un TTL de 0 desactiva la compactación y el borrado"""
+    job.interval_days = job.hourly_days = job.alert_days = 0
+    session.add(interval_row(test_sensor.id, NOW - timedelta(days=1000), 20.0))
+    session.commit()
+
+    report = job.run(now=NOW)
+
+    assert (report.compacted_rows, report.deleted_rows, report.archived_alerts) == (0, 0, 0)
+    assert len(session.exec(select(SensorData)).all()) == 1
@@ -0,0 +1,35 @@
+"""
+Tests para la medición del tiempo de arranque
+"""
+import json
+
+from app.startup_timing import StartupTimer
+
+
+def test_mark_records_phases_in_order():
+    """Test: Cada marca registra la duración desde la marca anterior"""
+    timer = StartupTimer()
+    timer.mark("imports")
+    timer.mark("app_setup")
+    
+    assert list(timer.phases) == ["imports", "app_setup"]
+    assert all(seconds >= 0 for seconds in timer.phases.values())
+
+
+def test_write_report_appends_json_line(tmp_path, monkeypatch):
+    """Test: El informe se añade como línea JSON etiquetada con la versión"""
+    monkeypatch.setenv("AGRORETO_RELEASE", "1.2.3")
+    report_path = tmp_path / "startup.jsonl"
+    timer = StartupTimer()
+    timer.mark("imports")
+    
+    timer.write_report("web", path=str(report_path))
+    timer.write_report("web", path=str(report_path))  # Sólo una vez por proceso
+    
+    lines = report_path.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 1
+    report = json.loads(lines[0])
+    assert report["component"] == "web"
+    assert report["release"] == "1.2.3"
+    assert "imports" in report["phases"]
+    assert report["total_seconds"] >= report["phases"]["imports"]
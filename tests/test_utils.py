@@ -65,3 +65,22 @@ def test_empty_password():
     # Debe poder hashear incluso contraseña vacía
     assert len(hashed) > 0
     assert verify_password(password, hashed) is True
+
+
+def test_init_database_runs_once(monkeypatch):
+    """Test: El esquema y los datos iniciales se preparan una sola vez por proceso"""
+    from unittest.mock import Mock
+    import app.utils as utils
+    
+    seed = Mock()
+    monkeypatch.setattr(utils, "seed_database", seed)
+    monkeypatch.setattr(utils, "_db_initialized", False)
+    
+    assert utils.init_database() is True
+    assert utils.init_database() is False
+    assert utils.init_database() is False
+    seed.assert_called_once()
+    
+    # force=True permite repetirla explícitamente (p. ej. tras restaurar la BD)
+    assert utils.init_database(force=True) is True
+    assert seed.call_count == 2